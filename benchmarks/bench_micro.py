@@ -0,0 +1,253 @@
+"""CPU热点微基准：可重复运行，保存基线并对比，发现性能回退
+
+覆盖：
+    extract_image_names（大图库）、image_to_base64（大PNG）、get_cached_thumbnail（冷/热缓存）、
+    refresh_prompt_table（1k/5k行，offscreen Qt）、CSV导入解析（50k行）、save_config（大历史记录）
+
+用法：
+    python benchmarks/bench_micro.py                         # 运行全部
+    python benchmarks/bench_micro.py --filter refresh        # 只运行名称包含 refresh 的项
+    python benchmarks/bench_micro.py --save baseline.json    # 保存基线
+    python benchmarks/bench_micro.py --compare baseline.json --threshold 1.25
+                                                             # 与基线对比，中位数变慢超过25%时退出码为1
+    python benchmarks/bench_micro.py --quick                 # 缩小数据规模，快速检查
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+os.environ.setdefault('SORA_LOG_LEVEL', 'WARNING')
+
+import main as app_main
+from mock_api_server import make_png
+from PyQt6.QtWidgets import QApplication
+
+# 名称 -> (准备函数, 重复次数, 是否预热)；准备函数接收 Context，返回被计时的无参函数
+BENCHMARKS = {}
+
+
+def benchmark(name, repeat=5, warmup=True):
+    def decorator(setup):
+        BENCHMARKS[name] = (setup, repeat, warmup)
+        return setup
+    return decorator
+
+
+class Context:
+    """基准共享的临时目录和主窗口（只创建一次）"""
+
+    def __init__(self, quick):
+        self.quick = quick
+        self.tmp = Path(tempfile.mkdtemp(prefix='sora_micro_'))
+        # 配置和缩略图缓存写到临时目录，不影响真实数据
+        app_main.APP_PATH = self.tmp
+        app_main.THUMBNAIL_CACHE_PATH = self.tmp / 'thumbnails'
+        self.app = QApplication.instance() or QApplication([])
+        self._window = None
+
+    def scale(self, full, quick):
+        return quick if self.quick else full
+
+    @property
+    def window(self):
+        if self._window is None:
+            self._window = app_main.MainWindow()
+            self.app.processEvents()
+            self._window._init_done = True
+        return self._window
+
+
+def make_gallery(count):
+    names = [f"角色{i:05d}" for i in range(count)]
+    category_links = {f"分类{c}": [] for c in range(20)}
+    for i, name in enumerate(names):
+        category_links[f"分类{i % 20}"].append({'name': name, 'url': f"https://example.com/{i}.png"})
+    return names, category_links
+
+
+def make_rows(count):
+    return [{
+        'number': str(i + 1),
+        'prompt': f"第{i + 1}镜，清晨的街道上，主角缓缓走过，镜头跟随，电影感光影 图片比例【16:9】",
+        'status': random.choice(['等待中', '成功', '失败', '生成中']),
+        'image_url': '',
+        'error_msg': '请求失败: 503' if i % 7 == 0 else '',
+        'reference_images': [],
+    } for i in range(count)]
+
+
+@benchmark('extract_image_names_2k')
+def bench_extract_small(ctx):
+    return setup_extract(ctx, 2000)
+
+
+@benchmark('extract_image_names_20k')
+def bench_extract_large(ctx):
+    return setup_extract(ctx, ctx.scale(20000, 5000))
+
+
+def setup_extract(ctx, count):
+    names, category_links = make_gallery(count)
+    holder = SimpleNamespace(category_links=category_links)
+    prompt = f"{names[3]}和{names[-5]}在雨中对视，{names[count // 2]}从背景走过，远景，电影质感" * 3
+    return lambda: app_main.MainWindow.extract_image_names(holder, prompt)
+
+
+@benchmark('image_to_base64_8mb', repeat=5)
+def bench_base64(ctx):
+    path = ctx.tmp / 'large.png'
+    path.write_bytes(make_png(ctx.scale(8, 2) * 1024 * 1024))
+    return lambda: app_main.image_to_base64(path)
+
+
+@benchmark('thumbnail_cold', repeat=5)
+def bench_thumbnail_cold(ctx):
+    path = setup_thumbnail_source(ctx)
+    cache_path = app_main.get_thumbnail_cache_path(path)
+
+    def run():
+        if cache_path.exists():
+            cache_path.unlink()
+        app_main.get_cached_thumbnail(str(path))
+    return run
+
+
+@benchmark('thumbnail_warm', repeat=10)
+def bench_thumbnail_warm(ctx):
+    path = setup_thumbnail_source(ctx)
+    app_main.get_cached_thumbnail(str(path))
+    return lambda: app_main.get_cached_thumbnail(str(path))
+
+
+def setup_thumbnail_source(ctx):
+    path = ctx.tmp / 'thumb_source.png'
+    if not path.exists():
+        path.write_bytes(make_png(4 * 1024 * 1024, seed=1))
+    return path
+
+
+@benchmark('refresh_prompt_table_1k', repeat=3)
+def bench_refresh_1k(ctx):
+    return setup_refresh(ctx, ctx.scale(1000, 200))
+
+
+# 整表重建耗时随行数增长很快，完整规模只跑一次
+@benchmark('refresh_prompt_table_5k', repeat=1, warmup=False)
+def bench_refresh_5k(ctx):
+    return setup_refresh(ctx, ctx.scale(5000, 500))
+
+
+def setup_refresh(ctx, count):
+    window = ctx.window
+    rows = make_rows(count)
+
+    def run():
+        window.prompt_table_data = rows
+        window.refresh_prompt_table()
+        ctx.app.processEvents()
+    return run
+
+
+@benchmark('import_csv_parse_50k', repeat=3)
+def bench_import_csv(ctx):
+    count = ctx.scale(50000, 5000)
+    path = ctx.tmp / f'prompts_{count}.csv'
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        f.write("分镜编号,分镜提示词\n")
+        for i in range(count):
+            f.write(f"{i + 1},\"第{i + 1}镜，角色{i % 300:05d}站在窗边，逆光，特写\"\n")
+    # 只计表格流式解析，表格分批填充由 refresh_prompt_table 基准衡量
+    return lambda: app_main.read_prompt_file(path)
+
+
+@benchmark('save_config_large_history', repeat=5)
+def bench_save_config(ctx):
+    window = ctx.window
+    window.optimization_history = [{
+        'original': f"原始提示词 {i} " * 5,
+        'optimized': f"优化后的提示词 {i}，更丰富的细节描述 " * 8,
+        'timestamp': '2024-01-01 00:00:00',
+        'model': 'qwen/qwq-32b',
+    } for i in range(ctx.scale(10000, 1000))]
+    window.style_library = {f"风格{i}": {'content': "电影感，胶片颗粒，柔和光线" * 5, 'usage_count': i}
+                            for i in range(ctx.scale(1000, 100))}
+    window.category_links = make_gallery(ctx.scale(5000, 500))[1]
+    return window.save_config
+
+
+def run_benchmarks(ctx, name_filter=''):
+    results = {}
+    for name, (setup, repeat, warmup) in BENCHMARKS.items():
+        if name_filter and name_filter not in name:
+            continue
+        fn = setup(ctx)
+        if warmup:
+            fn()
+        timings = timeit.Timer(fn).repeat(repeat=repeat, number=1)
+        results[name] = {
+            'min': min(timings),
+            'median': statistics.median(timings),
+            'repeat': repeat,
+        }
+        print(f"{name:<28} min {results[name]['min'] * 1000:10.2f} ms   median {results[name]['median'] * 1000:10.2f} ms")
+    return results
+
+
+def compare(results, baseline, threshold):
+    """与基线对比中位数，返回变慢超过阈值的项目"""
+    regressions = []
+    print(f"\n与基线对比（阈值 {threshold:.2f}x）:")
+    for name, current in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            print(f"  {name:<28} 无基线")
+            continue
+        ratio = current['median'] / base['median'] if base['median'] else float('inf')
+        flag = "回退" if ratio > threshold else ("提升" if ratio < 1 / threshold else "持平")
+        print(f"  {name:<28} {ratio:6.2f}x  {flag}")
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU热点微基准")
+    parser.add_argument('--filter', default='', help="只运行名称包含该字符串的基准")
+    parser.add_argument('--quick', action='store_true', help="缩小数据规模")
+    parser.add_argument('--save', default='', help="保存结果为基线JSON")
+    parser.add_argument('--compare', default='', help="与基线JSON对比")
+    parser.add_argument('--threshold', type=float, default=1.25, help="判定回退的变慢倍数")
+    args = parser.parse_args()
+
+    random.seed(0)
+    ctx = Context(args.quick)
+    results = run_benchmarks(ctx, args.filter)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'quick': args.quick, 'python': sys.version.split()[0], 'results': results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"\n基线已保存: {args.save}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('quick') != args.quick:
+            print("警告: 基线与本次运行的数据规模不同（--quick），对比结果仅供参考")
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
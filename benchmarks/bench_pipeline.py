@@ -0,0 +1,247 @@
+"""端到端压测：用本地模拟服务跑 N 条提示词的生图 + 下载流程，统计吞吐、耗时分布和内存
+
+示例：
+    python benchmarks/bench_pipeline.py --prompts 200 --concurrency 20 --latency-median 1 --errors 429=0.05
+    python benchmarks/bench_pipeline.py --prompts 100 --stream --images-per-prompt 2 --json result.json
+
+默认在进程内启动模拟服务；指定 --server-url 时使用已运行的服务。
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import mock_api_server
+
+
+def peak_rss_mb():
+    """进程峰值常驻内存（MB），平台不支持时返回 None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 单位为KB，macOS 为字节
+        return round(peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024, 2)
+    except ImportError:
+        try:
+            import psutil
+            return round(psutil.Process().memory_info().peak_wset / 1024 / 1024, 2)
+        except Exception:
+            return None
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="生图流程端到端压测（使用本地模拟服务）")
+    parser.add_argument('--prompts', type=int, default=50, help="提示词条数")
+    parser.add_argument('--concurrency', type=int, default=10, help="生图并发线程数")
+    parser.add_argument('--images-per-prompt', type=int, default=1)
+    parser.add_argument('--stream', action='store_true', help="使用流式响应")
+    parser.add_argument('--model', default='sora', choices=['sora', 'nano-banana'])
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--retry-delay-scale', type=float, default=0.01, help="重试等待时间倍率（默认缩短为1%%）")
+    parser.add_argument('--optimize', type=int, default=0, help="额外压测批量提示词优化的条数")
+    parser.add_argument('--server-url', default='', help="已运行的模拟服务地址，不指定则在进程内启动")
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--json', default='', help="把结果写入JSON文件")
+    # 进程内模拟服务参数
+    parser.add_argument('--latency-median', type=float, default=1.0)
+    parser.add_argument('--latency-sigma', type=float, default=0.4)
+    parser.add_argument('--errors', default='')
+    parser.add_argument('--formats', default=','.join(list(mock_api_server.RESPONSE_FORMATS) + ['json_data']))
+    parser.add_argument('--image-bytes', type=int, default=512 * 1024)
+    return parser
+
+
+def start_mock_server(args):
+    server_args = mock_api_server.build_arg_parser().parse_args([
+        '--port', '0',
+        '--latency-median', str(args.latency_median),
+        '--latency-sigma', str(args.latency_sigma),
+        '--errors', args.errors,
+        '--formats', args.formats,
+        '--image-bytes', str(args.image_bytes),
+    ])
+    server = mock_api_server.create_server(server_args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def run(args):
+    server = None
+    base_url = args.server_url.rstrip('/')
+    if not base_url:
+        server, base_url = start_mock_server(args)
+
+    # 需在导入主程序前设置
+    os.environ['SORA_API_BASE_URL'] = base_url
+    os.environ['SORA_OPENROUTER_URL'] = base_url + '/api/v1/chat/completions'
+    os.environ['SORA_RETRY_DELAY_SCALE'] = str(args.retry_delay_scale)
+    os.environ.setdefault('SORA_LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    import main as app_main
+    from PyQt6.QtCore import QCoreApplication, QThreadPool
+
+    app = QCoreApplication.instance() or QCoreApplication([])
+    pool = QThreadPool()
+    pool.setMaxThreadCount(args.concurrency)
+    download_pool = QThreadPool()
+    out_dir = tempfile.mkdtemp(prefix='sora_bench_')
+
+    state = {'done': 0, 'success': 0, 'failed': 0, 'images': 0, 'bytes': 0, 'errors': {}}
+    workers = []  # 保持引用，避免信号对象被提前回收
+
+    def on_downloaded(filenames, results):
+        state['done'] += 1
+        state['success'] += 1
+        state['images'] += sum(results)
+        state['bytes'] += sum(os.path.getsize(f) for f, ok in zip(filenames, results) if ok)
+
+    def on_finished(index, image_urls):
+        filenames = [os.path.join(out_dir, f"{index}_{i}.png") for i in range(len(image_urls))]
+        downloader = app_main.DownloadWorker(list(zip(image_urls, filenames)))
+        downloader.signals.finished.connect(lambda results: on_downloaded(filenames, results))
+        workers.append(downloader)
+        download_pool.start(downloader)
+
+    def on_error(error):
+        state['done'] += 1
+        state['failed'] += 1
+        key = error.split('状态码: ')[1].split(',')[0] if '状态码: ' in error else error[:40]
+        state['errors'][key] = state['errors'].get(key, 0) + 1
+
+    count = max(1, args.images_per_prompt)
+    jobs = [{'pending': count, 'urls': [], 'errors': []} for _ in range(args.prompts)]
+
+    def on_request_done(index):
+        # 与界面一致：每张图一次请求，全部结束后汇总
+        job = jobs[index]
+        job['pending'] -= 1
+        if job['pending'] > 0:
+            return
+        if job['urls']:
+            on_finished(index, job['urls'])
+        else:
+            on_error(job['errors'][0])
+
+    tracemalloc.start()
+    start_time = time.monotonic()
+    for i in range(args.prompts):
+        for variant in range(count):
+            worker = app_main.Worker(f"benchmark prompt {i} 图片比例【3:2】", 'sk-benchmark', [], '云雾', args.model,
+                                     args.retries, str(i + 1), stream=args.stream, variant=variant)
+            worker.signals.finished.connect(lambda p, urls, num, idx=i: (jobs[idx]['urls'].extend(urls), on_request_done(idx)))
+            worker.signals.error.connect(lambda p, err, idx=i: (jobs[idx]['errors'].append(err), on_request_done(idx)))
+            workers.append(worker)
+            pool.start(worker)
+
+    deadline = start_time + args.timeout
+    while state['done'] < args.prompts and time.monotonic() < deadline:
+        app.processEvents()
+        time.sleep(0.005)
+    wall = time.monotonic() - start_time
+
+    optimize_result = None
+    if args.optimize:
+        optimize_result = run_optimize(app, app_main, args, QThreadPool())
+
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    def latency(name):
+        # 合并各标签的样本
+        samples = []
+        with app_main.METRICS.lock:
+            for (metric_name, _), histogram in app_main.METRICS.histograms.items():
+                if metric_name == name:
+                    samples.extend(histogram.samples)
+        if not samples:
+            return None
+        samples.sort()
+        pick = lambda q: round(samples[min(len(samples) - 1, int(q / 100 * (len(samples) - 1)))], 3)
+        return {'count': len(samples), 'avg': round(sum(samples) / len(samples), 3),
+                'p50': pick(50), 'p95': pick(95), 'p99': pick(99)}
+
+    result = {
+        'prompts': args.prompts,
+        'concurrency': args.concurrency,
+        'stream': args.stream,
+        'images_per_prompt': args.images_per_prompt,
+        'completed': state['done'],
+        'success': state['success'],
+        'failed': state['failed'],
+        'errors': state['errors'],
+        'wall_seconds': round(wall, 3),
+        'prompts_per_second': round(state['done'] / wall, 3) if wall else 0,
+        'images_per_minute': round(state['images'] * 60 / wall, 2) if wall else 0,
+        'download_mb': round(state['bytes'] / 1024 / 1024, 2),
+        'download_mb_per_second': round(state['bytes'] / 1024 / 1024 / wall, 2) if wall else 0,
+        'latency': {name: latency(name) for name in (
+            'image_queue_wait_seconds', 'image_ttfb_seconds', 'image_request_seconds',
+            'image_job_seconds', 'download_seconds')},
+        'retries': sum(v for (name, _), v in app_main.METRICS.counters.items() if name == 'image_retries_total'),
+        'python_peak_mb': round(traced_peak / 1024 / 1024, 2),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    if optimize_result:
+        result['optimize'] = optimize_result
+
+    if server:
+        server.shutdown()
+        server.server_close()
+    return result
+
+
+def run_optimize(app, app_main, args, pool):
+    """批量提示词优化压测（按主程序默认的每批5条合并请求）"""
+    pool.setMaxThreadCount(4)
+    items = [(i, f"benchmark prompt {i}") for i in range(args.optimize)]
+    done = {'count': 0}
+    workers = []
+    start_time = time.monotonic()
+    for start in range(0, len(items), 5):
+        worker = app_main.OptimizeWorker(items[start:start + 5], 'sk-benchmark', 'mock/model', '优化以下提示词')
+        worker.signals.finished.connect(lambda *a: done.__setitem__('count', done['count'] + 1))
+        worker.signals.error.connect(lambda *a: done.__setitem__('count', done['count'] + 1))
+        workers.append(worker)
+        pool.start(worker)
+    deadline = start_time + args.timeout
+    while done['count'] < len(items) and time.monotonic() < deadline:
+        app.processEvents()
+        time.sleep(0.005)
+    wall = time.monotonic() - start_time
+    return {'prompts': len(items), 'wall_seconds': round(wall, 3),
+            'prompts_per_second': round(len(items) / wall, 2) if wall else 0}
+
+
+def print_report(result):
+    print(f"提示词 {result['prompts']} 条 | 并发 {result['concurrency']} | 流式 {result['stream']} | 每条 {result['images_per_prompt']} 张")
+    print(f"完成 {result['completed']}（成功 {result['success']}，失败 {result['failed']}）| 重试 {result['retries']} 次 | 错误 {result['errors']}")
+    print(f"总耗时 {result['wall_seconds']}s | {result['prompts_per_second']} 条/秒 | {result['images_per_minute']} 张/分钟")
+    print(f"下载 {result['download_mb']} MB，{result['download_mb_per_second']} MB/s")
+    for name, stats in result['latency'].items():
+        if stats:
+            print(f"  {name:<26} n={stats['count']:<5} avg={stats['avg']:<8} p50={stats['p50']:<8} p95={stats['p95']:<8} p99={stats['p99']}")
+    print(f"内存: Python峰值 {result['python_peak_mb']} MB | 进程峰值RSS {result['peak_rss_mb']} MB")
+    if 'optimize' in result:
+        print(f"提示词优化: {result['optimize']}")
+
+
+def main():
+    args = build_arg_parser().parse_args()
+    result = run(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""冷启动耗时：每次在新进程中启动主程序，统计各阶段和到界面可交互的耗时，并检查是否超出预算
+
+用法：
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --runs 10 --budget 1500 --json startup.json
+    python benchmarks/bench_startup.py --exe dist\\深海圈生图.exe    # 测量打包后的程序
+
+源码方式运行时把 main.py 和 config.json 复制到临时目录再启动，不会改动真实配置；
+首次启动需要编译字节码，作为预热不计入统计。
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def prepare_workdir(config_path):
+    workdir = Path(tempfile.mkdtemp(prefix='sora_startup_'))
+    shutil.copy2(ROOT / 'main.py', workdir / 'main.py')
+    if config_path.exists():
+        shutil.copy2(config_path, workdir / 'config.json')
+    return workdir
+
+
+def launch(command, trace_path, timeout):
+    """启动一次，返回 (进程总耗时秒, 启动时间线)；程序在可交互后自行退出"""
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    env.setdefault('SORA_LOG_LEVEL', 'WARNING')
+    env['SORA_STARTUP_EXIT'] = '1'
+    env['SORA_STARTUP_TRACE'] = str(trace_path)
+    if trace_path.exists():
+        trace_path.unlink()
+    start_time = time.perf_counter()
+    subprocess.run(command, env=env, timeout=timeout, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wall = time.perf_counter() - start_time
+    if not trace_path.exists():
+        raise RuntimeError("程序没有写出启动时间线，可能启动失败")
+    with open(trace_path, 'r', encoding='utf-8') as f:
+        return wall, json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="冷启动耗时测量")
+    parser.add_argument('--runs', type=int, default=5, help="计入统计的启动次数")
+    parser.add_argument('--budget', type=float, default=float(os.environ.get('SORA_STARTUP_BUDGET_MS', '2000')),
+                        help="可交互耗时预算（毫秒），中位数超出时退出码为1")
+    parser.add_argument('--exe', default='', help="测量打包后的可执行文件，不指定则运行源码")
+    parser.add_argument('--config', default=str(ROOT / 'config.json'), help="源码方式运行时使用的配置文件")
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--json', default='', help="把结果写入JSON文件")
+    args = parser.parse_args()
+
+    if args.exe:
+        workdir = Path(tempfile.mkdtemp(prefix='sora_startup_'))
+        command = [args.exe]
+    else:
+        workdir = prepare_workdir(Path(args.config))
+        command = [sys.executable, str(workdir / 'main.py')]
+    trace_path = workdir / 'startup_trace.json'
+
+    try:
+        launch(command, trace_path, args.timeout)  # 预热
+        walls, traces = [], []
+        for _ in range(args.runs):
+            wall, trace = launch(command, trace_path, args.timeout)
+            walls.append(wall)
+            traces.append(trace)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    phase_names = [phase['name'] for phase in traces[0]['phases']]
+    phases = {}
+    for name in phase_names:
+        durations = [phase['duration_ms'] for trace in traces for phase in trace['phases'] if phase['name'] == name]
+        phases[name] = round(statistics.median(durations), 1)
+    totals = [trace['total_ms'] for trace in traces]
+    result = {
+        'runs': args.runs,
+        'interactive_ms': {'median': round(statistics.median(totals), 1), 'min': min(totals), 'max': max(totals)},
+        'process_seconds_median': round(statistics.median(walls), 3),
+        'phases_ms_median': phases,
+        'heavy_modules': sorted({module for trace in traces for module in trace.get('heavy_modules', [])}),
+        'budget_ms': args.budget,
+    }
+
+    print(f"启动 {args.runs} 次 | 可交互中位数 {result['interactive_ms']['median']}ms "
+          f"(最快 {result['interactive_ms']['min']}ms, 最慢 {result['interactive_ms']['max']}ms) | "
+          f"进程总耗时中位数 {result['process_seconds_median']}s")
+    for name, duration in phases.items():
+        print(f"  {name:<10} {duration:8.1f} ms")
+    if result['heavy_modules']:
+        print(f"启动阶段加载了重型模块: {', '.join(result['heavy_modules'])}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if result['interactive_ms']['median'] > args.budget:
+        print(f"超出预算 {args.budget:.0f}ms")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
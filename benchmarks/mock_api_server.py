@@ -0,0 +1,252 @@
+"""本地模拟API服务：模拟生图平台和OpenRouter的 /v1/chat/completions 接口，并提供图片下载
+
+用于在不消耗真实额度的情况下测试和压测完整流程。
+
+启动：
+    python benchmarks/mock_api_server.py --port 18080 --latency-median 3 --errors 429=0.05,503=0.02
+
+主程序改用模拟服务：
+    set SORA_API_BASE_URL=http://127.0.0.1:18080
+    set SORA_OPENROUTER_URL=http://127.0.0.1:18080/api/v1/chat/completions
+"""
+import argparse
+import base64
+import itertools
+import json
+import math
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 与 main.py 中 IMAGE_URL_PATTERNS 各分支对应的响应格式
+RESPONSE_FORMATS = {
+    'download_link': lambda urls: "\n".join(f"图片已生成 [点击下载]({url})" for url in urls),
+    'markdown_cn': lambda urls: "\n".join(f"![图片]({url})" for url in urls),
+    'markdown': lambda urls: "\n".join(f"![generated]({url})" for url in urls),
+    'image_ext': lambda urls: "生成完成: " + " ".join(urls),
+    'any_link': lambda urls: "结果地址 " + " ".join(url.replace('.png', '') for url in urls),
+}
+# 结构化响应格式（不走文本匹配）
+STRUCTURED_FORMATS = ('json_data', 'b64_json')
+
+
+def make_png(size_bytes, seed=0):
+    """生成约 size_bytes 大小的合法PNG（随机噪声，压缩率低）"""
+    side = max(8, int(math.sqrt(max(size_bytes, 64) / 3)))
+    rng = random.Random(seed)
+    raw = b''.join(b'\x00' + rng.getrandbits(side * 24).to_bytes(side * 3, 'little') for _ in range(side))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', side, side, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(raw, 1)) + chunk(b'IEND', b'')
+
+
+def parse_error_rates(spec):
+    """解析 "429=0.05,503=0.02" 形式的错误率"""
+    rates = {}
+    for part in (spec or '').split(','):
+        if '=' in part:
+            code, rate = part.split('=', 1)
+            rates[int(code)] = float(rate)
+    return rates
+
+
+class MockState:
+    """模拟服务的配置和计数（多线程共享）"""
+
+    def __init__(self, args):
+        self.latency_median = args.latency_median
+        self.latency_sigma = args.latency_sigma
+        self.optimize_latency = args.optimize_latency
+        self.error_rates = parse_error_rates(args.errors)
+        self.formats = [f.strip() for f in args.formats.split(',') if f.strip()]
+        self.stream_steps = args.stream_steps
+        self.image = make_png(args.image_bytes)
+        self.rng = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.image_ids = itertools.count(1)
+        self.format_cycle = itertools.cycle(self.formats)
+        self.counts = {}
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def sample_latency(self):
+        """对数正态分布的生成耗时（中位数 latency_median 秒）"""
+        if self.latency_median <= 0:
+            return 0.0
+        with self.lock:
+            return self.rng.lognormvariate(math.log(self.latency_median), self.latency_sigma)
+
+    def sample_error(self):
+        """按配置的错误率随机返回错误码，无错误时返回 None"""
+        with self.lock:
+            roll = self.rng.random()
+        for code, rate in self.error_rates.items():
+            if roll < rate:
+                return code
+            roll -= rate
+        return None
+
+    def next_format(self):
+        with self.lock:
+            return next(self.format_cycle)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None  # MockState，由 create_server 设置
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith('/images/'):
+            self.state.count('download')
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(self.state.image)))
+            self.end_headers()
+            self.wfile.write(self.state.image)
+        elif self.path == '/stats':
+            with self.state.lock:
+                self.send_json(200, dict(self.state.counts))
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_json(400, {'error': {'message': 'invalid json'}})
+            return
+        if not self.path.endswith('/chat/completions'):
+            self.send_json(404, {'error': 'not found'})
+            return
+        if self.path.startswith('/api/'):
+            self.handle_optimize(payload)
+        else:
+            self.handle_image(payload)
+
+    def handle_optimize(self, payload):
+        """模拟OpenRouter提示词优化（单条和JSON数组批量）"""
+        self.state.count('optimize')
+        time.sleep(self.state.optimize_latency)
+        text = payload['messages'][-1]['content']
+        match = re.search(r'\[.*\]', text, re.S)
+        if 'JSON数组' in text and match:
+            prompts = json.loads(match.group(0))
+            content = json.dumps([f"{p}（已优化）" for p in prompts], ensure_ascii=False)
+        else:
+            content = text.rsplit('待优化提示词：', 1)[-1] + "（已优化）"
+        if payload.get('stream'):
+            self.send_stream([content[i:i + 8] for i in range(0, len(content), 8)], delay=0.01)
+        else:
+            self.send_json(200, {'choices': [{'message': {'role': 'assistant', 'content': content}}]})
+
+    def handle_image(self, payload):
+        """模拟生图接口：按配置的耗时、错误率和响应格式返回"""
+        self.state.count('image')
+        latency = self.state.sample_latency()
+        error_code = self.state.sample_error()
+        if error_code:
+            self.state.count(f'error_{error_code}')
+            time.sleep(min(latency, 1.0))
+            self.send_json(error_code, {'error': {'message': f'mock error {error_code}', 'code': error_code}})
+            return
+
+        host = self.headers.get('Host', '127.0.0.1')
+        count = max(1, int(payload.get('n') or 1))
+        urls = [f"http://{host}/images/{next(self.state.image_ids)}.png" for _ in range(count)]
+        response_format = self.state.next_format()
+
+        if payload.get('stream'):
+            steps = max(1, self.state.stream_steps)
+            chunks = [f"> 生成中 {int((i + 1) * 100 / (steps + 1))}%\n" for i in range(steps)]
+            chunks.append(RESPONSE_FORMATS.get(response_format, RESPONSE_FORMATS['markdown_cn'])(urls))
+            self.send_stream(chunks, delay=latency / (steps + 1))
+            return
+
+        time.sleep(latency)
+        if response_format == 'json_data':
+            self.send_json(200, {'data': [{'url': url} for url in urls]})
+        elif response_format == 'b64_json':
+            encoded = base64.b64encode(self.state.image).decode('ascii')
+            self.send_json(200, {'data': [{'b64_json': encoded} for _ in urls]})
+        else:
+            content = RESPONSE_FORMATS[response_format](urls)
+            self.send_json(200, {'choices': [{'message': {'role': 'assistant', 'content': content}}]})
+
+    def send_stream(self, chunks, delay):
+        """以SSE分块发送内容"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for text in chunks:
+                time.sleep(delay)
+                event = {'choices': [{'delta': {'content': text}}]}
+                self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端拿到链接后会提前断开
+            pass
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="本地模拟生图/优化API服务")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--latency-median', type=float, default=2.0, help="生图耗时中位数（秒）")
+    parser.add_argument('--latency-sigma', type=float, default=0.4, help="生图耗时对数正态分布的sigma")
+    parser.add_argument('--optimize-latency', type=float, default=0.2, help="提示词优化耗时（秒）")
+    parser.add_argument('--errors', default='', help="错误率，如 429=0.05,503=0.02,401=0.01")
+    parser.add_argument('--formats', default=','.join(list(RESPONSE_FORMATS) + list(STRUCTURED_FORMATS)),
+                        help="轮流使用的响应格式")
+    parser.add_argument('--stream-steps', type=int, default=5, help="流式响应中的进度条数")
+    parser.add_argument('--image-bytes', type=int, default=1024 * 1024, help="下载图片的大致大小（字节）")
+    parser.add_argument('--seed', type=int, default=0)
+    return parser
+
+
+def create_server(args):
+    """创建模拟服务（调用方负责 serve_forever / shutdown）"""
+    handler = type('BoundMockHandler', (MockHandler,), {'state': MockState(args)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    args = build_arg_parser().parse_args()
+    server = create_server(args)
+    print(f"模拟API服务已启动: http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,27 @@ import json
 import logging
 import os
 import time
+STARTUP_BEGIN = time.perf_counter()  # 启动耗时报告的起点
+import threading
+import bisect
+import math
+import struct
+import zlib
+import functools
+import cProfile
+import io
+from collections import deque
+import queue
+import atexit
+import argparse
+import sqlite3
+import socket
+from contextlib import contextmanager
+import uuid
+from urllib.parse import urlparse, parse_qs
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 # 检查Python版本
@@ -16,14 +37,16 @@ if sys.version_info < (3, 8):
 try:
     import requests
     import re
-    import pandas as pd
     import base64
     import shutil
+    import hashlib
+    import csv
+    import codecs
     import datetime
 except ImportError as e:
     print(f"缺少必需的模块: {e}")
     print("请运行以下命令安装:")
-    print("pip install requests pandas")
+    print("pip install requests")
     input("按回车键退出...")
     sys.exit(1)
 # 检查并导入PyQt6
@@ -35,9 +58,9 @@ try:
                                 QTreeWidget, QTreeWidgetItem, QMenu, QInputDialog, QMessageBox,
                                 QSplitter, QPlainTextEdit, QGroupBox, QGridLayout, QScrollArea,
                                 QFrame, QProgressBar, QTabWidget, QAbstractItemView, QStyledItemDelegate, QStyle,
-                                QSizePolicy)
-    from PyQt6.QtCore import Qt, QThreadPool, QRunnable, pyqtSignal, QObject, QTimer, QSize, QUrl, QMimeData
-    from PyQt6.QtGui import QPixmap, QImage, QFont, QPalette, QColor, QIcon, QTextOption, QDragEnterEvent, QDropEvent
+                                QSizePolicy, QProgressDialog)
+    from PyQt6.QtCore import Qt, QCoreApplication, QThreadPool, QRunnable, pyqtSignal, QObject, QTimer, QSize, QUrl, QMimeData
+    from PyQt6.QtGui import QPixmap, QImage, QFont, QPalette, QColor, QIcon, QTextOption, QTextCursor, QDragEnterEvent, QDropEvent
 except ImportError as e:
     print(f"缺少PyQt6模块: {e}")
     print("请运行以下命令安装:")
@@ -56,6 +79,14 @@ try:
 except ImportError:
     subprocess = None
 
+# 监视文件夹时优先使用系统文件事件通知（可选依赖），未安装时轮询
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
 def get_app_path():
     """获取应用程序路径，支持打包后的exe"""
     if getattr(sys, 'frozen', False):
@@ -160,8 +191,8 @@ def delete_category_directory(category_name):
         shutil.rmtree(category_path)
         logging.info(f"删除分类目录: {category_path}")
 
-def copy_image_to_category(source_path, category_name, image_name):
-    """复制图片到分类目录"""
+def copy_image_to_category(source_path, category_name, image_name, link_duplicates=True):
+    """复制图片到分类目录；link_duplicates=True 时图库中已有相同内容的图片则创建硬链接，不再复制一份"""
     try:
         # 验证输入参数
         if not source_path or not category_name or not image_name:
@@ -195,9 +226,20 @@ def copy_image_to_category(source_path, category_name, image_name):
             target_path = category_path / target_filename
             counter += 1
         
-        # 复制文件
-        shutil.copy2(source_path, target_path)
-        logging.info(f"复制图片: {source_path} -> {target_path}")
+        # 复制文件（图库中已有相同图片时改为硬链接，不支持硬链接或图库索引尚未在后台建立完成时仍复制）
+        existing = GALLERY_INDEX.find(source_path) if link_duplicates else None
+        linked = False
+        if existing:
+            try:
+                os.link(existing, target_path)
+                linked = True
+                logging.info(f"图库中已有相同图片，创建硬链接: {existing} -> {target_path}")
+            except OSError as e:
+                logging.warning(f"创建硬链接失败，改为复制: {str(e)}")
+        if not linked:
+            shutil.copy2(source_path, target_path)
+            logging.info(f"复制图片: {source_path} -> {target_path}")
+        GALLERY_INDEX.add(target_path)
         
         # 验证复制结果
         if not target_path.exists():
@@ -234,12 +276,91 @@ def image_to_base64(image_path):
         return None
 
 # 配置日志
-logging.basicConfig(
-    filename=APP_PATH / 'sora_generator.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    encoding='utf-8'
-)
+LOG_FILE_PATH = APP_PATH / 'sora_generator.log'
+LOG_MAX_BYTES = 5 * 1024 * 1024  # 单个日志文件上限，超过后轮转
+LOG_BACKUP_COUNT = 5
+
+# 各子系统使用独立的logger，可单独调整级别（界面部分仍使用根logger）
+worker_logger = logging.getLogger('sora.worker')      # 生图请求
+optimize_logger = logging.getLogger('sora.optimize')  # 提示词优化
+download_logger = logging.getLogger('sora.download')  # 图片下载
+cache_logger = logging.getLogger('sora.cache')        # 生图结果缓存
+service_logger = logging.getLogger('sora.service')    # 任务服务
+startup_logger = logging.getLogger('sora.startup')    # 启动耗时
+
+_log_listener = None
+
+def parse_log_levels(spec):
+    """解析 "sora.worker=DEBUG,sora.download=WARNING" 形式的级别配置"""
+    levels = {}
+    for part in (spec or '').split(','):
+        if '=' in part:
+            name, level = part.split('=', 1)
+            levels[name.strip()] = level.strip()
+    return levels
+
+def resolve_log_level(level):
+    """日志级别名称转为数值，无效时返回 None"""
+    level_value = logging.getLevelName(str(level).strip().upper())
+    return level_value if isinstance(level_value, int) else None
+
+def apply_log_levels(levels):
+    """按 {logger名: 级别} 设置各子系统日志级别，忽略无效级别"""
+    for name, level in (levels or {}).items():
+        level_value = resolve_log_level(level)
+        if level_value is not None:
+            logging.getLogger(name).setLevel(level_value)
+        else:
+            logging.warning(f"无效的日志级别: {name}={level}")
+
+def setup_logging():
+    """日志经队列交给后台线程写入轮转文件，避免磁盘IO阻塞生图和界面线程
+
+    环境变量 SORA_LOG_LEVEL 设置总体级别，SORA_LOG_LEVELS 设置子系统级别。
+    """
+    global _log_listener
+    file_handler = RotatingFileHandler(LOG_FILE_PATH, maxBytes=LOG_MAX_BYTES,
+                                       backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s'))
+    log_queue = queue.SimpleQueue()
+    root_logger = logging.getLogger()
+    root_logger.addHandler(QueueHandler(log_queue))
+    level_name = os.environ.get('SORA_LOG_LEVEL') or 'INFO'
+    root_level = resolve_log_level(level_name)
+    root_logger.setLevel(root_level if root_level is not None else logging.INFO)
+    _log_listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+    if root_level is None:
+        logging.warning(f"无效的日志级别 SORA_LOG_LEVEL={level_name}，使用 INFO")
+    apply_log_levels(parse_log_levels(os.environ.get('SORA_LOG_LEVELS', '')))
+
+setup_logging()
+
+BASE64_DATA_URL_PATTERN = re.compile(r'data:([\w/+.-]+);base64,[A-Za-z0-9+/=]+')
+
+def describe_binary(data_url):
+    """用类型、长度和哈希前缀代替内联base64数据"""
+    mime_type = data_url[5:data_url.find(';')]
+    digest = hashlib.sha256(data_url.encode('ascii', 'ignore')).hexdigest()[:12]
+    return f"<{mime_type} base64 {len(data_url)}字节 sha256:{digest}>"
+
+def summarize_text(text, limit=1000):
+    """日志用文本摘要：替换内联base64并截断过长内容"""
+    if not isinstance(text, str):
+        return text
+    text = BASE64_DATA_URL_PATTERN.sub(lambda m: describe_binary(m.group(0)), text)
+    if len(text) > limit:
+        text = f"{text[:limit]}...(共{len(text)}字符)"
+    return text
+
+def summarize_payload(payload, limit=500):
+    """日志用请求体摘要：递归处理所有字符串字段，二进制数据只记录长度和哈希"""
+    if isinstance(payload, dict):
+        return {key: summarize_payload(value, limit) for key, value in payload.items()}
+    if isinstance(payload, list):
+        return [summarize_payload(value, limit) for value in payload]
+    return summarize_text(payload, limit)
 
 # 缩略图缓存目录
 THUMBNAIL_CACHE_PATH = APP_PATH / 'thumbnails'
@@ -308,279 +429,2359 @@ def get_cached_thumbnail(image_path, size=(120, 120)):
     # 创建新的缩略图
     return create_thumbnail(image_path, thumbnail_path, size)
 
-class WorkerSignals(QObject):
-    finished = pyqtSignal(str, str, str)  # 提示词, 图片URL, 编号
-    error = pyqtSignal(str, str)     # 提示词, 错误信息
-    progress = pyqtSignal(str, str)  # 提示词, 状态信息
+class OperationCancelled(Exception):
+    """用户主动取消的请求"""
 
-class Worker(QRunnable):
-    def __init__(self, prompt, api_key, image_data=None, api_platform="云雾", image_model="sora", retry_count=3, number=None):
-        super().__init__()
-        self.prompt = prompt
-        self.api_key = api_key
-        self.image_data = image_data or []  # 现在包含{'name': '', 'url': '', 'path': ''} 的数据
-        self.api_platform = api_platform
-        self.image_model = image_model  # 添加生图模型参数
-        self.retry_count = retry_count
-        self.number = number
-        self.signals = WorkerSignals()
-        
-    def run(self):
+def iter_sse_events(response, include_keepalive=False):
+    """逐条解析SSE流（data: {...}），遇到[DONE]结束
+
+    include_keepalive=True 时对注释/心跳行产出 None，便于调用方做停滞检测。
+    """
+    for raw_line in response.iter_lines(decode_unicode=False):
+        if not raw_line:
+            continue
+        line = raw_line.decode('utf-8', errors='replace').strip()
+        if not line.startswith('data:'):
+            # 注释行（如 ": OPENROUTER PROCESSING"）和event行
+            if include_keepalive:
+                yield None
+            continue
+        payload = line[5:].strip()
+        if payload == '[DONE]':
+            return
         try:
-            # 发送进度信号
-            self.signals.progress.emit(self.prompt, "生成中...")
-            
-            # 验证API密钥
-            if not self.api_key:
-                raise ValueError("API密钥不能为空")
-            
-            # 验证API密钥格式
-            if not self.api_key.startswith('sk-'):
-                logging.warning(f"API密钥格式可能不正确，应以'sk-'开头: {self.api_key[:10]}...")
-            
-            # 记录使用的配置（用于调试）
-            logging.info(f"使用配置 - 平台: {self.api_platform}, 模型: {self.image_model}, 密钥前缀: {self.api_key[:10]}...")
-                
-            # 构建API请求
-            if self.api_platform == "云雾":
-                api_url = "https://yunwu.ai/v1/chat/completions"
-            elif self.api_platform == "apicore":
-                api_url = "https://api.apicore.ai/v1/chat/completions"
-            else:
-                api_url = "https://api.apicore.ai/v1/chat/completions"  # 默认使用apicore
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_key}"
-            }
-            
-            # 构建消息内容
-            content = [{"type": "text", "text": self.prompt}]
-            
-            # 添加图片（支持URL、本地文件和base64数据）
-            for img_data in self.image_data:
-                if 'data' in img_data and img_data['data']:
-                    # 直接使用base64数据（拖拽参考图）
-                    base64_url = f"data:image/png;base64,{img_data['data']}"
-                    content.append({
-                        "type": "image_url",
-                        "image_url": {"url": base64_url}
-                    })
-                    logging.info(f"添加拖拽参考图片: {img_data['name']} (base64数据)")
-                elif 'path' in img_data and img_data['path']:
-                    # 本地图片，转换为base64
-                    local_path = APP_PATH / img_data['path']
-                    if local_path.exists():
-                        base64_url = image_to_base64(local_path)
-                        if base64_url:
-                            content.append({
-                                "type": "image_url",
-                                "image_url": {"url": base64_url}
-                            })
-                            logging.info(f"添加本地图片: {img_data['name']} -> {img_data['path']}")
-                        else:
-                            logging.warning(f"本地图片转换base64失败: {img_data['path']}")
-                    else:
-                        logging.warning(f"本地图片文件不存在: {img_data['path']}")
-                elif 'url' in img_data and img_data['url']:
-                    # 网络图片，使用URL
-                    content.append({
-                        "type": "image_url",
-                        "image_url": {"url": img_data['url']}
-                    })
-                    logging.info(f"添加网络图片: {img_data['name']} -> {img_data['url']}")
-            
-            # 根据选择的模型设置API参数
-            if self.image_model == "sora":
-                # Sora模型配置
-                if self.api_platform == "云雾":
-                    model = "sora"  # 修正：云雾平台使用 sora 而不是 sora_image
-                elif self.api_platform == "apicore":
-                    model = "sora"
-                else:
-                    model = "sora"
-            elif self.image_model == "nano-banana":
-                # nano-banana模型配置
-                if self.api_platform == "云雾":
-                    model = "fal-ai/nano-banana"
-                elif self.api_platform == "apicore":
-                    model = "fal-ai/nano-banana"  # 修正：统一使用 fal-ai/nano-banana
-                else:
-                    model = "fal-ai/nano-banana"
+            yield json.loads(payload)
+        except json.JSONDecodeError:
+            logging.debug(f"无法解析的SSE数据: {payload[:200]}")
+
+# 流式生图：两次有效输出之间的最长等待时间（秒）
+IMAGE_STREAM_STALL_TIMEOUT = 120
+# 流式生图：中间进度文本中的百分比，如 "进度 45%"、"🏃 67.5%"
+IMAGE_PROGRESS_PATTERN = re.compile(r'(\d{1,3}(?:\.\d+)?)\s*%')
+
+# ========== 响应图片链接提取 ==========
+
+# 预编译的文本匹配规则，按优先级排列: 名称 -> (正则, 链接是否带闭合括号)
+IMAGE_URL_PATTERNS = {
+    # 点击下载链接
+    'download_link': (re.compile(r'\[点击下载\]\((.*?)\)'), True),
+    # 图片markdown格式
+    'markdown_cn': (re.compile(r'!\[图片\]\((.*?)\)'), True),
+    # 任何markdown图片格式
+    'markdown': (re.compile(r'!\[.*?\]\((https?://[^\)]+)\)'), True),
+    # 直接查找图片URL（常见格式）
+    'image_ext': (re.compile(r'(https?://[^\s\)\]]+\.(?:jpg|jpeg|png|gif|webp|bmp))', re.IGNORECASE), False),
+    # 任何以http开头的链接（可能是图片）
+    'any_link': (re.compile(r'(https?://[^\s\)\]]+)'), False),
+}
+DEFAULT_TEXT_PATTERN_ORDER = ['download_link', 'markdown_cn', 'markdown', 'image_ext', 'any_link']
+
+def _unique(urls):
+    """去重并保持顺序"""
+    seen = set()
+    return [u for u in urls if u and not (u in seen or seen.add(u))]
+
+def extract_urls_from_json_data(data, content, complete_only):
+    """结构化快速路径: OpenAI images 风格的 data[].url / data[].b64_json"""
+    urls = []
+    if not isinstance(data, dict):
+        return urls
+    for item in data.get('data') or []:
+        if not isinstance(item, dict):
+            continue
+        if item.get('url'):
+            urls.append(item['url'])
+        elif item.get('b64_json'):
+            urls.append(f"data:image/png;base64,{item['b64_json']}")
+    return urls
+
+def extract_urls_from_message_parts(data, content, complete_only):
+    """结构化快速路径: message.images[] 或多段 content 中的 image_url"""
+    urls = []
+    try:
+        message = data['choices'][0]['message']
+    except (KeyError, IndexError, TypeError):
+        return urls
+    if not isinstance(message, dict):
+        return urls
+    parts = list(message.get('images') or [])
+    if isinstance(message.get('content'), list):
+        parts.extend(message['content'])
+    for part in parts:
+        if isinstance(part, dict) and part.get('type') == 'image_url':
+            image_url = part.get('image_url')
+            urls.append(image_url.get('url') if isinstance(image_url, dict) else image_url)
+    return urls
+
+def make_text_pattern_extractor(pattern_names):
+    """按给定优先级在文本中匹配，返回第一个命中规则的全部链接（支持一次返回多张图）"""
+    def extractor(data, content, complete_only):
+        if not isinstance(content, str) or not content:
+            return []
+        for name in pattern_names:
+            pattern, is_closed = IMAGE_URL_PATTERNS[name]
+            if complete_only and not is_closed:
+                # 流式响应中，未闭合的链接可能还没接收完整
+                continue
+            urls = pattern.findall(content)
+            if urls:
+                return urls
+        return []
+    return extractor
+
+# 提取器注册表: (平台, 模型) -> [提取器]，None 表示通配
+IMAGE_URL_EXTRACTORS = {
+    (None, None): [
+        extract_urls_from_json_data,
+        extract_urls_from_message_parts,
+        make_text_pattern_extractor(DEFAULT_TEXT_PATTERN_ORDER),
+    ],
+}
+
+def register_image_url_extractors(extractors, api_platform=None, image_model=None):
+    """为指定平台/模型注册提取器列表（按顺序尝试，第一个有结果的生效）"""
+    IMAGE_URL_EXTRACTORS[(api_platform, image_model)] = list(extractors)
+
+def get_image_url_extractors(api_platform=None, image_model=None):
+    """按 (平台,模型) -> (平台,*) -> (*,模型) -> 默认 的顺序查找提取器"""
+    for key in ((api_platform, image_model), (api_platform, None), (None, image_model), (None, None)):
+        if key in IMAGE_URL_EXTRACTORS:
+            return IMAGE_URL_EXTRACTORS[key]
+    return IMAGE_URL_EXTRACTORS[(None, None)]
+
+def extract_image_urls(data=None, content=None, api_platform=None, image_model=None, complete_only=False):
+    """从响应中提取全部图片URL（可能多张），未找到时返回空列表
+
+    data 为完整的JSON响应（可选），content 为消息文本；
+    complete_only=True 时只接受已闭合的链接，用于流式响应中提前返回。
+    """
+    if content is None and data is not None:
+        try:
+            content = data['choices'][0]['message'].get('content')
+        except (KeyError, IndexError, TypeError, AttributeError):
+            content = None
+    if isinstance(content, list):
+        # 多段内容只取文本部分做文本匹配，图片部分由结构化提取器处理
+        content = '\n'.join(part.get('text', '') for part in content if isinstance(part, dict))
+    for extractor in get_image_url_extractors(api_platform, image_model):
+        urls = _unique(extractor(data, content, complete_only))
+        if urls:
+            return urls
+    return []
+
+def extract_image_url(content, complete_only=False, api_platform=None, image_model=None):
+    """从响应文本中提取第一张图片URL"""
+    urls = extract_image_urls(content=content, api_platform=api_platform,
+                              image_model=image_model, complete_only=complete_only)
+    return urls[0] if urls else None
+
+def fetch_image_bytes(image_url, timeout=120):
+    """下载图片内容，兼容 data:image/...;base64 形式的内联图片"""
+    if image_url.startswith('data:'):
+        return base64.b64decode(image_url.split(',', 1)[1])
+    response = requests.get(image_url, timeout=timeout)
+    response.raise_for_status()
+    return response.content
+
+# ========== 运行指标 ==========
+
+# 耗时直方图的桶边界（秒）与字节数直方图的桶边界
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+BYTES_BUCKETS = (64 * 1024, 256 * 1024, 512 * 1024, 1024 * 1024, 2 * 1024 * 1024, 5 * 1024 * 1024, 10 * 1024 * 1024)
+
+def api_key_label(api_key):
+    """指标中用于区分API密钥的标签（只保留哈希前缀，不暴露密钥）"""
+    if not api_key:
+        return ''
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:8]
+
+def percentile_of(ordered, q):
+    """已排序样本的分位数（q 取 0~100），没有样本时返回 None"""
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+class Histogram:
+    """固定桶直方图，另保留最近的样本用于计算分位数"""
+
+    RESERVOIR_SIZE = 1024
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)  # 最后一个为 +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=self.RESERVOIR_SIZE)
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+    def percentile(self, q):
+        """最近样本的分位数（q 取 0~100），没有样本时返回 None"""
+        return percentile_of(sorted(self.samples), q)
+
+class MetricsRegistry:
+    """进程内指标注册表：计数器、仪表和直方图，按标签（平台、模型、密钥等）分组，线程安全"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}    # (名称, 标签) -> 数值
+        self.gauges = {}      # (名称, 标签) -> 数值
+        self.histograms = {}  # (名称, 标签) -> Histogram
+
+    @staticmethod
+    def label_key(labels):
+        return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+    def inc(self, name, value=1, **labels):
+        key = (name, self.label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_gauge(self, name, delta, **labels):
+        key = (name, self.label_key(labels))
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + delta
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, self.label_key(labels))] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, self.label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def percentile(self, name, q, **labels):
+        """指定标签组合的分位数；不给标签时合并该指标的全部样本"""
+        with self.lock:
+            if labels:
+                histogram = self.histograms.get((name, self.label_key(labels)))
+                samples = list(histogram.samples) if histogram else []
             else:
-                # 默认使用sora
-                model = "sora"
-            
-            payload = {
-                "model": model,
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "You are an AI image generator. Generate high-quality images based on user text descriptions. Always provide the generated image URL in the response."
-                    },
-                    {
-                        "role": "user",
-                        "content": content
-                    }
-                ],
-                "max_tokens": 1000,  # 添加max_tokens限制
-                "temperature": 0.7   # 添加适中的创造性
-            }
-            
-            # 记录请求信息
-            logging.info("发送API请求:")
-            logging.info(f"URL: {api_url}")
-            logging.info(f"请求参数: {json.dumps(payload, ensure_ascii=False, indent=2)}")
-            
-            # 发送请求(带重试机制)
-            retry_times = 0
-            while retry_times <= self.retry_count:
-                try:
-                    # 添加随机延迟，避免同时发送大量请求
-                    import random
-                    # 初次请求延迟较短，重试时延迟会递增
-                    initial_delay = random.uniform(0.5, 1.5)
-                    time.sleep(initial_delay)
-                    
-                    response = requests.post(
-                        api_url, 
-                        headers=headers, 
-                        json=payload,
-                        timeout=300  # 减少超时时间到5分钟，避免长时间挂起
-                    )
-                    
-                    # 记录响应信息
-                    logging.info(f"API响应状态码: {response.status_code}")
-                    logging.info(f"API响应内容: {response.text}")
-                    
-                    response.raise_for_status()
-                    data = response.json()
-                    
-                    # 解析响应
-                    # 平台返回文本中的图片URL
-                    content = data["choices"][0]["message"]["content"]
-                    
-                    # 尝试多种格式的图片URL，按优先级排序
-                    image_url_match = None
-                    
-                    # 优先级1: 点击下载链接
-                    image_url_match = re.search(r'\[点击下载\]\((.*?)\)', content)
-                    
-                    # 优先级2: 图片markdown格式
-                    if not image_url_match:
-                        image_url_match = re.search(r'!\[图片\]\((.*?)\)', content)
-                    
-                    # 优先级3: 任何markdown图片格式
-                    if not image_url_match:
-                        image_url_match = re.search(r'!\[.*?\]\((https?://[^\)]+)\)', content)
-                    
-                    # 优先级4: 直接查找图片URL（常见格式）
-                    if not image_url_match:
-                        image_url_match = re.search(r'(https?://[^\s\)\]]+\.(?:jpg|jpeg|png|gif|webp|bmp))', content, re.IGNORECASE)
-                    
-                    # 优先级5: 查找任何以http开头的链接（可能是图片）
-                    if not image_url_match:
-                        image_url_match = re.search(r'(https?://[^\s\)\]]+)', content)
-                    
-                    if image_url_match:
-                        image_url = image_url_match.group(1)
-                    else:
-                        error_msg = f"响应中没有找到图片URL。响应内容: {content}"
-                        logging.error(error_msg)
-                        raise ValueError(error_msg)
-                    
-                    logging.info(f"成功提取图片URL: {image_url}")
-                    self.signals.finished.emit(self.prompt, image_url, self.number or "")
-                    return
-                        
-                except (requests.exceptions.RequestException, ValueError, KeyError) as e:
-                    retry_times += 1
-                    error_detail = f"API平台: {self.api_platform}, 模型: {model}, 错误: {str(e)}"
-                    
-                    if hasattr(e, 'response') and e.response is not None:
-                        status_code = e.response.status_code
-                        response_text = e.response.text[:500]
-                        error_detail += f", 状态码: {status_code}, 响应: {response_text}"
-                        
-                        # 针对不同错误码提供具体建议
-                        if status_code == 401:
-                            error_detail += f"\n💡 解决建议: API密钥无效，请检查："
-                            error_detail += f"\n  1. 确认API密钥是否正确复制"
-                            error_detail += f"\n  2. 检查{self.api_platform}平台密钥是否过期"
-                            error_detail += f"\n  3. 验证密钥是否支持{model}模型"
-                            error_detail += f"\n  4. 当前使用密钥: {self.api_key[:15]}..."
-                        elif status_code == 503:
-                            error_detail += f"\n💡 解决建议: 服务暂不可用，请考虑："
-                            error_detail += f"\n  1. 切换到apicore平台试试"
-                            error_detail += f"\n  2. 使用nano-banana模型替代"
-                            error_detail += f"\n  3. 稍后重试，服务可能正在维护"
-                            error_detail += f"\n  4. {self.api_platform}平台的{model}模型可能暂时无可用通道"
-                    
-                    if retry_times <= self.retry_count:
-                        logging.warning(f"请求失败,正在进行第{retry_times}次重试: {error_detail}")
-                        self.signals.progress.emit(self.prompt, f"重试中 ({retry_times}/{self.retry_count})...")
-                        # 递增式重试延迟：第1次重试等待60秒，第2次等待120秒，第3次等待180秒
-                        # 针对503错误延长等待时间，给服务器更多恢复时间
-                        if hasattr(e, 'response') and e.response is not None and e.response.status_code == 503:
-                            retry_delay = 90 * retry_times  # 503错误等待更长时间
-                        else:
-                            retry_delay = 60 * retry_times  # 其他错误也延长到60秒倍数
-                        logging.info(f"重试延迟 {retry_delay} 秒...")
-                        # 显示倒计时，让用户知道等待进度
-                        for remaining in range(retry_delay, 0, -5):
-                            self.signals.progress.emit(self.prompt, f"重试中 ({retry_times}/{self.retry_count}) - {remaining}秒后重试...")
-                            time.sleep(5)
-                        continue
-                    else:
-                        # 重试失败，提供最终建议
-                        final_suggestion = ""
-                        if hasattr(e, 'response') and e.response is not None and e.response.status_code == 503:
-                            final_suggestion = f"\n\n🔄 建议立即尝试："
-                            final_suggestion += f"\n• 切换到apicore平台"
-                            final_suggestion += f"\n• 或使用nano-banana模型"
-                            final_suggestion += f"\n• 云雾平台sora模型可能正在维护中"
-                        
-                        error_msg = f"请求失败(已重试{self.retry_count}次): {error_detail}{final_suggestion}"
-                        logging.error(error_msg)
-                        self.signals.error.emit(self.prompt, error_msg)
-                        return
-                        
-        except Exception as e:
-            error_msg = f"发生错误: {str(e)}"
-            logging.error(error_msg)
-            self.signals.error.emit(self.prompt, error_msg)
+                samples = [value for (metric_name, _), histogram in self.histograms.items()
+                           if metric_name == name for value in histogram.samples]
+        # 排序在锁外进行，不阻塞工作线程记录指标
+        return percentile_of(sorted(samples), q)
 
-class SettingsDialog(QDialog):
-    """统一设置管理对话框"""
-    
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self._init_done = False  # 初始化标志
-        self.setWindowTitle("⚙️ 设置管理中心")
-        self.resize(1100, 750)
-        self.setMinimumSize(900, 650)
+    def summary(self, name):
+        """按标签列出直方图的次数、平均值和 p50/p95/p99"""
+        # 在锁内复制样本和计数，避免工作线程同时写入导致读到不一致的数据或迭代出错
+        with self.lock:
+            items = [(labels, h.count, h.sum, list(h.samples))
+                     for (metric_name, labels), h in self.histograms.items() if metric_name == name]
+        rows = []
+        for labels, count, total, samples in items:
+            ordered = sorted(samples)
+            rows.append({
+                'labels': dict(labels),
+                'count': count,
+                'avg': total / count if count else 0,
+                'p50': percentile_of(ordered, 50),
+                'p95': percentile_of(ordered, 95),
+                'p99': percentile_of(ordered, 99),
+            })
+        return rows
+
+# 全局指标注册表
+METRICS = MetricsRegistry()
+
+# ========== OpenMetrics 导出 ==========
+
+METRICS_PREFIX = 'sora_'
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+def _format_labels(labels, extra=None):
+    """OpenMetrics 标签格式，值中的反斜杠、引号和换行需转义"""
+    items = list(labels) + list(extra or [])
+    if not items:
+        return ''
+    escaped = [
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in items
+    ]
+    return '{' + ','.join(escaped) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render_openmetrics(registry):
+    """把指标注册表渲染为 OpenMetrics 文本"""
+    with registry.lock:
+        counters = sorted(registry.counters.items())
+        gauges = sorted(registry.gauges.items())
+        histograms = sorted(
+            ((key, h.buckets, list(h.bucket_counts), h.count, h.sum) for key, h in registry.histograms.items()),
+            key=lambda item: item[0])
+
+    lines = []
+    declared = set()
+
+    def declare(family, metric_type):
+        if family not in declared:
+            declared.add(family)
+            lines.append(f"# TYPE {family} {metric_type}")
+
+    for (name, labels), value in counters:
+        family = METRICS_PREFIX + (name[:-len('_total')] if name.endswith('_total') else name)
+        declare(family, 'counter')
+        lines.append(f"{family}_total{_format_labels(labels)} {_format_value(value)}")
+    for (name, labels), value in gauges:
+        family = METRICS_PREFIX + name
+        declare(family, 'gauge')
+        lines.append(f"{family}{_format_labels(labels)} {_format_value(value)}")
+    for (name, labels), buckets, bucket_counts, count, total in histograms:
+        family = METRICS_PREFIX + name
+        declare(family, 'histogram')
+        cumulative = 0
+        for bound, bucket_count in zip(list(buckets) + ['+Inf'], bucket_counts):
+            cumulative += bucket_count
+            le = bound if bound == '+Inf' else _format_value(float(bound))
+            lines.append(f"{family}_bucket{_format_labels(labels, [('le', le)])} {cumulative}")
+        lines.append(f"{family}_count{_format_labels(labels)} {count}")
+        lines.append(f"{family}_sum{_format_labels(labels)} {_format_value(float(total))}")
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """GET /metrics 返回 OpenMetrics 文本"""
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = render_openmetrics(METRICS).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', OPENMETRICS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 抓取请求很频繁，只在DEBUG级别记录
+        logging.getLogger('sora.metrics').debug(format % args)
+
+class MetricsServer:
+    """在后台线程中提供 /metrics 接口"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.httpd = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='metrics-server', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        logging.getLogger('sora.metrics').info(f"指标接口已启动: http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# ========== 批次统计 ==========
+
+class GenerationStats:
+    """按任务完成事件增量计算出图速度、成功率、耗时分布和预计完成时间（只在界面线程使用）"""
+
+    RATE_WINDOW = 600     # 出图速度按最近10分钟计算（秒）
+    ROLLING_SIZE = 100    # 滚动成功率取最近100个任务
+    LATENCY_SAMPLES = 500  # 计算p95保留的最近耗时样本数
+
+    def __init__(self):
+        self.completions = deque()  # (完成时间, 图片数)，只保留速度窗口内的记录
+        self.recent_results = deque(maxlen=self.ROLLING_SIZE)
+        self.latencies = deque(maxlen=self.LATENCY_SAMPLES)
+        self.latency_sum = 0.0
+        self.latency_count = 0
+        self.platforms = {}  # 平台/模型 -> {'jobs', 'success', 'images', 'latency_sum'}
+        self.first_event_time = None
+        self.batch_total = 0
+        self.batch_done = 0
+
+    def start_batch(self, total):
+        """开始新批次（或向进行中的批次追加任务）"""
+        if self.batch_done >= self.batch_total:
+            self.batch_total = 0
+            self.batch_done = 0
+        self.batch_total += total
+
+    def record(self, platform, success, latency, images=0):
+        """记录一个任务结束"""
+        now = time.monotonic()
+        if self.first_event_time is None:
+            self.first_event_time = now - latency
+        self.batch_done += 1
+        self.recent_results.append(success)
+        stats = self.platforms.setdefault(platform, {'jobs': 0, 'success': 0, 'images': 0, 'latency_sum': 0.0})
+        stats['jobs'] += 1
+        self.completions.append((now, images if success else 0))
+        if success:
+            stats['success'] += 1
+            stats['images'] += images
+            stats['latency_sum'] += latency
+            self.latencies.append(latency)
+            self.latency_sum += latency
+            self.latency_count += 1
+
+    def trim_window(self, now):
+        while self.completions and now - self.completions[0][0] > self.RATE_WINDOW:
+            self.completions.popleft()
+        return min(self.RATE_WINDOW, max(now - self.first_event_time, 1.0))
+
+    def images_per_minute(self):
+        if self.first_event_time is None:
+            return 0.0
+        window = self.trim_window(time.monotonic())
+        return sum(images for _, images in self.completions) * 60 / window
+
+    def eta_seconds(self):
+        """按最近的任务完成速度估算当前批次剩余时间，无法估算时返回 None"""
+        remaining = self.batch_total - self.batch_done
+        if remaining <= 0 or self.first_event_time is None:
+            return None
+        window = self.trim_window(time.monotonic())
+        if not self.completions:
+            return None
+        return remaining * window / len(self.completions)
+
+    def summary_text(self):
+        """面板显示文本"""
+        if not self.recent_results:
+            return ""
+        success_rate = sum(self.recent_results) / len(self.recent_results) * 100
+        parts = [f"⚡ {self.images_per_minute():.1f} 张/分钟", f"✅ 近{len(self.recent_results)}个成功率 {success_rate:.0f}%"]
+        if self.latency_count:
+            p95 = sorted(self.latencies)[int(0.95 * (len(self.latencies) - 1))]
+            parts.append(f"⏱ 平均 {self.latency_sum / self.latency_count:.0f}s / p95 {p95:.0f}s")
+        eta = self.eta_seconds()
+        if eta is not None:
+            finish_at = datetime.datetime.now() + datetime.timedelta(seconds=eta)
+            parts.append(f"🏁 预计 {finish_at.strftime('%H:%M')} 完成（剩余约 {int(eta // 60)}分{int(eta % 60)}秒）")
+        platform_parts = []
+        for platform, stats in self.platforms.items():
+            avg = f"{stats['latency_sum'] / stats['success']:.0f}s" if stats['success'] else "-"
+            platform_parts.append(f"{platform}: {stats['images']}张 成功{stats['success']}/{stats['jobs']} 平均{avg}")
+        return " | ".join(parts) + "\n" + " | ".join(platform_parts)
+
+# ========== 性能分析（开发模式） ==========
+
+PROFILE_DIR = APP_PATH / 'profiles'
+PROFILE_SAMPLE_INTERVAL = 0.005  # 调用栈采样间隔（秒）
+STALL_CHECK_INTERVAL_MS = 50     # 事件循环卡顿检测计时器间隔
+STALL_THRESHOLD_MS = 100         # 计时器超出间隔多少毫秒算一次卡顿
+# 叶子帧位于这些文件时视为线程空闲等待，不计入采样
+IDLE_FRAME_FILES = {'threading.py', 'queue.py', 'selectors.py', 'socketserver.py'}
+
+class ProfilingSession:
+    """一次性能分析会话
+
+    被 @profiled 标记的函数在各自线程的 cProfile 中运行；后台线程定时采样所有线程的调用栈，
+    结束时写出 pstats、火焰图用的折叠栈（flamegraph.pl / speedscope 可直接读取）和卡顿记录。
+    """
+
+    def __init__(self, output_dir=None):
+        self.started_at = datetime.datetime.now()
+        self.output_dir = Path(output_dir or PROFILE_DIR) / self.started_at.strftime('%Y%m%d_%H%M%S')
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.profiles = []    # 各线程的 cProfile.Profile
+        self.call_stats = {}  # 函数名 -> [次数, 总耗时, 最长耗时]
+        self.stacks = {}      # 折叠栈 -> 采样次数
+        self.stalls = []      # (时间, 卡顿毫秒数)
+        self.sample_count = 0
+        self.active = True
+        self.sampler = threading.Thread(target=self.sample_loop, name='profile-sampler', daemon=True)
+        self.sampler.start()
+
+    def call(self, name, func, args, kwargs):
+        """在当前线程的 cProfile 中执行 func，嵌套的被标记函数只统计耗时
+
+        Python 3.12+ 同一时间只能启用一个 cProfile，其他线程正在分析时本次调用也只统计耗时。
+        """
+        profile = getattr(self.local, 'profile', None)
+        if profile is None:
+            profile = self.local.profile = cProfile.Profile()
+            self.local.depth = 0
+            with self.lock:
+                self.profiles.append(profile)
+        self.local.depth += 1
+        outermost = self.local.depth == 1
+        start = time.perf_counter()
+        profiling = False
+        if outermost:
+            try:
+                profile.enable()
+                profiling = True
+            except ValueError:
+                pass
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if profiling:
+                profile.disable()
+            self.local.depth -= 1
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                stats = self.call_stats.setdefault(name, [0, 0.0, 0.0])
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] = max(stats[2], elapsed)
+
+    def record_stall(self, duration_ms):
+        with self.lock:
+            self.stalls.append((time.time(), duration_ms))
+
+    def sample_loop(self):
+        """定时采样除自身外所有线程的调用栈"""
+        own_id = threading.get_ident()
+        while self.active:
+            time.sleep(PROFILE_SAMPLE_INTERVAL)
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            samples = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or os.path.basename(frame.f_code.co_filename) in IDLE_FRAME_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, f"thread-{thread_id}"))
+                samples.append(';'.join(reversed(stack)))
+            with self.lock:
+                self.sample_count += 1
+                for key in samples:
+                    self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def stop(self):
+        """结束采样并写出结果，返回输出目录"""
+        self.active = False
+        self.sampler.join(timeout=1)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            profiles = list(self.profiles)
+            stacks = dict(self.stacks)
+            call_stats = {name: list(values) for name, values in self.call_stats.items()}
+            stalls = list(self.stalls)
+
+        # 只在结束分析时用到，按需导入以免拖慢启动
+        import pstats
         
-        # 从父窗口获取数据
-        if parent:
-            self.api_key = parent.api_key
-            self.api_platform = parent.api_platform
-            self.image_model = parent.image_model  # 获取生图模型配置
-            # 分离的API密钥
-            self.sora_api_key = getattr(parent, 'sora_api_key', '')
-            self.nano_api_key = getattr(parent, 'nano_api_key', '')
-            self.thread_count = parent.thread_count
-            self.retry_count = parent.retry_count
-            self.save_path = parent.save_path
-            self.image_ratio = parent.image_ratio
-            self.style_library = parent.style_library.copy()
-            self.category_links = parent.category_links.copy()
-            self.current_style = parent.current_style
-            self.custom_style_content = parent.custom_style_content
-            # OpenRouter AI优化配置
+        # 合并各线程的 cProfile 结果（正在其他线程运行的调用只包含已完成部分）
+        stats = None
+        for profile in profiles:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            except TypeError:
+                # 该线程还没有记录到任何调用
+                continue
+        if stats is not None:
+            stats.dump_stats(str(self.output_dir / 'profile.pstats'))
+            text = io.StringIO()
+            stats.stream = text
+            stats.sort_stats('cumulative').print_stats(50)
+            (self.output_dir / 'profile.txt').write_text(text.getvalue(), encoding='utf-8')
+
+        with open(self.output_dir / 'stacks.folded', 'w', encoding='utf-8') as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+        stall_values = [duration for _, duration in stalls]
+        summary = {
+            'started_at': self.started_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'duration_seconds': round((datetime.datetime.now() - self.started_at).total_seconds(), 2),
+            'samples': self.sample_count,
+            'calls': {name: {'count': count, 'total_seconds': round(total, 4), 'max_seconds': round(longest, 4),
+                             'avg_seconds': round(total / count, 4)}
+                      for name, (count, total, longest) in sorted(call_stats.items(), key=lambda item: -item[1][1])},
+            'stalls': {
+                'count': len(stall_values),
+                'total_ms': round(sum(stall_values), 1),
+                'max_ms': round(max(stall_values), 1) if stall_values else 0,
+                'events': [{'time': datetime.datetime.fromtimestamp(at).strftime('%H:%M:%S.%f')[:-3],
+                            'ms': round(duration, 1)} for at, duration in stalls],
+            },
+        }
+        with open(self.output_dir / 'summary.json', 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        return self.output_dir
+
+PROFILER = None  # 当前的 ProfilingSession，未开启分析时为 None
+
+def start_profiling(output_dir=None):
+    """开启性能分析（已开启时返回当前会话）"""
+    global PROFILER
+    if PROFILER is None:
+        PROFILER = ProfilingSession(output_dir)
+        logging.info(f"性能分析已开启，结果目录: {PROFILER.output_dir}")
+    return PROFILER
+
+def stop_profiling():
+    """关闭性能分析并写出结果，返回输出目录；未开启时返回 None"""
+    global PROFILER
+    session, PROFILER = PROFILER, None
+    if session is None:
+        return None
+    output_dir = session.stop()
+    logging.info(f"性能分析结果已保存: {output_dir}")
+    return output_dir
+
+def profiled(func):
+    """标记纳入性能分析的函数；未开启分析时只多一次判断"""
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        session = PROFILER
+        if session is None:
+            return func(*args, **kwargs)
+        return session.call(name, func, args, kwargs)
+    return wrapper
+
+# ========== 启动耗时 ==========
+
+def read_startup_budget(default=2000.0):
+    """读取环境变量 SORA_STARTUP_BUDGET_MS，无效时使用默认值并记录警告"""
+    value = os.environ.get('SORA_STARTUP_BUDGET_MS')
+    if not value:
+        return default
+    try:
+        budget = float(value)
+    except ValueError:
+        budget = None
+    if budget is None or not math.isfinite(budget) or budget <= 0:
+        logging.warning(f"无效的启动耗时预算 SORA_STARTUP_BUDGET_MS={value}，使用 {default:.0f}ms")
+        return default
+    return budget
+
+STARTUP_BUDGET_MS = read_startup_budget()  # 可交互耗时预算
+STARTUP_HEAVY_MODULES = ('pandas', 'numpy', 'openpyxl', 'pyarrow')
+
+class StartupTrace:
+    """启动时间线：各阶段结束时 mark 记录时间点，界面可交互时 finish 输出报告
+
+    报告写入 sora.startup 日志，可交互耗时超过 STARTUP_BUDGET_MS 时记为警告。
+    环境变量 SORA_STARTUP_REPORT=1 时同时输出到控制台，SORA_STARTUP_TRACE=<文件> 时另存为JSON。
+    """
+
+    def __init__(self, begin):
+        self.begin = begin
+        self.marks = []  # [(阶段名, perf_counter时间点)]
+        self.finished = False
+
+    def mark(self, name):
+        if not self.finished:
+            self.marks.append((name, time.perf_counter()))
+
+    def phases(self):
+        """[{'name', 'at_ms', 'duration_ms'}]，duration 为距上一阶段的耗时"""
+        result = []
+        previous = self.begin
+        for name, timestamp in self.marks:
+            result.append({'name': name,
+                           'at_ms': round((timestamp - self.begin) * 1000, 1),
+                           'duration_ms': round((timestamp - previous) * 1000, 1)})
+            previous = timestamp
+        return result
+
+    def finish(self, name='可交互'):
+        if self.finished:
+            return
+        self.mark(name)
+        self.finished = True
+        phases = self.phases()
+        total_ms = phases[-1]['at_ms']
+        # 重型可选模块是否在启动阶段被加载，便于发现误导入
+        heavy = [module for module in STARTUP_HEAVY_MODULES if module in sys.modules]
+        report = (f"启动耗时 {total_ms:.0f}ms: "
+                  + " | ".join(f"{phase['name']} {phase['duration_ms']:.0f}ms" for phase in phases)
+                  + (f" | 已加载: {', '.join(heavy)}" if heavy else ""))
+        if total_ms > STARTUP_BUDGET_MS:
+            startup_logger.warning(f"{report}（超过预算 {STARTUP_BUDGET_MS:.0f}ms）")
+        else:
+            startup_logger.info(report)
+        if os.environ.get('SORA_STARTUP_REPORT'):
+            print(report, flush=True)
+        trace_path = os.environ.get('SORA_STARTUP_TRACE')
+        if trace_path:
+            try:
+                with open(trace_path, 'w', encoding='utf-8') as f:
+                    json.dump({'total_ms': total_ms, 'budget_ms': STARTUP_BUDGET_MS,
+                               'phases': phases, 'heavy_modules': heavy}, f, ensure_ascii=False, indent=2)
+            except OSError as e:
+                startup_logger.warning(f"写入启动时间线失败: {e}")
+
+STARTUP_TRACE = StartupTrace(STARTUP_BEGIN)
+
+# ========== 生图结果缓存 ==========
+
+GENERATION_CACHE_PATH = APP_PATH / 'generation_cache.json'
+
+def compute_request_key(api_platform, payload, variant=0):
+    """对规范化后的请求体计算内容哈希，作为结果缓存的键
+
+    同一提示词并发多次请求时用 variant 区分，避免被合并成同一张图。
+    """
+    canonical = json.dumps({'platform': api_platform, 'payload': payload, 'variant': variant},
+                           ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+class GenerationCache:
+    """按请求内容哈希缓存生图结果，并合并进行中的相同请求（线程安全）
+
+    requests: 请求键 -> {'image_urls': [...], 'time': 时间戳}
+    files:    图片URL -> 已保存的本地文件路径，命中缓存时直接复制本地文件
+
+    修改只标记为待写入，由后台定时器合并写盘（退出时也会写入），工作线程不必排队等磁盘。
+    """
+
+    MAX_ENTRIES = 2000
+    MAX_FILES = MAX_ENTRIES * 10  # files 超过时只保留仍被 requests 引用的图片
+    SAVE_DELAY = 2.0              # 修改后多久写盘（秒），期间的修改合并为一次写入
+    IN_FLIGHT_TIMEOUT = 600       # 等待进行中的相同请求的最长时间（秒），超时后自行请求
+
+    def __init__(self, path=GENERATION_CACHE_PATH):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.in_flight = {}  # 请求键 -> threading.Event
+        self.requests = {}
+        self.files = {}
+        self.dirty = False
+        self.save_timer = None
+        self.save_lock = threading.Lock()  # 串行化写盘，避免两次写入交错
+        atexit.register(self.flush)
+        try:
+            if self.path.exists():
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.requests = data.get('requests', {})
+                self.files = data.get('files', {})
+        except Exception as e:
+            cache_logger.warning(f"加载生图缓存失败，将重新建立: {str(e)}")
+
+    def mark_dirty(self):
+        """标记有待写入的修改并安排写盘（调用方需持有锁）"""
+        self.dirty = True
+        if self.save_timer is None:
+            self.save_timer = threading.Timer(self.SAVE_DELAY, self.flush)
+            self.save_timer.daemon = True
+            self.save_timer.start()
+
+    def flush(self):
+        """把待写入的修改写入缓存文件；先写临时文件再改名，中途退出不会留下残缺的缓存"""
+        with self.save_lock:
+            # 锁内只复制，序列化和写盘在锁外进行（条目写入后不再修改，浅复制即可）
+            with self.lock:
+                self.save_timer = None
+                if not self.dirty:
+                    return
+                self.dirty = False
+                data = {'requests': dict(self.requests), 'files': dict(self.files)}
+            temp_path = self.path.with_name(self.path.name + '.part')
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(temp_path, self.path)
+            except Exception as e:
+                cache_logger.error(f"保存生图缓存失败: {str(e)}")
+                with self.lock:
+                    self.dirty = True
+
+    def trim(self):
+        """淘汰最旧的请求，并清理不再被引用的文件记录（调用方需持有锁）"""
+        if len(self.requests) > self.MAX_ENTRIES:
+            oldest = sorted(self.requests, key=lambda k: self.requests[k]['time'])
+            for old_key in oldest[:len(self.requests) - self.MAX_ENTRIES]:
+                del self.requests[old_key]
+        if len(self.files) > self.MAX_FILES:
+            referenced = {url for entry in self.requests.values() for url in entry['image_urls']}
+            self.files = {url: path for url, path in self.files.items() if url in referenced}
+
+    def acquire(self, key):
+        """命中缓存时返回图片URL列表；否则登记为进行中并返回 None，调用方完成后必须 release
+
+        已有相同请求在进行时阻塞等待其结束，再重新检查缓存；等待超过 IN_FLIGHT_TIMEOUT 秒
+        （对方线程异常退出未 release）时接手该请求。
+        """
+        while True:
+            with self.lock:
+                entry = self.requests.get(key)
+                if entry:
+                    return list(entry['image_urls'])
+                event = self.in_flight.get(key)
+                if event is None:
+                    self.in_flight[key] = threading.Event()
+                    return None
+            cache_logger.info(f"等待进行中的相同请求: {key[:12]}")
+            if not event.wait(self.IN_FLIGHT_TIMEOUT):
+                cache_logger.warning(f"等待相同请求超时，改为自行请求: {key[:12]}")
+                with self.lock:
+                    # 仍是原来的请求时由本线程接手，原等待者随之唤醒
+                    if self.in_flight.get(key) is event:
+                        self.in_flight[key] = threading.Event()
+                        event.set()
+                        return None
+
+    def release(self, key):
+        """结束进行中的请求，唤醒等待者"""
+        with self.lock:
+            event = self.in_flight.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def store(self, key, image_urls):
+        """记录请求结果（内联base64图片体积大，不缓存）"""
+        if any(url.startswith('data:') for url in image_urls):
+            return
+        with self.lock:
+            self.requests[key] = {'image_urls': list(image_urls), 'time': time.time()}
+            self.trim()
+            self.mark_dirty()
+
+    def record_file(self, image_url, file_path):
+        """记录图片URL对应的本地文件"""
+        if image_url.startswith('data:'):
+            return
+        with self.lock:
+            self.files[image_url] = str(file_path)
+            self.trim()
+            self.mark_dirty()
+
+    def local_file(self, image_url):
+        """返回图片URL已保存的本地文件（文件仍存在时）"""
+        with self.lock:
+            file_path = self.files.get(image_url)
+        return file_path if file_path and os.path.exists(file_path) else None
+
+# 各平台生图接口地址；设置环境变量 SORA_API_BASE_URL 时全部改发到该地址（用于本地模拟服务和压测）
+IMAGE_API_URLS = {
+    "云雾": "https://yunwu.ai/v1/chat/completions",
+    "apicore": "https://api.apicore.ai/v1/chat/completions",
+}
+
+def read_retry_delay_scale(default=1.0):
+    """读取环境变量 SORA_RETRY_DELAY_SCALE，无效时使用默认值并记录警告，负数按0处理"""
+    value = os.environ.get('SORA_RETRY_DELAY_SCALE')
+    if not value:
+        return default
+    try:
+        scale = float(value)
+    except ValueError:
+        scale = None
+    if scale is None or not math.isfinite(scale):
+        logging.warning(f"无效的重试等待倍率 SORA_RETRY_DELAY_SCALE={value}，使用 {default}")
+        return default
+    return max(0.0, scale)
+
+# 重试等待时间倍率，压测时可通过环境变量 SORA_RETRY_DELAY_SCALE 缩短
+RETRY_DELAY_SCALE = read_retry_delay_scale()
+
+def get_image_api_url(api_platform):
+    """返回平台的生图接口地址，未知平台默认使用apicore"""
+    base_url = os.environ.get('SORA_API_BASE_URL')
+    if base_url:
+        return base_url.rstrip('/') + '/v1/chat/completions'
+    return IMAGE_API_URLS.get(api_platform, IMAGE_API_URLS["apicore"])
+
+# ========== 提示词处理 ==========
+
+def compose_prompt(prompt, style_content, ratio):
+    """在提示词后追加风格和图片比例（已带比例的提示词保持不变）"""
+    if f"图片比例【{ratio}】" not in prompt:
+        if style_content and style_content not in prompt:
+            prompt = f"{prompt} {style_content}"
+        prompt = f"{prompt} 图片比例【{ratio}】"
+    return prompt
+
+def resolve_style_content(style_library, current_style, custom_style_content=''):
+    """当前生效的风格提示词：自定义内容优先，其次是风格库中选中的风格"""
+    if custom_style_content and custom_style_content.strip():
+        return custom_style_content.strip()
+    if current_style and current_style in style_library:
+        return style_library[current_style]['content'].strip()
+    return ""
+
+def extract_image_names(prompt, category_links):
+    """从提示词中提取图库里出现的图片名称，较长的名称优先"""
+    all_names = []
+    for cat_links in category_links.values():
+        for link in cat_links:
+            name = link['name'].strip()
+            if name:
+                all_names.append(name)
+    
+    # 按长度排序，优先匹配更长的名称
+    all_names.sort(key=len, reverse=True)
+    return [name for name in all_names if name in prompt]
+
+def get_image_data_list(prompt, category_links):
+    """提示词中提到的图库图片对应的参考图数据"""
+    image_data_map = {}
+    for links in category_links.values():
+        for link in links:
+            if link['name']:
+                image_data_map[link['name']] = link
+    return [image_data_map[name] for name in extract_image_names(prompt, category_links) if name in image_data_map]
+
+def make_image_filenames(number, count, timestamp=None):
+    """带时间戳前缀的图片文件名，多张时从第2张起追加序号"""
+    timestamp = timestamp or time.strftime('%Y%m%d_%H%M%S')
+    number = safe_dirname(str(number))
+    return [f"{timestamp}_{number}.png" if i == 0 else f"{timestamp}_{number}_{i + 1}.png"
+            for i in range(count)]
+
+# ========== 输出目录布局与索引 ==========
+
+# 界面生成的图片在保存路径下的存放方式
+OUTPUT_LAYOUTS = {
+    'date': "按日期分文件夹（保存路径/2024-01-31/）",
+    'batch': "按批次分文件夹（保存路径/2024-01-31/批次开始时间/）",
+    'flat': "全部放在保存路径下",
+}
+OUTPUT_INDEX_NAME = 'output_index.jsonl'  # 保存路径下已保存图片的索引
+
+def output_subdir(layout, started=None):
+    """按输出布局返回相对保存路径的子目录，'' 表示直接放在保存路径下"""
+    if layout == 'flat':
+        return ''
+    started = time.localtime(started)
+    day = time.strftime('%Y-%m-%d', started)
+    if layout == 'batch':
+        return os.path.join(day, time.strftime('%H%M%S', started))
+    return day
+
+def reserve_image_path(file_path):
+    """新建空文件占用文件名（O_EXCL），已存在时依次尝试 名称-2、名称-3……，返回实际路径
+
+    同一秒完成的同编号任务、多个程序写同一共享目录时都不会互相覆盖。
+    """
+    stem, suffix = os.path.splitext(file_path)
+    attempt = 1
+    while True:
+        candidate = file_path if attempt == 1 else f"{stem}-{attempt}{suffix}"
+        try:
+            os.close(os.open(candidate, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return candidate
+        except FileExistsError:
+            attempt += 1
+
+def save_image_file(file_path, image_bytes, metadata=None, metadata_mode='off'):
+    """先写 .part 临时文件再改名，中断时不会留下残缺图片；按 metadata_mode 写入元数据
+
+    返回 (写入字节数, 写入内容的sha256)，内嵌PNG元数据时与平台返回的原始内容不同。
+    """
+    sidecar = bool(metadata) and metadata_mode == 'sidecar'
+    if metadata and metadata_mode == 'png':
+        embedded = embed_png_metadata(image_bytes, json.dumps(metadata, ensure_ascii=False))
+        # 平台返回的不是PNG（如JPEG、WebP）时改写旁路文件
+        sidecar = embedded is None
+        image_bytes = embedded or image_bytes
+    temp_path = f"{file_path}.part"
+    with open(temp_path, 'wb') as f:
+        f.write(image_bytes)
+    os.replace(temp_path, file_path)
+    if sidecar:
+        write_metadata_sidecar(file_path, metadata)
+    return len(image_bytes), hashlib.sha256(image_bytes).hexdigest()
+
+def save_image_link(source, file_path, metadata=None, metadata_mode='off'):
+    """内容相同的图片已保存过时把 file_path 保存为它的硬链接，元数据只能写旁路JSON；不支持硬链接时返回 False"""
+    try:
+        link_file(source, file_path)
+    except OSError as e:
+        download_logger.warning(f"创建硬链接失败，改为写入文件: {file_path} - {str(e)}")
+        return False
+    if metadata and metadata_mode != 'off':
+        write_metadata_sidecar(file_path, metadata)
+    return True
+
+def write_metadata_sidecar(file_path, metadata):
+    with open(metadata_sidecar_path(file_path), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+class OutputIndex:
+    """保存路径下已保存图片的索引（JSONL，每个文件一行），缩略图和预览据此确认文件存在，不必逐个访问共享盘
+
+    索引只追加；索引中没有的文件（旧版保存或手动复制的）仍按文件系统判断。
+    界面线程只调用 contains：索引在后台线程读取，读完之前返回 False，由调用方按文件系统判断。
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.path = self.root / OUTPUT_INDEX_NAME
+        self.lock = threading.Lock()
+        self.files = None  # 相对路径 -> 记录，首次查询时读取
+        self.hashes = {}   # 图片内容 sha256 -> 相对路径
+        self.loading = False
+
+    def key(self, file_path):
+        path = Path(file_path)
+        if path.is_absolute():
+            path = path.relative_to(self.root)
+        return path.as_posix()
+
+    def read(self):
+        """读取索引文件，返回 (文件记录, 哈希 -> 相对路径)"""
+        files, hashes = {}, {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        files[record['file']] = record
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    if record.get('sha256'):
+                        hashes[record['sha256']] = record['file']
+        except OSError:
+            pass
+        return files, hashes
+
+    def load(self):
+        """调用方需持有锁"""
+        if self.files is None:
+            self.files, self.hashes = self.read()
+
+    def preload(self):
+        """在后台线程读取索引（已读取或正在读取时不重复）"""
+        if self.files is not None or self.loading:
+            return
+        self.loading = True
+
+        def load():
+            files, hashes = self.read()
+            with self.lock:
+                if self.files is None:
+                    self.files, self.hashes = files, hashes
+        threading.Thread(target=load, name='output-index', daemon=True).start()
+
+    def contains(self, file_path):
+        """文件是否已登记；索引尚未读取完成时开始后台读取并返回 False，不阻塞界面线程"""
+        files = self.files
+        if files is None:
+            self.preload()
+            return False
+        return self.key(file_path) in files
+
+    def find(self, digest):
+        """内容相同的已保存文件（仍存在时），没有时返回 None"""
+        with self.lock:
+            self.load()
+            relative = self.hashes.get(digest)
+        if relative is None:
+            return None
+        file_path = self.root / relative
+        return str(file_path) if file_path.exists() else None
+
+    def add(self, records):
+        """登记新保存的文件：[(路径, 字节数, 图片内容sha256)]"""
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        entries = [{'file': self.key(path), 'size': size, 'sha256': digest, 'saved_at': now}
+                   for path, size, digest in records]
+        if not entries:
+            return
+        with self.lock:
+            self.load()
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    for entry in entries:
+                        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            except OSError as e:
+                logging.warning(f"写入输出索引失败: {self.path} - {str(e)}")
+            for entry in entries:
+                self.files[entry['file']] = entry
+                self.hashes.setdefault(entry['sha256'], entry['file'])
+
+# ========== 内容去重 ==========
+
+IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
+HASH_CHUNK_BYTES = 1024 * 1024
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def link_file(source, file_path):
+    """把 file_path 替换为 source 的硬链接（先链接到 .part 再改名）；不支持硬链接（如跨盘、部分网络盘）时抛出 OSError"""
+    temp_path = f"{file_path}.part"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    os.link(source, temp_path)
+    try:
+        os.replace(temp_path, file_path)
+    except OSError:
+        os.remove(temp_path)
+        raise
+
+def iter_image_files(roots):
+    """遍历目录下的图片，返回 (路径, 大小, 文件标识)；互为硬链接的文件只返回一次"""
+    seen = set()
+    for root in roots:
+        for dirpath, _, filenames in os.walk(root):
+            for name in sorted(filenames):
+                if not name.lower().endswith(IMAGE_SUFFIXES):
+                    continue
+                file_path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                identity = (stat.st_dev, stat.st_ino)
+                # 空文件是下载中占用的文件名
+                if stat.st_size == 0 or identity in seen:
+                    continue
+                seen.add(identity)
+                yield file_path, stat.st_size, identity
+
+def find_duplicate_images(roots):
+    """按内容查找重复图片（先按大小筛选，只对大小相同的文件计算哈希）
+
+    返回 [{'sha256', 'size', 'files'}]，files 的第一个为保留的文件，其余可替换为它的硬链接。
+    """
+    by_size = {}
+    for file_path, size, _ in iter_image_files(roots):
+        by_size.setdefault(size, []).append(file_path)
+    groups = []
+    for size, paths in by_size.items():
+        if len(paths) < 2:
+            continue
+        by_hash = {}
+        for file_path in paths:
+            try:
+                by_hash.setdefault(file_sha256(file_path), []).append(file_path)
+            except OSError:
+                continue
+        groups.extend({'sha256': digest, 'size': size, 'files': files}
+                      for digest, files in by_hash.items() if len(files) > 1)
+    groups.sort(key=lambda group: group['size'] * (len(group['files']) - 1), reverse=True)
+    return groups
+
+def summarize_duplicates(groups):
+    """重复图片统计：组数、可替换的文件数、可节省的字节数"""
+    return {
+        'groups': len(groups),
+        'duplicates': sum(len(group['files']) - 1 for group in groups),
+        'reclaimable_bytes': sum(group['size'] * (len(group['files']) - 1) for group in groups),
+    }
+
+def link_duplicate_images(groups):
+    """把每组重复的文件替换为保留文件的硬链接，返回 (替换的文件数, 节省的字节数, [失败信息])"""
+    linked, reclaimed, errors = 0, 0, []
+    for group in groups:
+        keep = group['files'][0]
+        for file_path in group['files'][1:]:
+            try:
+                link_file(keep, file_path)
+                linked += 1
+                reclaimed += group['size']
+            except OSError as e:
+                errors.append(f"{file_path}: {str(e)}")
+    return linked, reclaimed, errors
+
+class ImageContentIndex:
+    """目录下图片的 大小 -> 路径 索引（内存中），查找相同内容的图片时只对大小相同的文件计算哈希
+
+    遍历目录和计算哈希都在后台线程进行（preload），之后新增的文件通过 add 登记并在后台计算哈希；
+    find 在界面线程调用，只比较已缓存的哈希：索引建立完成之前或哈希尚未算出的文件视为不同，按普通复制处理。
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.lock = threading.Lock()
+        self.by_size = None  # 文件大小 -> [路径]，后台建立
+        self.digests = {}    # 路径 -> (修改时间, sha256)
+        self.loading = False
+
+    def preload(self):
+        """在后台线程遍历图库并计算哈希（已建立或正在建立时不重复）"""
+        if self.by_size is not None or self.loading:
+            return
+        self.loading = True
+
+        def load():
+            by_size = {}
+            for file_path, size, _ in iter_image_files([self.root]):
+                by_size.setdefault(size, []).append(file_path)
+            with self.lock:
+                self.by_size = by_size
+            for paths in by_size.values():
+                for file_path in paths:
+                    self.hash_file(file_path)
+        threading.Thread(target=load, name='gallery-index', daemon=True).start()
+
+    def hash_file(self, file_path):
+        """计算并缓存文件哈希（后台线程调用）"""
+        try:
+            stat = os.stat(file_path)
+            cached = self.digests.get(file_path)
+            if cached and cached[0] == stat.st_mtime_ns:
+                return
+            digest = file_sha256(file_path)
+        except OSError:
+            return
+        with self.lock:
+            self.digests[file_path] = (stat.st_mtime_ns, digest)
+
+    def find(self, file_path):
+        """与 file_path 内容相同的图片，没有或索引尚未建立完成时返回 None"""
+        with self.lock:
+            if self.by_size is None:
+                candidates = None
+            else:
+                size = os.path.getsize(file_path)
+                candidates = [(path, self.digests.get(path)) for path in self.by_size.get(size, [])]
+        if candidates is None:
+            self.preload()
+            return None
+        candidates = [(path, cached) for path, cached in candidates if cached]
+        if not candidates:
+            return None
+        source_digest = file_sha256(file_path)
+        for candidate, (mtime_ns, digest) in candidates:
+            try:
+                stat = os.stat(candidate)
+            except OSError:
+                continue
+            # 已删除或被修改过的文件
+            if stat.st_size == size and stat.st_mtime_ns == mtime_ns and digest == source_digest:
+                return candidate
+        return None
+
+    def add(self, file_path):
+        """登记新加入的文件并在后台计算哈希（尚未建立索引时跳过，建立时会遍历到）"""
+        file_path = str(file_path)
+        with self.lock:
+            if self.by_size is None:
+                return
+            self.by_size.setdefault(os.path.getsize(file_path), []).append(file_path)
+        threading.Thread(target=self.hash_file, args=(file_path,), name='gallery-hash', daemon=True).start()
+
+# 图库（images/）的内容索引，添加图片到图库时查找相同图片
+GALLERY_INDEX = ImageContentIndex(IMAGES_PATH)
+
+# ========== 生成结果清单与图片元数据 ==========
+
+# 每张图片的元数据写入方式
+IMAGE_METADATA_MODES = {
+    'png': "写入PNG文本块（非PNG图片改写旁路JSON）",
+    'sidecar': "旁路JSON文件（图片同名 .json）",
+    'off': "不写入",
+}
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_METADATA_KEYWORD = 'sora-generator'  # iTXt 文本块关键字
+MANIFEST_DIRNAME = 'manifests'           # 界面生成的批次清单保存在 <保存路径>/manifests/
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+def embed_png_metadata(png_bytes, text, keyword=PNG_METADATA_KEYWORD):
+    """在 IEND 前写入 UTF-8 的 iTXt 文本块（替换同关键字的旧块），不是完整PNG时返回 None"""
+    if not png_bytes.startswith(PNG_SIGNATURE):
+        return None
+    prefix = keyword.encode('latin-1') + b'\0'
+    parts = [PNG_SIGNATURE]
+    offset = len(PNG_SIGNATURE)
+    while offset + 8 <= len(png_bytes):
+        length, kind = struct.unpack('>I4s', png_bytes[offset:offset + 8])
+        end = offset + 12 + length
+        if kind == b'IEND':
+            # 压缩标志、压缩方法、语言标签、翻译后关键字均为空
+            parts.append(png_chunk(b'iTXt', prefix + b'\0\0\0\0' + text.encode('utf-8')))
+            parts.append(png_bytes[offset:end])
+            return b''.join(parts)
+        # 从缓存复制的文件带有上次写入的元数据
+        if not (kind == b'iTXt' and png_bytes[offset + 8:offset + 8 + len(prefix)] == prefix):
+            parts.append(png_bytes[offset:end])
+        offset = end
+    return None
+
+def read_png_metadata(png_bytes, keyword=PNG_METADATA_KEYWORD):
+    """读取 embed_png_metadata 写入的文本，没有时返回 None"""
+    prefix = keyword.encode('latin-1') + b'\0'
+    offset = len(PNG_SIGNATURE)
+    while png_bytes.startswith(PNG_SIGNATURE) and offset + 8 <= len(png_bytes):
+        length, kind = struct.unpack('>I4s', png_bytes[offset:offset + 8])
+        data = png_bytes[offset + 8:offset + 8 + length]
+        if kind == b'iTXt' and data.startswith(prefix):
+            # 跳过压缩标志、压缩方法、语言标签和翻译后关键字
+            rest = data[len(prefix) + 2:]
+            return rest.split(b'\0', 2)[2].decode('utf-8')
+        if kind == b'IEND':
+            break
+        offset += 12 + length
+    return None
+
+def metadata_sidecar_path(file_path):
+    return Path(file_path).with_suffix('.json')
+
+def read_image_metadata(file_path):
+    """读取图片的生成信息（旁路JSON优先，其次PNG文本块），没有时返回 None"""
+    try:
+        with open(metadata_sidecar_path(file_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(file_path, 'rb') as f:
+            text = read_png_metadata(f.read())
+        return json.loads(text) if text else None
+    except (OSError, ValueError):
+        return None
+
+def manifest_image_url(image_url):
+    """清单中记录的来源URL，内联base64只记录摘要"""
+    return describe_binary(image_url) if image_url.startswith('data:') else image_url
+
+def image_metadata_list(record, image_urls):
+    """按一条结果记录生成每张图片的元数据（与 image_urls 一一对应）"""
+    base = {key: record[key] for key in ('number', 'prompt', 'final_prompt', 'style', 'ratio', 'api_platform',
+                                         'image_model', 'reference_names', 'reference_images', 'seconds')
+            if key in record}
+    return [dict(base, image_url=manifest_image_url(url), variant=index + 1, created_at=record['finished_at'])
+            for index, url in enumerate(image_urls)]
+
+class ResultsManifest:
+    """追加写入的JSONL结果清单，每条提示词一行（可多线程调用）"""
+
+    def __init__(self, path, started=None):
+        self.path = Path(path)
+        self.started = started or time.time()  # 批次开始时间，按批次分文件夹时使用
+        self.lock = threading.Lock()
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        try:
+            with self.lock:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+        except OSError as e:
+            logging.error(f"写入结果清单失败: {self.path} - {str(e)}")
+
+# ========== 提示词表格导入导出 ==========
+
+CSV_ENCODINGS = ['utf-8', 'gbk', 'gb2312', 'gb18030']
+CSV_SNIFF_BYTES = 64 * 1024      # 判断编码时读取的字节样本
+PROMPT_IMPORT_CHUNK_ROWS = 1000  # 流式导入/导出每批行数
+
+# 表格字段 -> 导入时识别的列名（不区分大小写），可被用户保存的列映射覆盖
+PROMPT_COLUMN_ALIASES = {
+    'number': ('分镜编号', '编号', 'number'),
+    'prompt': ('分镜提示词', '提示词', 'prompt'),
+    'reference_images': ('参考图', '参考图片', 'reference_images'),
+    'status': ('状态', 'status'),
+    'error_msg': ('错误信息', 'error_msg'),
+    'image_url': ('图片URL', 'image_url'),
+    'filename': ('文件名', 'filename'),
+}
+# 导出列：CSV/xlsx 使用中文表头，JSONL/parquet 使用字段名
+PROMPT_EXPORT_HEADERS = {
+    'number': '编号',
+    'prompt': '提示词',
+    'status': '状态',
+    'error_msg': '错误信息',
+    'image_url': '图片URL',
+    'filename': '文件名',
+    'reference_images': '参考图',
+}
+PROMPT_FILE_FILTER = ("表格文件 (*.csv *.xlsx *.parquet *.jsonl);;CSV (*.csv);;Excel (*.xlsx);;"
+                      "Parquet (*.parquet);;JSONL (*.jsonl)")
+PROMPT_IMPORT_STATUSES = ('等待中', '成功', '失败')  # 导入时保留的状态，其余按等待中处理
+REFERENCE_IMAGE_SEPARATOR = '|'  # CSV/xlsx 单元格中多张参考图的分隔符（Windows文件名不允许出现）
+
+def sniff_csv_encoding(file_path):
+    """根据文件开头的字节样本判断编码，只读取一次"""
+    with open(file_path, 'rb') as f:
+        sample = f.read(CSV_SNIFF_BYTES)
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    # 样本可能在多字节字符中间截断，未读完时不要求结尾完整
+    final = len(sample) < CSV_SNIFF_BYTES
+    for encoding in CSV_ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=final)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    raise ValueError("无法读取CSV文件，请确保文件编码为UTF-8、GBK、GB2312或GB18030")
+
+# 各格式的读取函数：第一次返回列名列表，之后逐批返回 ([{列名: 值}], 进度0-1)
+
+def iter_csv_records(file_path, chunk_size):
+    encoding = sniff_csv_encoding(file_path)
+    size = os.path.getsize(file_path) or 1
+    with open(file_path, 'rb') as raw:
+        text = io.TextIOWrapper(raw, encoding=encoding, newline='')
+        try:
+            # 跳过空行
+            reader = filter(None, csv.reader(text))
+            header = [name.strip() for name in next(reader, [])]
+            yield header
+            records = []
+            for values in reader:
+                records.append(dict(zip(header, values)))
+                if len(records) >= chunk_size:
+                    yield records, min(1.0, raw.tell() / size)
+                    records = []
+            yield records, 1.0
+        except UnicodeDecodeError as e:
+            raise ValueError(f"CSV文件编码不一致（按 {encoding} 解码失败）: {e}")
+        except csv.Error as e:
+            raise ValueError(f"CSV格式错误: {e}")
+
+def iter_jsonl_records(file_path, chunk_size):
+    size = os.path.getsize(file_path) or 1
+    with open(file_path, 'rb') as f:
+        records = []
+        header = None
+        for line_number, line in enumerate(f, 1):
+            if line_number == 1:
+                if line.startswith(codecs.BOM_UTF8):
+                    line = line[len(codecs.BOM_UTF8):]
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"第{line_number}行不是有效的JSON: {e}")
+            if not isinstance(record, dict):
+                raise ValueError(f"第{line_number}行不是JSON对象")
+            if header is None:
+                # 以第一条记录的字段作为列名
+                header = list(record)
+                yield header
+            records.append(record)
+            if len(records) >= chunk_size:
+                yield records, min(1.0, f.tell() / size)
+                records = []
+        if header is None:
+            yield []
+        yield records, 1.0
+
+def iter_xlsx_records(file_path, chunk_size):
+    try:
+        import openpyxl  # 只有Excel文件需要，按需导入
+    except ImportError:
+        raise ValueError("读取Excel文件需要安装 openpyxl：pip install openpyxl")
+    # 只读模式按行流式读取，不把整个工作簿载入内存
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.active
+        total = sheet.max_row or 0
+        rows = sheet.iter_rows(values_only=True)
+        header = [cell_text(value).strip() for value in next(rows, ())]
+        yield header
+        records = []
+        for index, values in enumerate(rows, 2):
+            if all(value is None or value == '' for value in values):
+                continue
+            records.append(dict(zip(header, values)))
+            if len(records) >= chunk_size:
+                yield records, min(1.0, index / total) if total else 0.0
+                records = []
+        yield records, 1.0
+    finally:
+        workbook.close()
+
+def iter_parquet_records(file_path, chunk_size):
+    try:
+        import pyarrow.parquet as pq  # 只有parquet文件需要，按需导入
+    except ImportError:
+        raise ValueError("读取Parquet文件需要安装 pyarrow：pip install pyarrow")
+    parquet_file = pq.ParquetFile(file_path)
+    yield list(parquet_file.schema_arrow.names)
+    total = parquet_file.metadata.num_rows or 1
+    done = 0
+    for batch in parquet_file.iter_batches(batch_size=chunk_size):
+        records = batch.to_pylist()
+        done += len(records)
+        yield records, min(1.0, done / total)
+
+PROMPT_FILE_READERS = {
+    '.csv': iter_csv_records,
+    '.jsonl': iter_jsonl_records,
+    '.xlsx': iter_xlsx_records,
+    '.parquet': iter_parquet_records,
+}
+
+def open_prompt_records(file_path, chunk_size=PROMPT_IMPORT_CHUNK_ROWS):
+    """按扩展名选择读取函数，返回 (列名列表, 记录批次迭代器)"""
+    suffix = Path(file_path).suffix.lower()
+    reader = PROMPT_FILE_READERS.get(suffix)
+    if reader is None:
+        raise ValueError(f"不支持的文件格式: {suffix or '无扩展名'}，支持 CSV、xlsx、parquet、JSONL")
+    records = reader(file_path, chunk_size)
+    return next(records), records
+
+def read_prompt_file_columns(file_path):
+    """只读取表头，用于导入前确认列映射"""
+    columns, records = open_prompt_records(file_path, chunk_size=1)
+    records.close()
+    return columns
+
+def resolve_prompt_columns(columns, column_map=None):
+    """确定各字段对应的列名 {字段: 列名}：先用 column_map 指定的列，再按默认别名匹配"""
+    lookup = {str(column).strip().lower(): column for column in columns}
+    resolved = {}
+    for field, aliases in PROMPT_COLUMN_ALIASES.items():
+        for name in ((column_map or {}).get(field), *aliases):
+            if name and str(name).strip().lower() in lookup:
+                resolved[field] = lookup[str(name).strip().lower()]
+                break
+    return resolved
+
+def cell_text(value):
+    """单元格值转为文本：空值为空字符串，Excel/parquet 数字列中的整数去掉 .0"""
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        if math.isnan(value):
+            return ''
+        if value.is_integer():
+            return str(int(value))
+    return str(value)
+
+def iter_prompt_file(file_path, chunk_size=PROMPT_IMPORT_CHUNK_ROWS, column_map=None):
+    """流式读取提示词表格（CSV/xlsx/parquet/JSONL），逐批返回 ([行], 进度0-1)
+
+    行包含 number、prompt，以及文件中有对应列时的 status、error_msg、image_url、filename、
+    reference_images（路径列表）。编号按原文保留，缺失时使用数据行序号。
+    找不到提示词列、格式不支持、解码失败或缺少读取所需模块时抛出 ValueError。
+    """
+    columns, records = open_prompt_records(file_path, chunk_size)
+    resolved = resolve_prompt_columns(columns, column_map)
+    if 'prompt' not in resolved:
+        records.close()
+        raise ValueError("文件中没有找到'分镜提示词'列")
+
+    index = 0
+    for chunk, progress in records:
+        rows = []
+        for record in chunk:
+            index += 1
+            prompt = cell_text(record.get(resolved['prompt']))
+            if not prompt:
+                continue
+            row = {'number': cell_text(record.get(resolved.get('number'))).strip() or str(index), 'prompt': prompt}
+            for field in ('status', 'error_msg', 'image_url', 'filename'):
+                if field in resolved:
+                    row[field] = cell_text(record.get(resolved[field])).strip()
+            if 'reference_images' in resolved:
+                value = record.get(resolved['reference_images'])
+                paths = value if isinstance(value, list) else cell_text(value).split(REFERENCE_IMAGE_SEPARATOR)
+                row['reference_images'] = [str(path).strip() for path in paths if path and str(path).strip()]
+            rows.append(row)
+        if rows:
+            yield rows, progress
+
+def read_prompt_file(file_path, column_map=None):
+    """读取整个提示词表格，返回 [行]（字段同 iter_prompt_file）"""
+    return [row for rows, _ in iter_prompt_file(file_path, column_map=column_map) for row in rows]
+
+def prompt_export_record(data):
+    """表格数据行 -> 导出字段"""
+    return {
+        'number': data['number'],
+        'prompt': data['prompt'],
+        'status': data['status'],
+        'error_msg': data.get('error_msg', ''),
+        'image_url': data.get('image_url', ''),
+        'filename': data.get('filename', ''),
+        'reference_images': [str(path) for path in data.get('reference_images') or []],
+    }
+
+def prompt_export_values(record):
+    """CSV/xlsx 的一行单元格，参考图合并为一个单元格"""
+    return [REFERENCE_IMAGE_SEPARATOR.join(record[field]) if field == 'reference_images' else record[field]
+            for field in PROMPT_EXPORT_HEADERS]
+
+def write_prompt_file(file_path, rows):
+    """按扩展名导出提示词表格（CSV/xlsx/parquet/JSONL），逐批写出"""
+    suffix = Path(file_path).suffix.lower()
+    if suffix not in PROMPT_FILE_READERS:
+        raise ValueError(f"不支持的文件格式: {suffix or '无扩展名'}，支持 CSV、xlsx、parquet、JSONL")
+
+    if suffix == '.csv':
+        with open(file_path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(PROMPT_EXPORT_HEADERS.values())
+            for data in rows:
+                writer.writerow(prompt_export_values(prompt_export_record(data)))
+    elif suffix == '.jsonl':
+        with open(file_path, 'w', encoding='utf-8') as f:
+            for data in rows:
+                f.write(json.dumps(prompt_export_record(data), ensure_ascii=False) + "\n")
+    elif suffix == '.xlsx':
+        try:
+            import openpyxl
+        except ImportError:
+            raise ValueError("导出Excel文件需要安装 openpyxl：pip install openpyxl")
+        # 只写模式逐行写出，内存占用与行数无关
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet("提示词")
+        sheet.append(list(PROMPT_EXPORT_HEADERS.values()))
+        for data in rows:
+            sheet.append(prompt_export_values(prompt_export_record(data)))
+        workbook.save(file_path)
+    else:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("导出Parquet文件需要安装 pyarrow：pip install pyarrow")
+        schema = pa.schema([(field, pa.list_(pa.string()) if field == 'reference_images' else pa.string())
+                            for field in PROMPT_EXPORT_HEADERS])
+        with pq.ParquetWriter(file_path, schema) as writer:
+            for start in range(0, len(rows), PROMPT_IMPORT_CHUNK_ROWS):
+                batch = [prompt_export_record(data) for data in rows[start:start + PROMPT_IMPORT_CHUNK_ROWS]]
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+
+class PromptImportWorkerSignals(QObject):
+    chunk = pyqtSignal(list, float)  # 本批提示词, 读取进度(0-1)
+    finished = pyqtSignal(int, bool) # 总条数, 是否已取消
+    error = pyqtSignal(str)          # 错误信息
+
+class PromptImportWorker(QRunnable):
+    """后台流式解析提示词表格，分批交给界面追加，可随时取消"""
+
+    def __init__(self, file_path, column_map=None, cancel_event=None):
+        super().__init__()
+        self.file_path = file_path
+        self.column_map = column_map or {}
+        self.cancel_event = cancel_event or threading.Event()
+        self.signals = PromptImportWorkerSignals()
+
+    def run(self):
+        total = 0
+        try:
+            for rows, progress in iter_prompt_file(self.file_path, column_map=self.column_map):
+                if self.cancel_event.is_set():
+                    break
+                total += len(rows)
+                self.signals.chunk.emit(rows, progress)
+        except ValueError as e:
+            self.signals.error.emit(str(e))
+            return
+        except Exception as e:
+            self.signals.error.emit(f"导入文件失败: {str(e)}")
+            return
+        self.signals.finished.emit(total, self.cancel_event.is_set())
+
+class WorkerSignals(QObject):
+    finished = pyqtSignal(str, list, str)  # 提示词, 图片URL列表, 编号
+    error = pyqtSignal(str, str)     # 提示词, 错误信息
+    progress = pyqtSignal(str, str)  # 提示词, 状态信息
+
+class Worker(QRunnable):
+    def __init__(self, prompt, api_key, image_data=None, api_platform="云雾", image_model="sora", retry_count=3, number=None, stream=False,
+                 cache=None, use_cache=True, variant=0):
+        super().__init__()
+        self.prompt = prompt
+        self.api_key = api_key
+        self.image_data = image_data or []  # 现在包含{'name': '', 'url': '', 'path': ''} 的数据
+        self.api_platform = api_platform
+        self.image_model = image_model  # 添加生图模型参数
+        self.retry_count = retry_count
+        self.number = number
+        self.stream = stream  # 流式接收响应，解析中间进度并尽早拿到图片链接
+        self.image_urls = []  # 响应中提取到的全部图片链接
+        self.cache = cache  # GenerationCache，为 None 时不使用缓存
+        self.use_cache = use_cache  # False 表示重新采样：不读取缓存，但会更新缓存
+        self.variant = variant  # 同一提示词的第几次并发请求
+        self.cache_claimed = None  # 本任务登记为进行中的缓存键
+        self.created_at = time.monotonic()  # 用于统计排队等待时间
+        self.signals = WorkerSignals()
+
+    def metric_labels(self):
+        return {'platform': self.api_platform, 'model': self.image_model, 'key': api_key_label(self.api_key)}
+
+    def request_streaming(self, api_url, headers, payload):
+        """以SSE流式请求生图接口，返回图片URL列表
+
+        中间文本里的百分比通过 progress 信号显示；接收完整个响应后与非流式相同地提取全部图片链接。
+        超过 IMAGE_STREAM_STALL_TIMEOUT 秒没有新内容视为卡住并抛出超时；流中的 error 事件和
+        格式不符的事件抛出 ValueError，均交给重试逻辑处理。
+        """
+        stream_payload = dict(payload, stream=True)
+        response = requests.post(
+            api_url,
+            headers=headers,
+            json=stream_payload,
+            timeout=(30, IMAGE_STREAM_STALL_TIMEOUT),
+            stream=True
+        )
+        try:
+            worker_logger.info(f"API响应状态码(流式): {response.status_code}")
+            response.raise_for_status()
+
+            chunks = []
+            recent = ''  # 最近的输出，用于解析进度
+            last_progress = None
+            last_content_time = time.monotonic()
+            request_start = time.monotonic()
+            first_content = True
+            for event in iter_sse_events(response, include_keepalive=True):
+                if event is not None and not isinstance(event, dict):
+                    raise ValueError(f"流式响应格式错误: {summarize_text(str(event), 200)}")
+                if event is not None and event.get('error'):
+                    raise ValueError(f"流式响应出错：{summarize_text(str(event['error']), 500)}")
+                if event is None or not event.get('choices'):
+                    # 心跳/空事件不算进展
+                    if time.monotonic() - last_content_time > IMAGE_STREAM_STALL_TIMEOUT:
+                        raise requests.exceptions.ReadTimeout(f"生成停滞超过 {IMAGE_STREAM_STALL_TIMEOUT} 秒")
+                    continue
+                choices = event['choices']
+                choice = choices[0] if isinstance(choices, list) else None
+                # 结束事件的 delta 可能为 null
+                delta = choice.get('delta') if isinstance(choice, dict) else None
+                if not isinstance(choice, dict) or not isinstance(delta, (dict, type(None))):
+                    raise ValueError(f"流式响应格式错误: {summarize_text(json.dumps(event, ensure_ascii=False), 200)}")
+                text = (delta or {}).get('content') or ''
+                if not isinstance(text, str):
+                    raise ValueError("流式响应格式错误: content 不是文本")
+                if not text:
+                    continue
+                last_content_time = time.monotonic()
+                if first_content:
+                    first_content = False
+                    METRICS.observe('image_ttfb_seconds', last_content_time - request_start, **self.metric_labels())
+                chunks.append(text)
+                recent = (recent + text)[-200:]
+
+                # 进度百分比（只看最近的输出）
+                progress_matches = IMAGE_PROGRESS_PATTERN.findall(recent)
+                if progress_matches:
+                    progress = progress_matches[-1]
+                    if progress != last_progress:
+                        last_progress = progress
+                        self.signals.progress.emit(self.prompt, f"生成中 {progress}%")
+
+            content = ''.join(chunks)
+            worker_logger.info(f"流式响应结束，共 {len(content)} 字符")
+            worker_logger.debug(f"API响应内容(流式): {summarize_text(content)}")
+            image_urls = extract_image_urls(content=content, api_platform=self.api_platform,
+                                            image_model=self.image_model)
+            if not image_urls:
+                error_msg = f"响应中没有找到图片URL。响应内容: {summarize_text(content)}"
+                worker_logger.error(error_msg)
+                raise ValueError(error_msg)
+            return image_urls
+        finally:
+            response.close()
+        
+    def build_request(self):
+        """构建生图请求，返回 (接口地址, 请求头, 请求体, 实际模型名)"""
+        # 构建API请求
+        api_url = get_image_api_url(self.api_platform)
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+        
+        # 构建消息内容
+        content = [{"type": "text", "text": self.prompt}]
+        
+        # 添加图片（支持URL、本地文件和base64数据）
+        for img_data in self.image_data:
+            if 'data' in img_data and img_data['data']:
+                # 直接使用base64数据（拖拽参考图）
+                base64_url = f"data:image/png;base64,{img_data['data']}"
+                content.append({
+                    "type": "image_url",
+                    "image_url": {"url": base64_url}
+                })
+                worker_logger.info(f"添加拖拽参考图片: {img_data['name']} (base64数据)")
+            elif 'path' in img_data and img_data['path']:
+                # 本地图片，转换为base64
+                local_path = APP_PATH / img_data['path']
+                if local_path.exists():
+                    base64_url = image_to_base64(local_path)
+                    if base64_url:
+                        content.append({
+                            "type": "image_url",
+                            "image_url": {"url": base64_url}
+                        })
+                        worker_logger.info(f"添加本地图片: {img_data['name']} -> {img_data['path']}")
+                    else:
+                        worker_logger.warning(f"本地图片转换base64失败: {img_data['path']}")
+                else:
+                    worker_logger.warning(f"本地图片文件不存在: {img_data['path']}")
+            elif 'url' in img_data and img_data['url']:
+                # 网络图片，使用URL
+                content.append({
+                    "type": "image_url",
+                    "image_url": {"url": img_data['url']}
+                })
+                worker_logger.info(f"添加网络图片: {img_data['name']} -> {img_data['url']}")
+        
+        # 根据选择的模型设置API参数
+        if self.image_model == "sora":
+            # Sora模型配置
+            if self.api_platform == "云雾":
+                model = "sora"  # 修正：云雾平台使用 sora 而不是 sora_image
+            elif self.api_platform == "apicore":
+                model = "sora"
+            else:
+                model = "sora"
+        elif self.image_model == "nano-banana":
+            # nano-banana模型配置
+            if self.api_platform == "云雾":
+                model = "fal-ai/nano-banana"
+            elif self.api_platform == "apicore":
+                model = "fal-ai/nano-banana"  # 修正：统一使用 fal-ai/nano-banana
+            else:
+                model = "fal-ai/nano-banana"
+        else:
+            # 默认使用sora
+            model = "sora"
+        
+        payload = {
+            "model": model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "You are an AI image generator. Generate high-quality images based on user text descriptions. Always provide the generated image URL in the response."
+                },
+                {
+                    "role": "user",
+                    "content": content
+                }
+            ],
+            "max_tokens": 1000,  # 添加max_tokens限制
+            "temperature": 0.7   # 添加适中的创造性
+        }
+        return api_url, headers, payload, model
+
+    @profiled
+    def run(self):
+        labels = self.metric_labels()
+        job_start = time.monotonic()
+        METRICS.observe('image_queue_wait_seconds', job_start - self.created_at, **labels)
+        METRICS.add_gauge('image_requests_in_flight', 1, **labels)
+        try:
+            # 发送进度信号
+            self.signals.progress.emit(self.prompt, "生成中...")
+            
+            # 验证API密钥
+            if not self.api_key:
+                raise ValueError("API密钥不能为空")
+            
+            # 验证API密钥格式
+            if not self.api_key.startswith('sk-'):
+                worker_logger.warning(f"API密钥格式可能不正确，应以'sk-'开头: {self.api_key[:10]}...")
+            
+            # 记录使用的配置（用于调试）
+            worker_logger.info(f"使用配置 - 平台: {self.api_platform}, 模型: {self.image_model}, 密钥前缀: {self.api_key[:10]}...")
+                
+            api_url, headers, payload, model = self.build_request()
+            
+            # 记录请求摘要（内联图片只记录长度和哈希），完整结构在DEBUG级别输出
+            worker_logger.info(f"发送API请求: {api_url}")
+            worker_logger.info(f"请求参数: {json.dumps(summarize_payload(payload, limit=200), ensure_ascii=False)}")
+            worker_logger.debug(f"请求参数(详细): {json.dumps(summarize_payload(payload), ensure_ascii=False, indent=2)}")
+            
+            # 相同请求直接复用已有结果，或等待进行中的相同请求完成
+            if self.cache is not None:
+                request_key = compute_request_key(self.api_platform, payload, self.variant)
+                if self.use_cache:
+                    cached_urls = self.cache.acquire(request_key)
+                    if cached_urls:
+                        worker_logger.info(f"命中生图缓存 {request_key[:12]}，复用 {len(cached_urls)} 张图片")
+                        self.image_urls = cached_urls
+                        METRICS.inc('image_requests_total', status='cache_hit', **labels)
+                        self.signals.finished.emit(self.prompt, cached_urls, self.number or "")
+                        return
+                    self.cache_claimed = request_key
+            
+            # 发送请求(带重试机制)
+            retry_times = 0
+            while retry_times <= self.retry_count:
+                try:
+                    # 添加随机延迟，避免同时发送大量请求
+                    import random
+                    # 初次请求延迟较短，重试时延迟会递增
+                    initial_delay = random.uniform(0.5, 1.5)
+                    time.sleep(initial_delay)
+                    
+                    attempt_start = time.monotonic()
+                    if self.stream:
+                        image_urls = self.request_streaming(api_url, headers, payload)
+                    else:
+                        response = requests.post(
+                            api_url, 
+                            headers=headers, 
+                            json=payload,
+                            timeout=300  # 减少超时时间到5分钟，避免长时间挂起
+                        )
+                        # 非流式响应到达响应头即视为首字节
+                        METRICS.observe('image_ttfb_seconds', response.elapsed.total_seconds(), **labels)
+                        
+                        # 记录响应信息
+                        worker_logger.info(f"API响应状态码: {response.status_code}, 长度: {len(response.content)} 字节")
+                        worker_logger.debug(f"API响应内容: {summarize_text(response.text)}")
+                        
+                        response.raise_for_status()
+                        data = response.json()
+                        
+                        # 解析响应（结构化字段优先，其次是消息文本中的链接）
+                        image_urls = extract_image_urls(data=data, api_platform=self.api_platform,
+                                                        image_model=self.image_model)
+                        if not image_urls:
+                            error_msg = f"响应中没有找到图片URL。响应内容: {summarize_text(response.text)}"
+                            worker_logger.error(error_msg)
+                            raise ValueError(error_msg)
+                    
+                    self.image_urls = image_urls
+                    worker_logger.info(f"成功提取图片URL: {summarize_text(image_urls[0], 200)}（共 {len(image_urls)} 张）")
+                    if self.cache is not None:
+                        self.cache.store(request_key, image_urls)
+                    now = time.monotonic()
+                    METRICS.observe('image_request_seconds', now - attempt_start, **labels)
+                    METRICS.observe('image_job_seconds', now - job_start, **labels)
+                    METRICS.inc('image_requests_total', status='success', **labels)
+                    METRICS.inc('images_generated_total', len(image_urls), **labels)
+                    self.signals.finished.emit(self.prompt, image_urls, self.number or "")
+                    return
+                        
+                except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                    retry_times += 1
+                    error_detail = f"API平台: {self.api_platform}, 模型: {model}, 错误: {str(e)}"
+                    error_code = e.response.status_code if getattr(e, 'response', None) is not None else type(e).__name__
+                    METRICS.inc('image_errors_total', code=error_code, **labels)
+                    
+                    if hasattr(e, 'response') and e.response is not None:
+                        status_code = e.response.status_code
+                        response_text = summarize_text(e.response.text, 500)
+                        error_detail += f", 状态码: {status_code}, 响应: {response_text}"
+                        
+                        # 针对不同错误码提供具体建议
+                        if status_code == 401:
+                            error_detail += f"\n💡 解决建议: API密钥无效，请检查："
+                            error_detail += f"\n  1. 确认API密钥是否正确复制"
+                            error_detail += f"\n  2. 检查{self.api_platform}平台密钥是否过期"
+                            error_detail += f"\n  3. 验证密钥是否支持{model}模型"
+                            error_detail += f"\n  4. 当前使用密钥: {self.api_key[:15]}..."
+                        elif status_code == 503:
+                            error_detail += f"\n💡 解决建议: 服务暂不可用，请考虑："
+                            error_detail += f"\n  1. 切换到apicore平台试试"
+                            error_detail += f"\n  2. 使用nano-banana模型替代"
+                            error_detail += f"\n  3. 稍后重试，服务可能正在维护"
+                            error_detail += f"\n  4. {self.api_platform}平台的{model}模型可能暂时无可用通道"
+                    
+                    if retry_times <= self.retry_count:
+                        worker_logger.warning(f"请求失败,正在进行第{retry_times}次重试: {error_detail}")
+                        self.signals.progress.emit(self.prompt, f"重试中 ({retry_times}/{self.retry_count})...")
+                        METRICS.inc('image_retries_total', **labels)
+                        # 递增式重试延迟：第1次重试等待60秒，第2次等待120秒，第3次等待180秒
+                        # 针对503错误延长等待时间，给服务器更多恢复时间
+                        if hasattr(e, 'response') and e.response is not None and e.response.status_code == 503:
+                            retry_delay = 90 * retry_times  # 503错误等待更长时间
+                        else:
+                            retry_delay = 60 * retry_times  # 其他错误也延长到60秒倍数
+                        retry_delay = round(retry_delay * RETRY_DELAY_SCALE)
+                        worker_logger.info(f"重试延迟 {retry_delay} 秒...")
+                        # 显示倒计时，让用户知道等待进度
+                        for remaining in range(retry_delay, 0, -5):
+                            self.signals.progress.emit(self.prompt, f"重试中 ({retry_times}/{self.retry_count}) - {remaining}秒后重试...")
+                            time.sleep(min(5, remaining))
+                        continue
+                    else:
+                        # 重试失败，提供最终建议
+                        final_suggestion = ""
+                        if hasattr(e, 'response') and e.response is not None and e.response.status_code == 503:
+                            final_suggestion = f"\n\n🔄 建议立即尝试："
+                            final_suggestion += f"\n• 切换到apicore平台"
+                            final_suggestion += f"\n• 或使用nano-banana模型"
+                            final_suggestion += f"\n• 云雾平台sora模型可能正在维护中"
+                        
+                        error_msg = f"请求失败(已重试{self.retry_count}次): {error_detail}{final_suggestion}"
+                        METRICS.inc('image_requests_total', status='error', **labels)
+                        worker_logger.error(error_msg)
+                        self.signals.error.emit(self.prompt, error_msg)
+                        return
+                        
+        except Exception as e:
+            error_msg = f"发生错误: {str(e)}"
+            worker_logger.error(error_msg)
+            METRICS.inc('image_errors_total', code=type(e).__name__, **labels)
+            METRICS.inc('image_requests_total', status='error', **labels)
+            self.signals.error.emit(self.prompt, error_msg)
+        finally:
+            METRICS.add_gauge('image_requests_in_flight', -1, **labels)
+            if self.cache_claimed:
+                self.cache.release(self.cache_claimed)
+
+class DownloadWorkerSignals(QObject):
+    progress = pyqtSignal(int, int)  # 已完成数, 总数
+    finished = pyqtSignal(list)      # 每个文件是否保存成功
+
+class DownloadWorker(QRunnable):
+    """在后台线程中并发下载一组图片，避免阻塞界面"""
+
+    MAX_PARALLEL = 4
+
+    def __init__(self, items, cache=None, metadata=None, metadata_mode='off', unique=False, index=None, dedupe=False):
+        super().__init__()
+        self.items = items  # [(图片URL, 保存路径)]
+        self.cache = cache  # GenerationCache，已下载过的URL直接复制本地文件
+        self.metadata = metadata  # 与 items 对应的每张图片元数据，保存时写入
+        self.metadata_mode = metadata_mode
+        self.unique = unique  # 保存路径已存在时改名（名称-2……），不覆盖
+        self.index = index  # OutputIndex，保存成功的文件登记到索引
+        self.dedupe = dedupe  # 索引中已有相同内容的图片时保存为硬链接
+        self.paths = [path for _, path in items]  # 实际保存路径，finished 之后读取
+        self.signals = DownloadWorkerSignals()
+
+    def download_one(self, index, image_url, file_path):
+        start_time = time.monotonic()
+        reserved = False
+        try:
+            local_file = self.cache.local_file(image_url) if self.cache is not None else None
+            if local_file:
+                source = 'cache'
+                with open(local_file, 'rb') as f:
+                    image_bytes = f.read()
+            else:
+                source = 'inline' if image_url.startswith('data:') else 'network'
+                image_bytes = fetch_image_bytes(image_url)
+            os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+            if self.unique:
+                file_path = reserve_image_path(file_path)
+                reserved = True
+                self.paths[index] = file_path
+            metadata = self.metadata[index] if self.metadata else None
+            # 索引记录的是磁盘上文件内容的哈希。内嵌PNG元数据时每个文件都记录各自的任务，
+            # 内容必然不同，不能与其他文件共用硬链接
+            embeds_metadata = bool(metadata) and self.metadata_mode == 'png'
+            digest = hashlib.sha256(image_bytes).hexdigest()
+            existing = None
+            if self.index is not None and self.dedupe and not embeds_metadata:
+                existing = self.index.find(digest)
+                # 旧版本按原始内容登记过内嵌元数据的文件，大小不同说明内容不同
+                if existing and os.path.getsize(existing) != len(image_bytes):
+                    existing = None
+            if existing and save_image_link(existing, file_path, metadata, self.metadata_mode):
+                size = len(image_bytes)
+                METRICS.inc('deduplicated_bytes_total', size)
+            else:
+                size, digest = save_image_file(file_path, image_bytes, metadata, self.metadata_mode)
+            if self.index is not None:
+                self.index.add([(file_path, size, digest)])
+            if source != 'cache' and self.cache is not None:
+                self.cache.record_file(image_url, file_path)
+            METRICS.observe('download_seconds', time.monotonic() - start_time, source=source)
+            METRICS.observe('download_bytes', size, buckets=BYTES_BUCKETS, source=source)
+            METRICS.inc('downloaded_bytes_total', size, source=source)
+            METRICS.inc('downloads_total', source=source, status='success')
+            return True
+        except Exception as e:
+            METRICS.inc('downloads_total', status='error')
+            download_logger.error(f"保存图片失败: {file_path} - {str(e)}")
+            if reserved:
+                # 释放占用的文件名
+                try:
+                    if os.path.getsize(file_path) == 0:
+                        os.remove(file_path)
+                except OSError:
+                    pass
+            return False
+
+    @profiled
+    def run(self):
+        results = [False] * len(self.items)
+        done = 0
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.MAX_PARALLEL, len(self.items)))) as executor:
+                futures = {executor.submit(self.download_one, i, url, path): i
+                           for i, (url, path) in enumerate(self.items)}
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+                    done += 1
+                    self.signals.progress.emit(done, len(self.items))
+        except Exception as e:
+            download_logger.error(f"批量下载图片出错: {str(e)}")
+        self.signals.finished.emit(results)
+
+class DedupeWorkerSignals(QObject):
+    finished = pyqtSignal(list)  # find_duplicate_images 的结果
+    error = pyqtSignal(str)
+
+class DedupeWorker(QRunnable):
+    """在后台查找重复图片（需要读取并计算大量文件的哈希）"""
+
+    def __init__(self, roots):
+        super().__init__()
+        self.roots = roots
+        self.signals = DedupeWorkerSignals()
+
+    def run(self):
+        try:
+            self.signals.finished.emit(find_duplicate_images(self.roots))
+        except Exception as e:
+            logging.error(f"查找重复图片失败: {str(e)}")
+            self.signals.error.emit(str(e))
+
+OPENROUTER_API_URL = os.environ.get('SORA_OPENROUTER_URL', "https://openrouter.ai/api/v1/chat/completions")
+
+def request_prompt_optimization(api_key, ai_model, meta_prompt, prompt, timeout=60,
+                                stream=False, on_delta=None, cancel_event=None):
+    """调用OpenRouter优化单条提示词，返回优化后的文本（失败时抛出异常）
+
+    stream=True 时以SSE流式接收，每收到新内容调用 on_delta(已接收全文)；
+    cancel_event 被设置时立即断开连接并抛出 OperationCancelled。
+    """
+    return request_chat_completion(api_key, ai_model, f"{meta_prompt}\n\n待优化提示词：{prompt}", timeout=timeout,
+                                   stream=stream, on_delta=on_delta, cancel_event=cancel_event)
+
+def request_chat_completion(api_key, ai_model, content, timeout=60, stream=False, on_delta=None, cancel_event=None):
+    """向OpenRouter发送单条用户消息，返回回复文本
+
+    非流式响应结构不符时抛出 ValueError；流式参数同 request_prompt_optimization。
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        raise OperationCancelled("已取消")
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+    request_data = {
+        'model': ai_model,
+        'messages': [
+            {
+                'role': 'user',
+                'content': content
+            }
+        ],
+        'temperature': 0.7
+    }
+    if not stream:
+        response = requests.post(OPENROUTER_API_URL, headers=headers, json=request_data, timeout=timeout)
+        if response.status_code != 200:
+            raise RuntimeError(f"请求失败：{response.status_code}\n{response.text[:500]}")
+        try:
+            return response.json()['choices'][0]['message']['content']
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise ValueError(f"响应格式错误: {e}") from None
+
+    request_data['stream'] = True
+    # 流式模式下timeout为两次数据之间的最长间隔
+    response = requests.post(OPENROUTER_API_URL, headers=headers, json=request_data, timeout=timeout, stream=True)
+    try:
+        if response.status_code != 200:
+            raise RuntimeError(f"请求失败：{response.status_code}\n{response.text[:500]}")
+        chunks = []
+        for event in iter_sse_events(response):
+            if cancel_event is not None and cancel_event.is_set():
+                raise OperationCancelled("已取消")
+            if 'error' in event:
+                raise RuntimeError(f"流式响应出错：{event['error']}")
+            choices = event.get('choices') or [{}]
+            delta = choices[0].get('delta', {}).get('content')
+            if delta:
+                chunks.append(delta)
+                if on_delta:
+                    on_delta(''.join(chunks))
+        if cancel_event is not None and cancel_event.is_set():
+            raise OperationCancelled("已取消")
+        return ''.join(chunks)
+    finally:
+        # 取消或出错时关闭连接，让上游停止生成
+        response.close()
+
+BATCH_OPTIMIZE_INSTRUCTION = """下面是一个JSON数组，包含 {count} 条待优化提示词。
+请按照上面的要求分别优化每一条，只输出一个长度为 {count} 的JSON字符串数组，顺序与输入一致，不要输出任何其他内容。
+
+待优化提示词：
+{prompts}"""
+
+def parse_batch_optimization_response(content, expected_count):
+    """解析批量优化的JSON数组响应，格式或数量不符时抛出ValueError"""
+    text = content.strip()
+    # 兼容模型用```json代码块包裹输出的情况
+    fence_match = re.search(r'```(?:json)?\s*(.*?)```', text, re.DOTALL)
+    if fence_match:
+        text = fence_match.group(1).strip()
+    start, end = text.find('['), text.rfind(']')
+    if start == -1 or end <= start:
+        raise ValueError("响应中没有找到JSON数组")
+    results = json.loads(text[start:end + 1])
+    if not isinstance(results, list) or len(results) != expected_count:
+        raise ValueError(f"JSON数组长度不符: 期望 {expected_count}，实际 {len(results) if isinstance(results, list) else '非数组'}")
+    if not all(isinstance(item, str) and item.strip() for item in results):
+        raise ValueError("JSON数组中存在空结果或非字符串结果")
+    return [item.strip() for item in results]
+
+def request_prompt_optimization_batch(api_key, ai_model, meta_prompt, prompts, timeout=180, cancel_event=None):
+    """一次请求优化多条提示词（JSON数组进、JSON数组出），返回与输入等长的列表
+
+    响应无法解析时抛出 ValueError（调用方可回退为逐条请求），请求失败时抛出其他异常。
+    传入 cancel_event 时以流式接收，取消后立即断开连接并抛出 OperationCancelled。
+    """
+    instruction = BATCH_OPTIMIZE_INSTRUCTION.format(
+        count=len(prompts), prompts=json.dumps(prompts, ensure_ascii=False, indent=1))
+    content = request_chat_completion(api_key, ai_model, f"{meta_prompt}\n\n{instruction}", timeout=timeout,
+                                      stream=cancel_event is not None, cancel_event=cancel_event)
+    return parse_batch_optimization_response(content, len(prompts))
+
+class OptimizeWorkerSignals(QObject):
+    finished = pyqtSignal(int, str, str)  # 行号, 原始提示词, 优化后提示词
+    error = pyqtSignal(int, str, str)     # 行号, 原始提示词, 错误信息
+    partial = pyqtSignal(int, str)        # 行号, 流式接收中的文本
+
+class OptimizeWorker(QRunnable):
+    """后台优化提示词，避免阻塞界面线程
+
+    items 为 [(行号, 提示词)]，多于一条时合并为一次批量请求，
+    批量响应解析失败时自动回退为逐条请求（请求本身失败时整批标记失败）。逐条请求支持流式输出和取消。
+    """
+    PARTIAL_EMIT_INTERVAL = 0.05  # 流式文本刷新间隔（秒），避免信号过多拖慢界面
+
+    def __init__(self, items, api_key, ai_model, meta_prompt, stream=False, cancel_event=None):
+        super().__init__()
+        self.items = list(items)
+        self.api_key = api_key
+        self.ai_model = ai_model
+        self.meta_prompt = meta_prompt
+        self.stream = stream
+        self.cancel_event = cancel_event or threading.Event()
+        self.signals = OptimizeWorkerSignals()
+        self.created_at = time.monotonic()  # 用于统计排队等待时间
+
+    def metric_labels(self):
+        return {'model': self.ai_model, 'key': api_key_label(self.api_key)}
+
+    def run(self):
+        METRICS.observe('optimize_queue_wait_seconds', time.monotonic() - self.created_at, **self.metric_labels())
+        if self.cancel_event.is_set():
+            for row, prompt in self.items:
+                self.signals.error.emit(row, prompt, "已取消")
+            return
+
+        if len(self.items) > 1:
+            prompts = [prompt for _, prompt in self.items]
+            start_time = time.monotonic()
+            try:
+                results = request_prompt_optimization_batch(self.api_key, self.ai_model, self.meta_prompt, prompts,
+                                                            cancel_event=self.cancel_event)
+                METRICS.observe('optimize_request_seconds', time.monotonic() - start_time, mode='batch', **self.metric_labels())
+                METRICS.inc('optimize_requests_total', mode='batch', status='success', **self.metric_labels())
+                for (row, prompt), optimized in zip(self.items, results):
+                    self.signals.finished.emit(row, prompt, optimized)
+                return
+            except OperationCancelled as e:
+                METRICS.inc('optimize_requests_total', mode='batch', status='cancelled', **self.metric_labels())
+                for row, prompt in self.items:
+                    self.signals.error.emit(row, prompt, str(e))
+                return
+            except requests.RequestException as e:
+                # 网络错误不回退：逐条请求同样会失败
+                self.fail_batch(e)
+                return
+            except ValueError as e:
+                METRICS.inc('optimize_requests_total', mode='batch', status='error', **self.metric_labels())
+                optimize_logger.warning(f"批量优化 {len(self.items)} 条的响应无法解析，回退为逐条优化: {e}")
+            except Exception as e:
+                # 密钥无效、限流等HTTP错误不回退，避免变成 N 次同样失败的请求
+                self.fail_batch(e)
+                return
+
+        for row, prompt in self.items:
+            self.optimize_one(row, prompt)
+
+    def fail_batch(self, error):
+        """批量请求失败，整批每一行都标记为失败"""
+        METRICS.inc('optimize_requests_total', mode='batch', status='error', **self.metric_labels())
+        optimize_logger.error(f"批量优化 {len(self.items)} 条失败: {error}")
+        for row, prompt in self.items:
+            self.signals.error.emit(row, prompt, str(error))
+
+    def optimize_one(self, row, prompt):
+        """单条优化"""
+        last_emit = [0.0]
+        labels = dict(self.metric_labels(), mode='stream' if self.stream else 'single')
+        start_time = time.monotonic()
+
+        def on_delta(text):
+            now = time.monotonic()
+            if not last_emit[0]:
+                METRICS.observe('optimize_ttfb_seconds', now - start_time, **labels)
+            if now - last_emit[0] >= self.PARTIAL_EMIT_INTERVAL:
+                last_emit[0] = now
+                self.signals.partial.emit(row, text)
+
+        try:
+            if self.cancel_event.is_set():
+                raise OperationCancelled("已取消")
+            optimized = request_prompt_optimization(
+                self.api_key, self.ai_model, self.meta_prompt, prompt,
+                stream=self.stream, on_delta=on_delta, cancel_event=self.cancel_event)
+            METRICS.observe('optimize_request_seconds', time.monotonic() - start_time, **labels)
+            METRICS.inc('optimize_requests_total', status='success', **labels)
+            self.signals.finished.emit(row, prompt, optimized)
+        except OperationCancelled as e:
+            METRICS.inc('optimize_requests_total', status='cancelled', **labels)
+            self.signals.error.emit(row, prompt, str(e))
+        except Exception as e:
+            METRICS.inc('optimize_requests_total', status='error', **labels)
+            optimize_logger.error(f"优化提示词失败 (行 {row + 1}): {e}")
+            self.signals.error.emit(row, prompt, str(e))
+
+class SettingsDialog(QDialog):
+    """统一设置管理对话框"""
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._init_done = False  # 初始化标志
+        self.setWindowTitle("⚙️ 设置管理中心")
+        self.resize(1100, 750)
+        self.setMinimumSize(900, 650)
+        
+        # 从父窗口获取数据
+        if parent:
+            self.api_key = parent.api_key
+            self.api_platform = parent.api_platform
+            self.image_model = parent.image_model  # 获取生图模型配置
+            # 分离的API密钥
+            self.sora_api_key = getattr(parent, 'sora_api_key', '')
+            self.nano_api_key = getattr(parent, 'nano_api_key', '')
+            self.thread_count = parent.thread_count
+            self.retry_count = parent.retry_count
+            self.save_path = parent.save_path
+            self.image_ratio = parent.image_ratio
+            self.image_stream = getattr(parent, 'image_stream', False)
+            self.images_per_prompt = getattr(parent, 'images_per_prompt', 1)
+            self.generation_cache_enabled = getattr(parent, 'generation_cache_enabled', False)
+            self.image_metadata_mode = getattr(parent, 'image_metadata_mode', 'png')
+            self.output_layout = getattr(parent, 'output_layout', 'date')
+            self.dedupe_images = getattr(parent, 'dedupe_images', True)
+            self.metrics_port = getattr(parent, 'metrics_port', 0)
+            self.style_library = parent.style_library.copy()
+            self.category_links = parent.category_links.copy()
+            self.current_style = parent.current_style
+            self.custom_style_content = parent.custom_style_content
+            # OpenRouter AI优化配置
             self.openrouter_api_key = getattr(parent, 'openrouter_api_key', '')
             self.ai_model = getattr(parent, 'ai_model', 'qwen/qwq-32b')
             self.meta_prompt = getattr(parent, 'meta_prompt', '')
             self.meta_prompt_template = getattr(parent, 'meta_prompt_template', 'template1')
             self.optimization_history = getattr(parent, 'optimization_history', [])
+            self.optimize_concurrency = getattr(parent, 'optimize_concurrency', 4)
+            self.optimize_batch_size = getattr(parent, 'optimize_batch_size', 5)
+            self.optimize_stream = getattr(parent, 'optimize_stream', True)
         else:
             self.api_key = ""
             self.api_platform = "云雾"
@@ -589,6 +2790,13 @@ class SettingsDialog(QDialog):
             self.retry_count = 3
             self.save_path = ""
             self.image_ratio = "3:2"
+            self.image_stream = False
+            self.images_per_prompt = 1
+            self.generation_cache_enabled = False
+            self.image_metadata_mode = 'png'
+            self.output_layout = 'date'
+            self.dedupe_images = True
+            self.metrics_port = 0
             self.style_library = {}
             self.category_links = {}
             self.current_style = ""
@@ -599,6 +2807,9 @@ class SettingsDialog(QDialog):
             self.meta_prompt = ""
             self.meta_prompt_template = "template1"
             self.optimization_history = []
+            self.optimize_concurrency = 4
+            self.optimize_batch_size = 5
+            self.optimize_stream = True
         
         self.setup_ui()
         self.load_settings()
@@ -615,14 +2826,15 @@ class SettingsDialog(QDialog):
         # 基础配置标签页
         self.create_config_tab()
         
+        # 其余标签页首次切换到时才创建，加快打开设置中心
+        self.lazy_tabs = {}
         # 风格库管理标签页
-        self.create_style_tab()
-        
+        self.add_lazy_tab("🎨 风格库", self.create_style_tab, self.load_style_settings)
         # 参考图管理标签页
-        self.create_image_tab()
-        
+        self.add_lazy_tab("🖼️ 参考图库", self.create_image_tab, self.load_image_settings)
         # AI优化配置标签页
-        self.create_ai_optimize_tab()
+        self.add_lazy_tab("🤖 AI优化", self.create_ai_optimize_tab, self.load_ai_settings)
+        self.tab_widget.currentChanged.connect(self.build_lazy_tab)
         
         layout.addWidget(self.tab_widget)
         
@@ -673,6 +2885,23 @@ class SettingsDialog(QDialog):
             }
         """)
     
+    def add_lazy_tab(self, title, create, load):
+        """添加占位标签页，首次显示时再创建内容并加载对应设置"""
+        page = QWidget()
+        page_layout = QVBoxLayout(page)
+        page_layout.setContentsMargins(0, 0, 0, 0)
+        index = self.tab_widget.addTab(page, title)
+        self.lazy_tabs[index] = (page_layout, create, load)
+    
+    def build_lazy_tab(self, index):
+        """切换到尚未创建的标签页时创建其内容"""
+        entry = self.lazy_tabs.pop(index, None)
+        if entry is None:
+            return
+        page_layout, create, load = entry
+        page_layout.addWidget(create())
+        load()
+    
     def create_config_tab(self):
         """创建基础配置标签页"""
         config_widget = QWidget()
@@ -763,6 +2992,51 @@ class SettingsDialog(QDialog):
         self.ratio_combo = QComboBox()
         self.ratio_combo.addItems(["1:1", "3:2", "4:3", "16:9", "9:16", "2:3", "3:4"])
         params_layout.addWidget(self.ratio_combo, 2, 1)
+
+        self.image_stream_checkbox = QCheckBox("流式接收（显示生成进度，链接出现即返回）")
+        self.image_stream_checkbox.setToolTip("平台支持流式输出时启用，可显示进度百分比并更早发现卡住的任务")
+        params_layout.addWidget(self.image_stream_checkbox, 2, 2, 1, 2)
+
+        params_layout.addWidget(QLabel("每条出图数:"), 3, 0)
+        self.images_per_prompt_spin = QSpinBox()
+        self.images_per_prompt_spin.setRange(1, MAX_IMAGES_PER_PROMPT)
+        self.images_per_prompt_spin.setSuffix(" 张")
+        self.images_per_prompt_spin.setToolTip("每条提示词生成多张变体，双击图片可切换并设为主图")
+        params_layout.addWidget(self.images_per_prompt_spin, 3, 1)
+
+        self.generation_cache_checkbox = QCheckBox("相同请求复用已生成图片")
+        self.generation_cache_checkbox.setToolTip("提示词、风格、比例、模型和参考图完全相同时直接使用已有图片，不再重复调用API；\n重新生成全部时可勾选“重新采样”强制生成新图")
+        params_layout.addWidget(self.generation_cache_checkbox, 3, 2, 1, 2)
+
+        params_layout.addWidget(QLabel("指标端口:"), 4, 0)
+        self.metrics_port_spin = QSpinBox()
+        self.metrics_port_spin.setRange(0, 65535)
+        self.metrics_port_spin.setSpecialValueText("关闭")
+        self.metrics_port_spin.setToolTip("开启后在 http://127.0.0.1:端口/metrics 提供 OpenMetrics 格式的运行指标，供监控面板抓取")
+        params_layout.addWidget(self.metrics_port_spin, 4, 1)
+
+        params_layout.addWidget(QLabel("图片元数据:"), 4, 2)
+        self.image_metadata_combo = QComboBox()
+        for mode, label in IMAGE_METADATA_MODES.items():
+            self.image_metadata_combo.addItem(label, mode)
+        self.image_metadata_combo.setToolTip("保存每张图片的提示词、风格、比例、模型、参考图、耗时和来源URL；\n每批生成的汇总清单保存在保存路径下的 manifests 文件夹")
+        params_layout.addWidget(self.image_metadata_combo, 4, 3)
+
+        params_layout.addWidget(QLabel("存放方式:"), 5, 0)
+        self.output_layout_combo = QComboBox()
+        for layout_name, label in OUTPUT_LAYOUTS.items():
+            self.output_layout_combo.addItem(label, layout_name)
+        self.output_layout_combo.setToolTip("图片较多或保存在共享盘时建议按日期或批次分文件夹；\n同名文件不会被覆盖，会自动改名为 名称-2.png")
+        params_layout.addWidget(self.output_layout_combo, 5, 1, 1, 3)
+
+        self.dedupe_checkbox = QCheckBox("相同内容的图片使用硬链接，不重复占用空间")
+        self.dedupe_checkbox.setToolTip("保存的图片与已保存的图片、添加到图库的图片与图库中已有图片内容相同时创建硬链接（元数据内嵌到PNG时每张图内容不同，不会链接）；\n硬链接的文件共用同一份内容，用其他软件直接修改其中一个会同时改变其他文件")
+        params_layout.addWidget(self.dedupe_checkbox, 6, 0, 1, 3)
+
+        self.dedupe_button = QPushButton("查找重复图片")
+        self.dedupe_button.setToolTip("扫描保存路径和图库，统计可节省的空间，确认后把重复的图片替换为硬链接")
+        self.dedupe_button.clicked.connect(self.scan_duplicate_images)
+        params_layout.addWidget(self.dedupe_button, 6, 3)
         
         layout.addWidget(params_group)
         
@@ -925,7 +3199,7 @@ class SettingsDialog(QDialog):
         self.style_content_edit.textChanged.connect(self.on_style_content_changed)
         
         self.current_style_name = ""
-        self.tab_widget.addTab(style_widget, "🎨 风格库")
+        return style_widget
     
     def create_image_tab(self):
         """创建参考图管理标签页"""
@@ -1020,7 +3294,7 @@ class SettingsDialog(QDialog):
         layout.addWidget(main_splitter)
         
         self.current_category = ""
-        self.tab_widget.addTab(image_widget, "🖼️ 参考图库")
+        return image_widget
     
     def create_ai_optimize_tab(self):
         """创建AI优化配置标签页"""
@@ -1059,6 +3333,23 @@ class SettingsDialog(QDialog):
             "deepseek/deepseek-chat-v3.1"
         ])
         model_layout.addWidget(self.ai_model_combo)
+
+        model_layout.addWidget(QLabel("批量优化并发:"))
+        self.optimize_concurrency_spin = QSpinBox()
+        self.optimize_concurrency_spin.setRange(1, 32)
+        self.optimize_concurrency_spin.setSuffix(" 个")
+        model_layout.addWidget(self.optimize_concurrency_spin)
+
+        model_layout.addWidget(QLabel("每次合并:"))
+        self.optimize_batch_size_spin = QSpinBox()
+        self.optimize_batch_size_spin.setRange(1, 50)
+        self.optimize_batch_size_spin.setSuffix(" 条")
+        self.optimize_batch_size_spin.setToolTip("批量优化时每次请求合并的提示词条数，设为1则逐条请求")
+        model_layout.addWidget(self.optimize_batch_size_spin)
+
+        self.optimize_stream_checkbox = QCheckBox("流式显示")
+        self.optimize_stream_checkbox.setToolTip("逐条优化时实时显示AI输出，可随时停止")
+        model_layout.addWidget(self.optimize_stream_checkbox)
         model_layout.addStretch()
         
         api_layout.addLayout(model_layout)
@@ -1128,6 +3419,7 @@ class SettingsDialog(QDialog):
 • 选择适合的AI模型进行提示词优化<br>
 • 元提示词用于指导AI如何优化你的生图提示词<br>
 • 可使用预设模板或自定义元提示词<br>
+• 批量优化会把多条提示词合并为一次请求，解析失败时自动逐条重试<br>
 • 所有优化记录都会保存在历史中供查看
         """)
         tips_label.setWordWrap(True)
@@ -1137,7 +3429,7 @@ class SettingsDialog(QDialog):
         layout.addLayout(tips_layout)
         layout.addStretch()
         
-        self.tab_widget.addTab(ai_widget, "🤖 AI优化")
+        return ai_widget
     
     def toggle_openrouter_key_visibility(self):
         """切换OpenRouter API密钥显示/隐藏"""
@@ -1334,12 +3626,7 @@ class SettingsDialog(QDialog):
         # 构建测试请求
         try:
             # 构建API URL
-            if platform == "云雾":
-                api_url = "https://yunwu.ai/v1/chat/completions"
-            elif platform == "apicore":
-                api_url = "https://api.apicore.ai/v1/chat/completions"
-            else:
-                api_url = "https://api.apicore.ai/v1/chat/completions"  # 默认使用apicore
+            api_url = get_image_api_url(platform)
             
             # 根据选择的模型设置API参数（与Worker类保持一致）
             if image_model == "sora":
@@ -1419,6 +3706,48 @@ class SettingsDialog(QDialog):
         if path:
             self.path_input.setText(path)
     
+    def scan_duplicate_images(self):
+        """在后台扫描保存路径和图库中的重复图片"""
+        roots = [str(IMAGES_PATH)]
+        save_path = self.path_input.text().strip()
+        if save_path and os.path.isdir(save_path):
+            roots.append(save_path)
+        self.dedupe_button.setEnabled(False)
+        self.dedupe_button.setText("扫描中...")
+        self.dedupe_worker = DedupeWorker(roots)  # 保持引用，避免信号对象被提前回收
+        self.dedupe_worker.signals.finished.connect(self.on_duplicate_scan_finished)
+        self.dedupe_worker.signals.error.connect(self.on_duplicate_scan_error)
+        self.parent().download_threadpool.start(self.dedupe_worker)
+    
+    def on_duplicate_scan_finished(self, groups):
+        """显示可节省的空间，确认后替换为硬链接"""
+        self.dedupe_button.setEnabled(True)
+        self.dedupe_button.setText("查找重复图片")
+        summary = summarize_duplicates(groups)
+        if not groups:
+            QMessageBox.information(self, "查找重复图片", "没有发现重复的图片")
+            return
+        examples = "\n".join(f"• {os.path.basename(group['files'][0])} 等 {len(group['files'])} 个" for group in groups[:5])
+        reply = QMessageBox.question(
+            self, "查找重复图片",
+            f"发现 {summary['groups']} 组内容相同的图片，共 {summary['duplicates']} 个重复文件，"
+            f"可节省 {summary['reclaimable_bytes'] / 1024 / 1024:.1f} MB：\n\n{examples}\n\n"
+            "是否把重复的文件替换为硬链接？文件名和位置不变。",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        linked, reclaimed, errors = link_duplicate_images(groups)
+        message = f"已替换 {linked} 个文件，节省 {reclaimed / 1024 / 1024:.1f} MB"
+        if errors:
+            logging.warning(f"替换重复图片失败 {len(errors)} 个: {errors[:5]}")
+            message += f"\n{len(errors)} 个文件无法创建硬链接（可能不在同一磁盘或网络盘不支持），详见日志"
+        QMessageBox.information(self, "查找重复图片", message)
+    
+    def on_duplicate_scan_error(self, error):
+        self.dedupe_button.setEnabled(True)
+        self.dedupe_button.setText("查找重复图片")
+        QMessageBox.critical(self, "错误", f"查找重复图片失败: {error}")
+    
     def load_settings(self):
         """加载设置到界面"""
         try:
@@ -1445,27 +3774,70 @@ class SettingsDialog(QDialog):
                 self.path_input.setText(self.save_path)
             if hasattr(self, 'ratio_combo'):
                 self.ratio_combo.setCurrentText(self.image_ratio)
-            
-            # 风格库 - 安全访问
-            if hasattr(self, 'refresh_style_combo'):
-                self.refresh_style_combo()
-            if hasattr(self, 'refresh_style_list'):
-                self.refresh_style_list()
-            if self.current_style and self.current_style in self.style_library and hasattr(self, 'style_combo'):
-                self.style_combo.setCurrentText(self.current_style)
-                # 确保custom_style_content与选择的风格同步
+            if hasattr(self, 'image_stream_checkbox'):
+                self.image_stream_checkbox.setChecked(self.image_stream)
+            if hasattr(self, 'images_per_prompt_spin'):
+                self.images_per_prompt_spin.setValue(self.images_per_prompt)
+            if hasattr(self, 'generation_cache_checkbox'):
+                self.generation_cache_checkbox.setChecked(self.generation_cache_enabled)
+            if hasattr(self, 'image_metadata_combo'):
+                self.image_metadata_combo.setCurrentIndex(max(0, self.image_metadata_combo.findData(self.image_metadata_mode)))
+            if hasattr(self, 'output_layout_combo'):
+                self.output_layout_combo.setCurrentIndex(max(0, self.output_layout_combo.findData(self.output_layout)))
+            if hasattr(self, 'dedupe_checkbox'):
+                self.dedupe_checkbox.setChecked(self.dedupe_images)
+            if hasattr(self, 'metrics_port_spin'):
+                self.metrics_port_spin.setValue(self.metrics_port)
+            
+            # 确保custom_style_content与选择的风格同步（风格库标签页可能还未创建）
+            if self.current_style and self.current_style in self.style_library:
                 if not self.custom_style_content or self.custom_style_content.strip() == "":
                     self.custom_style_content = self.style_library[self.current_style]['content']
-            
-            # 参考图
-            if hasattr(self, 'refresh_category_list'):
-                self.refresh_category_list()
-            
+        
+        except Exception as e:
+            print(f"加载设置失败: {e}")
+            pass
+        
+        # 已创建的其他标签页
+        self.load_style_settings()
+        self.load_image_settings()
+        self.load_ai_settings()
+    
+    def load_style_settings(self):
+        """加载风格库标签页"""
+        if not hasattr(self, 'style_combo'):
+            return
+        try:
+            self.refresh_style_combo()
+            self.refresh_style_list()
+            if self.current_style and self.current_style in self.style_library:
+                self.style_combo.setCurrentText(self.current_style)
+        except Exception as e:
+            print(f"加载风格库设置失败: {e}")
+    
+    def load_image_settings(self):
+        """加载参考图库标签页"""
+        if not hasattr(self, 'category_list'):
+            return
+        try:
+            self.refresh_category_list()
+        except Exception as e:
+            print(f"加载参考图库设置失败: {e}")
+    
+    def load_ai_settings(self):
+        """加载AI优化标签页"""
+        try:
             # OpenRouter AI优化配置
             if hasattr(self, 'openrouter_key_input'):
                 self.openrouter_key_input.setText(self.openrouter_api_key)
             if hasattr(self, 'ai_model_combo'):
                 self.ai_model_combo.setCurrentText(self.ai_model)
+            if hasattr(self, 'optimize_concurrency_spin'):
+                self.optimize_concurrency_spin.setValue(self.optimize_concurrency)
+            if hasattr(self, 'optimize_batch_size_spin'):
+                self.optimize_batch_size_spin.setValue(self.optimize_batch_size)
+            if hasattr(self, 'optimize_stream_checkbox'):
+                self.optimize_stream_checkbox.setChecked(self.optimize_stream)
             if hasattr(self, 'meta_template_combo'):
                 self.meta_template_combo.setCurrentText(self.meta_prompt_template)
             if hasattr(self, 'meta_prompt_text'):
@@ -1475,11 +3847,11 @@ class SettingsDialog(QDialog):
                         self.load_meta_template()
                 else:
                     self.meta_prompt_text.setPlainText(self.meta_prompt)
-            if hasattr(self, 'update_history_stats'):
+            if hasattr(self, 'history_stats_label'):
                 self.update_history_stats()
         
         except Exception as e:
-            print(f"加载设置失败: {e}")
+            print(f"加载AI优化设置失败: {e}")
             pass
     
     def accept_settings(self):
@@ -1508,6 +3880,20 @@ class SettingsDialog(QDialog):
                 self.parent().save_path = self.path_input.text()
             if hasattr(self, 'ratio_combo'):
                 self.parent().image_ratio = self.ratio_combo.currentText()
+            if hasattr(self, 'image_stream_checkbox'):
+                self.parent().image_stream = self.image_stream_checkbox.isChecked()
+            if hasattr(self, 'images_per_prompt_spin'):
+                self.parent().images_per_prompt = self.images_per_prompt_spin.value()
+            if hasattr(self, 'generation_cache_checkbox'):
+                self.parent().generation_cache_enabled = self.generation_cache_checkbox.isChecked()
+            if hasattr(self, 'image_metadata_combo'):
+                self.parent().image_metadata_mode = self.image_metadata_combo.currentData()
+            if hasattr(self, 'output_layout_combo'):
+                self.parent().output_layout = self.output_layout_combo.currentData()
+            if hasattr(self, 'dedupe_checkbox'):
+                self.parent().dedupe_images = self.dedupe_checkbox.isChecked()
+            if hasattr(self, 'metrics_port_spin'):
+                self.parent().metrics_port = self.metrics_port_spin.value()
             self.parent().style_library = self.style_library
             self.parent().category_links = self.category_links
             self.parent().current_style = self.current_style
@@ -1520,6 +3906,9 @@ class SettingsDialog(QDialog):
                 self.parent().meta_prompt = self.meta_prompt_text.toPlainText()
                 self.parent().meta_prompt_template = self.meta_template_combo.currentText()
                 self.parent().optimization_history = self.optimization_history
+                self.parent().optimize_concurrency = self.optimize_concurrency_spin.value()
+                self.parent().optimize_batch_size = self.optimize_batch_size_spin.value()
+                self.parent().optimize_stream = self.optimize_stream_checkbox.isChecked()
             
             # 刷新主窗口界面
             self.parent().refresh_ui_after_settings()
@@ -1975,6 +4364,10 @@ class SettingsDialog(QDialog):
                 QMessageBox.warning(self, "提示", "请先选择分类")
                 return
             
+            # 选择文件期间在后台建立图库索引，添加时查找相同图片不必遍历图库
+            if self.dedupe_checkbox.isChecked():
+                GALLERY_INDEX.preload()
+            
             # 弹出文件选择对话框
             file_path, _ = QFileDialog.getOpenFileName(
                 self,
@@ -2013,7 +4406,8 @@ class SettingsDialog(QDialog):
                             self.category_links[self.current_category] = []
                         
                         # 复制图片到分类目录
-                        relative_path = copy_image_to_category(file_path, self.current_category, name.strip())
+                        relative_path = copy_image_to_category(file_path, self.current_category, name.strip(),
+                                                               self.dedupe_checkbox.isChecked())
                         
                         # 添加到配置中
                         images = self.category_links[self.current_category]
@@ -2335,7 +4729,7 @@ class PromptEditDialog(QDialog):
         return self.text_edit.toPlainText().strip()
 
 class ImageViewDialog(QDialog):
-    """图片查看对话框"""
+    """图片查看对话框（多张变体时可切换并设为主图）"""
     
     def __init__(self, image_number, prompt_text, save_path, parent=None):
         super().__init__(parent)
@@ -2346,6 +4740,23 @@ class ImageViewDialog(QDialog):
         self.setModal(True)
         self.resize(800, 600)
         
+        # 从数据中获取实际的文件名（可能有多张变体）
+        self.row_data = None
+        if hasattr(parent, 'prompt_table_data'):
+            for data in parent.prompt_table_data:
+                if data['number'] == self.image_number:
+                    self.row_data = data
+                    break
+        self.filenames = []
+        self.current_index = 0
+        if self.row_data:
+            self.filenames = list(self.row_data.get('filenames') or [])
+            filename = self.row_data.get('filename')
+            if filename and filename not in self.filenames:
+                self.filenames.insert(0, filename)
+            if filename:
+                self.current_index = self.filenames.index(filename)
+        
         layout = QVBoxLayout(self)
         
         # 图片显示区域
@@ -2356,6 +4767,31 @@ class ImageViewDialog(QDialog):
         
         layout.addWidget(self.image_label)
         
+        # 多张变体切换
+        if len(self.filenames) > 1:
+            variant_layout = QHBoxLayout()
+            
+            self.prev_button = QPushButton("◀ 上一张")
+            self.prev_button.clicked.connect(lambda: self.show_variant(self.current_index - 1))
+            variant_layout.addWidget(self.prev_button)
+            
+            self.variant_label = QLabel()
+            self.variant_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+            variant_layout.addWidget(self.variant_label)
+            
+            self.next_button = QPushButton("下一张 ▶")
+            self.next_button.clicked.connect(lambda: self.show_variant(self.current_index + 1))
+            variant_layout.addWidget(self.next_button)
+            
+            variant_layout.addStretch()
+            
+            self.primary_button = QPushButton("⭐ 设为主图")
+            self.primary_button.setToolTip("表格缩略图和导出使用主图")
+            self.primary_button.clicked.connect(self.set_as_primary)
+            variant_layout.addWidget(self.primary_button)
+            
+            layout.addLayout(variant_layout)
+        
         # 底部信息和按钮
         info_layout = QHBoxLayout()
         
@@ -2375,21 +4811,45 @@ class ImageViewDialog(QDialog):
         # 加载图片
         self.load_image()
     
+    def show_variant(self, index):
+        """切换到第 index 张变体"""
+        if not self.filenames:
+            return
+        self.current_index = index % len(self.filenames)
+        self.load_image()
+    
+    def update_variant_controls(self):
+        """更新变体序号和主图按钮状态"""
+        if len(self.filenames) <= 1:
+            return
+        is_primary = self.row_data.get('filename') == self.filenames[self.current_index]
+        self.variant_label.setText(f"第 {self.current_index + 1}/{len(self.filenames)} 张" + ("（主图）" if is_primary else ""))
+        self.primary_button.setEnabled(not is_primary)
+    
+    def set_as_primary(self):
+        """将当前变体设为该提示词的主图"""
+        filename = self.filenames[self.current_index]
+        self.row_data['filename'] = filename
+        # 主图URL与文件保持对应
+        image_urls = self.row_data.get('image_urls') or []
+        saved_filenames = self.row_data.get('filenames') or []
+        if filename in saved_filenames and len(image_urls) == len(saved_filenames):
+            self.row_data['image_url'] = image_urls[saved_filenames.index(filename)]
+        self.update_variant_controls()
+        if hasattr(self.parent(), 'refresh_row_status'):
+            self.parent().refresh_row_status(self.row_data)
+    
     def load_image(self):
         """从本地文件加载并显示图片"""
         try:
+            self.update_variant_controls()
+            
             # 检查保存路径
             if not self.save_path:
                 self.image_label.setText("保存路径未设置")
                 return
             
-            # 从数据中获取实际的文件名
-            filename = None
-            if hasattr(self.parent(), 'prompt_table_data'):
-                for data in self.parent().prompt_table_data:
-                    if data['number'] == self.image_number:
-                        filename = data.get('filename')
-                        break
+            filename = self.filenames[self.current_index] if self.filenames else None
             
             # 如果没有找到文件名，使用旧的命名规则作为后备
             if not filename:
@@ -2397,8 +4857,9 @@ class ImageViewDialog(QDialog):
             
             file_path = os.path.join(self.save_path, filename)
             
-            # 检查文件是否存在
-            if not os.path.exists(file_path):
+            # 检查文件是否存在（索引中登记过的文件不再访问文件系统）
+            index = self.parent().get_output_index() if hasattr(self.parent(), 'get_output_index') else None
+            if not (index and index.contains(filename)) and not os.path.exists(file_path):
                 self.image_label.setText(f"本地图片文件不存在:\n{filename}")
                 return
             
@@ -2413,11 +4874,70 @@ class ImageViewDialog(QDialog):
                     Qt.TransformationMode.SmoothTransformation
                 )
                 self.image_label.setPixmap(scaled_pixmap)
+                # 鼠标悬停显示保存时写入的生成信息
+                self.image_label.setToolTip(self.describe_metadata(read_image_metadata(file_path)))
             else:
                 self.image_label.setText("图片文件格式错误")
                 
         except Exception as e:
             self.image_label.setText(f"本地图片加载失败:\n{str(e)}")
+    
+    def describe_metadata(self, metadata):
+        """图片元数据 -> 提示文字"""
+        if not metadata:
+            return ""
+        fields = [('api_platform', "平台"), ('image_model', "模型"), ('style', "风格"), ('ratio', "比例"),
+                  ('seconds', "耗时(秒)"), ('created_at', "生成时间"), ('image_url', "来源")]
+        lines = [f"{label}: {metadata[key]}" for key, label in fields if metadata.get(key)]
+        references = (metadata.get('reference_names') or []) + (metadata.get('reference_images') or [])
+        if references:
+            lines.append(f"参考图: {', '.join(references)}")
+        return "\n".join(lines)
+
+class ColumnMappingDialog(QDialog):
+    """导入表格时选择分镜编号、分镜提示词和参考图对应的列"""
+    
+    FIELDS = [('prompt', "分镜提示词"), ('number', "分镜编号"), ('reference_images', "参考图")]
+    
+    def __init__(self, columns, resolved, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("选择导入列")
+        self.setModal(True)
+        self.resize(420, 220)
+        
+        layout = QVBoxLayout(self)
+        info_label = QLabel("没有识别出提示词列，请指定各字段对应的列（选择会保存，下次自动使用）")
+        info_label.setWordWrap(True)
+        info_label.setStyleSheet("color: #666; font-size: 14px; margin-bottom: 10px;")
+        layout.addWidget(info_label)
+        
+        grid = QGridLayout()
+        self.combos = {}
+        for row, (field, label) in enumerate(self.FIELDS):
+            grid.addWidget(QLabel(f"{label}:"), row, 0)
+            combo = QComboBox()
+            combo.addItem("（无）", None)
+            for column in columns:
+                combo.addItem(str(column), column)
+            if resolved.get(field) is not None:
+                combo.setCurrentIndex(combo.findData(resolved[field]))
+            grid.addWidget(combo, row, 1)
+            self.combos[field] = combo
+        layout.addLayout(grid)
+        
+        button_layout = QHBoxLayout()
+        button_layout.addStretch()
+        ok_button = QPushButton("导入")
+        ok_button.clicked.connect(self.accept)
+        cancel_button = QPushButton("取消")
+        cancel_button.clicked.connect(self.reject)
+        button_layout.addWidget(ok_button)
+        button_layout.addWidget(cancel_button)
+        layout.addLayout(button_layout)
+    
+    def get_mapping(self):
+        """{字段: 列名}，未选择的字段不包含"""
+        return {field: combo.currentData() for field, combo in self.combos.items() if combo.currentData() is not None}
 
 class TextReplaceDialog(QDialog):
     """文字替换对话框"""
@@ -2882,6 +5402,8 @@ class PromptTableDelegate(QStyledItemDelegate):
         return super().sizeHint(option, index)
 
 class MainWindow(QMainWindow):
+    PROMPT_TABLE_FILL_BATCH = 50  # 追加行时每次事件循环创建控件的行数
+
     def __init__(self):
         super().__init__()
         self._init_done = False
@@ -2900,6 +5422,21 @@ class MainWindow(QMainWindow):
         self.retry_count = 3
         self.save_path = ""
         self.image_ratio = "3:2"
+        self.image_stream = False  # 生图请求使用流式响应
+        self.images_per_prompt = 1  # 每条提示词生成的图片数
+        self.generation_cache_enabled = False  # 相同请求复用已生成图片（默认关闭，重复提交通常是想要新图）
+        self.image_metadata_mode = 'png'  # 每张图片元数据的写入方式，见 IMAGE_METADATA_MODES
+        self.results_manifest = None  # 当前批次的结果清单（ResultsManifest），批次结束后下次生成时新建
+        self.output_layout = 'date'  # 图片在保存路径下的存放方式，见 OUTPUT_LAYOUTS
+        self.output_index = None  # 保存路径的 OutputIndex
+        self.dedupe_images = True  # 相同内容的图片保存为硬链接
+        self.generation_cache = None  # 首次生成时加载
+        self.log_levels = {}  # 子系统日志级别，如 {"sora.worker": "DEBUG"}
+        self.metrics_port = 0  # OpenMetrics 接口端口，0 表示关闭
+        self.metrics_host = '127.0.0.1'  # 需要局域网抓取时可改为 0.0.0.0
+        self.metrics_server = None
+        self.generation_stats = GenerationStats()  # 生成统计面板数据
+        self.profile_stall_timer = None  # 性能分析时的事件循环卡顿检测
         self.style_library = {}
         self.category_links = {}
         self.current_style = ""
@@ -2911,6 +5448,10 @@ class MainWindow(QMainWindow):
         self.meta_prompt = ""
         self.meta_prompt_template = "template1"
         self.optimization_history = []
+        self.optimize_concurrency = 4  # 批量优化并发数
+        self.optimize_batch_size = 5  # 每次请求合并优化的提示词条数（1为逐条请求）
+        self.optimize_stream = True  # 逐条优化时流式显示输出
+        self.import_column_map = {}  # 导入表格时的列映射 {字段: 列名}，覆盖默认列名识别
         
         # 添加计数器变量
         self.total_images = 0
@@ -2924,9 +5465,14 @@ class MainWindow(QMainWindow):
         
         # 创建主窗口
         self.setup_ui()
+        STARTUP_TRACE.mark('构建界面')
         
         # 初始化线程池
         self.threadpool = QThreadPool()
+        # 提示词优化使用独立线程池，避免占用生图并发
+        self.optimize_threadpool = QThreadPool()
+        # 图片下载使用独立线程池，不阻塞界面也不与生图任务抢线程
+        self.download_threadpool = QThreadPool()
         
         # 存储提示词和编号的对应关系
         self.prompt_numbers = {}
@@ -2934,6 +5480,9 @@ class MainWindow(QMainWindow):
         # 存储每行的光标位置 {row: cursor_position}
         self.cursor_positions = {}
         self.active_editors = {}  # 记录当前活跃的编辑器
+        self.prompt_table_filled_rows = 0  # 已创建控件的行数，分批追加时小于总行数
+        self.prompt_table_fill_scheduled = False  # 是否已有补建控件的定时任务，保证只有一条补建链
+        self.prompt_import_cancel = None  # 正在进行的表格导入的取消标志
         self.focused_row = -1  # 当前焦点行，用于图片插入时的光标定位
         
         # 异步初始化：延迟非关键操作
@@ -2942,6 +5491,10 @@ class MainWindow(QMainWindow):
         # 存储生成的图片信息
         self.generated_images = {}
         
+        # 环境变量 SORA_PROFILE=1 时启动即开启性能分析
+        if os.environ.get('SORA_PROFILE', '') not in ('', '0'):
+            self.profile_button.setChecked(True)
+        
         self._init_done = True
     
     def get_current_api_key(self):
@@ -2996,10 +5549,21 @@ class MainWindow(QMainWindow):
         
         # 加载配置
         self.load_config()
+        STARTUP_TRACE.mark('加载配置')
+        
+        # 排在 load_config 安排的界面刷新和表格刷新之后，完成即视为可交互
+        QTimer.singleShot(0, self.finish_startup)
         
         # 后台创建目录（避免阻塞UI）
         QTimer.singleShot(100, self.create_directories_async)
     
+    def finish_startup(self):
+        """启动完成：记录可交互耗时"""
+        STARTUP_TRACE.finish()
+        # 测量启动耗时用（benchmarks/bench_startup.py）
+        if os.environ.get('SORA_STARTUP_EXIT'):
+            QApplication.instance().quit()
+    
     def create_directories_async(self):
         """异步创建目录"""
         # 确保图片目录存在
@@ -3124,6 +5688,7 @@ class MainWindow(QMainWindow):
                 padding: 8px;
             }
         """)
+        STARTUP_TRACE.mark('界面样式')
     
     def setup_ui(self):
         """设置优化后的UI布局"""
@@ -3215,7 +5780,30 @@ class MainWindow(QMainWindow):
                 margin-right: 10px;
             }
         """)
-        api_settings_layout.addWidget(self.api_status_label)
+        api_settings_layout.addWidget(self.api_status_label)
+        
+        # 性能分析开关（开发用）
+        self.profile_button = QPushButton("性能分析")
+        self.profile_button.setCheckable(True)
+        self.profile_button.setToolTip("记录界面卡顿、槽函数和生图/下载线程的耗时，再次点击结束并保存结果")
+        self.profile_button.setStyleSheet("""
+            QPushButton {
+                background-color: #f8f9fa;
+                color: #6c757d;
+                font-size: 16px;
+                padding: 10px 16px;
+                border: 1px solid #dee2e6;
+                border-radius: 6px;
+                margin-right: 10px;
+            }
+            QPushButton:checked {
+                background-color: #dc3545;
+                color: white;
+                border-color: #dc3545;
+            }
+        """)
+        self.profile_button.toggled.connect(self.toggle_profiling)
+        api_settings_layout.addWidget(self.profile_button)
         
         # 设置按钮
         self.settings_button = QPushButton("设置中心")
@@ -3627,1000 +6215,1722 @@ class MainWindow(QMainWindow):
                 return button
         return None
     
-    def create_main_content(self, parent_layout):
-        """创建主要内容区域"""
-        main_card = QGroupBox("📝 提示词管理与生成")
-        main_card.setStyleSheet("""
+    def create_main_content(self, parent_layout):
+        """创建主要内容区域"""
+        main_card = QGroupBox("📝 提示词管理与生成")
+        main_card.setStyleSheet("""
+            QGroupBox {
+                font-weight: bold;
+                font-size: 18px;
+                color: #2c3e50;
+                border: 1px solid #e0e0e0;
+                border-radius: 12px;
+                margin: 12px 4px;
+                padding-top: 24px;
+                background: qlineargradient(x1:0, y1:0, x2:0, y2:1,
+                    stop:0 #ffffff, stop:1 #fafafa);
+            }
+            QGroupBox::title {
+                subcontrol-origin: margin;
+                subcontrol-position: top left;
+                left: 18px;
+                top: 10px;
+                background: qlineargradient(x1:0, y1:0, x2:0, y2:1,
+                    stop:0 #ffffff, stop:1 #f8f9fa);
+                padding: 4px 12px;
+                border-radius: 6px;
+                color: #2c3e50;
+            }
+        """)
+        parent_layout.addWidget(main_card)
+        
+        layout = QVBoxLayout(main_card)
+        
+        # 元提示词区域已移至右上角
+        
+        # 现代化分组工具栏设计
+        toolbar_container = QFrame()
+        toolbar_container.setStyleSheet("""
+            QFrame {
+                background: qlineargradient(x1:0, y1:0, x2:0, y2:1,
+                    stop:0 #ffffff, stop:1 #f8f9fa);
+                border: 1px solid #e0e0e0;
+                border-radius: 12px;
+                padding: 20px;
+                margin: 8px 0px;
+            }
+        """)
+        
+        toolbar_layout = QHBoxLayout(toolbar_container)
+        toolbar_layout.setSpacing(12)  # 进一步减小组间距离
+        
+        # === 文件操作区 ===
+        file_group = self.create_button_group("文件操作", [
+            ("导入表格", self.import_prompt_file, "#2196F3"),
+            ("导出表格", self.export_prompt_file, "#2196F3")
+        ])
+        toolbar_layout.addWidget(file_group)
+        
+        # === 内容编辑区 ===
+        edit_group = self.create_button_group("内容编辑", [
+            ("添加", self.add_prompt, "#4CAF50"),
+            ("删除选中", self.delete_selected_prompts, "#F44336"),
+            ("清空", self.clear_prompts, "#F44336"),
+            ("清除参考图", self.clear_selected_reference_images, "#FF9800"),
+            ("全选", self.toggle_select_all, "#607D8B")
+        ])
+        toolbar_layout.addWidget(edit_group)
+        
+        # === AI功能区 ===
+        ai_group = self.create_button_group("AI功能", [
+            ("文字替换", self.open_text_replace_dialog, "#FF9800"),
+            ("批量优化", self.batch_optimize_prompts, "#9C27B0")
+        ])
+        toolbar_layout.addWidget(ai_group)
+        
+        # === 生成控制区 ===
+        generate_group = self.create_button_group("图片生成", [
+            ("智能生成", self.start_generation, "#4CAF50"),
+            ("重新生成", self.start_regenerate_all, "#FF5722")
+        ])
+        toolbar_layout.addWidget(generate_group)
+        
+        # 存储按钮引用供后续使用 - 通过返回的按钮组获取
+        self.select_all_button = self.get_button_from_group(edit_group, "全选")
+        self.batch_optimize_button = self.get_button_from_group(ai_group, "批量优化") 
+        self.generate_button = self.get_button_from_group(generate_group, "智能生成")
+        self.regenerate_all_button = self.get_button_from_group(generate_group, "重新生成")
+        
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(toolbar_container)
+        button_layout.addStretch()
+        
+        # 风格选择已移至左侧面板，此处删除
+        
+        # 底部信息栏
+        info_layout = QHBoxLayout()
+        
+        # 使用提示
+        usage_hint = QLabel("💡 双击提示词可编辑")
+        usage_hint.setStyleSheet("""
+            QLabel {
+                color: #6c757d; 
+                font-size: 14px; 
+                font-style: italic;
+                padding: 6px 10px;
+                background-color: #f8f9fa;
+                border-radius: 4px;
+            }
+        """)
+        info_layout.addWidget(usage_hint)
+        
+        info_layout.addStretch()
+        
+        # 统计信息
+        self.prompt_stats_label = QLabel("总计: 0 个提示词")
+        self.prompt_stats_label.setStyleSheet("""
+            QLabel {
+                color: #495057; 
+                font-size: 16px;
+                font-weight: 600;
+                padding: 8px 14px;
+                background-color: #e9ecef;
+                border-radius: 6px;
+            }
+        """)
+        info_layout.addWidget(self.prompt_stats_label)
+        
+        button_layout.addLayout(info_layout)
+        
+        layout.addLayout(button_layout)
+        
+        # 提示词表格（支持拖拽）
+        self.prompt_table = DragDropTableWidget()
+        self.prompt_table.set_main_window(self)
+        self.prompt_table.setColumnCount(8)
+        self.prompt_table.setHorizontalHeaderLabels(["选择", "编号", "提示词", "参考图", "图库", "生成状态/图片", "AI优化", "单独生成"])
+        
+        # 设置表格属性
+        self.prompt_table.setAlternatingRowColors(False)  # 禁用斑马纹，全部白色背景
+        self.prompt_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)  # 整行选择
+        
+        # 启用拖拽功能
+        self.prompt_table.setAcceptDrops(True)
+        self.prompt_table.setDragDropMode(QAbstractItemView.DragDropMode.DropOnly)
+        self.prompt_table.setDefaultDropAction(Qt.DropAction.CopyAction)
+        
+        # 现代化表格样式
+        self.prompt_table.setStyleSheet("""
+            QTableWidget {
+                background-color: #ffffff;
+                border: 1px solid #e0e0e0;
+                border-radius: 8px;
+                gridline-color: #f0f0f0;
+                selection-background-color: #e3f2fd;
+                alternate-background-color: #f8f9fa;
+            }
+            QTableWidget::item {
+                padding: 8px;
+                border-bottom: 1px solid #f5f5f5;
+                border-right: 1px solid #f5f5f5;
+            }
+            QTableWidget::item:selected {
+                background-color: #cce7ff;
+                color: #0056b3;
+                border: 2px solid #007bff;
+                font-weight: 600;
+            }
+            QTableWidget::item:hover {
+                background-color: #f0f8ff;
+                border: 1px solid #b3d9ff;
+            }
+            QTableWidget::item:focus {
+                background-color: #e6f3ff;
+                border: 2px solid #007bff;
+                outline: none;
+            }
+            QHeaderView::section {
+                background: qlineargradient(x1:0, y1:0, x2:0, y2:1,
+                    stop:0 #f8f9fa, stop:1 #e9ecef);
+                color: #495057;
+                padding: 12px 8px;
+                border: none;
+                border-right: 1px solid #dee2e6;
+                border-bottom: 1px solid #dee2e6;
+                font-weight: 600;
+                font-size: 16px;
+            }
+            QHeaderView::section:first {
+                border-top-left-radius: 8px;
+            }
+            QHeaderView::section:last {
+                border-top-right-radius: 8px;
+                border-right: none;
+            }
+            QHeaderView::section:hover {
+                background: qlineargradient(x1:0, y1:0, x2:0, y2:1,
+                    stop:0 #e9ecef, stop:1 #dee2e6);
+            }
+        """)
+        # 允许多种编辑触发方式：双击、单击、F2键
+        self.prompt_table.setEditTriggers(
+            QAbstractItemView.EditTrigger.DoubleClicked | 
+            QAbstractItemView.EditTrigger.EditKeyPressed |
+            QAbstractItemView.EditTrigger.SelectedClicked
+        )
+        
+        # 设置表格图标尺寸（重要：这决定了缩略图在表格中的显示大小）
+        self.prompt_table.setIconSize(QSize(180, 180))
+        
+        
+        # 设置列宽
+        header = self.prompt_table.horizontalHeader()
+        header.setSectionResizeMode(0, QHeaderView.ResizeMode.Fixed)  # 选择列固定宽度
+        header.setSectionResizeMode(1, QHeaderView.ResizeMode.Fixed)  # 编号列固定宽度
+        header.setSectionResizeMode(2, QHeaderView.ResizeMode.Stretch)  # 提示词列自适应
+        header.setSectionResizeMode(3, QHeaderView.ResizeMode.Fixed)  # 参考图列固定宽度
+        header.setSectionResizeMode(4, QHeaderView.ResizeMode.Fixed)  # 图库列固定宽度
+        header.setSectionResizeMode(5, QHeaderView.ResizeMode.Fixed)  # 生成状态/图片列固定宽度
+        header.setSectionResizeMode(6, QHeaderView.ResizeMode.Fixed)  # AI优化列固定宽度
+        header.setSectionResizeMode(7, QHeaderView.ResizeMode.Fixed)  # 单独生成列固定宽度
+        
+        self.prompt_table.setColumnWidth(0, 60)   # 选择列
+        self.prompt_table.setColumnWidth(1, 70)   # 编号列
+        self.prompt_table.setColumnWidth(3, 100)  # 参考图列
+        self.prompt_table.setColumnWidth(4, 90)   # 图库列（缩小）
+        self.prompt_table.setColumnWidth(5, 200)  # 生成状态/图片列（合并后加宽）
+        self.prompt_table.setColumnWidth(6, 90)   # AI优化列
+        self.prompt_table.setColumnWidth(7, 90)   # 单独生成列
+        
+        # 设置行高自适应内容
+        self.prompt_table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        self.prompt_table.verticalHeader().setMinimumSectionSize(230)  # 设置最小行高为230像素
+        
+        # 隐藏行号，避免与编号列混淆
+        self.prompt_table.verticalHeader().setVisible(False)
+        
+        # 设置文本换行
+        self.prompt_table.setWordWrap(True)
+        
+        # 设置自定义委托
+        self.table_delegate = PromptTableDelegate(main_window=self)
+        self.prompt_table.setItemDelegate(self.table_delegate)
+        
+        # 连接信号（提示词列现在使用内嵌编辑器，不需要cellChanged）
+        self.prompt_table.cellDoubleClicked.connect(self.on_table_cell_double_clicked)
+        self.prompt_table.cellClicked.connect(self.on_table_cell_clicked)
+        
+        layout.addWidget(self.prompt_table)
+    
+    def on_checkbox_changed(self, state, row):
+        """处理复选框状态变化"""
+        
+        # 更新行的背景色
+        if state == 2:  # 选中状态
+            for col in range(self.prompt_table.columnCount()):
+                item = self.prompt_table.item(row, col)
+                if item:
+                    item.setBackground(QColor("#e6f3ff"))  # 淡蓝色背景
+        else:  # 未选中状态
+            for col in range(self.prompt_table.columnCount()):
+                item = self.prompt_table.item(row, col)
+                if item:
+                    item.setBackground(QColor("#ffffff"))  # 白色背景
+        
+        # 更新批量优化按钮状态
+        self.update_batch_optimize_button()
+    
+    def create_progress_card(self, parent_layout):
+        """创建生成进度显示卡片"""
+        progress_card = QGroupBox("📊 生成进度")
+        progress_card.setStyleSheet("""
             QGroupBox {
                 font-weight: bold;
                 font-size: 18px;
                 color: #2c3e50;
                 border: 1px solid #e0e0e0;
-                border-radius: 12px;
-                margin: 12px 4px;
-                padding-top: 24px;
+                border-radius: 8px;
+                margin: 4px 0px;
+                padding-top: 12px;
                 background: qlineargradient(x1:0, y1:0, x2:0, y2:1,
-                    stop:0 #ffffff, stop:1 #fafafa);
+                    stop:0 #ffffff, stop:1 #f8f9fa);
+                max-height: 130px;
             }
             QGroupBox::title {
                 subcontrol-origin: margin;
                 subcontrol-position: top left;
-                left: 18px;
-                top: 10px;
-                background: qlineargradient(x1:0, y1:0, x2:0, y2:1,
-                    stop:0 #ffffff, stop:1 #f8f9fa);
-                padding: 4px 12px;
-                border-radius: 6px;
+                left: 16px;
+                top: 8px;
+                background-color: transparent;
                 color: #2c3e50;
             }
         """)
-        parent_layout.addWidget(main_card)
-        
-        layout = QVBoxLayout(main_card)
-        
-        # 元提示词区域已移至右上角
-        
-        # 现代化分组工具栏设计
-        toolbar_container = QFrame()
-        toolbar_container.setStyleSheet("""
-            QFrame {
-                background: qlineargradient(x1:0, y1:0, x2:0, y2:1,
-                    stop:0 #ffffff, stop:1 #f8f9fa);
-                border: 1px solid #e0e0e0;
-                border-radius: 12px;
-                padding: 20px;
-                margin: 8px 0px;
-            }
-        """)
-        
-        toolbar_layout = QHBoxLayout(toolbar_container)
-        toolbar_layout.setSpacing(12)  # 进一步减小组间距离
-        
-        # === 文件操作区 ===
-        file_group = self.create_button_group("文件操作", [
-            ("导入CSV", self.import_csv, "#2196F3"),
-            ("导出CSV", self.export_prompts_to_csv, "#2196F3")
-        ])
-        toolbar_layout.addWidget(file_group)
+        parent_layout.addWidget(progress_card)
         
-        # === 内容编辑区 ===
-        edit_group = self.create_button_group("内容编辑", [
-            ("添加", self.add_prompt, "#4CAF50"),
-            ("删除选中", self.delete_selected_prompts, "#F44336"),
-            ("清空", self.clear_prompts, "#F44336"),
-            ("清除参考图", self.clear_selected_reference_images, "#FF9800"),
-            ("全选", self.toggle_select_all, "#607D8B")
-        ])
-        toolbar_layout.addWidget(edit_group)
+        layout = QVBoxLayout(progress_card)
         
-        # === AI功能区 ===
-        ai_group = self.create_button_group("AI功能", [
-            ("文字替换", self.open_text_replace_dialog, "#FF9800"),
-            ("批量优化", self.batch_optimize_prompts, "#9C27B0")
-        ])
-        toolbar_layout.addWidget(ai_group)
+        # 进度信息
+        self.overall_progress_label = QLabel("等待开始...")
+        self.overall_progress_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.overall_progress_label.setStyleSheet("font-size: 16px; font-weight: bold; color: #333; padding: 4px;")
+        layout.addWidget(self.overall_progress_label)
         
-        # === 生成控制区 ===
-        generate_group = self.create_button_group("图片生成", [
-            ("智能生成", self.start_generation, "#4CAF50"),
-            ("重新生成", self.start_regenerate_all, "#FF5722")
-        ])
-        toolbar_layout.addWidget(generate_group)
+        self.overall_progress_bar = QProgressBar()
+        self.overall_progress_bar.setVisible(False)
+        layout.addWidget(self.overall_progress_bar)
         
-        # 存储按钮引用供后续使用 - 通过返回的按钮组获取
-        self.select_all_button = self.get_button_from_group(edit_group, "全选")
-        self.batch_optimize_button = self.get_button_from_group(ai_group, "批量优化") 
-        self.generate_button = self.get_button_from_group(generate_group, "智能生成")
-        self.regenerate_all_button = self.get_button_from_group(generate_group, "重新生成")
+        # 提示词统计
+        self.prompt_stats_label = QLabel("")
+        self.prompt_stats_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.prompt_stats_label.setStyleSheet("color: #888; font-size: 14px;")
+        layout.addWidget(self.prompt_stats_label)
         
-        button_layout = QHBoxLayout()
-        button_layout.addWidget(toolbar_container)
-        button_layout.addStretch()
+        # 生成统计（速度、成功率、耗时、预计完成时间、各平台情况）
+        self.generation_stats_label = QLabel("")
+        self.generation_stats_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.generation_stats_label.setStyleSheet("color: #555; font-size: 13px;")
+        self.generation_stats_label.setVisible(False)
+        layout.addWidget(self.generation_stats_label)
         
-        # 风格选择已移至左侧面板，此处删除
+        # 批次进行中定时刷新预计完成时间
+        self.generation_stats_timer = QTimer(self)
+        self.generation_stats_timer.setInterval(5000)
+        self.generation_stats_timer.timeout.connect(self.update_generation_stats_display)
+    
+    def open_settings(self):
+        """打开设置中心"""
+        dialog = SettingsDialog(self)
+        dialog.exec()
+    
+    def open_ai_settings(self):
+        """直接打开AI优化配置标签页"""
+        dialog = SettingsDialog(self)
+        # 切换到AI优化标签页 (索引3: 基础配置0, 风格库1, 参考图库2, AI优化3)
+        dialog.tab_widget.setCurrentIndex(3)
+        dialog.exec()
+    
+    def refresh_ui_after_settings(self):
+        """设置应用后刷新界面"""
+        try:
+            # 更新快捷状态显示
+            if hasattr(self, 'quick_status_label'):
+                save_status = "已设置" if self.save_path else "未设置"
+                self.quick_status_label.setText(f"API平台: {self.api_platform} | 线程: {self.thread_count} | 保存路径: {save_status}")
+            
+            # 更新生图模型显示
+            self.on_model_changed(self.image_model)
+            
+            # 更新API状态显示
+            if hasattr(self, 'api_status_label'):
+                api_key = self.get_current_api_key()
+                if api_key and api_key.strip():
+                    # 根据模型显示不同的emoji和颜色
+                    if self.image_model == "sora":
+                        model_emoji = "🌊"
+                        model_color = "#17a2b8"
+                    elif self.image_model == "nano-banana":
+                        model_emoji = "🍌" 
+                        model_color = "#fd7e14"
+                    else:
+                        model_emoji = "🤖"
+                        model_color = "#28a745"
+                    
+                    self.api_status_label.setText(f"{model_emoji} {self.image_model} 模型 | {self.api_platform} 平台")
+                    self.api_status_label.setStyleSheet(f"""
+                        QLabel {{
+                            color: #ffffff; 
+                            font-size: 14px; 
+                            font-weight: bold;
+                            padding: 8px 14px;
+                            background-color: {model_color};
+                            border: 2px solid rgba(255, 255, 255, 0.3);
+                            border-radius: 8px;
+                            margin-right: 10px;
+                        }}
+                    """)
+                else:
+                    self.api_status_label.setText("❌ API未配置")
+                    self.api_status_label.setStyleSheet("""
+                        QLabel {
+                            color: #dc3545; 
+                            font-size: 14px; 
+                            padding: 8px 14px;
+                            background-color: #f8d7da;
+                            border: 1px solid #f5c6cb;
+                            border-radius: 6px;
+                            margin-right: 10px;
+                        }
+                    """)
+            
+            # 更新AI优化显示
+            if hasattr(self, 'update_ai_optimization_display'):
+                self.update_ai_optimization_display()
+            
+            # 刷新主界面的风格选择下拉框
+            if hasattr(self, 'main_style_combo') and hasattr(self, 'refresh_main_style_combo'):
+                self.refresh_main_style_combo()
+            
+            # 按设置启动/停止指标接口
+            self.update_metrics_server()
+                
+        except Exception as e:
+            # 如果UI刷新失败，记录但不影响程序运行
+            print(f"UI刷新失败: {e}")
+            pass
+    
+    def update_metrics_server(self):
+        """根据指标端口设置启动、重启或停止 /metrics 接口（环境变量 SORA_METRICS_PORT 优先）"""
+        port = int(os.environ.get('SORA_METRICS_PORT', self.metrics_port) or 0)
+        host = self.metrics_host or '127.0.0.1'
+        server = self.metrics_server
+        if server and (server.port, server.host) == (port, host):
+            return
+        if server:
+            server.stop()
+            self.metrics_server = None
+        if port <= 0:
+            return
+        try:
+            self.metrics_server = MetricsServer(host, port)
+            self.metrics_server.start()
+        except OSError as e:
+            logging.error(f"指标接口启动失败 ({host}:{port}): {str(e)}")
+    
+    def toggle_profiling(self, enabled):
+        """开启/结束性能分析，结束时保存结果"""
+        if enabled:
+            start_profiling()
+            self.last_stall_check = time.perf_counter()
+            self.profile_stall_timer = QTimer(self)
+            self.profile_stall_timer.timeout.connect(self.check_event_loop_stall)
+            self.profile_stall_timer.start(STALL_CHECK_INTERVAL_MS)
+            self.profile_button.setText("⏺ 分析中")
+            return
         
-        # 底部信息栏
-        info_layout = QHBoxLayout()
+        if self.profile_stall_timer:
+            self.profile_stall_timer.stop()
+            self.profile_stall_timer = None
+        self.profile_button.setText("性能分析")
+        try:
+            output_dir = stop_profiling()
+        except Exception as e:
+            logging.error(f"保存性能分析结果失败: {str(e)}")
+            QMessageBox.warning(self, "性能分析", f"保存性能分析结果失败：{str(e)}")
+            return
+        if output_dir:
+            QMessageBox.information(self, "性能分析", f"分析结果已保存到：\n{output_dir}\n\n"
+                                    "profile.pstats 可用 snakeviz 查看，stacks.folded 可用 flamegraph.pl 或 speedscope 生成火焰图，"
+                                    "summary.json 包含各函数耗时和界面卡顿记录。")
+    
+    def check_event_loop_stall(self):
+        """计时器触发时间比预期晚得多，说明界面线程被占用"""
+        now = time.perf_counter()
+        delay_ms = (now - self.last_stall_check) * 1000 - STALL_CHECK_INTERVAL_MS
+        self.last_stall_check = now
+        session = PROFILER
+        if session and delay_ms >= STALL_THRESHOLD_MS:
+            session.record_stall(delay_ms)
+            logging.debug(f"界面卡顿 {delay_ms:.0f}ms")
+    
+    def update_ai_optimization_display(self):
+        """更新AI优化显示信息"""
+        try:
+            if hasattr(self, 'current_meta_prompt_label') and hasattr(self, 'ai_status_label'):
+                # 更新AI模型显示
+                if hasattr(self, 'current_model_label'):
+                    if self.openrouter_api_key.strip():
+                        # 显示模型名称（简化显示）
+                        model_display = self.ai_model.split('/')[-1] if '/' in self.ai_model else self.ai_model
+                        self.current_model_label.setText(model_display)
+                    else:
+                        self.current_model_label.setText("未设置")
+                
+                # 更新元提示词显示（显示更多内容）
+                if self.meta_prompt.strip():
+                    # 显示前80个字符，保持关键信息
+                    preview_text = self.meta_prompt.strip()[:80] + "..." if len(self.meta_prompt.strip()) > 80 else self.meta_prompt.strip()
+                    self.current_meta_prompt_label.setText(preview_text)
+                else:
+                    self.current_meta_prompt_label.setText("尚未设置")
+                
+                # 更新AI状态显示
+                if self.openrouter_api_key.strip():
+                    self.ai_status_label.setText(f"AI优化: 已配置 ({self.ai_model})")
+                    self.ai_status_label.setStyleSheet("color: #4caf50; font-size: 14px;")
+                else:
+                    self.ai_status_label.setText("AI优化: 未配置")
+                    self.ai_status_label.setStyleSheet("color: #666; font-size: 14px;")
+                    
+            # 刷新提示词表格中的AI优化按钮状态
+            if hasattr(self, 'refresh_prompt_table'):
+                self.refresh_prompt_table()
+        except Exception as e:
+            # 如果AI优化显示更新失败，记录但不影响程序运行
+            print(f"AI优化显示更新失败: {e}")
+            pass
+    
+    def import_prompt_file(self):
+        """导入提示词表格（CSV/xlsx/parquet/JSONL，后台流式解析，逐批追加到表格）"""
+        if self.prompt_import_cancel is not None:
+            QMessageBox.information(self, "提示", "正在导入，请等待完成或取消后再试")
+            return
         
-        # 使用提示
-        usage_hint = QLabel("💡 双击提示词可编辑")
-        usage_hint.setStyleSheet("""
-            QLabel {
-                color: #6c757d; 
-                font-size: 14px; 
-                font-style: italic;
-                padding: 6px 10px;
-                background-color: #f8f9fa;
-                border-radius: 4px;
-            }
-        """)
-        info_layout.addWidget(usage_hint)
+        file_path, _ = QFileDialog.getOpenFileName(
+            self,
+            "选择提示词表格",
+            "",
+            PROMPT_FILE_FILTER
+        )
         
-        info_layout.addStretch()
+        if file_path:
+            try:
+                columns = read_prompt_file_columns(file_path)
+            except ValueError as e:
+                QMessageBox.critical(self, "错误", str(e))
+                return
+            except Exception as e:
+                QMessageBox.critical(self, "错误", f"导入文件失败: {str(e)}")
+                return
+            
+            column_map = dict(self.import_column_map)
+            resolved = resolve_prompt_columns(columns, column_map)
+            if 'prompt' not in resolved:
+                if not columns:
+                    QMessageBox.critical(self, "错误", "文件中没有找到'分镜提示词'列")
+                    return
+                dialog = ColumnMappingDialog(columns, resolved, self)
+                if dialog.exec() != QDialog.DialogCode.Accepted:
+                    return
+                chosen = dialog.get_mapping()
+                if 'prompt' not in chosen:
+                    QMessageBox.warning(self, "提示", "请选择分镜提示词对应的列")
+                    return
+                # 记住团队表格的列名，下次自动识别
+                self.import_column_map.update(chosen)
+                self.save_config()
+                column_map = dict(self.import_column_map)
+            
+            self.prompt_import_cancel = threading.Event()
+            self.prompt_import_started = False
+            
+            self.prompt_import_progress = QProgressDialog("正在导入...", "取消", 0, 1000, self)
+            self.prompt_import_progress.setWindowTitle("导入提示词")
+            self.prompt_import_progress.setWindowModality(Qt.WindowModality.WindowModal)
+            self.prompt_import_progress.setMinimumDuration(300)
+            self.prompt_import_progress.setAutoClose(False)
+            self.prompt_import_progress.setAutoReset(False)
+            self.prompt_import_progress.canceled.connect(self.prompt_import_cancel.set)
+            
+            worker = PromptImportWorker(file_path, column_map, self.prompt_import_cancel)
+            worker.signals.chunk.connect(self.on_prompt_import_chunk)
+            worker.signals.finished.connect(self.on_prompt_import_finished)
+            worker.signals.error.connect(self.on_prompt_import_error)
+            # 与下载共用线程池，不占用生图并发
+            self.download_threadpool.start(worker)
+    
+    def on_prompt_import_chunk(self, rows, progress):
+        """收到一批解析好的提示词"""
+        if self.prompt_import_cancel is None or self.prompt_import_cancel.is_set():
+            return
+        if not self.prompt_import_started:
+            # 文件格式确认无误后才清空现有数据
+            self.prompt_import_started = True
+            self.prompt_table_data.clear()
+            self.prompt_numbers.clear()
+            self.refresh_prompt_table()
         
-        # 统计信息
-        self.prompt_stats_label = QLabel("总计: 0 个提示词")
-        self.prompt_stats_label.setStyleSheet("""
-            QLabel {
-                color: #495057; 
-                font-size: 16px;
-                font-weight: 600;
-                padding: 8px 14px;
-                background-color: #e9ecef;
-                border-radius: 6px;
+        new_rows = []
+        for row in rows:
+            data = {
+                'number': row['number'],
+                'prompt': row['prompt'],
+                'status': '等待中',
+                'image_url': row.get('image_url', ''),
+                'error_msg': row.get('error_msg', ''),
+                'reference_images': row.get('reference_images', [])  # 改为支持多张参考图片的列表
             }
-        """)
-        info_layout.addWidget(self.prompt_stats_label)
+            # 导出过的表格带回生成状态和文件名，成功行可直接显示本地缩略图
+            if row.get('status') in PROMPT_IMPORT_STATUSES:
+                data['status'] = row['status']
+            if row.get('filename'):
+                data['filename'] = row['filename']
+            new_rows.append(data)
+        self.append_prompt_rows(new_rows)
+        self.update_prompt_stats()
+        self.prompt_import_progress.setLabelText(f"正在导入... 已读取 {len(self.prompt_table_data)} 个提示词")
+        # 模态进度框的 setValue 会处理事件，可能先收到结束信号，放在最后
+        self.prompt_import_progress.setValue(int(progress * 1000))
+    
+    def on_prompt_import_finished(self, total, cancelled):
+        """导入结束"""
+        started = self.prompt_import_started
+        # 解析可能已先于取消完成，此时后续批次已被丢弃
+        cancelled = cancelled or self.prompt_import_cancel.is_set()
+        self.finish_prompt_import()
+        if cancelled:
+            if started:
+                QMessageBox.information(self, "已取消", f"已取消导入，保留已读取的 {len(self.prompt_table_data)} 个提示词")
+            return
+        if not started:
+            # 没有任何有效行，与之前一样清空列表
+            self.prompt_table_data.clear()
+            self.prompt_numbers.clear()
+            self.refresh_prompt_table()
+        self.update_prompt_stats()
+        QMessageBox.information(self, "成功", f"成功导入 {len(self.prompt_table_data)} 个提示词")
+    
+    def on_prompt_import_error(self, error):
+        """导入失败（已追加的行保留）"""
+        self.finish_prompt_import()
+        QMessageBox.critical(self, "错误", error)
+    
+    def finish_prompt_import(self):
+        self.prompt_import_cancel = None
+        self.prompt_import_progress.close()
+        self.prompt_import_progress.deleteLater()
+        self.prompt_import_progress = None
+    
+    def clear_prompts(self):
+        """清空导入的提示词列表"""
+        self.prompt_table_data.clear()
+        self.prompt_numbers.clear()
+        self.refresh_prompt_table()
+        self.update_prompt_stats()
+        QMessageBox.information(self, "完成", "已清空所有提示词")
+    
+    def export_prompt_file(self):
+        """导出提示词表格（按扩展名选择 CSV/xlsx/parquet/JSONL，含状态、文件名和图片URL）"""
+        if not self.prompt_table_data:
+            QMessageBox.warning(self, "提示", "没有可导出的提示词数据")
+            return
         
-        button_layout.addLayout(info_layout)
+        # 选择保存路径
+        file_path, selected_filter = QFileDialog.getSaveFileName(
+            self,
+            "导出提示词",
+            f"sora_prompts_{time.strftime('%Y%m%d_%H%M%S')}.csv",
+            PROMPT_FILE_FILTER
+        )
         
-        layout.addLayout(button_layout)
+        if file_path:
+            # 没有写扩展名时按选择的格式补上
+            if Path(file_path).suffix.lower() not in PROMPT_FILE_READERS:
+                match = re.search(r'\(\*(\.\w+)\)', selected_filter)
+                file_path += match.group(1) if match else '.csv'
+            try:
+                write_prompt_file(file_path, self.prompt_table_data)
+                
+                QMessageBox.information(self, "导出成功", 
+                    f"已成功导出 {len(self.prompt_table_data)} 个提示词到:\n{file_path}")
+                
+            except Exception as e:
+                QMessageBox.critical(self, "导出失败", f"导出过程中出现错误: {str(e)}")
+    
+    def open_text_replace_dialog(self):
+        """打开文字替换对话框"""
+        if not self.prompt_table_data:
+            QMessageBox.warning(self, "提示", "没有提示词数据，请先添加提示词或导入CSV文件")
+            return
         
-        # 提示词表格（支持拖拽）
-        self.prompt_table = DragDropTableWidget()
-        self.prompt_table.set_main_window(self)
-        self.prompt_table.setColumnCount(8)
-        self.prompt_table.setHorizontalHeaderLabels(["选择", "编号", "提示词", "参考图", "图库", "生成状态/图片", "AI优化", "单独生成"])
+        dialog = TextReplaceDialog(self)
         
-        # 设置表格属性
-        self.prompt_table.setAlternatingRowColors(False)  # 禁用斑马纹，全部白色背景
-        self.prompt_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)  # 整行选择
+        if dialog.exec() == QDialog.DialogCode.Accepted:
+            replacement_data = dialog.get_replacement_data()
+            find_text = replacement_data['find_text']
+            replace_text = replacement_data['replace_text']
+            
+            if not find_text:
+                QMessageBox.warning(self, "提示", "请输入要查找的文字")
+                return
+            
+            # 执行替换
+            replaced_count = 0
+            for data in self.prompt_table_data:
+                if find_text in data['prompt']:
+                    data['prompt'] = data['prompt'].replace(find_text, replace_text)
+                    replaced_count += 1
+            
+            if replaced_count > 0:
+                # 刷新表格显示
+                self.refresh_prompt_table()
+                QMessageBox.information(self, "替换完成", 
+                    f"成功替换了 {replaced_count} 个提示词中的文字")
+            else:
+                QMessageBox.information(self, "替换完成", "未找到匹配的文字，没有进行替换")
+    
+    def open_gallery_dialog(self, row):
+        """打开图库选择对话框"""
+        if not self.category_links:
+            QMessageBox.warning(self, "提示", "图库为空，请先在设置中心配置参考图库")
+            return
         
-        # 启用拖拽功能
-        self.prompt_table.setAcceptDrops(True)
-        self.prompt_table.setDragDropMode(QAbstractItemView.DragDropMode.DropOnly)
-        self.prompt_table.setDefaultDropAction(Qt.DropAction.CopyAction)
+        if 0 <= row < len(self.prompt_table_data):
+            # 清理无效的编辑器引用
+            self.clean_inactive_editors()
+            
+            dialog = GallerySelectionDialog(self.category_links, self)
+            
+            if dialog.exec() == QDialog.DialogCode.Accepted:
+                selected_image = dialog.get_selected_image()
+                if selected_image:
+                    # 如果是字典，获取name字段；如果是字符串，直接使用
+                    if isinstance(selected_image, dict):
+                        image_name_raw = selected_image.get('name', selected_image)
+                    else:
+                        image_name_raw = selected_image
+                    
+                    # 用「」框起来
+                    image_name = f"「{image_name_raw}」"
+                    
+                    # 现在所有提示词都有持续活跃的编辑器，直接插入
+                    if row in self.active_editors:
+                        editor = self.active_editors[row]
+                        try:
+                            if isinstance(editor, QLineEdit):
+                                cursor_pos = editor.cursorPosition()
+                                current_text = editor.text()
+                                new_text = current_text[:cursor_pos] + image_name + current_text[cursor_pos:]
+                                editor.setText(new_text)
+                                # 移动光标到插入文本之后
+                                new_cursor_pos = cursor_pos + len(image_name)
+                                editor.setCursorPosition(new_cursor_pos)
+                                # 确保焦点在这个编辑器上
+                                editor.setFocus()
+                                self.focused_row = row
+                                return
+                            elif isinstance(editor, QPlainTextEdit):
+                                cursor = editor.textCursor()
+                                cursor_pos = cursor.position()
+                                # 使用insertText方法保持撤销历史
+                                cursor.insertText(image_name)
+                                editor.setTextCursor(cursor)
+                                # 确保焦点在这个编辑器上
+                                editor.setFocus()
+                                self.focused_row = row
+                                return
+                        except (RuntimeError, AttributeError):
+                            # 编辑器已被删除或不可用，从活跃编辑器列表中移除
+                            if row in self.active_editors:
+                                del self.active_editors[row]
+                    
+                    # 如果编辑器不可用，作为后备方案更新数据模型
+                    current_prompt = self.prompt_table_data[row]['prompt']
+                    cursor_pos = self.get_smart_cursor_position(row)
+                    cursor_pos = min(cursor_pos, len(current_prompt))
+                    new_prompt = current_prompt[:cursor_pos] + image_name + current_prompt[cursor_pos:]
+                    self.prompt_table_data[row]['prompt'] = new_prompt
+                    # 重建编辑器
+                    prompt_editor = self.create_prompt_editor(new_prompt, row)
+                    self.prompt_table.setCellWidget(row, 2, prompt_editor)
+                    # 设置光标到插入位置之后
+                    new_cursor_pos = cursor_pos + len(image_name)
+                    if isinstance(prompt_editor, QLineEdit):
+                        prompt_editor.setCursorPosition(new_cursor_pos)
+                    else:
+                        cursor = prompt_editor.textCursor()
+                        cursor.setPosition(new_cursor_pos)
+                        prompt_editor.setTextCursor(cursor)
+                    prompt_editor.setFocus()
+    
+    def record_cursor_position(self, row, position):
+        """记录指定行的光标位置"""
+        if row >= 0 and position >= 0:
+            self.cursor_positions[row] = position
+    
+    def set_active_editor(self, row, editor):
+        """设置当前活跃的编辑器"""
+        self.active_editors[row] = editor
         
-        # 现代化表格样式
-        self.prompt_table.setStyleSheet("""
-            QTableWidget {
-                background-color: #ffffff;
-                border: 1px solid #e0e0e0;
-                border-radius: 8px;
-                gridline-color: #f0f0f0;
-                selection-background-color: #e3f2fd;
-                alternate-background-color: #f8f9fa;
-            }
-            QTableWidget::item {
-                padding: 8px;
-                border-bottom: 1px solid #f5f5f5;
-                border-right: 1px solid #f5f5f5;
-            }
-            QTableWidget::item:selected {
-                background-color: #cce7ff;
-                color: #0056b3;
-                border: 2px solid #007bff;
-                font-weight: 600;
-            }
-            QTableWidget::item:hover {
-                background-color: #f0f8ff;
-                border: 1px solid #b3d9ff;
-            }
-            QTableWidget::item:focus {
-                background-color: #e6f3ff;
-                border: 2px solid #007bff;
-                outline: none;
-            }
-            QHeaderView::section {
-                background: qlineargradient(x1:0, y1:0, x2:0, y2:1,
-                    stop:0 #f8f9fa, stop:1 #e9ecef);
-                color: #495057;
-                padding: 12px 8px;
-                border: none;
-                border-right: 1px solid #dee2e6;
-                border-bottom: 1px solid #dee2e6;
-                font-weight: 600;
-                font-size: 16px;
-            }
-            QHeaderView::section:first {
-                border-top-left-radius: 8px;
-            }
-            QHeaderView::section:last {
-                border-top-right-radius: 8px;
-                border-right: none;
-            }
-            QHeaderView::section:hover {
-                background: qlineargradient(x1:0, y1:0, x2:0, y2:1,
-                    stop:0 #e9ecef, stop:1 #dee2e6);
-            }
-        """)
-        # 允许多种编辑触发方式：双击、单击、F2键
-        self.prompt_table.setEditTriggers(
-            QAbstractItemView.EditTrigger.DoubleClicked | 
-            QAbstractItemView.EditTrigger.EditKeyPressed |
-            QAbstractItemView.EditTrigger.SelectedClicked
-        )
+    def clean_inactive_editors(self):
+        """清理无效的编辑器引用"""
+        to_remove = []
+        for row, editor in self.active_editors.items():
+            try:
+                # 尝试访问编辑器的一个属性来测试是否还有效
+                if isinstance(editor, QLineEdit):
+                    _ = editor.text()
+                elif isinstance(editor, QPlainTextEdit):
+                    _ = editor.toPlainText()
+            except (RuntimeError, AttributeError):
+                to_remove.append(row)
+        
+        for row in to_remove:
+            del self.active_editors[row]
+    
+    def get_current_cursor_position(self, row):
+        """获取指定行的当前光标位置"""
+        # 优先从活跃编辑器获取实时光标位置
+        if row in self.active_editors:
+            editor = self.active_editors[row]
+            try:
+                if isinstance(editor, QLineEdit):
+                    return editor.cursorPosition()
+                elif isinstance(editor, QPlainTextEdit):
+                    return editor.textCursor().position()
+            except (RuntimeError, AttributeError):
+                # 编辑器已无效，清理并使用记录的位置
+                if row in self.active_editors:
+                    del self.active_editors[row]
         
-        # 设置表格图标尺寸（重要：这决定了缩略图在表格中的显示大小）
-        self.prompt_table.setIconSize(QSize(180, 180))
+        # 如果没有活跃编辑器，使用记录的位置
+        return self.cursor_positions.get(row, 0)
         
+    def get_smart_cursor_position(self, row):
+        """获取智能光标位置 - 专为图片插入优化"""
+        # 如果当前行正是焦点行，尝试从活跃编辑器获取最新位置
+        if row == self.focused_row and row in self.active_editors:
+            editor = self.active_editors[row]
+            try:
+                if isinstance(editor, QLineEdit):
+                    pos = editor.cursorPosition()
+                    # 更新记录的位置
+                    self.cursor_positions[row] = pos
+                    return pos
+                elif isinstance(editor, QPlainTextEdit):
+                    pos = editor.textCursor().position()
+                    # 更新记录的位置
+                    self.cursor_positions[row] = pos
+                    return pos
+            except (RuntimeError, AttributeError):
+                # 编辑器已无效，清理
+                if row in self.active_editors:
+                    del self.active_editors[row]
         
-        # 设置列宽
-        header = self.prompt_table.horizontalHeader()
-        header.setSectionResizeMode(0, QHeaderView.ResizeMode.Fixed)  # 选择列固定宽度
-        header.setSectionResizeMode(1, QHeaderView.ResizeMode.Fixed)  # 编号列固定宽度
-        header.setSectionResizeMode(2, QHeaderView.ResizeMode.Stretch)  # 提示词列自适应
-        header.setSectionResizeMode(3, QHeaderView.ResizeMode.Fixed)  # 参考图列固定宽度
-        header.setSectionResizeMode(4, QHeaderView.ResizeMode.Fixed)  # 图库列固定宽度
-        header.setSectionResizeMode(5, QHeaderView.ResizeMode.Fixed)  # 生成状态/图片列固定宽度
-        header.setSectionResizeMode(6, QHeaderView.ResizeMode.Fixed)  # AI优化列固定宽度
-        header.setSectionResizeMode(7, QHeaderView.ResizeMode.Fixed)  # 单独生成列固定宽度
+        # 使用记录的位置，如果没有记录则使用文本末尾
+        if row < len(self.prompt_table_data):
+            text_length = len(self.prompt_table_data[row]['prompt'])
+            return self.cursor_positions.get(row, text_length)
         
-        self.prompt_table.setColumnWidth(0, 60)   # 选择列
-        self.prompt_table.setColumnWidth(1, 70)   # 编号列
-        self.prompt_table.setColumnWidth(3, 100)  # 参考图列
-        self.prompt_table.setColumnWidth(4, 90)   # 图库列（缩小）
-        self.prompt_table.setColumnWidth(5, 200)  # 生成状态/图片列（合并后加宽）
-        self.prompt_table.setColumnWidth(6, 90)   # AI优化列
-        self.prompt_table.setColumnWidth(7, 90)   # 单独生成列
+        return 0
+    
+    def create_prompt_editor(self, text, row):
+        """创建提示词的内嵌编辑器"""
+        # 统一使用QPlainTextEdit，支持自动换行和滚动
+        editor = QPlainTextEdit()
+        editor.setPlainText(text)
         
-        # 设置行高自适应内容
-        self.prompt_table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
-        self.prompt_table.verticalHeader().setMinimumSectionSize(230)  # 设置最小行高为230像素
+        # 应用所有样式和设置
+        self.apply_editor_settings(editor)
         
-        # 隐藏行号，避免与编号列混淆
-        self.prompt_table.verticalHeader().setVisible(False)
+        # 连接信号处理文本变化
+        def handle_text_change(r=row, e=editor):
+            self.on_prompt_text_changed(r, e.toPlainText())
+        def handle_cursor_change(r=row, e=editor):
+            self.on_cursor_position_changed(r, e.textCursor().position())
         
-        # 设置文本换行
-        self.prompt_table.setWordWrap(True)
+        editor.textChanged.connect(handle_text_change)
+        editor.cursorPositionChanged.connect(handle_cursor_change)
         
-        # 设置自定义委托
-        self.table_delegate = PromptTableDelegate(main_window=self)
-        self.prompt_table.setItemDelegate(self.table_delegate)
+        # 添加动态高度调整
+        def adjust_height():
+            self.adjust_editor_height(editor)
+        editor.textChanged.connect(adjust_height)
         
-        # 连接信号（提示词列现在使用内嵌编辑器，不需要cellChanged）
-        self.prompt_table.cellDoubleClicked.connect(self.on_table_cell_double_clicked)
-        self.prompt_table.cellClicked.connect(self.on_table_cell_clicked)
+        # 初始调整高度
+        self.adjust_editor_height(editor)
         
-        layout.addWidget(self.prompt_table)
+        # 注册为活跃编辑器
+        self.active_editors[row] = editor
+        
+        return editor
     
-    def on_checkbox_changed(self, state, row):
-        """处理复选框状态变化"""
+    def apply_editor_settings(self, editor):
+        """应用编辑器的样式和设置"""
+        if not isinstance(editor, QPlainTextEdit):
+            return
         
-        # 更新行的背景色
-        if state == 2:  # 选中状态
-            for col in range(self.prompt_table.columnCount()):
-                item = self.prompt_table.item(row, col)
-                if item:
-                    item.setBackground(QColor("#e6f3ff"))  # 淡蓝色背景
-        else:  # 未选中状态
-            for col in range(self.prompt_table.columnCount()):
-                item = self.prompt_table.item(row, col)
-                if item:
-                    item.setBackground(QColor("#ffffff"))  # 白色背景
+        # 设置自动换行
+        editor.setWordWrapMode(QTextOption.WrapMode.WrapAtWordBoundaryOrAnywhere)
+        editor.setLineWrapMode(QPlainTextEdit.LineWrapMode.WidgetWidth)
         
-        # 更新批量优化按钮状态
-        self.update_batch_optimize_button()
-    
-    def create_progress_card(self, parent_layout):
-        """创建生成进度显示卡片"""
-        progress_card = QGroupBox("📊 生成进度")
-        progress_card.setStyleSheet("""
-            QGroupBox {
-                font-weight: bold;
-                font-size: 18px;
-                color: #2c3e50;
-                border: 1px solid #e0e0e0;
-                border-radius: 8px;
-                margin: 4px 0px;
-                padding-top: 12px;
-                background: qlineargradient(x1:0, y1:0, x2:0, y2:1,
-                    stop:0 #ffffff, stop:1 #f8f9fa);
-                max-height: 80px;
+        # 设置尺寸策略 - 让编辑器填满整个单元格
+        editor.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
+        
+        # 确保编辑器占用全部可用宽度
+        editor.setMinimumWidth(200)
+        editor.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        
+        # 设置文档边距为0，让文本填充到边沿
+        editor.document().setDocumentMargin(0)
+        editor.setContentsMargins(0, 0, 0, 0)
+        
+        # 设置视口边距为0
+        editor.setViewportMargins(0, 0, 0, 0)
+        
+        # 获取文档并设置更详细的边距控制
+        doc = editor.document()
+        doc.setDocumentMargin(0)
+        
+        # 设置文本光标边距
+        editor.setCursorWidth(1)
+        
+        # 设置合理的高度范围
+        editor.setMinimumHeight(200)  # 调整最小高度到200像素
+        editor.setMaximumHeight(450)
+        
+        # 应用样式
+        editor.setStyleSheet("""
+            QPlainTextEdit {
+                border: 1px solid #ddd;
+                border-radius: 4px;
+                padding: 0px !important;
+                margin: 0px !important;
+                background-color: white;
+                font-size: 20px;
+                line-height: 1.2;
+                font-weight: 500;
+                font-family: 'Microsoft YaHei', 'Segoe UI', Arial, sans-serif;
+                width: 100%;
+                min-width: 100%;
+                padding-top: 0px !important;
+                padding-bottom: 0px !important;
+                padding-left: 0px !important;
+                padding-right: 0px !important;
+                selection-background-color: #3399ff;
             }
-            QGroupBox::title {
-                subcontrol-origin: margin;
-                subcontrol-position: top left;
-                left: 16px;
-                top: 8px;
-                background-color: transparent;
-                color: #2c3e50;
+            QPlainTextEdit:focus {
+                border: 2px solid #1976d2;
+                background-color: #fafafa;
+                padding: 0px !important;
+                margin: 0px !important;
+            }
+            QPlainTextEdit QScrollArea {
+                padding: 0px !important;
+                margin: 0px !important;
+            }
+            QPlainTextEdit QAbstractScrollArea {
+                padding: 0px !important;
+                margin: 0px !important;
+            }
+            QScrollBar:vertical {
+                background: #f0f0f0;
+                width: 12px;
+                border-radius: 6px;
+                margin: 0px;
+            }
+            QScrollBar::handle:vertical {
+                background: #c0c0c0;
+                border-radius: 6px;
+                min-height: 20px;
+                margin: 2px;
+            }
+            QScrollBar::handle:vertical:hover {
+                background: #a0a0a0;
+            }
+            QScrollBar::add-line, QScrollBar::sub-line {
+                border: none;
+                background: none;
             }
         """)
-        parent_layout.addWidget(progress_card)
-        
-        layout = QVBoxLayout(progress_card)
-        
-        # 进度信息
-        self.overall_progress_label = QLabel("等待开始...")
-        self.overall_progress_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.overall_progress_label.setStyleSheet("font-size: 16px; font-weight: bold; color: #333; padding: 4px;")
-        layout.addWidget(self.overall_progress_label)
         
-        self.overall_progress_bar = QProgressBar()
-        self.overall_progress_bar.setVisible(False)
-        layout.addWidget(self.overall_progress_bar)
+        # 强制刷新样式和布局
+        editor.update()
+        editor.repaint()
         
-        # 提示词统计
-        self.prompt_stats_label = QLabel("")
-        self.prompt_stats_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.prompt_stats_label.setStyleSheet("color: #888; font-size: 14px;")
-        layout.addWidget(self.prompt_stats_label)
-    
-    def open_settings(self):
-        """打开设置中心"""
-        dialog = SettingsDialog(self)
-        dialog.exec()
-    
-    def open_ai_settings(self):
-        """直接打开AI优化配置标签页"""
-        dialog = SettingsDialog(self)
-        # 切换到AI优化标签页 (索引3: 基础配置0, 风格库1, 参考图库2, AI优化3)
-        dialog.tab_widget.setCurrentIndex(3)
-        dialog.exec()
+        # 调整高度
+        self.adjust_editor_height(editor)
     
-    def refresh_ui_after_settings(self):
-        """设置应用后刷新界面"""
+    def adjust_editor_height(self, editor):
+        """根据内容动态调整编辑器高度"""
+        if not isinstance(editor, QPlainTextEdit):
+            return
+        
         try:
-            # 更新快捷状态显示
-            if hasattr(self, 'quick_status_label'):
-                save_status = "已设置" if self.save_path else "未设置"
-                self.quick_status_label.setText(f"API平台: {self.api_platform} | 线程: {self.thread_count} | 保存路径: {save_status}")
+            # 获取文档高度
+            doc = editor.document()
+            doc_height = doc.size().height()
             
-            # 更新生图模型显示
-            self.on_model_changed(self.image_model)
+            # 计算需要的高度（不加任何边距，让文本充满到边沿）
+            border_width = 2  # 边框宽度
+            needed_height = int(doc_height + border_width)
             
-            # 更新API状态显示
-            if hasattr(self, 'api_status_label'):
-                api_key = self.get_current_api_key()
-                if api_key and api_key.strip():
-                    # 根据模型显示不同的emoji和颜色
-                    if self.image_model == "sora":
-                        model_emoji = "🌊"
-                        model_color = "#17a2b8"
-                    elif self.image_model == "nano-banana":
-                        model_emoji = "🍌" 
-                        model_color = "#fd7e14"
-                    else:
-                        model_emoji = "🤖"
-                        model_color = "#28a745"
-                    
-                    self.api_status_label.setText(f"{model_emoji} {self.image_model} 模型 | {self.api_platform} 平台")
-                    self.api_status_label.setStyleSheet(f"""
-                        QLabel {{
-                            color: #ffffff; 
-                            font-size: 14px; 
-                            font-weight: bold;
-                            padding: 8px 14px;
-                            background-color: {model_color};
-                            border: 2px solid rgba(255, 255, 255, 0.3);
-                            border-radius: 8px;
-                            margin-right: 10px;
-                        }}
-                    """)
-                else:
-                    self.api_status_label.setText("❌ API未配置")
-                    self.api_status_label.setStyleSheet("""
-                        QLabel {
-                            color: #dc3545; 
-                            font-size: 14px; 
-                            padding: 8px 14px;
-                            background-color: #f8d7da;
-                            border: 1px solid #f5c6cb;
-                            border-radius: 6px;
-                            margin-right: 10px;
-                        }
-                    """)
+            # 限制在最小和最大高度之间，但确保文本能完全显示
+            min_height = max(200, needed_height)   # 最小高度至少要能显示完整文本
+            max_height = 450  # 最大高度
+            new_height = min(max_height, min_height)
             
-            # 更新AI优化显示
-            if hasattr(self, 'update_ai_optimization_display'):
-                self.update_ai_optimization_display()
+            editor.setFixedHeight(new_height)
             
-            # 刷新主界面的风格选择下拉框
-            if hasattr(self, 'main_style_combo') and hasattr(self, 'refresh_main_style_combo'):
-                self.refresh_main_style_combo()
-                
         except Exception as e:
-            # 如果UI刷新失败，记录但不影响程序运行
-            print(f"UI刷新失败: {e}")
-            pass
+            # 如果出错，使用默认高度
+            editor.setFixedHeight(100)
     
-    def update_ai_optimization_display(self):
-        """更新AI优化显示信息"""
-        try:
-            if hasattr(self, 'current_meta_prompt_label') and hasattr(self, 'ai_status_label'):
-                # 更新AI模型显示
-                if hasattr(self, 'current_model_label'):
-                    if self.openrouter_api_key.strip():
-                        # 显示模型名称（简化显示）
-                        model_display = self.ai_model.split('/')[-1] if '/' in self.ai_model else self.ai_model
-                        self.current_model_label.setText(model_display)
-                    else:
-                        self.current_model_label.setText("未设置")
-                
-                # 更新元提示词显示（显示更多内容）
-                if self.meta_prompt.strip():
-                    # 显示前80个字符，保持关键信息
-                    preview_text = self.meta_prompt.strip()[:80] + "..." if len(self.meta_prompt.strip()) > 80 else self.meta_prompt.strip()
-                    self.current_meta_prompt_label.setText(preview_text)
-                else:
-                    self.current_meta_prompt_label.setText("尚未设置")
-                
-                # 更新AI状态显示
-                if self.openrouter_api_key.strip():
-                    self.ai_status_label.setText(f"AI优化: 已配置 ({self.ai_model})")
-                    self.ai_status_label.setStyleSheet("color: #4caf50; font-size: 14px;")
-                else:
-                    self.ai_status_label.setText("AI优化: 未配置")
-                    self.ai_status_label.setStyleSheet("color: #666; font-size: 14px;")
-                    
-            # 刷新提示词表格中的AI优化按钮状态
-            if hasattr(self, 'refresh_prompt_table'):
-                self.refresh_prompt_table()
-        except Exception as e:
-            # 如果AI优化显示更新失败，记录但不影响程序运行
-            print(f"AI优化显示更新失败: {e}")
-            pass
+    def on_prompt_text_changed(self, row, text):
+        """提示词文本改变时的处理"""
+        if 0 <= row < len(self.prompt_table_data):
+            self.prompt_table_data[row]['prompt'] = text
     
-    def import_csv(self):
-        """导入CSV文件"""
-        file_path, _ = QFileDialog.getOpenFileName(
-            self,
-            "选择CSV文件",
-            "",
-            "CSV Files (*.csv)"
-        )
-        
-        if file_path:
-            try:
-                # 尝试不同的编码方式读取CSV文件
-                encodings = ['utf-8', 'gbk', 'gb2312', 'gb18030']
-                df = None
-                
-                for encoding in encodings:
-                    try:
-                        df = pd.read_csv(file_path, encoding=encoding)
-                        break
-                    except UnicodeDecodeError:
-                        continue
-                
-                if df is None:
-                    QMessageBox.critical(self, "错误", "无法读取CSV文件，请确保文件编码为UTF-8、GBK、GB2312或GB18030")
-                    return
-                
-                # 检查是否存在"分镜提示词"列
-                if "分镜提示词" not in df.columns:
-                    QMessageBox.critical(self, "错误", "CSV文件中没有找到'分镜提示词'列")
-                    return
-                
-                # 检查是否存在"分镜编号"列
-                has_number_column = "分镜编号" in df.columns
-                
-                # 清空现有数据
-                self.prompt_table_data.clear()
-                self.prompt_numbers.clear()
-                
-                # 添加提示词到数据
-                for index, row in df.iterrows():
-                    prompt = row["分镜提示词"]
-                    if pd.notna(prompt):
-                        prompt_str = str(prompt)
-                        
-                        # 确定编号
-                        if has_number_column:
-                            number = row["分镜编号"]
-                            if pd.notna(number):
-                                display_number = str(number)
-                            else:
-                                display_number = str(index + 1)
-                        else:
-                            display_number = str(index + 1)
-                        
-                        # 添加到数据列表
-                        self.prompt_table_data.append({
-                            'number': display_number,
-                            'prompt': prompt_str,
-                            'status': '等待中',
-                            'image_url': '',
-                            'error_msg': '',
-                            'reference_images': []  # 改为支持多张参考图片的列表
-                        })
-                        
-                        self.prompt_numbers[prompt_str] = display_number
-                
-                # 刷新表格显示
-                self.refresh_prompt_table()
-                self.update_prompt_stats()
-                QMessageBox.information(self, "成功", f"成功导入 {len(self.prompt_table_data)} 个提示词")
-                
-            except Exception as e:
-                QMessageBox.critical(self, "错误", f"导入CSV文件失败: {str(e)}")
+    def on_cursor_position_changed(self, row, position):
+        """光标位置改变时的处理"""
+        self.record_cursor_position(row, position)
+        self.focused_row = row
     
-    def clear_prompts(self):
-        """清空导入的提示词列表"""
-        self.prompt_table_data.clear()
-        self.prompt_numbers.clear()
-        self.refresh_prompt_table()
-        self.update_prompt_stats()
-        QMessageBox.information(self, "完成", "已清空所有提示词")
     
-    def export_prompts_to_csv(self):
-        """导出提示词到CSV文件"""
-        if not self.prompt_table_data:
-            QMessageBox.warning(self, "提示", "没有可导出的提示词数据")
-            return
+    def refresh_main_style_combo(self):
+        """刷新主界面的风格选择下拉框"""
+        # 阻止信号触发，避免循环调用
+        self.main_style_combo.blockSignals(True)
         
-        # 选择保存路径
-        file_path, _ = QFileDialog.getSaveFileName(
-            self,
-            "导出提示词",
-            f"sora_prompts_{time.strftime('%Y%m%d_%H%M%S')}.csv",
-            "CSV Files (*.csv);;All Files (*)"
-        )
+        current_text = self.main_style_combo.currentText()
         
-        if file_path:
-            try:
-                import pandas as pd
-                
-                # 准备导出数据
-                export_data = []
-                for data in self.prompt_table_data:
-                    export_data.append({
-                        '编号': data['number'],
-                        '提示词': data['prompt'],
-                        '状态': data['status'],
-                        '错误信息': data.get('error_msg', ''),
-                        '图片URL': data.get('image_url', '')
-                    })
-                
-                # 创建DataFrame并导出
-                df = pd.DataFrame(export_data)
-                df.to_csv(file_path, index=False, encoding='utf-8-sig')
+        self.main_style_combo.clear()
+        self.main_style_combo.addItem("选择风格...")
+        
+        for style_name in self.style_library.keys():
+            self.main_style_combo.addItem(style_name)
+        
+        # 优先使用当前配置的风格，然后是之前的选择
+        target_style = None
+        if self.current_style and self.current_style in self.style_library:
+            target_style = self.current_style
+        elif current_text and current_text != "选择风格..." and current_text in self.style_library:
+            target_style = current_text
+        
+        if target_style:
+            self.main_style_combo.setCurrentText(target_style)
+        else:
+            self.main_style_combo.setCurrentIndex(0)  # 选择"选择风格..."
+        
+        # 恢复信号
+        self.main_style_combo.blockSignals(False)
+    
+    def on_main_style_changed(self, style_name):
+        """主界面风格选择变化处理"""
+        if style_name == "选择风格..." or style_name == "":
+            self.current_style = ""
+            self.custom_style_content = ""
+            # 更新风格预览
+            if hasattr(self, 'style_preview_text'):
+                self.style_preview_text.setText("请选择一个风格")
+        else:
+            if style_name in self.style_library:
+                self.current_style = style_name
+                self.custom_style_content = self.style_library[style_name]['content']
                 
-                QMessageBox.information(self, "导出成功", 
-                    f"已成功导出 {len(export_data)} 个提示词到:\n{file_path}")
+                # 更新使用次数
+                self.style_library[style_name]['usage_count'] = self.style_library[style_name].get('usage_count', 0) + 1
                 
-            except ImportError:
-                QMessageBox.critical(self, "导出失败", "缺少pandas模块，无法导出CSV文件")
-            except Exception as e:
-                QMessageBox.critical(self, "导出失败", f"导出过程中出现错误: {str(e)}")
-    
-    def open_text_replace_dialog(self):
-        """打开文字替换对话框"""
-        if not self.prompt_table_data:
-            QMessageBox.warning(self, "提示", "没有提示词数据，请先添加提示词或导入CSV文件")
-            return
-        
-        dialog = TextReplaceDialog(self)
+                # 更新风格预览
+                if hasattr(self, 'style_preview_text'):
+                    preview_text = self.custom_style_content
+                    # 缩短显示文本，但保留关键信息
+                    if len(preview_text) > 60:
+                        preview_text = preview_text[:60] + "..."
+                    self.style_preview_text.setText(preview_text)
         
-        if dialog.exec() == QDialog.DialogCode.Accepted:
-            replacement_data = dialog.get_replacement_data()
-            find_text = replacement_data['find_text']
-            replace_text = replacement_data['replace_text']
+        # 保存配置
+        self.save_config()
+    
+    @profiled
+    def handle_image_drop(self, image_files, drop_row):
+        """处理图片拖拽事件 - 只添加到参考图列"""
+        try:
+            # 如果拖拽到空白区域（超出现有行范围），创建新行
+            if drop_row >= len(self.prompt_table_data):
+                # 创建新行，提示词保持默认值，只添加参考图
+                max_number = 0
+                for data in self.prompt_table_data:
+                    try:
+                        num = int(data['number'])
+                        max_number = max(max_number, num)
+                    except ValueError:
+                        continue
+                
+                new_number = str(max_number + 1)
+                new_data = {
+                    'number': new_number,
+                    'prompt': '新提示词',  # 保持默认提示词
+                    'status': '等待中',
+                    'image_url': '',
+                    'error_msg': '',
+                    'reference_images': list(image_files)  # 直接设置参考图片列表
+                }
+                self.prompt_table_data.append(new_data)
             
-            if not find_text:
-                QMessageBox.warning(self, "提示", "请输入要查找的文字")
-                return
+            elif drop_row >= 0:
+                # 添加到现有行的参考图列表
+                data = self.prompt_table_data[drop_row]
+                existing_images = data.get('reference_images', [])
+                existing_images.extend(image_files)
+                data['reference_images'] = existing_images
             
-            # 执行替换
-            replaced_count = 0
-            for data in self.prompt_table_data:
-                if find_text in data['prompt']:
-                    data['prompt'] = data['prompt'].replace(find_text, replace_text)
-                    replaced_count += 1
+            # 刷新表格显示
+            self.refresh_prompt_table()
             
-            if replaced_count > 0:
-                # 刷新表格显示
-                self.refresh_prompt_table()
-                QMessageBox.information(self, "替换完成", 
-                    f"成功替换了 {replaced_count} 个提示词中的文字")
+            # 显示简单的成功提示
+            if len(image_files) == 1:
+                image_name = os.path.basename(image_files[0])
+                print(f"参考图片已添加: {image_name}")
             else:
-                QMessageBox.information(self, "替换完成", "未找到匹配的文字，没有进行替换")
+                print(f"已添加 {len(image_files)} 张参考图片")
+            
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"处理拖拽图片时出错: {str(e)}")
     
-    def open_gallery_dialog(self, row):
-        """打开图库选择对话框"""
-        if not self.category_links:
-            QMessageBox.warning(self, "提示", "图库为空，请先在设置中心配置参考图库")
-            return
-        
-        if 0 <= row < len(self.prompt_table_data):
-            # 清理无效的编辑器引用
-            self.clean_inactive_editors()
+    def add_image_reference_prompt(self, image_path, insert_row=None):
+        """添加图片参考提示词（此方法现在用于其他场景，如果需要）"""
+        try:
+            # 获取图片文件名（不包括扩展名）
+            image_name = os.path.splitext(os.path.basename(image_path))[0]
             
-            dialog = GallerySelectionDialog(self.category_links, self)
+            # 生成新编号
+            max_number = 0
+            for data in self.prompt_table_data:
+                try:
+                    num = int(data['number'])
+                    max_number = max(max_number, num)
+                except ValueError:
+                    continue
             
-            if dialog.exec() == QDialog.DialogCode.Accepted:
-                selected_image = dialog.get_selected_image()
-                if selected_image:
-                    # 如果是字典，获取name字段；如果是字符串，直接使用
-                    if isinstance(selected_image, dict):
-                        image_name_raw = selected_image.get('name', selected_image)
-                    else:
-                        image_name_raw = selected_image
-                    
-                    # 用「」框起来
-                    image_name = f"「{image_name_raw}」"
-                    
-                    # 现在所有提示词都有持续活跃的编辑器，直接插入
-                    if row in self.active_editors:
-                        editor = self.active_editors[row]
-                        try:
-                            if isinstance(editor, QLineEdit):
-                                cursor_pos = editor.cursorPosition()
-                                current_text = editor.text()
-                                new_text = current_text[:cursor_pos] + image_name + current_text[cursor_pos:]
-                                editor.setText(new_text)
-                                # 移动光标到插入文本之后
-                                new_cursor_pos = cursor_pos + len(image_name)
-                                editor.setCursorPosition(new_cursor_pos)
-                                # 确保焦点在这个编辑器上
-                                editor.setFocus()
-                                self.focused_row = row
-                                return
-                            elif isinstance(editor, QPlainTextEdit):
-                                cursor = editor.textCursor()
-                                cursor_pos = cursor.position()
-                                # 使用insertText方法保持撤销历史
-                                cursor.insertText(image_name)
-                                editor.setTextCursor(cursor)
-                                # 确保焦点在这个编辑器上
-                                editor.setFocus()
-                                self.focused_row = row
-                                return
-                        except (RuntimeError, AttributeError):
-                            # 编辑器已被删除或不可用，从活跃编辑器列表中移除
-                            if row in self.active_editors:
-                                del self.active_editors[row]
-                    
-                    # 如果编辑器不可用，作为后备方案更新数据模型
-                    current_prompt = self.prompt_table_data[row]['prompt']
-                    cursor_pos = self.get_smart_cursor_position(row)
-                    cursor_pos = min(cursor_pos, len(current_prompt))
-                    new_prompt = current_prompt[:cursor_pos] + image_name + current_prompt[cursor_pos:]
-                    self.prompt_table_data[row]['prompt'] = new_prompt
-                    # 重建编辑器
-                    prompt_editor = self.create_prompt_editor(new_prompt, row)
-                    self.prompt_table.setCellWidget(row, 2, prompt_editor)
-                    # 设置光标到插入位置之后
-                    new_cursor_pos = cursor_pos + len(image_name)
-                    if isinstance(prompt_editor, QLineEdit):
-                        prompt_editor.setCursorPosition(new_cursor_pos)
-                    else:
-                        cursor = prompt_editor.textCursor()
-                        cursor.setPosition(new_cursor_pos)
-                        prompt_editor.setTextCursor(cursor)
-                    prompt_editor.setFocus()
+            new_number = str(max_number + 1)
+            
+            # 创建新的提示词数据
+            new_data = {
+                'number': new_number,
+                'prompt': f'参考图片「{image_name}」',  # 初始提示词
+                'status': '等待中',
+                'image_url': '',
+                'error_msg': '',
+                'reference_images': [image_path]  # 保存参考图片路径到列表
+            }
+            
+            # 插入到指定位置或末尾
+            if insert_row is not None and 0 <= insert_row < len(self.prompt_table_data):
+                self.prompt_table_data.insert(insert_row + 1, new_data)
+            else:
+                self.prompt_table_data.append(new_data)
+                
+        except Exception as e:
+            raise Exception(f"添加图片参考失败: {str(e)}")
     
-    def record_cursor_position(self, row, position):
-        """记录指定行的光标位置"""
-        if row >= 0 and position >= 0:
-            self.cursor_positions[row] = position
+    def show_reference_image(self, row, img_index=0):
+        """显示参考图片"""
+        if 0 <= row < len(self.prompt_table_data):
+            data = self.prompt_table_data[row]
+            reference_images = data.get('reference_images', [])
+            if img_index < len(reference_images):
+                image_path = reference_images[img_index]
+                if os.path.exists(image_path):
+                    dialog = ReferenceImageDialog(image_path, data['prompt'], self)
+                    dialog.exec()
+                else:
+                    QMessageBox.warning(self, "警告", f"参考图片不存在: {image_path}")
     
-    def set_active_editor(self, row, editor):
-        """设置当前活跃的编辑器"""
-        self.active_editors[row] = editor
-        
-    def clean_inactive_editors(self):
-        """清理无效的编辑器引用"""
-        to_remove = []
-        for row, editor in self.active_editors.items():
-            try:
-                # 尝试访问编辑器的一个属性来测试是否还有效
-                if isinstance(editor, QLineEdit):
-                    _ = editor.text()
-                elif isinstance(editor, QPlainTextEdit):
-                    _ = editor.toPlainText()
-            except (RuntimeError, AttributeError):
-                to_remove.append(row)
-        
-        for row in to_remove:
-            del self.active_editors[row]
+    def delete_single_reference_image(self, row, img_index):
+        """删除单张参考图片"""
+        if 0 <= row < len(self.prompt_table_data):
+            data = self.prompt_table_data[row]
+            reference_images = data.get('reference_images', [])
+            
+            if 0 <= img_index < len(reference_images):
+                img_name = os.path.basename(reference_images[img_index])
+                reply = QMessageBox.question(
+                    self,
+                    "确认删除",
+                    f"确定要删除这张参考图片吗？\n\n图片: {img_name}\n\n注意：这只会移除图片关联，不会删除原始文件。",
+                    QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                    QMessageBox.StandardButton.No
+                )
+                
+                if reply == QMessageBox.StandardButton.Yes:
+                    # 从列表中删除这张图片
+                    reference_images.pop(img_index)
+                    data['reference_images'] = reference_images
+                    # 刷新表格显示
+                    self.refresh_prompt_table()
     
-    def get_current_cursor_position(self, row):
-        """获取指定行的当前光标位置"""
-        # 优先从活跃编辑器获取实时光标位置
-        if row in self.active_editors:
-            editor = self.active_editors[row]
-            try:
-                if isinstance(editor, QLineEdit):
-                    return editor.cursorPosition()
-                elif isinstance(editor, QPlainTextEdit):
-                    return editor.textCursor().position()
-            except (RuntimeError, AttributeError):
-                # 编辑器已无效，清理并使用记录的位置
-                if row in self.active_editors:
-                    del self.active_editors[row]
-        
-        # 如果没有活跃编辑器，使用记录的位置
-        return self.cursor_positions.get(row, 0)
-        
-    def get_smart_cursor_position(self, row):
-        """获取智能光标位置 - 专为图片插入优化"""
-        # 如果当前行正是焦点行，尝试从活跃编辑器获取最新位置
-        if row == self.focused_row and row in self.active_editors:
-            editor = self.active_editors[row]
-            try:
-                if isinstance(editor, QLineEdit):
-                    pos = editor.cursorPosition()
-                    # 更新记录的位置
-                    self.cursor_positions[row] = pos
-                    return pos
-                elif isinstance(editor, QPlainTextEdit):
-                    pos = editor.textCursor().position()
-                    # 更新记录的位置
-                    self.cursor_positions[row] = pos
-                    return pos
-            except (RuntimeError, AttributeError):
-                # 编辑器已无效，清理
-                if row in self.active_editors:
-                    del self.active_editors[row]
-        
-        # 使用记录的位置，如果没有记录则使用文本末尾
-        if row < len(self.prompt_table_data):
-            text_length = len(self.prompt_table_data[row]['prompt'])
-            return self.cursor_positions.get(row, text_length)
-        
-        return 0
+    def add_more_reference_images(self, row):
+        """为指定行添加更多参考图片"""
+        if 0 <= row < len(self.prompt_table_data):
+            file_paths, _ = QFileDialog.getOpenFileNames(
+                self,
+                "选择参考图片",
+                "",
+                "图片文件 (*.png *.jpg *.jpeg *.bmp *.gif);;所有文件 (*.*)"
+            )
+            
+            if file_paths:
+                data = self.prompt_table_data[row]
+                reference_images = data.get('reference_images', [])
+                
+                # 添加新选择的图片
+                reference_images.extend(file_paths)
+                data['reference_images'] = reference_images
+                
+                # 刷新表格显示
+                self.refresh_prompt_table()
     
-    def create_prompt_editor(self, text, row):
-        """创建提示词的内嵌编辑器"""
-        # 统一使用QPlainTextEdit，支持自动换行和滚动
-        editor = QPlainTextEdit()
-        editor.setPlainText(text)
-        
-        # 应用所有样式和设置
-        self.apply_editor_settings(editor)
-        
-        # 连接信号处理文本变化
-        def handle_text_change(r=row, e=editor):
-            self.on_prompt_text_changed(r, e.toPlainText())
-        def handle_cursor_change(r=row, e=editor):
-            self.on_cursor_position_changed(r, e.textCursor().position())
-        
-        editor.textChanged.connect(handle_text_change)
-        editor.cursorPositionChanged.connect(handle_cursor_change)
-        
-        # 添加动态高度调整
-        def adjust_height():
-            self.adjust_editor_height(editor)
-        editor.textChanged.connect(adjust_height)
-        
-        # 初始调整高度
-        self.adjust_editor_height(editor)
-        
-        # 注册为活跃编辑器
-        self.active_editors[row] = editor
-        
-        return editor
+    def manage_reference_images(self, row):
+        """打开参考图片管理对话框"""
+        if 0 <= row < len(self.prompt_table_data):
+            data = self.prompt_table_data[row]
+            reference_images = data.get('reference_images', [])
+            
+            if not reference_images:
+                QMessageBox.information(self, "提示", "该行没有参考图片")
+                return
+            
+            # 创建管理对话框
+            dialog = ReferenceImagesManagerDialog(reference_images, self)
+            if dialog.exec() == QDialog.DialogCode.Accepted:
+                # 更新参考图片列表
+                data['reference_images'] = dialog.get_images()
+                self.refresh_prompt_table()
     
-    def apply_editor_settings(self, editor):
-        """应用编辑器的样式和设置"""
-        if not isinstance(editor, QPlainTextEdit):
-            return
+    def delete_reference_image(self, row):
+        """删除所有参考图片（兼容旧版本）"""
+        if 0 <= row < len(self.prompt_table_data):
+            data = self.prompt_table_data[row]
+            reference_images = data.get('reference_images', [])
+            
+            if reference_images:
+                reply = QMessageBox.question(
+                    self, 
+                    "确认删除", 
+                    f"确定要删除第 {row + 1} 行的所有参考图片吗？\n\n共 {len(reference_images)} 张图片\n\n注意：这只会移除图片关联，不会删除原始文件。",
+                    QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                    QMessageBox.StandardButton.No
+                )
+                
+                if reply == QMessageBox.StandardButton.Yes:
+                    # 清除所有参考图片关联
+                    data['reference_images'] = []
+                    
+                    # 刷新表格显示
+                    self.refresh_prompt_table()
+                    
+                    QMessageBox.information(self, "删除成功", f"已删除第 {row + 1} 行的参考图片关联")
+    
+    def clear_selected_reference_images(self):
+        """清除选中行的参考图片"""
+        selected_rows = set()
         
-        # 设置自动换行
-        editor.setWordWrapMode(QTextOption.WrapMode.WrapAtWordBoundaryOrAnywhere)
-        editor.setLineWrapMode(QPlainTextEdit.LineWrapMode.WidgetWidth)
+        # 优先检查复选框选择
+        checkbox_selected = False
+        for row in range(len(self.prompt_table_data)):
+            checkbox = self.prompt_table.cellWidget(row, 0)
+            if checkbox and checkbox.isChecked():
+                selected_rows.add(row)
+                checkbox_selected = True
         
-        # 设置尺寸策略 - 让编辑器填满整个单元格
-        editor.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
+        # 如果没有复选框选择，则检查表格行选择
+        if not checkbox_selected:
+            for item in self.prompt_table.selectedItems():
+                selected_rows.add(item.row())
         
-        # 确保编辑器占用全部可用宽度
-        editor.setMinimumWidth(200)
-        editor.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        if not selected_rows:
+            QMessageBox.warning(self, "提示", "请先选择要清除参考图的提示词（可以通过复选框选择或点击行选择）")
+            return
         
-        # 设置文档边距为0，让文本填充到边沿
-        editor.document().setDocumentMargin(0)
-        editor.setContentsMargins(0, 0, 0, 0)
+        # 统计有参考图的行数
+        rows_with_ref_images = []
+        for row in selected_rows:
+            if 0 <= row < len(self.prompt_table_data):
+                data = self.prompt_table_data[row]
+                if data.get('reference_images', []):
+                    rows_with_ref_images.append(row)
         
-        # 设置视口边距为0
-        editor.setViewportMargins(0, 0, 0, 0)
+        if not rows_with_ref_images:
+            QMessageBox.information(self, "提示", "选中的提示词没有关联的参考图片")
+            return
         
-        # 获取文档并设置更详细的边距控制
-        doc = editor.document()
-        doc.setDocumentMargin(0)
+        reply = QMessageBox.question(
+            self,
+            "确认清除",
+            f"确定要清除 {len(rows_with_ref_images)} 个提示词的参考图片关联吗？\n\n注意：这只会移除图片关联，不会删除原始文件。",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+            QMessageBox.StandardButton.No
+        )
         
-        # 设置文本光标边距
-        editor.setCursorWidth(1)
+        if reply == QMessageBox.StandardButton.Yes:
+            # 清除选中行的参考图片关联
+            cleared_count = 0
+            for row in rows_with_ref_images:
+                if 0 <= row < len(self.prompt_table_data):
+                    self.prompt_table_data[row]['reference_images'] = []
+                    cleared_count += 1
+            
+            # 刷新表格显示
+            self.refresh_prompt_table()
+            self.update_prompt_stats()
+            
+            QMessageBox.information(self, "清除完成", f"成功清除了 {cleared_count} 个参考图片关联")
+    
+    def update_prompt_stats(self):
+        """更新提示词统计"""
+        count = len(self.prompt_table_data)
+        reference_count = len([data for data in self.prompt_table_data if data.get('reference_images', [])])
+        if reference_count > 0:
+            self.prompt_stats_label.setText(f"总计: {count} 个提示词（包含 {reference_count} 个图片参考）")
+        else:
+            self.prompt_stats_label.setText(f"总计: {count} 个提示词")
+    
+    @profiled
+    def refresh_prompt_table(self):
+        """刷新提示词表格显示"""
+        # 清理无效的编辑器引用
+        self.clean_inactive_editors()
         
-        # 设置合理的高度范围
-        editor.setMinimumHeight(200)  # 调整最小高度到200像素
-        editor.setMaximumHeight(450)
+        # 清理超出当前数据范围的编辑器
+        current_row_count = len(self.prompt_table_data)
+        rows_to_remove = [row for row in self.active_editors.keys() if row >= current_row_count]
+        for row in rows_to_remove:
+            del self.active_editors[row]
         
-        # 应用样式
-        editor.setStyleSheet("""
-            QPlainTextEdit {
-                border: 1px solid #ddd;
+        self.prompt_table.setRowCount(current_row_count)
+        for row, data in enumerate(self.prompt_table_data):
+            self.populate_prompt_row(row, data)
+        self.prompt_table_filled_rows = current_row_count
+    
+    def populate_prompt_row(self, row, data):
+        """创建一行提示词表格的单元格和控件"""
+        # 选择列 - 复选框
+        checkbox = QCheckBox()
+        checkbox.setStyleSheet("""
+            QCheckBox {
+                margin: 5px;
+                spacing: 5px;
+            }
+            QCheckBox::indicator {
+                width: 18px;
+                height: 18px;
+                border: 2px solid #ced4da;
                 border-radius: 4px;
-                padding: 0px !important;
-                margin: 0px !important;
-                background-color: white;
-                font-size: 20px;
-                line-height: 1.2;
-                font-weight: 500;
-                font-family: 'Microsoft YaHei', 'Segoe UI', Arial, sans-serif;
-                width: 100%;
-                min-width: 100%;
-                padding-top: 0px !important;
-                padding-bottom: 0px !important;
-                padding-left: 0px !important;
-                padding-right: 0px !important;
-                selection-background-color: #3399ff;
+                background-color: #ffffff;
             }
-            QPlainTextEdit:focus {
-                border: 2px solid #1976d2;
-                background-color: #fafafa;
-                padding: 0px !important;
-                margin: 0px !important;
+            QCheckBox::indicator:hover {
+                border-color: #007bff;
+                background-color: #f8f9ff;
             }
-            QPlainTextEdit QScrollArea {
-                padding: 0px !important;
-                margin: 0px !important;
+            QCheckBox::indicator:checked {
+                background-color: #007bff;
+                border-color: #007bff;
+                image: url(data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iMTIiIGhlaWdodD0iOSIgdmlld0JveD0iMCAwIDEyIDkiIGZpbGw9Im5vbmUiIHhtbG5zPSJodHRwOi8vd3d3LnczLm9yZy8yMDAwL3N2ZyI+CjxwYXRoIGQ9Ik0xMS4yNSAwLjc1TDQuNSA3LjUgMC43NSAzLjc1IiBzdHJva2U9IndoaXRlIiBzdHJva2Utd2lkdGg9IjEuNSIgc3Ryb2tlLWxpbmVjYXA9InJvdW5kIiBzdHJva2UtbGluZWpvaW49InJvdW5kIi8+Cjwvc3ZnPgo=);
             }
-            QPlainTextEdit QAbstractScrollArea {
-                padding: 0px !important;
-                margin: 0px !important;
+            QCheckBox::indicator:checked:hover {
+                background-color: #0056b3;
+                border-color: #0056b3;
             }
-            QScrollBar:vertical {
-                background: #f0f0f0;
-                width: 12px;
-                border-radius: 6px;
-                margin: 0px;
+            QCheckBox::indicator:indeterminate {
+                background-color: #6c757d;
+                border-color: #6c757d;
+                image: url(data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iMTAiIGhlaWdodD0iMiIgdmlld0JveD0iMCAwIDEwIDIiIGZpbGw9Im5vbmUiIHhtbG5zPSJodHRwOi8vd3d3LnczLm9yZy8yMDAwL3N2ZyI+CjxyZWN0IHdpZHRoPSIxMCIgaGVpZ2h0PSIyIiBmaWxsPSJ3aGl0ZSIvPgo8L3N2Zz4K);
             }
-            QScrollBar::handle:vertical {
-                background: #c0c0c0;
-                border-radius: 6px;
-                min-height: 20px;
-                margin: 2px;
+        """)
+        checkbox.stateChanged.connect(lambda state, r=row: self.on_checkbox_changed(state, r))
+        self.prompt_table.setCellWidget(row, 0, checkbox)
+        
+        # 编号列
+        number_item = QTableWidgetItem(data['number'])
+        number_item.setFlags(number_item.flags() & ~Qt.ItemFlag.ItemIsEditable)  # 不可编辑
+        self.prompt_table.setItem(row, 1, number_item)
+        
+        # 提示词列 - 强制重新创建编辑器以确保样式正确应用
+        # 创建新的编辑器
+        prompt_editor = self.create_prompt_editor(data['prompt'], row)
+        self.prompt_table.setCellWidget(row, 2, prompt_editor)
+        
+        
+        # 参考图片列 - 简洁信息显示
+        reference_images = data.get('reference_images', [])
+        if reference_images:
+            # 创建简洁的参考图信息widget
+            ref_widget = QWidget()
+            ref_layout = QVBoxLayout(ref_widget)
+            ref_layout.setContentsMargins(4, 4, 4, 4)
+            ref_layout.setSpacing(3)
+            
+            # 图片数量信息
+            info_label = QLabel(f"📷 {len(reference_images)} 张图片")
+            info_label.setStyleSheet("""
+                QLabel {
+                    color: #333;
+                    font-size: 12px;
+                    font-weight: bold;
+                    background-color: #f8f9fa;
+                    border: 1px solid #ddd;
+                    border-radius: 4px;
+                    padding: 6px;
+                    text-align: center;
+                }
+            """)
+            info_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+            ref_layout.addWidget(info_label)
+            
+            # 操作按钮
+            button_widget = QWidget()
+            button_layout = QHBoxLayout(button_widget)
+            button_layout.setContentsMargins(0, 0, 0, 0)
+            button_layout.setSpacing(3)
+            
+            # 管理按钮（主要功能）
+            manage_button = QPushButton("管理预览")
+            manage_button.setStyleSheet("""
+                QPushButton {
+                    background-color: #17a2b8;
+                    color: white;
+                    border: none;
+                    padding: 4px 8px;
+                    border-radius: 4px;
+                    font-size: 11px;
+                    font-weight: bold;
+                }
+                QPushButton:hover {
+                    background-color: #138496;
+                }
+            """)
+            manage_button.clicked.connect(lambda checked, r=row: self.manage_reference_images(r))
+            
+            # 添加按钮
+            add_button = QPushButton("添加")
+            add_button.setStyleSheet("""
+                QPushButton {
+                    background-color: #28a745;
+                    color: white;
+                    border: none;
+                    padding: 4px 8px;
+                    border-radius: 4px;
+                    font-size: 11px;
+                }
+                QPushButton:hover {
+                    background-color: #218838;
+                }
+            """)
+            add_button.clicked.connect(lambda checked, r=row: self.add_more_reference_images(r))
+            
+            button_layout.addWidget(manage_button)
+            button_layout.addWidget(add_button)
+            
+            ref_layout.addWidget(button_widget)
+            
+            self.prompt_table.setCellWidget(row, 3, ref_widget)
+        else:
+            # 清除可能存在的widget并设置空列
+            self.prompt_table.setCellWidget(row, 3, None)  # 清除之前的widget
+            empty_item = QTableWidgetItem("无参考图")
+            empty_item.setFlags(empty_item.flags() & ~Qt.ItemFlag.ItemIsEditable)
+            empty_item.setForeground(QColor("#999999"))  # 灰色文本
+            empty_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
+            empty_item.setToolTip("拖拽图片到此行来添加参考图片")
+            self.prompt_table.setItem(row, 3, empty_item)
+        
+        # 图库列 - 添加选择按钮
+        gallery_button = QPushButton("选择")
+        gallery_button.setToolTip("从图库选择图片")
+        gallery_button.setStyleSheet("""
+            QPushButton {
+                background-color: #ff9800;
+                color: white;
+                border: none;
+                padding: 6px 10px;
+                border-radius: 4px;
+                font-size: 15px;
             }
-            QScrollBar::handle:vertical:hover {
-                background: #a0a0a0;
+            QPushButton:hover {
+                background-color: #f57c00;
             }
-            QScrollBar::add-line, QScrollBar::sub-line {
+        """)
+        gallery_button.clicked.connect(lambda checked, r=row: self.open_gallery_dialog(r))
+        self.prompt_table.setCellWidget(row, 4, gallery_button)
+        
+        # 生成状态/图片列（合并原状态列和图片列）
+        status_image_item = QTableWidgetItem()
+        status_image_item.setFlags(status_image_item.flags() & ~Qt.ItemFlag.ItemIsEditable)  # 不可编辑
+        status_image_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.prompt_table.setItem(row, 5, status_image_item)
+        # 更新合并列的显示内容
+        self.update_status_image_display(row, data)
+        
+        # AI优化列 - 添加优化按钮
+        optimize_button = QPushButton("🤖 优化")
+        optimize_button.setToolTip("使用AI优化这条提示词")
+        optimize_button.setStyleSheet("""
+            QPushButton {
+                background-color: #9c27b0;
+                color: white;
                 border: none;
-                background: none;
+                padding: 6px 10px;
+                border-radius: 4px;
+                font-size: 15px;
+                font-weight: bold;
+            }
+            QPushButton:hover {
+                background-color: #7b1fa2;
+            }
+            QPushButton:disabled {
+                background-color: #ccc;
+                color: #666;
             }
         """)
+        # 检查AI优化是否已配置
+        if not self.openrouter_api_key.strip() or not self.meta_prompt.strip():
+            optimize_button.setEnabled(False)
+            optimize_button.setToolTip("请先在设置中心配置AI优化功能")
+        else:
+            optimize_button.clicked.connect(lambda checked, r=row: self.optimize_single_prompt(r))
         
-        # 强制刷新样式和布局
-        editor.update()
-        editor.repaint()
+        self.prompt_table.setCellWidget(row, 6, optimize_button)
         
-        # 调整高度
-        self.adjust_editor_height(editor)
-    
-    def adjust_editor_height(self, editor):
-        """根据内容动态调整编辑器高度"""
-        if not isinstance(editor, QPlainTextEdit):
+        # 单独生成列 - 添加生成按钮
+        generate_button = QPushButton("生成")
+        generate_button.setToolTip("单独生成这条提示词的图片")
+        generate_button.setStyleSheet("""
+            QPushButton {
+                background-color: #4caf50;
+                color: white;
+                border: none;
+                padding: 6px 10px;
+                border-radius: 4px;
+                font-size: 15px;
+                font-weight: bold;
+            }
+            QPushButton:hover {
+                background-color: #388e3c;
+            }
+            QPushButton:disabled {
+                background-color: #ccc;
+                color: #666;
+            }
+        """)
+        # 检查API配置
+        if not self.get_current_api_key() or not self.save_path:
+            generate_button.setEnabled(False)
+            generate_button.setToolTip("请先在设置中心配置API密钥和保存路径")
+        else:
+            generate_button.clicked.connect(lambda checked, r=row: self.generate_single_prompt(r))
+        
+        self.prompt_table.setCellWidget(row, 7, generate_button)
+    
+    def append_prompt_rows(self, rows):
+        """追加提示词行，控件分批创建，大量导入时界面保持响应"""
+        for row in rows:
+            self.prompt_table_data.append(row)
+            self.prompt_numbers[row['prompt']] = row['number']
+        self.prompt_table.setRowCount(len(self.prompt_table_data))
+        self.schedule_prompt_table_fill()
+    
+    def schedule_prompt_table_fill(self):
+        """安排下一批补建；已有待执行的补建时不重复安排，多次追加共用同一条补建链"""
+        if not self.prompt_table_fill_scheduled:
+            self.prompt_table_fill_scheduled = True
+            QTimer.singleShot(0, self.fill_pending_prompt_rows)
+    
+    def fill_pending_prompt_rows(self):
+        """为尚未创建控件的行补建控件，每次只处理一小批"""
+        self.prompt_table_fill_scheduled = False
+        total = len(self.prompt_table_data)
+        start = self.prompt_table_filled_rows
+        if start >= total:
             return
-        
-        try:
-            # 获取文档高度
-            doc = editor.document()
-            doc_height = doc.size().height()
-            
-            # 计算需要的高度（不加任何边距，让文本充满到边沿）
-            border_width = 2  # 边框宽度
-            needed_height = int(doc_height + border_width)
-            
-            # 限制在最小和最大高度之间，但确保文本能完全显示
-            min_height = max(200, needed_height)   # 最小高度至少要能显示完整文本
-            max_height = 450  # 最大高度
-            new_height = min(max_height, min_height)
-            
-            editor.setFixedHeight(new_height)
-            
-        except Exception as e:
-            # 如果出错，使用默认高度
-            editor.setFixedHeight(100)
-    
-    def on_prompt_text_changed(self, row, text):
-        """提示词文本改变时的处理"""
-        if 0 <= row < len(self.prompt_table_data):
-            self.prompt_table_data[row]['prompt'] = text
-    
-    def on_cursor_position_changed(self, row, position):
-        """光标位置改变时的处理"""
-        self.record_cursor_position(row, position)
-        self.focused_row = row
-    
+        end = min(total, start + self.PROMPT_TABLE_FILL_BATCH)
+        for row in range(start, end):
+            self.populate_prompt_row(row, self.prompt_table_data[row])
+        self.prompt_table_filled_rows = end
+        if end < total:
+            self.schedule_prompt_table_fill()
     
-    def refresh_main_style_combo(self):
-        """刷新主界面的风格选择下拉框"""
-        # 阻止信号触发，避免循环调用
-        self.main_style_combo.blockSignals(True)
-        
-        current_text = self.main_style_combo.currentText()
-        
-        self.main_style_combo.clear()
-        self.main_style_combo.addItem("选择风格...")
-        
-        for style_name in self.style_library.keys():
-            self.main_style_combo.addItem(style_name)
+    def update_status_image_display(self, row, data):
+        """更新合并的状态/图片列显示"""
+        item = self.prompt_table.item(row, 5)  # 合并后的列索引是5
+        if not item:
+            return
         
-        # 优先使用当前配置的风格，然后是之前的选择
-        target_style = None
-        if self.current_style and self.current_style in self.style_library:
-            target_style = self.current_style
-        elif current_text and current_text != "选择风格..." and current_text in self.style_library:
-            target_style = current_text
+        status = data['status']
         
-        if target_style:
-            self.main_style_combo.setCurrentText(target_style)
+        if status == '成功':
+            # 显示缩略图（从本地文件加载）
+            self.load_and_set_thumbnail(row, data['number'])
+            item.setBackground(QColor("#e8f5e8"))
+        elif status == '失败':
+            # 显示失败信息和状态颜色
+            error_msg = data.get('error_msg', '生成失败')
+            if len(error_msg) > 50:
+                error_msg = error_msg[:50] + "..."
+            
+            item.setText(f"❌ 失败\n{error_msg}")
+            item.setToolTip(data.get('error_msg', '生成失败'))
+            item.setBackground(QColor("#ffebee"))
+            item.setForeground(QColor("#d32f2f"))
+            item.setIcon(QIcon())
+        elif status == '生成中':
+            # 显示进度状态（流式生图时带百分比）
+            item.setText(data.get('progress_text') or "生成中...")
+            item.setBackground(QColor("#e3f2fd"))
+            item.setForeground(QColor("#1976d2"))
+            item.setIcon(QIcon())
+            item.setToolTip("正在生成图片，请等待...")
+        elif status == '等待中':
+            # 显示等待状态
+            item.setText("⏳ 等待中")
+            item.setBackground(QColor("#f0f0f0"))
+            item.setForeground(QColor("#666"))
+            item.setIcon(QIcon())
+            item.setToolTip("等待生成")
         else:
-            self.main_style_combo.setCurrentIndex(0)  # 选择"选择风格..."
-        
-        # 恢复信号
-        self.main_style_combo.blockSignals(False)
+            # 其他状态
+            item.setText(f"{status}")
+            item.setBackground(QColor("#f8f9fa"))
+            item.setForeground(QColor("#666"))
+            item.setIcon(QIcon())
     
-    def on_main_style_changed(self, style_name):
-        """主界面风格选择变化处理"""
-        if style_name == "选择风格..." or style_name == "":
-            self.current_style = ""
-            self.custom_style_content = ""
-            # 更新风格预览
-            if hasattr(self, 'style_preview_text'):
-                self.style_preview_text.setText("请选择一个风格")
+    def update_status_style(self, item, status):
+        """更新状态列样式（保留用于兼容性）"""
+        if status == "等待中":
+            item.setBackground(QColor("#f0f0f0"))
+            item.setForeground(QColor("#666"))
+        elif status == "生成中":
+            item.setBackground(QColor("#e3f2fd"))
+            item.setForeground(QColor("#1976d2"))
+        elif status == "成功":
+            item.setBackground(QColor("#e8f5e8"))
+            item.setForeground(QColor("#388e3c"))
+        elif status == "失败":
+            item.setBackground(QColor("#ffebee"))
+            item.setForeground(QColor("#d32f2f"))
+    
+    def update_image_display(self, row, data):
+        """更新图片显示"""
+        item = self.prompt_table.item(row, 5)  # 更新列索引：图片列现在是第5列
+        if not item:
+            return
+            
+        if data['status'] == '成功':
+            # 显示缩略图（从本地文件加载）
+            self.load_and_set_thumbnail(row, data['number'])
+        elif data['status'] == '失败':
+            # 显示详细的失败信息
+            error_msg = data.get('error_msg', '生成失败')
+            # 简化错误信息，保留关键部分
+            if len(error_msg) > 100:
+                # 截取关键错误信息
+                error_msg = error_msg[:100] + "..."
+            
+            item.setText(f"❌ 失败:\n{error_msg}")
+            item.setToolTip(data.get('error_msg', '生成失败'))  # 完整错误信息作为提示
+            item.setForeground(QColor("#d32f2f"))
+            item.setIcon(QIcon())  # 清除图标
         else:
-            if style_name in self.style_library:
-                self.current_style = style_name
-                self.custom_style_content = self.style_library[style_name]['content']
-                
-                # 更新使用次数
-                self.style_library[style_name]['usage_count'] = self.style_library[style_name].get('usage_count', 0) + 1
-                
-                # 更新风格预览
-                if hasattr(self, 'style_preview_text'):
-                    preview_text = self.custom_style_content
-                    # 缩短显示文本，但保留关键信息
-                    if len(preview_text) > 60:
-                        preview_text = preview_text[:60] + "..."
-                    self.style_preview_text.setText(preview_text)
-        
-        # 保存配置
-        self.save_config()
+            # 其他状态（等待中、生成中等）
+            item.setText("")
+            item.setIcon(QIcon())  # 清除图标
+            item.setToolTip("")
     
-    def handle_image_drop(self, image_files, drop_row):
-        """处理图片拖拽事件 - 只添加到参考图列"""
+    @profiled
+    def load_and_set_thumbnail(self, row, image_number):
+        """从本地文件加载并设置缩略图"""
+        item = self.prompt_table.item(row, 5)  # 使用正确的列索引5
+        if not item:
+            return
+            
         try:
-            # 如果拖拽到空白区域（超出现有行范围），创建新行
-            if drop_row >= len(self.prompt_table_data):
-                # 创建新行，提示词保持默认值，只添加参考图
-                max_number = 0
-                for data in self.prompt_table_data:
-                    try:
-                        num = int(data['number'])
-                        max_number = max(max_number, num)
-                    except ValueError:
-                        continue
+            # 检查保存路径是否设置
+            if not self.save_path:
+                item.setText("路径未设置")
+                item.setToolTip("请先在设置中心配置保存路径")
+                item.setForeground(QColor("#ff9800"))
+                return
                 
-                new_number = str(max_number + 1)
-                new_data = {
-                    'number': new_number,
-                    'prompt': '新提示词',  # 保持默认提示词
-                    'status': '等待中',
-                    'image_url': '',
-                    'error_msg': '',
-                    'reference_images': list(image_files)  # 直接设置参考图片列表
-                }
-                self.prompt_table_data.append(new_data)
+            # 从数据中获取实际的文件名
+            data = self.prompt_table_data[row] if 0 <= row < len(self.prompt_table_data) else {}
+            filename = data.get('filename')
+            if not filename:
+                # 如果没有文件名，使用旧的命名规则作为后备
+                filename = f"{image_number}.png"
             
-            elif drop_row >= 0:
-                # 添加到现有行的参考图列表
-                data = self.prompt_table_data[drop_row]
-                existing_images = data.get('reference_images', [])
-                existing_images.extend(image_files)
-                data['reference_images'] = existing_images
+            file_path = os.path.join(self.save_path, filename)
             
-            # 刷新表格显示
-            self.refresh_prompt_table()
+            # 检查文件是否存在（索引中登记过的文件不再访问文件系统）
+            if not self.get_output_index().contains(filename) and not os.path.exists(file_path):
+                item.setText("文件未找到")
+                item.setToolTip(f"本地图片文件不存在: {filename}")
+                item.setForeground(QColor("#ff9800"))
+                return
             
-            # 显示简单的成功提示
-            if len(image_files) == 1:
-                image_name = os.path.basename(image_files[0])
-                print(f"参考图片已添加: {image_name}")
+            # 从本地文件加载图片
+            pixmap = QPixmap(file_path)
+            
+            if not pixmap.isNull():
+                # 缩放为缩略图大小（增大尺寸以提高观看体验）
+                thumbnail = pixmap.scaled(180, 180, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+                
+                # 设置图标，多张变体时标注数量
+                item.setIcon(QIcon(thumbnail))
+                variant_count = len(data.get('filenames') or [])
+                if variant_count > 1:
+                    item.setText(f"共{variant_count}张")
+                    item.setToolTip(f"双击查看大图（共 {variant_count} 张，可切换并设为主图）")
+                else:
+                    item.setText("")
+                    item.setToolTip("双击查看大图")
+            elif not os.path.exists(file_path):
+                # 索引登记后被移走或删除
+                item.setText("文件未找到")
+                item.setToolTip(f"本地图片文件不存在: {filename}")
+                item.setForeground(QColor("#ff9800"))
             else:
-                print(f"已添加 {len(image_files)} 张参考图片")
+                item.setText("格式错误")
+                item.setToolTip(f"图片格式无法识别: {filename}")
+                item.setForeground(QColor("#d32f2f"))
             
         except Exception as e:
-            QMessageBox.critical(self, "错误", f"处理拖拽图片时出错: {str(e)}")
+            error_msg = f"本地缩略图加载失败: {str(e)}"
+            
+            item.setText("加载失败")
+            item.setToolTip(error_msg)
+            item.setIcon(QIcon())  # 清除图标
+            item.setForeground(QColor("#d32f2f"))
     
-    def add_image_reference_prompt(self, image_path, insert_row=None):
-        """添加图片参考提示词（此方法现在用于其他场景，如果需要）"""
+    def on_table_cell_clicked(self, row, column):
+        """表格单元格点击事件"""
+        if column == 2:  # 提示词列 - 现在点击直接聚焦到内嵌编辑器
+            if row in self.active_editors:
+                editor = self.active_editors[row]
+                editor.setFocus()
+                self.focused_row = row
+    
+    def add_prompt(self):
+        """添加新提示词"""
         try:
-            # 获取图片文件名（不包括扩展名）
-            image_name = os.path.splitext(os.path.basename(image_path))[0]
-            
             # 生成新编号
             max_number = 0
             for data in self.prompt_table_data:
@@ -4628,129 +7938,47 @@ class MainWindow(QMainWindow):
                     num = int(data['number'])
                     max_number = max(max_number, num)
                 except ValueError:
-                    continue
+                    pass
             
             new_number = str(max_number + 1)
             
-            # 创建新的提示词数据
+            # 添加新行数据
             new_data = {
                 'number': new_number,
-                'prompt': f'参考图片「{image_name}」',  # 初始提示词
+                'prompt': '新提示词',
                 'status': '等待中',
                 'image_url': '',
                 'error_msg': '',
-                'reference_images': [image_path]  # 保存参考图片路径到列表
+                'reference_images': []  # 改为支持多张参考图片的列表
             }
             
-            # 插入到指定位置或末尾
-            if insert_row is not None and 0 <= insert_row < len(self.prompt_table_data):
-                self.prompt_table_data.insert(insert_row + 1, new_data)
-            else:
-                self.prompt_table_data.append(new_data)
-                
-        except Exception as e:
-            raise Exception(f"添加图片参考失败: {str(e)}")
-    
-    def show_reference_image(self, row, img_index=0):
-        """显示参考图片"""
-        if 0 <= row < len(self.prompt_table_data):
-            data = self.prompt_table_data[row]
-            reference_images = data.get('reference_images', [])
-            if img_index < len(reference_images):
-                image_path = reference_images[img_index]
-                if os.path.exists(image_path):
-                    dialog = ReferenceImageDialog(image_path, data['prompt'], self)
-                    dialog.exec()
-                else:
-                    QMessageBox.warning(self, "警告", f"参考图片不存在: {image_path}")
-    
-    def delete_single_reference_image(self, row, img_index):
-        """删除单张参考图片"""
-        if 0 <= row < len(self.prompt_table_data):
-            data = self.prompt_table_data[row]
-            reference_images = data.get('reference_images', [])
-            
-            if 0 <= img_index < len(reference_images):
-                img_name = os.path.basename(reference_images[img_index])
-                reply = QMessageBox.question(
-                    self,
-                    "确认删除",
-                    f"确定要删除这张参考图片吗？\n\n图片: {img_name}\n\n注意：这只会移除图片关联，不会删除原始文件。",
-                    QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
-                    QMessageBox.StandardButton.No
-                )
-                
-                if reply == QMessageBox.StandardButton.Yes:
-                    # 从列表中删除这张图片
-                    reference_images.pop(img_index)
-                    data['reference_images'] = reference_images
-                    # 刷新表格显示
-                    self.refresh_prompt_table()
-    
-    def add_more_reference_images(self, row):
-        """为指定行添加更多参考图片"""
-        if 0 <= row < len(self.prompt_table_data):
-            file_paths, _ = QFileDialog.getOpenFileNames(
-                self,
-                "选择参考图片",
-                "",
-                "图片文件 (*.png *.jpg *.jpeg *.bmp *.gif);;所有文件 (*.*)"
-            )
+            self.prompt_table_data.append(new_data)
+            self.refresh_prompt_table()
+            self.update_prompt_stats()
             
-            if file_paths:
-                data = self.prompt_table_data[row]
-                reference_images = data.get('reference_images', [])
-                
-                # 添加新选择的图片
-                reference_images.extend(file_paths)
-                data['reference_images'] = reference_images
-                
-                # 刷新表格显示
-                self.refresh_prompt_table()
-    
-    def manage_reference_images(self, row):
-        """打开参考图片管理对话框"""
-        if 0 <= row < len(self.prompt_table_data):
-            data = self.prompt_table_data[row]
-            reference_images = data.get('reference_images', [])
+            # 自动选中新添加的行
+            new_row = len(self.prompt_table_data) - 1
+            self.prompt_table.selectRow(new_row)
             
-            if not reference_images:
-                QMessageBox.information(self, "提示", "该行没有参考图片")
-                return
+            # 使用QTimer延迟编辑，确保表格完全更新后再开始编辑
+            QTimer.singleShot(100, lambda: self.edit_new_prompt_item(new_row))
             
-            # 创建管理对话框
-            dialog = ReferenceImagesManagerDialog(reference_images, self)
-            if dialog.exec() == QDialog.DialogCode.Accepted:
-                # 更新参考图片列表
-                data['reference_images'] = dialog.get_images()
-                self.refresh_prompt_table()
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"添加提示词失败: {str(e)}")
     
-    def delete_reference_image(self, row):
-        """删除所有参考图片（兼容旧版本）"""
-        if 0 <= row < len(self.prompt_table_data):
-            data = self.prompt_table_data[row]
-            reference_images = data.get('reference_images', [])
-            
-            if reference_images:
-                reply = QMessageBox.question(
-                    self, 
-                    "确认删除", 
-                    f"确定要删除第 {row + 1} 行的所有参考图片吗？\n\n共 {len(reference_images)} 张图片\n\n注意：这只会移除图片关联，不会删除原始文件。",
-                    QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
-                    QMessageBox.StandardButton.No
-                )
-                
-                if reply == QMessageBox.StandardButton.Yes:
-                    # 清除所有参考图片关联
-                    data['reference_images'] = []
-                    
-                    # 刷新表格显示
-                    self.refresh_prompt_table()
-                    
-                    QMessageBox.information(self, "删除成功", f"已删除第 {row + 1} 行的参考图片关联")
+    def edit_new_prompt_item(self, row):
+        """延迟编辑新添加的提示词项"""
+        try:
+            if 0 <= row < self.prompt_table.rowCount():
+                item = self.prompt_table.item(row, 1)  # 提示词列
+                if item:
+                    self.prompt_table.editItem(item)
+        except Exception as e:
+            # 如果编辑失败，不要崩溃，只是记录错误
+            print(f"编辑新项失败: {str(e)}")
     
-    def clear_selected_reference_images(self):
-        """清除选中行的参考图片"""
+    def delete_selected_prompts(self):
+        """删除选中的提示词"""
         selected_rows = set()
         
         # 优先检查复选框选择
@@ -4767,1417 +7995,2457 @@ class MainWindow(QMainWindow):
                 selected_rows.add(item.row())
         
         if not selected_rows:
-            QMessageBox.warning(self, "提示", "请先选择要清除参考图的提示词（可以通过复选框选择或点击行选择）")
+            QMessageBox.warning(self, "提示", "请先选择要删除的提示词（可以通过复选框选择或点击行选择）")
             return
         
-        # 统计有参考图的行数
-        rows_with_ref_images = []
-        for row in selected_rows:
+        reply = QMessageBox.question(
+            self,
+            "确认删除",
+            f"确定要删除选中的 {len(selected_rows)} 个提示词吗？",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+            QMessageBox.StandardButton.No
+        )
+        
+        if reply == QMessageBox.StandardButton.Yes:
+            # 从大到小删除，避免索引变化
+            for row in sorted(selected_rows, reverse=True):
+                if 0 <= row < len(self.prompt_table_data):
+                    del self.prompt_table_data[row]
+            
+            self.refresh_prompt_table()
+            self.update_prompt_stats()
+    
+    def on_table_cell_changed(self, row, column):
+        """表格单元格内容改变"""
+        if 0 <= row < len(self.prompt_table_data):
+            item = self.prompt_table.item(row, column)
+            if item:
+                if column == 1:  # 编号列
+                    self.prompt_table_data[row]['number'] = item.text().strip()
+                elif column == 2:  # 提示词列
+                    old_prompt = self.prompt_table_data[row]['prompt']
+                    new_prompt = item.text().strip()
+                    self.prompt_table_data[row]['prompt'] = new_prompt
+                    
+                    # 更新提示词编号映射
+                    if old_prompt in self.prompt_numbers:
+                        number = self.prompt_numbers.pop(old_prompt)
+                        self.prompt_numbers[new_prompt] = number
+                    
+                    # 设置工具提示显示完整内容
+                    item.setToolTip(new_prompt)
+                    
+                    # 调整行高以适应新内容
+                    self.prompt_table.resizeRowToContents(row)
+                    
+                    # 如果文本很长，确保表格能正确显示
+                    if len(new_prompt) > 100:  # 长文本时强制刷新
+                        self.prompt_table.viewport().update()
+    
+    def on_table_cell_double_clicked(self, row, column):
+        """表格单元格双击"""
+        if column == 2:  # 提示词列 - 直接编辑，不弹出对话框
+            # 不需要特殊处理，让默认编辑器处理即可
+            pass
+        elif column == 5:  # 生成状态/图片列（合并后）
             if 0 <= row < len(self.prompt_table_data):
                 data = self.prompt_table_data[row]
-                if data.get('reference_images', []):
-                    rows_with_ref_images.append(row)
+                if data['status'] == '成功':
+                    # 打开图片查看对话框（从本地文件加载）
+                    dialog = ImageViewDialog(data['number'], data['prompt'], self.save_path, self)
+                    dialog.exec()
+    
+    def update_batch_optimize_button(self):
+        """更新批量优化按钮状态和全选按钮文本"""
+        selected_count = 0
+        total_count = len(self.prompt_table_data)
+        
+        for row in range(total_count):
+            checkbox = self.prompt_table.cellWidget(row, 0)
+            if checkbox and checkbox.isChecked():
+                selected_count += 1
+        
+        # 更新批量优化按钮
+        self.batch_optimize_button.setEnabled(selected_count > 0)
+        
+        # 更新全选按钮文本
+        if hasattr(self, 'select_all_button') and self.select_all_button:
+            if selected_count == 0:
+                self.select_all_button.setText("全选")
+            elif selected_count == total_count:
+                self.select_all_button.setText("取消全选")
+            else:
+                self.select_all_button.setText(f"全选({selected_count}/{total_count})")
+        
+    def toggle_select_all(self):
+        """切换全选状态"""
+        # 检查当前是否已全选
+        all_selected = True
+        for row in range(len(self.prompt_table_data)):
+            checkbox = self.prompt_table.cellWidget(row, 0)
+            if checkbox and not checkbox.isChecked():
+                all_selected = False
+                break
+        
+        # 切换状态
+        new_state = not all_selected
+        for row in range(len(self.prompt_table_data)):
+            checkbox = self.prompt_table.cellWidget(row, 0)
+            if checkbox:
+                checkbox.setChecked(new_state)
         
-        if not rows_with_ref_images:
-            QMessageBox.information(self, "提示", "选中的提示词没有关联的参考图片")
+        # 更新按钮状态（会自动更新全选按钮文本）
+        self.update_batch_optimize_button()
+    
+    def batch_optimize_prompts(self):
+        """批量优化提示词"""
+        if not self.openrouter_api_key:
+            QMessageBox.warning(self, "配置错误", "请先在设置中心配置OpenRouter API密钥")
             return
         
-        reply = QMessageBox.question(
-            self,
-            "确认清除",
-            f"确定要清除 {len(rows_with_ref_images)} 个提示词的参考图片关联吗？\n\n注意：这只会移除图片关联，不会删除原始文件。",
-            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
-            QMessageBox.StandardButton.No
-        )
+        # 收集选中的提示词
+        selected_prompts = []
+        for row in range(len(self.prompt_table_data)):
+            checkbox = self.prompt_table.cellWidget(row, 0)
+            if checkbox and checkbox.isChecked():
+                selected_prompts.append({
+                    'row': row,
+                    'data': self.prompt_table_data[row]
+                })
         
-        if reply == QMessageBox.StandardButton.Yes:
-            # 清除选中行的参考图片关联
-            cleared_count = 0
-            for row in rows_with_ref_images:
-                if 0 <= row < len(self.prompt_table_data):
-                    self.prompt_table_data[row]['reference_images'] = []
-                    cleared_count += 1
-            
-            # 刷新表格显示
+        if not selected_prompts:
+            QMessageBox.information(self, "提示", "请至少选择一个提示词进行优化")
+            return
+
+        # 结果统一收集到审阅窗口，由用户批量采用/拒绝
+        self.optimize_threadpool.setMaxThreadCount(max(1, self.optimize_concurrency))
+        review_dialog = BatchOptimizationReviewDialog(
+            [(info['row'], info['data']['number'], info['data']['prompt']) for info in selected_prompts], self)
+        review_dialog.applied.connect(self.apply_batch_optimization)
+        # 停止或关闭审阅窗口时中断进行中的请求；排队中的任务开始时看到取消标记即报告"已取消"，
+        # 不清空共享线程池，以免误删单条优化等其他任务
+        cancel_event = threading.Event()
+        review_dialog.cancel_requested.connect(cancel_event.set)
+        review_dialog.finished.connect(lambda _: review_dialog.cancel_requested.emit())
+        review_dialog.show()
+        self.batch_review_dialog = review_dialog
+
+        # 按批量大小打包（每包一次请求），后台并发处理（并发数受线程池限制）
+        batch_size = max(1, self.optimize_batch_size)
+        for start in range(0, len(selected_prompts), batch_size):
+            chunk = selected_prompts[start:start + batch_size]
+            worker = OptimizeWorker([(info['row'], info['data']['prompt']) for info in chunk],
+                                    self.openrouter_api_key, self.ai_model, self.meta_prompt,
+                                    stream=self.optimize_stream, cancel_event=cancel_event)
+            worker.signals.finished.connect(review_dialog.set_result)
+            worker.signals.error.connect(review_dialog.set_error)
+            worker.signals.partial.connect(review_dialog.set_partial)
+            self.optimize_threadpool.start(worker)
+
+    def apply_batch_optimization(self, results):
+        """应用批量审阅中被采用的优化结果"""
+        applied_count = 0
+        skipped_count = 0
+        for row, original_prompt, optimized_prompt in results:
+            # 优化期间表格可能被编辑，提示词不一致时跳过，避免覆盖错误的行
+            if not (0 <= row < len(self.prompt_table_data)) or self.prompt_table_data[row]['prompt'] != original_prompt:
+                skipped_count += 1
+                continue
+            self.prompt_table_data[row]['prompt'] = optimized_prompt
+            self.record_optimization_history(original_prompt, optimized_prompt)
+            applied_count += 1
+
+        if applied_count:
             self.refresh_prompt_table()
-            self.update_prompt_stats()
-            
-            QMessageBox.information(self, "清除完成", f"成功清除了 {cleared_count} 个参考图片关联")
-    
-    def update_prompt_stats(self):
-        """更新提示词统计"""
-        count = len(self.prompt_table_data)
-        reference_count = len([data for data in self.prompt_table_data if data.get('reference_images', [])])
-        if reference_count > 0:
-            self.prompt_stats_label.setText(f"总计: {count} 个提示词（包含 {reference_count} 个图片参考）")
-        else:
-            self.prompt_stats_label.setText(f"总计: {count} 个提示词")
+            self.save_config()
+
+        message = f"已应用 {applied_count} 条优化结果"
+        if skipped_count:
+            message += f"\n{skipped_count} 条因提示词已被修改而跳过"
+        QMessageBox.information(self, "批量优化", message)
     
-    def refresh_prompt_table(self):
-        """刷新提示词表格显示"""
-        # 清理无效的编辑器引用
-        self.clean_inactive_editors()
-        
-        # 清理超出当前数据范围的编辑器
-        current_row_count = len(self.prompt_table_data)
-        rows_to_remove = [row for row in self.active_editors.keys() if row >= current_row_count]
-        for row in rows_to_remove:
-            del self.active_editors[row]
+    def generate_single_prompt(self, row):
+        """生成单个提示词的图片"""
+        # 检查配置
+        if not self.get_current_api_key():
+            QMessageBox.warning(self, "配置不完整", "请先在设置中心配置API密钥")
+            return
         
-        self.prompt_table.setRowCount(current_row_count)
+        if not self.save_path:
+            QMessageBox.warning(self, "配置不完整", "请先在设置中心设置保存路径")
+            return
         
-        for row, data in enumerate(self.prompt_table_data):
-            # 选择列 - 复选框
-            checkbox = QCheckBox()
-            checkbox.setStyleSheet("""
-                QCheckBox {
-                    margin: 5px;
-                    spacing: 5px;
-                }
-                QCheckBox::indicator {
-                    width: 18px;
-                    height: 18px;
-                    border: 2px solid #ced4da;
-                    border-radius: 4px;
-                    background-color: #ffffff;
-                }
-                QCheckBox::indicator:hover {
-                    border-color: #007bff;
-                    background-color: #f8f9ff;
-                }
-                QCheckBox::indicator:checked {
-                    background-color: #007bff;
-                    border-color: #007bff;
-                    image: url(data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iMTIiIGhlaWdodD0iOSIgdmlld0JveD0iMCAwIDEyIDkiIGZpbGw9Im5vbmUiIHhtbG5zPSJodHRwOi8vd3d3LnczLm9yZy8yMDAwL3N2ZyI+CjxwYXRoIGQ9Ik0xMS4yNSAwLjc1TDQuNSA3LjUgMC43NSAzLjc1IiBzdHJva2U9IndoaXRlIiBzdHJva2Utd2lkdGg9IjEuNSIgc3Ryb2tlLWxpbmVjYXA9InJvdW5kIiBzdHJva2UtbGluZWpvaW49InJvdW5kIi8+Cjwvc3ZnPgo=);
-                }
-                QCheckBox::indicator:checked:hover {
-                    background-color: #0056b3;
-                    border-color: #0056b3;
-                }
-                QCheckBox::indicator:indeterminate {
-                    background-color: #6c757d;
-                    border-color: #6c757d;
-                    image: url(data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iMTAiIGhlaWdodD0iMiIgdmlld0JveD0iMCAwIDEwIDIiIGZpbGw9Im5vbmUiIHhtbG5zPSJodHRwOi8vd3d3LnczLm9yZy8yMDAwL3N2ZyI+CjxyZWN0IHdpZHRoPSIxMCIgaGVpZ2h0PSIyIiBmaWxsPSJ3aGl0ZSIvPgo8L3N2Zz4K);
-                }
-            """)
-            checkbox.stateChanged.connect(lambda state, r=row: self.on_checkbox_changed(state, r))
-            self.prompt_table.setCellWidget(row, 0, checkbox)
-            
-            # 编号列
-            number_item = QTableWidgetItem(data['number'])
-            number_item.setFlags(number_item.flags() & ~Qt.ItemFlag.ItemIsEditable)  # 不可编辑
-            self.prompt_table.setItem(row, 1, number_item)
-            
-            # 提示词列 - 强制重新创建编辑器以确保样式正确应用
-            # 创建新的编辑器
-            prompt_editor = self.create_prompt_editor(data['prompt'], row)
-            self.prompt_table.setCellWidget(row, 2, prompt_editor)
-            
-            
-            # 参考图片列 - 简洁信息显示
-            reference_images = data.get('reference_images', [])
-            if reference_images:
-                # 创建简洁的参考图信息widget
-                ref_widget = QWidget()
-                ref_layout = QVBoxLayout(ref_widget)
-                ref_layout.setContentsMargins(4, 4, 4, 4)
-                ref_layout.setSpacing(3)
-                
-                # 图片数量信息
-                info_label = QLabel(f"📷 {len(reference_images)} 张图片")
-                info_label.setStyleSheet("""
-                    QLabel {
-                        color: #333;
-                        font-size: 12px;
-                        font-weight: bold;
-                        background-color: #f8f9fa;
-                        border: 1px solid #ddd;
-                        border-radius: 4px;
-                        padding: 6px;
-                        text-align: center;
-                    }
-                """)
-                info_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-                ref_layout.addWidget(info_label)
-                
-                # 操作按钮
-                button_widget = QWidget()
-                button_layout = QHBoxLayout(button_widget)
-                button_layout.setContentsMargins(0, 0, 0, 0)
-                button_layout.setSpacing(3)
-                
-                # 管理按钮（主要功能）
-                manage_button = QPushButton("管理预览")
-                manage_button.setStyleSheet("""
-                    QPushButton {
-                        background-color: #17a2b8;
-                        color: white;
-                        border: none;
-                        padding: 4px 8px;
-                        border-radius: 4px;
-                        font-size: 11px;
-                        font-weight: bold;
-                    }
-                    QPushButton:hover {
-                        background-color: #138496;
-                    }
-                """)
-                manage_button.clicked.connect(lambda checked, r=row: self.manage_reference_images(r))
-                
-                # 添加按钮
-                add_button = QPushButton("添加")
-                add_button.setStyleSheet("""
-                    QPushButton {
-                        background-color: #28a745;
-                        color: white;
-                        border: none;
-                        padding: 4px 8px;
-                        border-radius: 4px;
-                        font-size: 11px;
-                    }
-                    QPushButton:hover {
-                        background-color: #218838;
-                    }
-                """)
-                add_button.clicked.connect(lambda checked, r=row: self.add_more_reference_images(r))
-                
-                button_layout.addWidget(manage_button)
-                button_layout.addWidget(add_button)
-                
-                ref_layout.addWidget(button_widget)
-                
-                self.prompt_table.setCellWidget(row, 3, ref_widget)
-            else:
-                # 清除可能存在的widget并设置空列
-                self.prompt_table.setCellWidget(row, 3, None)  # 清除之前的widget
-                empty_item = QTableWidgetItem("无参考图")
-                empty_item.setFlags(empty_item.flags() & ~Qt.ItemFlag.ItemIsEditable)
-                empty_item.setForeground(QColor("#999999"))  # 灰色文本
-                empty_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-                empty_item.setToolTip("拖拽图片到此行来添加参考图片")
-                self.prompt_table.setItem(row, 3, empty_item)
-            
-            # 图库列 - 添加选择按钮
-            gallery_button = QPushButton("选择")
-            gallery_button.setToolTip("从图库选择图片")
-            gallery_button.setStyleSheet("""
-                QPushButton {
-                    background-color: #ff9800;
-                    color: white;
-                    border: none;
-                    padding: 6px 10px;
-                    border-radius: 4px;
-                    font-size: 15px;
-                }
-                QPushButton:hover {
-                    background-color: #f57c00;
-                }
-            """)
-            gallery_button.clicked.connect(lambda checked, r=row: self.open_gallery_dialog(r))
-            self.prompt_table.setCellWidget(row, 4, gallery_button)
-            
-            # 生成状态/图片列（合并原状态列和图片列）
-            status_image_item = QTableWidgetItem()
-            status_image_item.setFlags(status_image_item.flags() & ~Qt.ItemFlag.ItemIsEditable)  # 不可编辑
-            status_image_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-            self.prompt_table.setItem(row, 5, status_image_item)
-            # 更新合并列的显示内容
-            self.update_status_image_display(row, data)
-            
-            # AI优化列 - 添加优化按钮
-            optimize_button = QPushButton("🤖 优化")
-            optimize_button.setToolTip("使用AI优化这条提示词")
-            optimize_button.setStyleSheet("""
-                QPushButton {
-                    background-color: #9c27b0;
-                    color: white;
-                    border: none;
-                    padding: 6px 10px;
-                    border-radius: 4px;
-                    font-size: 15px;
-                    font-weight: bold;
-                }
-                QPushButton:hover {
-                    background-color: #7b1fa2;
-                }
-                QPushButton:disabled {
-                    background-color: #ccc;
-                    color: #666;
-                }
-            """)
-            # 检查AI优化是否已配置
-            if not self.openrouter_api_key.strip() or not self.meta_prompt.strip():
-                optimize_button.setEnabled(False)
-                optimize_button.setToolTip("请先在设置中心配置AI优化功能")
-            else:
-                optimize_button.clicked.connect(lambda checked, r=row: self.optimize_single_prompt(r))
-            
-            self.prompt_table.setCellWidget(row, 6, optimize_button)
+        if 0 <= row < len(self.prompt_table_data):
+            data = self.prompt_table_data[row]
+            original_prompt = data['prompt']
             
-            # 单独生成列 - 添加生成按钮
-            generate_button = QPushButton("生成")
-            generate_button.setToolTip("单独生成这条提示词的图片")
-            generate_button.setStyleSheet("""
-                QPushButton {
-                    background-color: #4caf50;
-                    color: white;
-                    border: none;
-                    padding: 6px 10px;
-                    border-radius: 4px;
-                    font-size: 15px;
-                    font-weight: bold;
-                }
-                QPushButton:hover {
-                    background-color: #388e3c;
-                }
-                QPushButton:disabled {
-                    background-color: #ccc;
-                    color: #666;
-                }
-            """)
-            # 检查API配置
-            if not self.get_current_api_key() or not self.save_path:
-                generate_button.setEnabled(False)
-                generate_button.setToolTip("请先在设置中心配置API密钥和保存路径")
-            else:
-                generate_button.clicked.connect(lambda checked, r=row: self.generate_single_prompt(r))
+            # 处理提示词 - 添加风格和比例
+            prompt = original_prompt
             
-            self.prompt_table.setCellWidget(row, 7, generate_button)
+            # 添加风格提示词和图片比例
+            prompt = compose_prompt(prompt, self.use_current_style(), self.image_ratio)
             
-            # 调整行高以适应内容
-            self.prompt_table.resizeRowToContents(row)
-    
-    def update_status_image_display(self, row, data):
-        """更新合并的状态/图片列显示"""
-        item = self.prompt_table.item(row, 5)  # 合并后的列索引是5
-        if not item:
-            return
-        
-        status = data['status']
-        
-        if status == '成功':
-            # 显示缩略图（从本地文件加载）
-            self.load_and_set_thumbnail(row, data['number'])
-            item.setBackground(QColor("#e8f5e8"))
-        elif status == '失败':
-            # 显示失败信息和状态颜色
-            error_msg = data.get('error_msg', '生成失败')
-            if len(error_msg) > 50:
-                error_msg = error_msg[:50] + "..."
+            # 获取图片数据映射
+            image_data_map = self.get_image_data_map()
             
-            item.setText(f"❌ 失败\n{error_msg}")
-            item.setToolTip(data.get('error_msg', '生成失败'))
-            item.setBackground(QColor("#ffebee"))
-            item.setForeground(QColor("#d32f2f"))
-            item.setIcon(QIcon())
-        elif status == '生成中':
-            # 显示进度状态
-            item.setText("生成中...")
-            item.setBackground(QColor("#e3f2fd"))
-            item.setForeground(QColor("#1976d2"))
-            item.setIcon(QIcon())
-            item.setToolTip("正在生成图片，请等待...")
-        elif status == '等待中':
-            # 显示等待状态
-            item.setText("⏳ 等待中")
-            item.setBackground(QColor("#f0f0f0"))
-            item.setForeground(QColor("#666"))
-            item.setIcon(QIcon())
-            item.setToolTip("等待生成")
-        else:
-            # 其他状态
-            item.setText(f"{status}")
-            item.setBackground(QColor("#f8f9fa"))
-            item.setForeground(QColor("#666"))
-            item.setIcon(QIcon())
-    
-    def update_status_style(self, item, status):
-        """更新状态列样式（保留用于兼容性）"""
-        if status == "等待中":
-            item.setBackground(QColor("#f0f0f0"))
-            item.setForeground(QColor("#666"))
-        elif status == "生成中":
-            item.setBackground(QColor("#e3f2fd"))
-            item.setForeground(QColor("#1976d2"))
-        elif status == "成功":
-            item.setBackground(QColor("#e8f5e8"))
-            item.setForeground(QColor("#388e3c"))
-        elif status == "失败":
-            item.setBackground(QColor("#ffebee"))
-            item.setForeground(QColor("#d32f2f"))
-    
-    def update_image_display(self, row, data):
-        """更新图片显示"""
-        item = self.prompt_table.item(row, 5)  # 更新列索引：图片列现在是第5列
-        if not item:
-            return
+            # 从提示词中提取图片名称
+            image_names = self.extract_image_names(prompt)
             
-        if data['status'] == '成功':
-            # 显示缩略图（从本地文件加载）
-            self.load_and_set_thumbnail(row, data['number'])
-        elif data['status'] == '失败':
-            # 显示详细的失败信息
-            error_msg = data.get('error_msg', '生成失败')
-            # 简化错误信息，保留关键部分
-            if len(error_msg) > 100:
-                # 截取关键错误信息
-                error_msg = error_msg[:100] + "..."
+            # 获取对应的图片数据
+            image_data_list = []
+            for name in image_names:
+                if name in image_data_map:
+                    image_data_list.append(image_data_map[name])
             
-            item.setText(f"❌ 失败:\n{error_msg}")
-            item.setToolTip(data.get('error_msg', '生成失败'))  # 完整错误信息作为提示
-            item.setForeground(QColor("#d32f2f"))
-            item.setIcon(QIcon())  # 清除图标
-        else:
-            # 其他状态（等待中、生成中等）
-            item.setText("")
-            item.setIcon(QIcon())  # 清除图标
-            item.setToolTip("")
-    
-    def load_and_set_thumbnail(self, row, image_number):
-        """从本地文件加载并设置缩略图"""
-        item = self.prompt_table.item(row, 5)  # 使用正确的列索引5
-        if not item:
-            return
+            # 添加拖拽的参考图片（多图支持）
+            reference_images = data.get('reference_images', [])
+            for img_path in reference_images:
+                try:
+                    with open(img_path, 'rb') as f:
+                        image_data = base64.b64encode(f.read()).decode()
+                        image_name = os.path.basename(img_path)
+                        image_data_list.append({
+                            'name': image_name,
+                            'data': image_data,
+                            'type': 'drag_reference'
+                        })
+                except Exception as e:
+                    logging.warning(f"无法读取拖拽的参考图片 {img_path}: {str(e)}")
+            
+            # 获取对应的编号
+            number = self.prompt_numbers.get(original_prompt, str(row + 1))
+            
+            # 更新状态为生成中
+            data['status'] = '生成中'
+            self.refresh_prompt_table()
+            
+            # 创建工作线程
+            # 单条生成是用户主动要求出图，始终重新采样
+            self.start_image_job(
+                prompt, image_data_list, number,
+                lambda p, urls, num, info: self.handle_single_success(p, urls, num, row, original_prompt, info),
+                lambda p, err: self.handle_single_error(p, err, row, original_prompt),
+                lambda p, status: self.handle_single_progress(p, status, original_prompt),
+                fresh=True)
             
+            QMessageBox.information(self, "开始生成", f"已开始生成编号 {number} 的图片")
+    
+    @profiled
+    def handle_single_success(self, prompt, image_urls, number, row, original_prompt, info=None):
+        """处理单个提示词生成成功"""
         try:
-            # 检查保存路径是否设置
-            if not self.save_path:
-                item.setText("路径未设置")
-                item.setToolTip("请先在设置中心配置保存路径")
-                item.setForeground(QColor("#ff9800"))
+            if not (0 <= row < len(self.prompt_table_data)):
                 return
-                
-            # 从数据中获取实际的文件名
-            data = self.prompt_table_data[row] if 0 <= row < len(self.prompt_table_data) else {}
-            filename = data.get('filename')
-            if not filename:
-                # 如果没有文件名，使用旧的命名规则作为后备
-                filename = f"{image_number}.png"
+            data = self.prompt_table_data[row]
+            data['image_url'] = image_urls[0]
+            data['image_urls'] = image_urls
+            data['error_msg'] = ''
             
-            file_path = os.path.join(self.save_path, filename)
+            # 存储图片信息
+            self.generated_images[prompt] = image_urls[0]
             
-            # 检查文件是否存在
-            if not os.path.exists(file_path):
-                item.setText("文件未找到")
-                item.setToolTip(f"本地图片文件不存在: {filename}")
-                item.setForeground(QColor("#ff9800"))
-                return
+            # 后台下载全部图片，完成后再标记成功
+            self.start_image_download(data, image_urls, number,
+                                      lambda: self.finish_single_success(data, number), info)
             
-            # 从本地文件加载图片
-            pixmap = QPixmap(file_path)
+        except Exception as e:
+            logging.error(f"处理单个生成成功时出错: {str(e)}")
+            QMessageBox.critical(self, "处理错误", f"图片生成成功，但保存时出错: {str(e)}")
+    
+    def finish_single_success(self, data, number):
+        """单个提示词的图片下载完成"""
+        data['status'] = '成功'
+        data['progress_text'] = ''
+        
+        # 刷新显示
+        self.refresh_prompt_table()
+        
+        # 播放完成提示音
+        try:
+            if hasattr(winsound, 'SND_ASYNC'):
+                winsound.MessageBeep()
+        except:
+            pass
+        
+        count = len(data.get('image_urls') or [])
+        if count > 1:
+            QMessageBox.information(self, "生成完成", f"编号 {number} 的 {count} 张图片生成成功！双击图片可切换并设为主图")
+        else:
+            QMessageBox.information(self, "生成完成", f"编号 {number} 的图片生成成功！")
+    
+    @profiled
+    def handle_single_error(self, prompt, error_msg, row, original_prompt):
+        """处理单个提示词生成失败"""
+        try:
+            # 更新数据状态
+            if 0 <= row < len(self.prompt_table_data):
+                self.prompt_table_data[row]['status'] = '失败'
             
-            if not pixmap.isNull():
-                # 缩放为缩略图大小（增大尺寸以提高观看体验）
-                thumbnail = pixmap.scaled(180, 180, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
-                
-                # 设置图标
-                item.setIcon(QIcon(thumbnail))
-                item.setText("")
-                item.setToolTip("双击查看大图")
-            else:
-                item.setText("格式错误")
-                item.setToolTip(f"图片格式无法识别: {filename}")
-                item.setForeground(QColor("#d32f2f"))
+            # 刷新显示
+            self.refresh_prompt_table()
+            
+            QMessageBox.critical(self, "生成失败", f"图片生成失败:\n{error_msg}")
             
         except Exception as e:
-            error_msg = f"本地缩略图加载失败: {str(e)}"
+            logging.error(f"处理单个生成失败时出错: {str(e)}")
+    
+    @profiled
+    def handle_single_progress(self, prompt, status, original_prompt):
+        """处理单个提示词生成进度"""
+        try:
+            # 找到对应的行并更新状态
+            for i, data in enumerate(self.prompt_table_data):
+                if data['prompt'] == original_prompt:
+                    data['status'] = status
+                    break
             
-            item.setText("加载失败")
-            item.setToolTip(error_msg)
-            item.setIcon(QIcon())  # 清除图标
-            item.setForeground(QColor("#d32f2f"))
+            # 刷新显示
+            self.refresh_prompt_table()
+            
+        except Exception as e:
+            logging.error(f"处理单个生成进度时出错: {str(e)}")
+
+    def optimize_single_prompt(self, row):
+        """优化单个提示词"""
+        if not self.openrouter_api_key:
+            QMessageBox.warning(self, "配置错误", "请先在设置中心配置OpenRouter API密钥")
+            return
+        
+        if 0 <= row < len(self.prompt_table_data):
+            data = self.prompt_table_data[row]
+            self.optimize_prompt(row, data)
     
-    def on_table_cell_clicked(self, row, column):
-        """表格单元格点击事件"""
-        if column == 2:  # 提示词列 - 现在点击直接聚焦到内嵌编辑器
-            if row in self.active_editors:
-                editor = self.active_editors[row]
-                editor.setFocus()
-                self.focused_row = row
+    def optimize_prompt(self, row, data):
+        """调用OpenRouter API优化提示词（后台执行，结果流式显示在对话框中）"""
+        original_prompt = data['prompt']
+        cancel_event = threading.Event()
+        dialog = OptimizationResultDialog(original_prompt, "", self, streaming=True)
+        dialog.stop_requested.connect(cancel_event.set)
+
+        worker = OptimizeWorker([(row, original_prompt)], self.openrouter_api_key, self.ai_model,
+                                self.meta_prompt, stream=self.optimize_stream, cancel_event=cancel_event)
+        worker.signals.partial.connect(lambda r, text: dialog.set_streaming_text(text))
+        worker.signals.finished.connect(lambda r, p, text: dialog.finish_streaming(text))
+        worker.signals.error.connect(lambda r, p, err: dialog.fail_streaming(err))
+        self.optimize_threadpool.start(worker)
+
+        accepted = dialog.exec() == QDialog.DialogCode.Accepted
+        # 对话框关闭后不再需要剩余输出
+        cancel_event.set()
+        if accepted:
+            self.apply_optimization_result(row, original_prompt, dialog.get_final_optimized_text())
+
+    def apply_optimization_result(self, row, original_prompt, final_optimized_prompt):
+        """应用单条优化结果"""
+        if not (0 <= row < len(self.prompt_table_data)) or not final_optimized_prompt.strip():
+            return
+        self.prompt_table_data[row]['prompt'] = final_optimized_prompt
+
+        # 保存到历史记录
+        self.record_optimization_history(original_prompt, final_optimized_prompt)
+
+        # 刷新表格显示
+        self.refresh_prompt_table()
+        self.save_config()
+
+    def record_optimization_history(self, original_prompt, optimized_prompt):
+        """记录一条优化历史"""
+        history_item = {
+            'timestamp': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'original': original_prompt,
+            'optimized': optimized_prompt,
+            'model': self.ai_model,
+            'meta_prompt': self.meta_prompt
+        }
+        self.optimization_history.append(history_item)
     
-    def add_prompt(self):
-        """添加新提示词"""
-        try:
-            # 生成新编号
-            max_number = 0
-            for data in self.prompt_table_data:
-                try:
-                    num = int(data['number'])
-                    max_number = max(max_number, num)
-                except ValueError:
-                    pass
+    def use_current_style(self):
+        """返回当前生效的风格提示词，并累计所选风格的使用次数"""
+        if self.current_style and self.current_style in self.style_library:
+            self.style_library[self.current_style]['usage_count'] = self.style_library[self.current_style].get('usage_count', 0) + 1
+        return resolve_style_content(self.style_library, self.current_style, self.custom_style_content)
+    
+    def get_image_data_map(self):
+        """获取所有图片数据映射"""
+        image_data_map = {}
+        for cat, links in self.category_links.items():
+            for link in links:
+                if link['name']:
+                    image_data_map[link['name']] = link
+        return image_data_map
+    
+    def extract_image_names(self, prompt):
+        """从提示词中提取图片名称"""
+        return extract_image_names(prompt, self.category_links)
+    
+    def start_generation(self):
+        """开始生成图片"""
+        # 检查配置
+        if not self.get_current_api_key():
+            QMessageBox.warning(self, "配置不完整", "请先在设置中心配置API密钥")
+            return
+        
+        if not self.save_path:
+            QMessageBox.warning(self, "配置不完整", "请先在设置中心设置保存路径")
+            return
+        
+        # 检查是否有提示词
+        if not self.prompt_table_data:
+            QMessageBox.warning(self, "提示", "请先添加提示词或导入CSV文件")
+            return
+        
+        self.save_config()
+        
+        # 获取提示词 - 只处理等待中的提示词
+        prompts = []
+        original_prompts = []
+        
+        # 只获取状态为'等待中'的提示词
+        for data in self.prompt_table_data:
+            if data.get('status', '等待中') == '等待中':
+                prompts.append(data['prompt'])
+                original_prompts.append(data['prompt'])
+        
+        # 检查是否有需要生成的提示词
+        if not prompts:
+            QMessageBox.information(self, "提示", "没有需要生成的新提示词！\n\n所有提示词都已生成完成或正在生成中。")
+            return
             
-            new_number = str(max_number + 1)
+        # 刷新表格显示
+        self.refresh_prompt_table()
+        
+        # 添加风格提示词和图片比例
+        style_content = self.use_current_style()
+        prompts = [compose_prompt(p, style_content, self.image_ratio) for p in prompts]
+        
+        # 设置计数器（保持兼容性）
+        self.total_images = len(prompts)
+        self.completed_images = 0
+        
+        # 显示整体进度
+        self.overall_progress_bar.setVisible(True)
+        self.overall_progress_label.setText(f"开始生成 {len(prompts)} 张新图片...")
+        
+        # 更新进度显示
+        self.update_generation_progress()
+        
+        # 更新按钮状态（但不禁用，允许继续添加新提示词）
+        self.generate_button.setText("继续生成新增")
+        
+        # 获取图片数据映射
+        image_data_map = self.get_image_data_map()
+        
+        # 为每个提示词创建工作线程
+        for i, prompt in enumerate(prompts):
+            # 从提示词中提取图片名称
+            image_names = self.extract_image_names(prompt)
             
-            # 添加新行数据
-            new_data = {
-                'number': new_number,
-                'prompt': '新提示词',
-                'status': '等待中',
-                'image_url': '',
-                'error_msg': '',
-                'reference_images': []  # 改为支持多张参考图片的列表
-            }
+            # 获取对应的图片数据
+            image_data_list = []
+            for name in image_names:
+                if name in image_data_map:
+                    image_data_list.append(image_data_map[name])
+            
+            # 获取对应的编号
+            original_prompt = original_prompts[i]
+            number = self.prompt_numbers.get(original_prompt, str(i + 1))
+            
+            self.start_image_job(
+                prompt, image_data_list, number,
+                lambda p, urls, num, info, idx=i, orig=original_prompt: self.handle_success(p, urls, num, idx, orig, info),
+                lambda p, err, idx=i, orig=original_prompt: self.handle_error(p, err, idx, orig),
+                lambda p, status, orig=original_prompt: self.handle_progress(p, status, orig))
+    
+    def start_regenerate_all(self):
+        """重新生成全部提示词"""
+        # 确认操作
+        msg_box = QMessageBox(self)
+        msg_box.setIcon(QMessageBox.Icon.Question)
+        msg_box.setWindowTitle("确认重新生成")
+        msg_box.setText("确定要重新生成全部提示词吗？\n\n这将重置所有状态并重新开始生成。")
+        msg_box.setStandardButtons(QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+        msg_box.setDefaultButton(QMessageBox.StandardButton.No)
+        fresh_checkbox = None
+        if self.generation_cache_enabled:
+            # 默认复用相同请求的已有图片，勾选后强制重新采样
+            fresh_checkbox = QCheckBox("重新采样（不复用相同请求的已生成图片）")
+            msg_box.setCheckBox(fresh_checkbox)
+        
+        if QMessageBox.StandardButton(msg_box.exec()) != QMessageBox.StandardButton.Yes:
+            return
+        fresh = fresh_checkbox is not None and fresh_checkbox.isChecked()
+        
+        # 检查配置
+        if not self.get_current_api_key():
+            QMessageBox.warning(self, "配置不完整", "请先在设置中心配置API密钥")
+            return
+        
+        if not self.save_path:
+            QMessageBox.warning(self, "配置不完整", "请先在设置中心设置保存路径")
+            return
+        
+        # 检查是否有提示词
+        if not self.prompt_table_data:
+            QMessageBox.warning(self, "提示", "请先添加提示词或导入CSV文件")
+            return
+        
+        self.save_config()
+        
+        # 获取所有提示词并重置状态
+        prompts = []
+        original_prompts = []
+        
+        # 重置所有状态
+        for data in self.prompt_table_data:
+            data['status'] = '等待中'
+            data['image_url'] = ''
+            data['error_msg'] = ''
+            prompts.append(data['prompt'])
+            original_prompts.append(data['prompt'])
             
-            self.prompt_table_data.append(new_data)
-            self.refresh_prompt_table()
-            self.update_prompt_stats()
+        # 刷新表格显示
+        self.refresh_prompt_table()
+        
+        # 添加风格提示词和图片比例
+        style_content = self.use_current_style()
+        prompts = [compose_prompt(p, style_content, self.image_ratio) for p in prompts]
+        
+        # 设置计数器（保持兼容性）
+        self.total_images = len(prompts)
+        self.completed_images = 0
+        
+        # 显示整体进度
+        self.overall_progress_bar.setVisible(True)
+        self.overall_progress_label.setText(f"开始重新生成 {len(prompts)} 张图片...")
+        
+        # 更新进度显示
+        self.update_generation_progress()
+        
+        # 重新生成全部时禁用按钮（避免冲突）
+        self.generate_button.setEnabled(False)
+        self.generate_button.setText("重新生成中...")
+        self.regenerate_all_button.setEnabled(False)
+        self.regenerate_all_button.setText("重新生成中...")
+        
+        # 获取图片数据映射
+        image_data_map = self.get_image_data_map()
+        
+        # 为每个提示词创建工作线程
+        for i, prompt in enumerate(prompts):
+            # 从提示词中提取图片名称
+            image_names = self.extract_image_names(prompt)
             
-            # 自动选中新添加的行
-            new_row = len(self.prompt_table_data) - 1
-            self.prompt_table.selectRow(new_row)
+            # 获取对应的图片数据
+            image_data_list = []
+            for name in image_names:
+                if name in image_data_map:
+                    image_data_list.append(image_data_map[name])
             
-            # 使用QTimer延迟编辑，确保表格完全更新后再开始编辑
-            QTimer.singleShot(100, lambda: self.edit_new_prompt_item(new_row))
+            # 获取对应的编号
+            original_prompt = original_prompts[i]
+            number = self.prompt_numbers.get(original_prompt, str(i + 1))
             
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"添加提示词失败: {str(e)}")
-    
-    def edit_new_prompt_item(self, row):
-        """延迟编辑新添加的提示词项"""
-        try:
-            if 0 <= row < self.prompt_table.rowCount():
-                item = self.prompt_table.item(row, 1)  # 提示词列
-                if item:
-                    self.prompt_table.editItem(item)
-        except Exception as e:
-            # 如果编辑失败，不要崩溃，只是记录错误
-            print(f"编辑新项失败: {str(e)}")
+            self.start_image_job(
+                prompt, image_data_list, number,
+                lambda p, urls, num, info, idx=i, orig=original_prompt: self.handle_success(p, urls, num, idx, orig, info),
+                lambda p, err, idx=i, orig=original_prompt: self.handle_error(p, err, idx, orig),
+                lambda p, status, orig=original_prompt: self.handle_progress(p, status, orig),
+                fresh=fresh)
     
-    def delete_selected_prompts(self):
-        """删除选中的提示词"""
-        selected_rows = set()
+    @profiled
+    def handle_progress(self, prompt, status, original_prompt):
+        """处理进度更新"""
+        # 找到对应的数据行
+        for row, data in enumerate(self.prompt_table_data):
+            if data['prompt'] == original_prompt:
+                if "重试" in status:
+                    data['status'] = status
+                else:
+                    data['status'] = '生成中'
+                # 流式生图的进度百分比单独保存，状态仍按"生成中"统计
+                data['progress_text'] = status if '%' in status else ''
+                # 进度事件频繁，只刷新该行的状态列
+                if self.prompt_table.item(row, 5):
+                    self.update_status_image_display(row, data)
+                    return
+                break
         
-        # 优先检查复选框选择
-        checkbox_selected = False
-        for row in range(len(self.prompt_table_data)):
-            checkbox = self.prompt_table.cellWidget(row, 0)
-            if checkbox and checkbox.isChecked():
-                selected_rows.add(row)
-                checkbox_selected = True
+        # 刷新表格显示
+        self.refresh_prompt_table()
+    
+    @profiled
+    def handle_success(self, prompt, image_urls, number, index, original_prompt, info=None):
+        """处理成功"""
+        # 找到对应的数据行并更新
+        target = None
+        for data in self.prompt_table_data:
+            if data['prompt'] == original_prompt:
+                data['image_url'] = image_urls[0]
+                data['image_urls'] = image_urls
+                data['error_msg'] = ''
+                target = data
+                break
         
-        # 如果没有复选框选择，则检查表格行选择
-        if not checkbox_selected:
-            for item in self.prompt_table.selectedItems():
-                selected_rows.add(item.row())
+        # 存储图片信息
+        self.generated_images[prompt] = image_urls[0]
         
-        if not selected_rows:
-            QMessageBox.warning(self, "提示", "请先选择要删除的提示词（可以通过复选框选择或点击行选择）")
+        if target is None:
             return
         
-        reply = QMessageBox.question(
-            self,
-            "确认删除",
-            f"确定要删除选中的 {len(selected_rows)} 个提示词吗？",
-            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
-            QMessageBox.StandardButton.No
-        )
-        
-        if reply == QMessageBox.StandardButton.Yes:
-            # 从大到小删除，避免索引变化
-            for row in sorted(selected_rows, reverse=True):
-                if 0 <= row < len(self.prompt_table_data):
-                    del self.prompt_table_data[row]
-            
-            self.refresh_prompt_table()
-            self.update_prompt_stats()
-    
-    def on_table_cell_changed(self, row, column):
-        """表格单元格内容改变"""
-        if 0 <= row < len(self.prompt_table_data):
-            item = self.prompt_table.item(row, column)
-            if item:
-                if column == 1:  # 编号列
-                    self.prompt_table_data[row]['number'] = item.text().strip()
-                elif column == 2:  # 提示词列
-                    old_prompt = self.prompt_table_data[row]['prompt']
-                    new_prompt = item.text().strip()
-                    self.prompt_table_data[row]['prompt'] = new_prompt
-                    
-                    # 更新提示词编号映射
-                    if old_prompt in self.prompt_numbers:
-                        number = self.prompt_numbers.pop(old_prompt)
-                        self.prompt_numbers[new_prompt] = number
-                    
-                    # 设置工具提示显示完整内容
-                    item.setToolTip(new_prompt)
-                    
-                    # 调整行高以适应新内容
-                    self.prompt_table.resizeRowToContents(row)
-                    
-                    # 如果文本很长，确保表格能正确显示
-                    if len(new_prompt) > 100:  # 长文本时强制刷新
-                        self.prompt_table.viewport().update()
-    
-    def on_table_cell_double_clicked(self, row, column):
-        """表格单元格双击"""
-        if column == 2:  # 提示词列 - 直接编辑，不弹出对话框
-            # 不需要特殊处理，让默认编辑器处理即可
-            pass
-        elif column == 5:  # 生成状态/图片列（合并后）
-            if 0 <= row < len(self.prompt_table_data):
-                data = self.prompt_table_data[row]
-                if data['status'] == '成功':
-                    # 打开图片查看对话框（从本地文件加载）
-                    dialog = ImageViewDialog(data['number'], data['prompt'], self.save_path, self)
-                    dialog.exec()
+        # 后台下载全部图片（使用表格中的编号命名），完成后再标记成功
+        self.start_image_download(target, image_urls, target['number'],
+                                  lambda: self.finish_success(target), info)
     
-    def update_batch_optimize_button(self):
-        """更新批量优化按钮状态和全选按钮文本"""
-        selected_count = 0
-        total_count = len(self.prompt_table_data)
+    def finish_success(self, data):
+        """批量生成中某条提示词的图片下载完成"""
+        data['status'] = '成功'
+        data['progress_text'] = ''
         
-        for row in range(total_count):
-            checkbox = self.prompt_table.cellWidget(row, 0)
-            if checkbox and checkbox.isChecked():
-                selected_count += 1
+        # 刷新表格显示
+        self.refresh_prompt_table()
         
-        # 更新批量优化按钮
-        self.batch_optimize_button.setEnabled(selected_count > 0)
+        # 动态计算当前任务状态
+        self.update_generation_progress()
         
-        # 更新全选按钮文本
-        if hasattr(self, 'select_all_button') and self.select_all_button:
-            if selected_count == 0:
-                self.select_all_button.setText("全选")
-            elif selected_count == total_count:
-                self.select_all_button.setText("取消全选")
+        # 检查是否当前批次全部完成
+        self.check_generation_completion()
+    
+    def get_generation_cache(self):
+        """返回生图结果缓存（未启用时为 None）"""
+        if not self.generation_cache_enabled:
+            return None
+        if self.generation_cache is None:
+            self.generation_cache = GenerationCache()
+        return self.generation_cache
+    
+    def start_image_job(self, prompt, image_data_list, number, on_success, on_error, on_progress, fresh=False):
+        """启动一条提示词的生图任务
+
+        每条需要多张图时并发多次请求；
+        全部请求结束后汇总：只要拿到图片就回调 on_success(提示词, 图片URL列表, 编号, 生成信息)，
+        全部失败才回调 on_error。生成信息包含最终提示词、耗时和图库参考图名称，用于结果清单。
+        fresh=True 时不复用缓存结果。
+        """
+        count = max(1, int(self.images_per_prompt or 1))
+        job = {'pending': count, 'urls': [], 'errors': [], 'started': None}
+        platform = f"{self.api_platform}/{self.image_model}"
+        self.generation_stats.start_batch(1)
+        
+        def request_started(p, status):
+            # 第一条进度信号表示任务开始执行，耗时统计不含排队时间
+            if job['started'] is None:
+                job['started'] = time.monotonic()
+            on_progress(p, status)
+        
+        def request_done():
+            job['pending'] -= 1
+            if job['pending'] > 0:
+                return
+            latency = time.monotonic() - (job['started'] or time.monotonic())
+            self.generation_stats.record(platform, bool(job['urls']), latency, len(job['urls'][:count]))
+            self.update_generation_stats_display()
+            if job['urls']:
+                if job['errors']:
+                    logging.warning(f"编号 {number} 部分请求失败，成功 {len(job['urls'])} 张: {job['errors'][0]}")
+                on_success(prompt, job['urls'][:count], number, {
+                    'final_prompt': prompt,
+                    'seconds': round(latency, 2),
+                    'reference_names': [item['name'] for item in image_data_list if item.get('type') != 'drag_reference'],
+                })
             else:
-                self.select_all_button.setText(f"全选({selected_count}/{total_count})")
+                on_error(prompt, job['errors'][0] if job['errors'] else "未获取到图片")
+        
+        cache = self.get_generation_cache()
+        for variant in range(count):
+            worker = Worker(prompt, self.get_current_api_key(), image_data_list, self.api_platform, self.image_model,
+                            self.retry_count, number, stream=self.image_stream,
+                            cache=cache, use_cache=not fresh, variant=variant)
+            worker.signals.finished.connect(lambda p, urls, num: (job['urls'].extend(urls), request_done()))
+            worker.signals.error.connect(lambda p, err: (job['errors'].append(err), request_done()))
+            worker.signals.progress.connect(request_started)
+            self.threadpool.start(worker)
+        self.update_generation_stats_display()
+    
+    def update_generation_stats_display(self):
+        """刷新生成统计面板，批次结束后停止定时刷新"""
+        stats = self.generation_stats
+        text = stats.summary_text()
+        self.generation_stats_label.setText(text)
+        self.generation_stats_label.setVisible(bool(text))
+        if stats.batch_done < stats.batch_total:
+            if not self.generation_stats_timer.isActive():
+                self.generation_stats_timer.start()
+        else:
+            self.generation_stats_timer.stop()
+    
+    def start_image_download(self, data, image_urls, number, on_done, info=None):
+        """在后台并发下载一条提示词的全部图片，下载期间该行保持"生成中"，完成后调用 on_done()
+
+        info 为 start_image_job 提供的生成信息，保存时写入每张图片的元数据和本批次的结果清单。
+        """
+        if not self.save_path:
+            filenames = make_image_filenames(number, len(image_urls))
+            data['filename'] = filenames[0]
+            data['filenames'] = filenames
+            on_done()
+            return
         
-    def toggle_select_all(self):
-        """切换全选状态"""
-        # 检查当前是否已全选
-        all_selected = True
-        for row in range(len(self.prompt_table_data)):
-            checkbox = self.prompt_table.cellWidget(row, 0)
-            if checkbox and not checkbox.isChecked():
-                all_selected = False
+        # 文件名相对保存路径，按输出布局放在日期/批次子文件夹中
+        save_path = self.save_path
+        manifest = self.get_results_manifest()
+        subdir = output_subdir(self.output_layout, manifest.started)
+        filenames = [os.path.join(subdir, name) for name in make_image_filenames(number, len(image_urls))]
+        
+        # 将文件名保存到数据中（第一张为主图）
+        data['filename'] = filenames[0]
+        data['filenames'] = filenames
+        
+        data['progress_text'] = f"下载中 0/{len(image_urls)}"
+        self.refresh_row_status(data)
+        
+        record = self.build_result_record(data, number, info or {})
+        # 子文件夹在下载线程中创建，重名时由下载线程改名，避免在界面线程访问共享盘
+        worker = DownloadWorker([(url, os.path.join(save_path, name)) for url, name in zip(image_urls, filenames)],
+                                cache=self.get_generation_cache(), metadata=image_metadata_list(record, image_urls),
+                                metadata_mode=self.image_metadata_mode, unique=True, index=self.get_output_index(),
+                                dedupe=self.dedupe_images)
+        worker.signals.progress.connect(lambda done, total: (data.update(progress_text=f"下载中 {done}/{total}"),
+                                                             self.refresh_row_status(data)))
+        worker.signals.finished.connect(lambda results: (
+            self.apply_download_results(data, [os.path.relpath(path, save_path) for path in worker.paths], results),
+            self.record_result(manifest, record, worker.paths, image_urls, results),
+            on_done()))
+        self.download_threadpool.start(worker)
+    
+    def get_results_manifest(self):
+        """当前批次的结果清单，批次结束后（check_generation_completion）下一次保存时新建"""
+        if self.results_manifest is None:
+            started = time.time()
+            name = time.strftime('%Y%m%d_%H%M%S', time.localtime(started))
+            self.results_manifest = ResultsManifest(Path(self.save_path) / MANIFEST_DIRNAME / f"{name}.jsonl", started)
+        return self.results_manifest
+    
+    def get_output_index(self):
+        """保存路径的输出索引，保存路径变更后重新读取"""
+        if not self.save_path:
+            return None
+        if self.output_index is None or self.output_index.root != Path(self.save_path):
+            self.output_index = OutputIndex(self.save_path)
+            self.output_index.preload()
+        return self.output_index
+    
+    def build_result_record(self, data, number, info):
+        """结果清单中一条提示词的记录（字段与命令行 manifest.jsonl 一致）"""
+        return {
+            'number': number,
+            'prompt': data['prompt'],
+            'final_prompt': info.get('final_prompt', data['prompt']),
+            'style': self.current_style,
+            'ratio': self.image_ratio,
+            'api_platform': self.api_platform,
+            'image_model': self.image_model,
+            'reference_names': info.get('reference_names', []),
+            'reference_images': [str(path) for path in data.get('reference_images') or []],
+            'seconds': info.get('seconds'),
+            'finished_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+    
+    def record_result(self, manifest, record, paths, image_urls, results):
+        """下载结束后把结果追加到批次清单"""
+        files = [path for path, ok in zip(paths, results) if ok]
+        record.update(status='success' if files else 'failed', files=files,
+                      image_urls=[manifest_image_url(url) for url in image_urls],
+                      error='' if files else "图片下载失败",
+                      finished_at=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        manifest.append(record)
+    
+    @profiled
+    def apply_download_results(self, data, filenames, results):
+        """只保留下载成功的文件；全部失败时保留主图文件名，由缩略图提示文件未找到"""
+        saved = [name for name, ok in zip(filenames, results) if ok]
+        if saved:
+            data['filenames'] = saved
+            data['filename'] = saved[0]
+    
+    def refresh_row_status(self, data):
+        """只刷新指定数据行的状态列"""
+        for row, row_data in enumerate(self.prompt_table_data):
+            if row_data is data:
+                self.update_status_image_display(row, data)
                 break
-        
-        # 切换状态
-        new_state = not all_selected
-        for row in range(len(self.prompt_table_data)):
-            checkbox = self.prompt_table.cellWidget(row, 0)
-            if checkbox:
-                checkbox.setChecked(new_state)
-        
-        # 更新按钮状态（会自动更新全选按钮文本）
-        self.update_batch_optimize_button()
     
-    def batch_optimize_prompts(self):
-        """批量优化提示词"""
-        if not self.openrouter_api_key:
-            QMessageBox.warning(self, "配置错误", "请先在设置中心配置OpenRouter API密钥")
-            return
+    @profiled
+    def handle_error(self, prompt, error, index, original_prompt):
+        """处理错误"""
+        # 找到对应的数据行并更新
+        for data in self.prompt_table_data:
+            if data['prompt'] == original_prompt:
+                data['status'] = '失败'
+                data['image_url'] = ''
+                data['error_msg'] = error
+                break
         
-        # 收集选中的提示词
-        selected_prompts = []
-        for row in range(len(self.prompt_table_data)):
-            checkbox = self.prompt_table.cellWidget(row, 0)
-            if checkbox and checkbox.isChecked():
-                selected_prompts.append({
-                    'row': row,
-                    'data': self.prompt_table_data[row]
-                })
+        # 刷新表格显示
+        self.refresh_prompt_table()
         
-        if not selected_prompts:
-            QMessageBox.information(self, "提示", "请至少选择一个提示词进行优化")
-            return
+        # 记录错误
+        logging.error(f"生成图片 {index+1} 失败:")
+        logging.error(f"提示词: {prompt}")
+        logging.error(f"错误信息: {error}")
+        
+        # 动态计算当前任务状态
+        self.update_generation_progress()
         
-        # 批量处理
-        for prompt_info in selected_prompts:
-            self.optimize_prompt(prompt_info['row'], prompt_info['data'])
+        # 检查是否当前批次全部完成
+        self.check_generation_completion()
     
-    def generate_single_prompt(self, row):
-        """生成单个提示词的图片"""
-        # 检查配置
-        if not self.get_current_api_key():
-            QMessageBox.warning(self, "配置不完整", "请先在设置中心配置API密钥")
-            return
+    def update_generation_progress(self):
+        """动态更新生成进度"""
+        # 统计各种状态的任务数量
+        waiting_count = len([data for data in self.prompt_table_data if data.get('status', '等待中') == '等待中'])
+        generating_count = len([data for data in self.prompt_table_data if data.get('status', '') == '生成中' or '重试' in data.get('status', '')])
+        success_count = len([data for data in self.prompt_table_data if data.get('status', '') == '成功'])
+        failed_count = len([data for data in self.prompt_table_data if data.get('status', '') == '失败'])
         
-        if not self.save_path:
-            QMessageBox.warning(self, "配置不完整", "请先在设置中心设置保存路径")
-            return
+        total_tasks = len(self.prompt_table_data)
+        completed_tasks = success_count + failed_count
         
-        if 0 <= row < len(self.prompt_table_data):
-            data = self.prompt_table_data[row]
-            original_prompt = data['prompt']
-            
-            # 处理提示词 - 添加风格和比例
-            prompt = original_prompt
-            
-            # 添加风格提示词
-            style_content = ""
-            if self.custom_style_content.strip():
-                style_content = self.custom_style_content.strip()
-                if self.current_style and self.current_style in self.style_library:
-                    self.style_library[self.current_style]['usage_count'] = self.style_library[self.current_style].get('usage_count', 0) + 1
-            elif self.current_style and self.current_style in self.style_library:
-                style_content = self.style_library[self.current_style]['content'].strip()
-                self.style_library[self.current_style]['usage_count'] = self.style_library[self.current_style].get('usage_count', 0) + 1
-            
-            ratio = self.image_ratio
-            
-            # 处理提示词
-            if f"图片比例【{ratio}】" not in prompt:
-                if style_content and style_content not in prompt:
-                    prompt = f"{prompt} {style_content}"
-                prompt = f"{prompt} 图片比例【{ratio}】"
-            
-            # 获取图片数据映射
-            image_data_map = self.get_image_data_map()
-            
-            # 从提示词中提取图片名称
-            image_names = self.extract_image_names(prompt)
-            
-            # 获取对应的图片数据
-            image_data_list = []
-            for name in image_names:
-                if name in image_data_map:
-                    image_data_list.append(image_data_map[name])
-            
-            # 添加拖拽的参考图片（多图支持）
-            reference_images = data.get('reference_images', [])
-            for img_path in reference_images:
-                try:
-                    with open(img_path, 'rb') as f:
-                        image_data = base64.b64encode(f.read()).decode()
-                        image_name = os.path.basename(img_path)
-                        image_data_list.append({
-                            'name': image_name,
-                            'data': image_data,
-                            'type': 'drag_reference'
-                        })
-                except Exception as e:
-                    logging.warning(f"无法读取拖拽的参考图片 {img_path}: {str(e)}")
-            
-            # 获取对应的编号
-            number = self.prompt_numbers.get(original_prompt, str(row + 1))
-            
-            # 更新状态为生成中
-            data['status'] = '生成中'
-            self.refresh_prompt_table()
-            
-            # 创建工作线程
-            worker = Worker(prompt, self.get_current_api_key(), image_data_list, self.api_platform, self.image_model, self.retry_count, number)
-            worker.signals.finished.connect(lambda p, url, num: self.handle_single_success(p, url, num, row, original_prompt))
-            worker.signals.error.connect(lambda p, err: self.handle_single_error(p, err, row, original_prompt))
-            worker.signals.progress.connect(lambda p, status: self.handle_single_progress(p, status, original_prompt))
-            self.threadpool.start(worker)
+        # 任务状态计数同步到指标（供 /metrics 接口读取，避免后台线程遍历表格数据）
+        for status, count in (('waiting', waiting_count), ('generating', generating_count),
+                              ('success', success_count), ('failed', failed_count)):
+            METRICS.set_gauge('jobs', count, status=status)
+        
+        # 更新进度条
+        if total_tasks > 0:
+            self.overall_progress_bar.setMaximum(total_tasks)
+            self.overall_progress_bar.setValue(completed_tasks)
             
-            QMessageBox.information(self, "开始生成", f"已开始生成编号 {number} 的图片")
+            # 更新进度标签
+            if generating_count > 0:
+                self.overall_progress_label.setText(f"进行中: 等待{waiting_count}个 | 生成中{generating_count}个 | 已完成{success_count}个 | 失败{failed_count}个")
+            else:
+                self.overall_progress_label.setText(f"已处理 {completed_tasks}/{total_tasks} 个任务 | 成功{success_count}个 | 失败{failed_count}个")
     
-    def handle_single_success(self, prompt, image_url, number, row, original_prompt):
-        """处理单个提示词生成成功"""
-        try:
-            # 更新数据状态
-            if 0 <= row < len(self.prompt_table_data):
-                self.prompt_table_data[row]['status'] = '成功'
-                self.prompt_table_data[row]['image_url'] = image_url
-                self.prompt_table_data[row]['error_msg'] = ''
-            
-            # 存储图片信息
-            self.generated_images[prompt] = image_url
-            
-            # 生成带时间戳前缀的文件名
-            timestamp = time.strftime('%Y%m%d_%H%M%S')
-            filename = f"{timestamp}_{number}.png"
-            
-            # 将文件名保存到数据中
-            if 0 <= row < len(self.prompt_table_data):
-                self.prompt_table_data[row]['filename'] = filename
-            
-            # 自动保存图片
-            if self.save_path:
-                try:
-                    os.makedirs(self.save_path, exist_ok=True)
-                    file_path = os.path.join(self.save_path, filename)
-                    
-                    response = requests.get(image_url)
-                    with open(file_path, 'wb') as f:
-                        f.write(response.content)
-                        
-                except Exception as e:
-                    error_msg = f"保存图片失败: {str(e)}"
-                    logging.error(error_msg)
-            
-            # 刷新显示
-            self.refresh_prompt_table()
-            
-            # 播放完成提示音
-            try:
-                if hasattr(winsound, 'SND_ASYNC'):
-                    winsound.MessageBeep()
-            except:
-                pass
-                
-            QMessageBox.information(self, "生成完成", f"编号 {number} 的图片生成成功！")
-            
-        except Exception as e:
-            logging.error(f"处理单个生成成功时出错: {str(e)}")
-            QMessageBox.critical(self, "处理错误", f"图片生成成功，但保存时出错: {str(e)}")
+    def check_generation_completion(self):
+        """检查生成是否完成"""
+        # 检查是否还有正在生成或等待中的任务
+        active_tasks = [data for data in self.prompt_table_data 
+                       if data.get('status', '等待中') in ['等待中', '生成中'] or '重试' in data.get('status', '')]
+        
+        # 如果没有活跃任务，说明当前批次已完成
+        if not active_tasks:
+            self.log_metrics_summary()
+            self.results_manifest = None
+            # 只有在重新生成全部模式下才完全恢复按钮状态
+            if not self.generate_button.isEnabled():  # 说明是重新生成全部模式
+                self.generation_finished()
     
-    def handle_single_error(self, prompt, error_msg, row, original_prompt):
-        """处理单个提示词生成失败"""
-        try:
-            # 更新数据状态
-            if 0 <= row < len(self.prompt_table_data):
-                self.prompt_table_data[row]['status'] = '失败'
-            
-            # 刷新显示
-            self.refresh_prompt_table()
-            
-            QMessageBox.critical(self, "生成失败", f"图片生成失败:\n{error_msg}")
-            
-        except Exception as e:
-            logging.error(f"处理单个生成失败时出错: {str(e)}")
+    def log_metrics_summary(self):
+        """批次结束时把各平台/模型的耗时分布写入日志，便于比较平台和调整并发"""
+        for name in ('image_queue_wait_seconds', 'image_ttfb_seconds', 'image_request_seconds',
+                     'image_job_seconds', 'download_seconds'):
+            for row in METRICS.summary(name):
+                logging.info(f"指标 {name} {row['labels']}: 次数 {row['count']}, 平均 {row['avg']:.2f}s, "
+                             f"p50 {row['p50']:.2f}s, p95 {row['p95']:.2f}s, p99 {row['p99']:.2f}s")
     
-    def handle_single_progress(self, prompt, status, original_prompt):
-        """处理单个提示词生成进度"""
-        try:
-            # 找到对应的行并更新状态
-            for i, data in enumerate(self.prompt_table_data):
-                if data['prompt'] == original_prompt:
-                    data['status'] = status
-                    break
-            
-            # 刷新显示
-            self.refresh_prompt_table()
-            
-        except Exception as e:
-            logging.error(f"处理单个生成进度时出错: {str(e)}")
-
-    def optimize_single_prompt(self, row):
-        """优化单个提示词"""
-        if not self.openrouter_api_key:
-            QMessageBox.warning(self, "配置错误", "请先在设置中心配置OpenRouter API密钥")
-            return
+    def generation_finished(self):
+        """生成完成"""
+        self.generate_button.setEnabled(True)
+        self.generate_button.setText("智能生成(仅新增)")
+        self.regenerate_all_button.setEnabled(True)
+        self.regenerate_all_button.setText("重新生成全部")
         
-        if 0 <= row < len(self.prompt_table_data):
-            data = self.prompt_table_data[row]
-            self.optimize_prompt(row, data)
+        # 统计结果
+        success_count = len([data for data in self.prompt_table_data if data['status'] == '成功'])
+        failed_count = self.total_images - success_count
+        
+        # 更新状态显示
+        self.overall_progress_label.setText(f"🎉 生成完成！成功: {success_count} 张，失败: {failed_count} 张")
+        
+        # 播放完成提示音
+        self.play_completion_sound()
     
-    def optimize_prompt(self, row, data):
-        """调用OpenRouter API优化提示词"""
+    def check_default_config(self):
+        """检查并创建默认配置文件"""
+        config_path = APP_PATH / 'config.json'
+        if not config_path.exists():
+            # 异步创建，避免阻塞启动
+            QTimer.singleShot(300, lambda: self.create_default_config_file(config_path))
+    
+    def create_default_config_file(self, config_path):
+        """异步创建默认配置文件"""
+        if config_path.exists():  # 双重检查
+            return
         try:
-            # 准备API请求
-            headers = {
-                'Authorization': f'Bearer {self.openrouter_api_key}',
-                'Content-Type': 'application/json'
-            }
-            
-            # 构建优化请求文本
-            prompt_text = f"{self.meta_prompt}\n\n待优化提示词：{data['prompt']}"
-            
-            request_data = {
-                'model': self.ai_model,
-                'messages': [
-                    {
-                        'role': 'user',
-                        'content': prompt_text
+            default_config = {
+                'api_key': '',
+                'api_platform': '云雾',
+                'thread_count': 5,
+                'retry_count': 3,
+                'save_path': '',
+                'image_ratio': '3:2',
+                'style_library': {
+                    '超写实风格': {
+                        'name': '超写实风格',
+                        'content': '极致的超写实主义照片风格，画面呈现出顶级数码单反相机（如佳能EOS R5）搭配高质量定焦镜头（如85mm f/1.2）的拍摄效果。明亮、均匀，光影过渡微妙且真实，无明显阴影。绝对真实的全彩照片，无任何色彩滤镜。色彩如同在D65标准光源环境下拍摄，白平衡极其精准，所见即所得。色彩干净通透，类似于现代商业广告摄影风格。严禁任何形式的棕褐色调、复古滤镜或暖黄色偏色。画面高度细腻，细节极其丰富，达到8K分辨率的视觉效果。追求极致的清晰度和纹理表现，所有物体的材质质感都应逼真呈现，无噪点，无失真。',
+                        'category': '摄影风格',
+                        'created_time': '2024-01-01 12:00:00',
+                        'usage_count': 0
+                    },
+                    '动漫风格': {
+                        'name': '动漫风格',
+                        'content': '二次元动漫风格，色彩鲜艳饱满，线条清晰，具有典型的日式动漫美学特征。人物造型精致，表情生动，背景细腻。',
+                        'category': '插画风格',
+                        'created_time': '2024-01-01 12:01:00',
+                        'usage_count': 0
+                    },
+                    '油画风格': {
+                        'name': '油画风格',
+                        'content': '经典油画艺术风格，笔触丰富，色彩层次分明，具有厚重的质感和艺术气息。光影效果自然，构图典雅。',
+                        'category': '艺术风格',
+                        'created_time': '2024-01-01 12:02:00',
+                        'usage_count': 0
                     }
-                ],
-                'temperature': 0.7
+                },
+                'current_style': '',
+                'custom_style_content': '',
+                'window_geometry': {
+                    'width': 1200,
+                    'height': 800,
+                    'x': 100,
+                    'y': 100
+                },
+                'category_links': {}
             }
-            
-            # 发送请求
-            response = requests.post(
-                'https://openrouter.ai/api/v1/chat/completions',
-                headers=headers,
-                json=request_data,
-                timeout=60
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                optimized_text = result['choices'][0]['message']['content']
+            with open(config_path, 'w', encoding='utf-8') as f:
+                json.dump(default_config, f, indent=2, ensure_ascii=False)
+        except Exception:
+            pass  # 静默失败，不影响程序运行
+    
+    def load_config(self):
+        """加载配置"""
+        try:
+            config_path = APP_PATH / 'config.json'
+            with open(config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+                self.api_key = config.get('api_key', '')
+                self.api_platform = config.get('api_platform', '云雾')
+                self.image_model = config.get('image_model', 'sora')  # 加载生图模型配置
+                # 加载分离的API密钥
+                self.sora_api_key = config.get('sora_api_key', '')
+                self.nano_api_key = config.get('nano_api_key', '')
+                self.thread_count = config.get('thread_count', 5)
+                self.retry_count = config.get('retry_count', 3)
+                self.save_path = config.get('save_path', '')
+                self.image_ratio = config.get('image_ratio', '3:2')
+                self.image_stream = config.get('image_stream', False)
+                self.images_per_prompt = config.get('images_per_prompt', 1)
+                self.generation_cache_enabled = config.get('generation_cache_enabled', False)
+                self.image_metadata_mode = config.get('image_metadata_mode', 'png')
+                self.output_layout = config.get('output_layout', 'date')
+                self.dedupe_images = config.get('dedupe_images', True)
+                
+                # 子系统日志级别（环境变量 SORA_LOG_LEVELS 优先）
+                self.log_levels = config.get('log_levels', {})
+                apply_log_levels({**self.log_levels, **parse_log_levels(os.environ.get('SORA_LOG_LEVELS', ''))})
+                
+                # 指标接口
+                self.metrics_port = config.get('metrics_port', 0)
+                self.metrics_host = config.get('metrics_host', '127.0.0.1')
+                
+                # 加载风格库
+                self.style_library = config.get('style_library', {})
+                self.current_style = config.get('current_style', '')
+                self.custom_style_content = config.get('custom_style_content', '')
+                
+                # 加载图片分类链接
+                self.category_links = config.get('category_links', {})
+                
+                # 加载OpenRouter AI优化配置
+                self.openrouter_api_key = config.get('openrouter_api_key', '')
+                self.ai_model = config.get('ai_model', 'qwen/qwq-32b')
+                self.meta_prompt = config.get('meta_prompt', '')
+                self.meta_prompt_template = config.get('meta_prompt_template', 'template1')
+                self.optimization_history = config.get('optimization_history', [])
+                self.optimize_concurrency = config.get('optimize_concurrency', 4)
+                self.optimize_batch_size = config.get('optimize_batch_size', 5)
+                self.optimize_stream = config.get('optimize_stream', True)
+                self.import_column_map = config.get('import_column_map', {})
+                
+                # 恢复窗口大小和位置
+                window_geometry = config.get('window_geometry', {})
+                if window_geometry:
+                    width = window_geometry.get('width', 1200)
+                    height = window_geometry.get('height', 800)
+                    x = window_geometry.get('x', 100)
+                    y = window_geometry.get('y', 100)
+                    
+                    self.resize(width, height)
+                    self.move(x, y)
                 
-                # 显示优化结果对话框
-                self.show_optimization_result(data['prompt'], optimized_text, row)
-            else:
-                QMessageBox.warning(self, "API错误", f"请求失败：{response.status_code}\n{response.text}")
+                # 异步刷新界面显示（避免阻塞），按安排顺序在下一轮事件循环执行
+                QTimer.singleShot(0, self.refresh_ui_after_settings)
                 
+                # 刷新提示词表格中的按钮状态
+                QTimer.singleShot(0, self.refresh_prompt_table)
+
+        except FileNotFoundError:
+            # 即使没有配置文件，也要异步刷新UI
+            QTimer.singleShot(0, self.refresh_ui_after_settings)
+            QTimer.singleShot(0, self.refresh_prompt_table)
         except Exception as e:
-            QMessageBox.critical(self, "优化错误", f"优化过程中出现错误：{str(e)}")
+            # 即使配置加载失败，也要异步刷新UI
+            QTimer.singleShot(0, self.refresh_ui_after_settings)
+            QTimer.singleShot(0, self.refresh_prompt_table)
     
-    def show_optimization_result(self, original_prompt, optimized_prompt, row):
-        """显示优化结果对话框"""
-        dialog = OptimizationResultDialog(original_prompt, optimized_prompt, self)
-        if dialog.exec() == QDialog.DialogCode.Accepted:
-            # 用户选择应用优化结果 - 获取用户可能编辑过的文本
-            final_optimized_prompt = dialog.get_final_optimized_text()
-            self.prompt_table_data[row]['prompt'] = final_optimized_prompt
-            
-            # 保存到历史记录
-            history_item = {
-                'timestamp': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                'original': original_prompt,
-                'optimized': final_optimized_prompt,
-                'model': self.ai_model,
-                'meta_prompt': self.meta_prompt
+    def save_config(self):
+        """保存配置"""
+        if not self._init_done:
+            return
+        try:
+            config = {
+                'api_key': self.api_key,
+                'api_platform': self.api_platform,
+                'image_model': self.image_model,  # 保存生图模型配置
+                # 分离的API密钥
+                'sora_api_key': getattr(self, 'sora_api_key', ''),
+                'nano_api_key': getattr(self, 'nano_api_key', ''),
+                'thread_count': self.thread_count,
+                'retry_count': self.retry_count,
+                'save_path': self.save_path,
+                'image_ratio': self.image_ratio,
+                'image_stream': self.image_stream,
+                'images_per_prompt': self.images_per_prompt,
+                'generation_cache_enabled': self.generation_cache_enabled,
+                'image_metadata_mode': self.image_metadata_mode,
+                'output_layout': self.output_layout,
+                'dedupe_images': self.dedupe_images,
+                'log_levels': self.log_levels,
+                'metrics_port': self.metrics_port,
+                'metrics_host': self.metrics_host,
+                'style_library': self.style_library,
+                'current_style': self.current_style,
+                'custom_style_content': self.custom_style_content,
+                'window_geometry': {
+                    'width': self.width(),
+                    'height': self.height(),
+                    'x': self.x(),
+                    'y': self.y()
+                },
+                'category_links': self.category_links,
+                # OpenRouter AI优化配置
+                'openrouter_api_key': self.openrouter_api_key,
+                'ai_model': self.ai_model,
+                'meta_prompt': self.meta_prompt,
+                'meta_prompt_template': self.meta_prompt_template,
+                'optimization_history': self.optimization_history,
+                'optimize_concurrency': self.optimize_concurrency,
+                'optimize_batch_size': self.optimize_batch_size,
+                'optimize_stream': self.optimize_stream,
+                'import_column_map': self.import_column_map
             }
-            self.optimization_history.append(history_item)
-            
-            # 刷新表格显示
-            self.refresh_prompt_table()
-            self.save_config()
-    
-    def get_image_data_map(self):
-        """获取所有图片数据映射"""
-        image_data_map = {}
-        for cat, links in self.category_links.items():
-            for link in links:
-                if link['name']:
-                    image_data_map[link['name']] = link
-        return image_data_map
+            config_path = APP_PATH / 'config.json'
+            with open(config_path, 'w', encoding='utf-8') as f:
+                json.dump(config, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+        except Exception as e:
+            pass
     
-    def extract_image_names(self, prompt):
-        """从提示词中提取图片名称"""
-        image_names = []
-        all_names = []
-        
-        # 收集所有图片名称
-        for cat_links in self.category_links.values():
-            for link in cat_links:
-                name = link['name'].strip()
-                if name:
-                    all_names.append(name)
-        
-        # 按长度排序，优先匹配更长的名称
-        all_names.sort(key=len, reverse=True)
-        
-        # 找到所有能匹配的图片名称
-        for name in all_names:
-            if name in prompt:
-                image_names.append(name)
-        
-        return image_names
+    def play_completion_sound(self):
+        """播放任务完成提示音"""
+        try:
+            if winsound:
+                # Windows系统：播放系统完成提示音
+                winsound.PlaySound("SystemAsterisk", winsound.SND_ALIAS | winsound.SND_ASYNC)
+            elif subprocess:
+                # 跨平台方案
+                if sys.platform.startswith('darwin'):  # macOS
+                    subprocess.run(['afplay', '/System/Library/Sounds/Glass.aiff'], check=False)
+                elif sys.platform.startswith('linux'):  # Linux
+                    subprocess.run(['aplay', '/usr/share/sounds/alsa/Front_Right.wav'], check=False)
+        except Exception as e:
+            # 如果播放声音失败，忽略错误
+            pass
     
-    def start_generation(self):
-        """开始生成图片"""
-        # 检查配置
-        if not self.get_current_api_key():
-            QMessageBox.warning(self, "配置不完整", "请先在设置中心配置API密钥")
-            return
-        
-        if not self.save_path:
-            QMessageBox.warning(self, "配置不完整", "请先在设置中心设置保存路径")
-            return
-        
-        # 检查是否有提示词
-        if not self.prompt_table_data:
-            QMessageBox.warning(self, "提示", "请先添加提示词或导入CSV文件")
-            return
-        
+    def closeEvent(self, event):
+        """窗口关闭事件"""
         self.save_config()
-        
-        # 获取提示词 - 只处理等待中的提示词
-        prompts = []
-        original_prompts = []
-        
-        # 只获取状态为'等待中'的提示词
-        for data in self.prompt_table_data:
-            if data.get('status', '等待中') == '等待中':
-                prompts.append(data['prompt'])
-                original_prompts.append(data['prompt'])
-        
-        # 检查是否有需要生成的提示词
-        if not prompts:
-            QMessageBox.information(self, "提示", "没有需要生成的新提示词！\n\n所有提示词都已生成完成或正在生成中。")
-            return
-            
-        # 刷新表格显示
-        self.refresh_prompt_table()
-        
-        # 添加风格提示词和图片比例
-        style_content = ""
-        if self.custom_style_content.strip():
-            style_content = self.custom_style_content.strip()
-            if self.current_style and self.current_style in self.style_library:
-                self.style_library[self.current_style]['usage_count'] = self.style_library[self.current_style].get('usage_count', 0) + 1
-        elif self.current_style and self.current_style in self.style_library:
-            style_content = self.style_library[self.current_style]['content'].strip()
-            self.style_library[self.current_style]['usage_count'] = self.style_library[self.current_style].get('usage_count', 0) + 1
-        
-        ratio = self.image_ratio
-        
-        # 处理每个提示词
-        processed_prompts = []
-        for p in prompts:
-            if f"图片比例【{ratio}】" not in p:
-                if style_content and style_content not in p:
-                    p = f"{p} {style_content}"
-                p = f"{p} 图片比例【{ratio}】"
-            processed_prompts.append(p)
-        
-        prompts = processed_prompts
-        
-        # 设置计数器（保持兼容性）
-        self.total_images = len(prompts)
-        self.completed_images = 0
-        
-        # 显示整体进度
-        self.overall_progress_bar.setVisible(True)
-        self.overall_progress_label.setText(f"开始生成 {len(prompts)} 张新图片...")
-        
-        # 更新进度显示
-        self.update_generation_progress()
-        
-        # 更新按钮状态（但不禁用，允许继续添加新提示词）
-        self.generate_button.setText("继续生成新增")
-        
-        # 获取图片数据映射
-        image_data_map = self.get_image_data_map()
-        
-        # 为每个提示词创建工作线程
-        for i, prompt in enumerate(prompts):
-            # 从提示词中提取图片名称
-            image_names = self.extract_image_names(prompt)
-            
-            # 获取对应的图片数据
-            image_data_list = []
-            for name in image_names:
-                if name in image_data_map:
-                    image_data_list.append(image_data_map[name])
-            
-            # 获取对应的编号
-            original_prompt = original_prompts[i]
-            number = self.prompt_numbers.get(original_prompt, str(i + 1))
-            
-            worker = Worker(prompt, self.get_current_api_key(), image_data_list, self.api_platform, self.image_model, self.retry_count, number)
-            worker.signals.finished.connect(lambda p, url, num, idx=i, orig=original_prompt: self.handle_success(p, url, num, idx, orig))
-            worker.signals.error.connect(lambda p, err, idx=i, orig=original_prompt: self.handle_error(p, err, idx, orig))
-            worker.signals.progress.connect(lambda p, status, orig=original_prompt: self.handle_progress(p, status, orig))
-            self.threadpool.start(worker)
-    
-    def start_regenerate_all(self):
-        """重新生成全部提示词"""
-        # 确认操作
-        reply = QMessageBox.question(
-            self, 
-            "确认重新生成", 
-            "确定要重新生成全部提示词吗？\n\n这将重置所有状态并重新开始生成。",
-            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
-            QMessageBox.StandardButton.No
-        )
-        
-        if reply != QMessageBox.StandardButton.Yes:
+        if self.generation_cache is not None:
+            self.generation_cache.flush()
+        if self.metrics_server:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        if PROFILER:
+            if self.profile_stall_timer:
+                self.profile_stall_timer.stop()
+            try:
+                stop_profiling()
+            except Exception as e:
+                logging.error(f"保存性能分析结果失败: {str(e)}")
+        event.accept()
+
+# ========== 命令行批量运行 ==========
+
+def load_app_config(config_path=None):
+    """读取 config.json（不存在时返回空配置）"""
+    path = Path(config_path) if config_path else APP_PATH / 'config.json'
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def get_config_api_key(config, image_model):
+    """按生图模型取API密钥，与 MainWindow.get_current_api_key 一致"""
+    if image_model == "sora":
+        return config.get('sora_api_key', '')
+    elif image_model == "fal-ai/nano-banana":
+        return config.get('nano_api_key', '')
+    return config.get('api_key', '')
+
+# 任务规格中除 number/prompt 外的可选字段
+JOB_OPTIONAL_FIELDS = ('style', 'ratio', 'images_per_prompt', 'reference_names', 'reference_images')
+MAX_IMAGES_PER_PROMPT = 10  # 每条提示词最多出图数，与设置中心的范围一致
+
+def parse_images_per_prompt(value):
+    """images_per_prompt 转为整数，不在 1~MAX_IMAGES_PER_PROMPT 范围内时抛出 ValueError"""
+    try:
+        count = int(value)
+    except (TypeError, ValueError, OverflowError):
+        count = 0
+    if not 1 <= count <= MAX_IMAGES_PER_PROMPT:
+        raise ValueError(f"images_per_prompt 必须为 1~{MAX_IMAGES_PER_PROMPT} 的整数")
+    return count
+
+def load_jobs(file_path, column_map=None):
+    """读取任务文件：提示词表格（CSV/xlsx/parquet，分镜编号/分镜提示词/参考图）或 JSONL（每行一个任务）
+
+    JSONL 任务字段：prompt（或 分镜提示词）必填；number（或 分镜编号）、style、ratio、images_per_prompt、
+    reference_names（图库图片名称列表）、reference_images（本地图片路径列表）可选。格式错误时抛出 ValueError。
+    """
+    if Path(file_path).suffix.lower() in ('.csv', '.xlsx', '.parquet'):
+        return table_jobs(read_prompt_file(file_path, column_map))
+    
+    jobs = []
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                spec = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"第{line_number}行不是有效的JSON: {e}")
+            prompt = spec.get('prompt', spec.get('分镜提示词')) if isinstance(spec, dict) else None
+            if not prompt:
+                raise ValueError(f"第{line_number}行缺少 prompt 字段")
+            job = {key: spec[key] for key in JOB_OPTIONAL_FIELDS if spec.get(key)}
+            job['number'] = str(spec.get('number', spec.get('分镜编号', len(jobs) + 1)))
+            job['prompt'] = str(prompt)
+            jobs.append(job)
+    return jobs
+
+def table_jobs(rows):
+    """表格行 -> 任务（只保留编号、提示词和参考图，导出表格中的状态等列不影响执行）"""
+    jobs = []
+    for row in rows:
+        job = {'number': row['number'], 'prompt': row['prompt']}
+        if row.get('reference_images'):
+            job['reference_images'] = row['reference_images']
+        jobs.append(job)
+    return jobs
+
+def read_manifest(manifest_path):
+    """读取结果清单，返回 编号 -> 最后一条记录"""
+    records = {}
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records[record.get('number')] = record
+    except FileNotFoundError:
+        pass
+    return records
+
+class BatchRunner:
+    """无界面批量生图：复用 Worker / DownloadWorker，进度输出到 stdout，每条结果写入JSONL清单"""
+
+    def __init__(self, config, jobs, out_dir, manifest_path, concurrency=None, images_per_prompt=None,
+                 ratio=None, style=None, use_cache=True, fresh=False, output=None):
+        self.jobs = jobs
+        self.out_dir = Path(out_dir)
+        self.manifest_path = Path(manifest_path) if manifest_path else None
+        self.output = output or sys.stdout
+        self.api_platform = config.get('api_platform', '云雾')
+        self.image_model = config.get('image_model', 'sora')
+        self.api_key = os.environ.get('SORA_API_KEY') or get_config_api_key(config, self.image_model)
+        self.retry_count = config.get('retry_count', 3)
+        self.image_stream = config.get('image_stream', False)
+        self.images_per_prompt = images_per_prompt or config.get('images_per_prompt', 1)
+        self.ratio = ratio or config.get('image_ratio', '3:2')
+        self.style_library = config.get('style_library', {})
+        self.category_links = config.get('category_links', {})
+        if style:
+            self.style_content = resolve_style_content(self.style_library, style)
+        else:
+            self.style_content = resolve_style_content(self.style_library, config.get('current_style', ''),
+                                                       config.get('custom_style_content', ''))
+        self.style_name = style or config.get('current_style', '')
+        self.image_metadata_mode = config.get('image_metadata_mode', 'png')
+        self.dedupe_images = config.get('dedupe_images', True)
+        self.output_index = OutputIndex(self.out_dir)
+        self.cache = GenerationCache() if use_cache and config.get('generation_cache_enabled', False) else None
+        self.fresh = fresh
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max(1, int(concurrency or config.get('thread_count', 5))))
+        self.download_pool = QThreadPool()
+        self.workers = set()  # 运行中的任务，保持引用避免信号对象被提前回收
+        self.done = 0
+        self.succeeded = 0
+        self.manifest_file = None
+
+    def build_job_request(self, job):
+        """返回 (最终提示词, 参考图数据列表)"""
+        style_content = self.style_content
+        if job.get('style'):
+            style_content = resolve_style_content(self.style_library, job['style'])
+        prompt = compose_prompt(job['prompt'], style_content, job.get('ratio') or self.ratio)
+        image_data_list = get_image_data_list(prompt, self.category_links)
+        # 显式指定的图库图片（提示词中没有出现名称时）
+        for name in job.get('reference_names') or []:
+            if any(item.get('name') == name for item in image_data_list):
+                continue
+            matches = [link for links in self.category_links.values() for link in links if link['name'] == name]
+            if matches:
+                image_data_list.append(matches[0])
+            else:
+                logging.warning(f"图库中没有该图片: {name}")
+        for img_path in job.get('reference_images', []):
+            try:
+                with open(img_path, 'rb') as f:
+                    image_data_list.append({'name': os.path.basename(img_path),
+                                            'data': base64.b64encode(f.read()).decode(),
+                                            'type': 'drag_reference'})
+            except Exception as e:
+                logging.warning(f"无法读取参考图片 {img_path}: {str(e)}")
+        return prompt, image_data_list
+
+    def job_image_count(self, job):
+        """任务的出图数（每张图一次请求），限制在 1~MAX_IMAGES_PER_PROMPT"""
+        return max(1, min(int(job.get('images_per_prompt') or self.images_per_prompt or 1), MAX_IMAGES_PER_PROMPT))
+
+    def start_job(self, job):
+        prompt, image_data_list = self.build_job_request(job)
+        count = self.job_image_count(job)
+        state = {'pending': count, 'urls': [], 'errors': [], 'start': time.monotonic(),
+                 'reference_names': [item['name'] for item in image_data_list if item.get('type') != 'drag_reference']}
+        
+        def request_done(worker):
+            self.workers.discard(worker)
+            state['pending'] -= 1
+            if state['pending'] > 0:
+                return
+            if state['urls']:
+                self.download(job, prompt, state['urls'][:count], state)
+            else:
+                self.finish(job, prompt, state, [], state['errors'][0] if state['errors'] else "未获取到图片")
+        
+        for variant in range(count):
+            worker = Worker(prompt, self.api_key, image_data_list, self.api_platform, self.image_model,
+                            self.retry_count, job['number'], stream=self.image_stream,
+                            cache=self.cache, use_cache=not self.fresh, variant=variant)
+            worker.signals.finished.connect(lambda p, urls, num, w=worker: (state['urls'].extend(urls), request_done(w)))
+            worker.signals.error.connect(lambda p, err, w=worker: (state['errors'].append(err), request_done(w)))
+            self.workers.add(worker)
+            self.pool.start(worker)
+
+    def download(self, job, prompt, image_urls, state):
+        out_dir = self.job_output_dir(job)
+        filenames = make_image_filenames(job['number'], len(image_urls))
+        paths = [str(out_dir / name) for name in filenames]
+        record = dict(self.job_record(job, prompt, state),
+                      finished_at=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        worker = DownloadWorker(list(zip(image_urls, paths)), cache=self.cache,
+                                metadata=image_metadata_list(record, image_urls), metadata_mode=self.image_metadata_mode,
+                                unique=True, index=self.output_index, dedupe=self.dedupe_images)
+        
+        def downloaded(results):
+            self.workers.discard(worker)
+            saved = [path for path, ok in zip(worker.paths, results) if ok]
+            self.finish(job, prompt, state, saved, "" if saved else "图片下载失败", image_urls)
+        
+        worker.signals.finished.connect(downloaded)
+        self.workers.add(worker)
+        self.download_pool.start(worker)
+
+    def job_output_dir(self, job):
+        return self.out_dir
+
+    def job_record(self, job, prompt, state):
+        """任务的生成信息（清单和每张图片的元数据共用）"""
+        return {
+            'number': job['number'],
+            'prompt': job['prompt'],
+            'final_prompt': prompt,
+            'style': job.get('style') or self.style_name,
+            'ratio': job.get('ratio') or self.ratio,
+            'api_platform': self.api_platform,
+            'image_model': self.image_model,
+            'reference_names': state.get('reference_names', []),
+            'reference_images': job.get('reference_images') or [],
+            'seconds': round(time.monotonic() - state['start'], 2),
+        }
+
+    def finish(self, job, prompt, state, files, error, image_urls=()):
+        """一条任务结束"""
+        self.done += 1
+        success = bool(files)
+        self.succeeded += success
+        record = self.job_record(job, prompt, state)
+        record.update({
+            'status': 'success' if success else 'failed',
+            'files': files,
+            'image_urls': [manifest_image_url(url) for url in image_urls],
+            'error': error,
+            'finished_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        })
+        self.record_result(job, record)
+
+    def record_result(self, job, record):
+        """写清单并输出进度"""
+        success = record['status'] == 'success'
+        files = record['files']
+        seconds = record['seconds']
+        error = record['error']
+        self.manifest_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.manifest_file.flush()
+        
+        width = len(str(len(self.jobs)))
+        if success:
+            detail = f"成功 {len(files)}张 ({seconds}s) -> {os.path.basename(files[0])}"
+        else:
+            detail = f"失败 ({seconds}s): {summarize_text(error, 200)}"
+        print(f"[{self.done:>{width}}/{len(self.jobs)}] 编号 {job['number']} {detail}", file=self.output, flush=True)
+
+    def run(self, append=False):
+        """运行全部任务直到结束，返回失败条数"""
+        app = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        start_time = time.monotonic()
+        print(f"开始批量生图: {len(self.jobs)} 条 | {self.api_platform}/{self.image_model} | "
+              f"并发 {self.pool.maxThreadCount()} | 输出 {self.out_dir}", file=self.output, flush=True)
+        with open(self.manifest_path, 'a' if append else 'w', encoding='utf-8') as self.manifest_file:
+            for job in self.jobs:
+                self.start_job(job)
+            try:
+                while self.done < len(self.jobs):
+                    app.processEvents()
+                    time.sleep(0.02)
+            except KeyboardInterrupt:
+                self.pool.clear()
+                print("已中断，等待运行中的请求结束后退出", file=self.output, flush=True)
+                raise
+            finally:
+                if self.cache is not None:
+                    self.cache.flush()
+        failed = len(self.jobs) - self.succeeded
+        print(f"完成: 成功 {self.succeeded} 条，失败 {failed} 条，用时 {time.monotonic() - start_time:.1f}s，"
+              f"清单 {self.manifest_path}", file=self.output, flush=True)
+        return failed
+
+# ========== 任务队列与本地服务 ==========
+
+JOB_DB_PATH = APP_PATH / 'jobs.db'
+JOB_FINISHED_STATUSES = ('success', 'failed', 'cancelled')
+JOB_LEASE_SECONDS = 120        # 执行节点领取任务的租约时长，超时未续约的任务重新排队
+JOB_HEARTBEAT_INTERVAL = 30    # 执行节点续约间隔（秒）
+JOB_POLL_INTERVAL = 1.0        # 队列为空时再次领取任务的间隔（秒）
+MAX_JOB_ATTEMPTS = 3           # 租约过期重新排队的最多次数，超过后标记失败
+
+class JobQueue:
+    """基于SQLite的持久化任务队列；任务状态 queued -> running -> success/failed/cancelled
+
+    执行节点以租约方式领取任务并定期续约，租约过期的任务重新排队。数据库可放在共享目录中
+    供多台机器的进程直接访问（写操作使用 BEGIN IMMEDIATE 跨进程互斥）。
+    每次状态变化分配递增的序号，便于客户端按序号增量获取或流式订阅变化。
+    """
+
+    JSON_COLUMNS = ('reference_names', 'files', 'image_urls')
+
+    def __init__(self, db_path=None):
+        self.db_path = Path(db_path or JOB_DB_PATH)
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                batch TEXT NOT NULL,
+                number TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                style TEXT,
+                ratio TEXT,
+                images_per_prompt INTEGER,
+                reference_names TEXT,
+                client TEXT,
+                status TEXT NOT NULL DEFAULT 'queued',
+                final_prompt TEXT,
+                files TEXT,
+                image_urls TEXT,
+                error TEXT,
+                created_at REAL,
+                started_at REAL,
+                finished_at REAL,
+                seq INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                output_dir TEXT)""")
+            # 监视文件夹已提交过的行：(来源文件, 行内容哈希)
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS source_rows (
+                source TEXT NOT NULL,
+                row_key TEXT NOT NULL,
+                job_id TEXT,
+                created_at REAL,
+                PRIMARY KEY (source, row_key))""")
+            # 旧版本创建的数据库缺少后来增加的字段
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in (('worker', 'TEXT'), ('lease_until', 'REAL'),
+                                        ('attempts', 'INTEGER NOT NULL DEFAULT 0'), ('output_dir', 'TEXT')):
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs (batch)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_seq ON jobs (seq)")
+            self.seq = self.max_seq()
+
+    def to_dict(self, row):
+        job = dict(row)
+        for column in self.JSON_COLUMNS:
+            job[column] = json.loads(job[column]) if job[column] else []
+        return job
+
+    def max_seq(self):
+        return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM jobs").fetchone()[0]
+
+    def next_seq(self):
+        self.seq += 1
+        return self.seq
+
+    @contextmanager
+    def transaction(self):
+        """写事务：进程内加锁，进程间由 BEGIN IMMEDIATE 互斥，提交后通知等待变化的线程"""
+        with self.changed:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 其他进程可能已写入更大的序号
+                self.seq = max(self.seq, self.max_seq())
+                yield
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self.changed.notify_all()
+
+    def submit(self, jobs, client='', source=None, output_dir=None):
+        """提交一批任务，返回 (批次ID, 任务ID列表)
+
+        指定 source（如监视的CSV文件路径）时按任务的 number+prompt 去重，该来源已提交过的行不再提交。
+        output_dir 为结果图片的子目录，默认使用批次ID。
+        """
+        batch = uuid.uuid4().hex[:12]
+        now = time.time()
+        job_ids = []
+        with self.transaction():
+            for index, job in enumerate(jobs):
+                number = str(job.get('number') or index + 1)
+                job_id = uuid.uuid4().hex
+                if source is not None:
+                    row_key = hashlib.sha1(f"{number}\n{job['prompt']}".encode('utf-8')).hexdigest()
+                    cursor = self.conn.execute(
+                        "INSERT OR IGNORE INTO source_rows (source, row_key, job_id, created_at) VALUES (?, ?, ?, ?)",
+                        (str(source), row_key, job_id, now))
+                    if cursor.rowcount == 0:
+                        continue
+                self.conn.execute(
+                    "INSERT INTO jobs (id, batch, number, prompt, style, ratio, images_per_prompt, reference_names, "
+                    "client, status, created_at, seq, output_dir) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+                    (job_id, batch, number, job['prompt'], job.get('style'), job.get('ratio'),
+                     job.get('images_per_prompt'), json.dumps(job.get('reference_names') or [], ensure_ascii=False),
+                     client, now, self.next_seq(), output_dir))
+                job_ids.append(job_id)
+        return batch, job_ids
+
+    def lease(self, worker, limit=1, lease_seconds=JOB_LEASE_SECONDS):
+        """按提交顺序领取最多 limit 条排队任务，标记为由 worker 运行"""
+        now = time.time()
+        jobs = []
+        with self.transaction():
+            rows = self.conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at, rowid LIMIT ?",
+                                     (limit,)).fetchall()
+            for row in rows:
+                seq = self.next_seq()
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, started_at = ?, "
+                    "attempts = attempts + 1, seq = ? WHERE id = ?",
+                    (worker, now + lease_seconds, now, seq, row['id']))
+                jobs.append({**self.to_dict(row), 'status': 'running', 'worker': worker, 'lease_until': now + lease_seconds,
+                             'started_at': now, 'attempts': row['attempts'] + 1, 'seq': seq})
+        return jobs
+
+    def heartbeat(self, worker, job_ids, lease_seconds=JOB_LEASE_SECONDS):
+        """为 worker 运行中的任务续约，返回租约已失效的任务ID"""
+        lost = []
+        if not job_ids:
+            return lost
+        lease_until = time.time() + lease_seconds
+        with self.transaction():
+            for job_id in job_ids:
+                cursor = self.conn.execute(
+                    "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                    (lease_until, job_id, worker))
+                if cursor.rowcount == 0:
+                    lost.append(job_id)
+        return lost
+
+    def finish(self, job_id, status, final_prompt='', files=(), image_urls=(), error='', worker=None):
+        """记录任务结果；指定 worker 时只接受仍持有租约的节点提交，返回是否记录成功"""
+        with self.transaction():
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = ?, final_prompt = ?, files = ?, image_urls = ?, error = ?, finished_at = ?, "
+                "lease_until = NULL, seq = ? WHERE id = ? AND status = 'running' AND (? IS NULL OR worker = ?)",
+                (status, final_prompt, json.dumps(list(files), ensure_ascii=False),
+                 json.dumps(list(image_urls), ensure_ascii=False), error, time.time(), self.next_seq(), job_id,
+                 worker, worker))
+            return cursor.rowcount > 0
+
+    def cancel(self, job_id):
+        """取消排队中的任务，已开始的任务无法取消；返回是否取消成功"""
+        with self.transaction():
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ?, seq = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), self.next_seq(), job_id))
+            return cursor.rowcount > 0
+
+    def requeue_expired(self):
+        """租约过期（执行节点失联或进程退出）的任务重新排队，超过最多尝试次数的标记失败；返回处理条数"""
+        now = time.time()
+        with self.transaction():
+            rows = self.conn.execute(
+                "SELECT id, worker, attempts FROM jobs WHERE status = 'running' AND lease_until < ?", (now,)).fetchall()
+            for row in rows:
+                if row['attempts'] >= MAX_JOB_ATTEMPTS:
+                    self.conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, lease_until = NULL, seq = ? "
+                        "WHERE id = ?",
+                        (f"执行节点失联（已尝试{row['attempts']}次）", now, self.next_seq(), row['id']))
+                else:
+                    self.conn.execute(
+                        "UPDATE jobs SET status = 'queued', worker = NULL, lease_until = NULL, started_at = NULL, "
+                        "seq = ? WHERE id = ?", (self.next_seq(), row['id']))
+                service_logger.warning(f"任务 {row['id']} 的租约已过期（{row['worker']}），"
+                                       f"{'标记失败' if row['attempts'] >= MAX_JOB_ATTEMPTS else '重新排队'}")
+        return len(rows)
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self.to_dict(row) if row else None
+
+    def list_jobs(self, batch=None, status=None, since=0, limit=1000):
+        """按变化序号升序列出任务，since 之后有变化的才返回"""
+        conditions, params = ["seq > ?"], [since]
+        if batch:
+            conditions.append("batch = ?")
+            params.append(batch)
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        with self.lock:
+            rows = self.conn.execute(f"SELECT * FROM jobs WHERE {' AND '.join(conditions)} ORDER BY seq LIMIT ?",
+                                     (*params, limit)).fetchall()
+        return [self.to_dict(row) for row in rows]
+
+    def counts(self, batch=None):
+        """各状态任务数"""
+        sql, params = "SELECT status, COUNT(*) FROM jobs", ()
+        if batch:
+            sql, params = sql + " WHERE batch = ?", (batch,)
+        with self.lock:
+            rows = self.conn.execute(sql + " GROUP BY status", params).fetchall()
+        return {status: count for status, count in rows}
+
+    def workers(self):
+        """各执行节点运行中的任务数"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT worker, COUNT(*) FROM jobs WHERE status = 'running' GROUP BY worker").fetchall()
+        return {worker: count for worker, count in rows}
+
+    def wait_for_change(self, seq, timeout):
+        """等待序号超过 seq 或超时，返回当前序号"""
+        deadline = time.monotonic() + timeout
+        with self.changed:
+            while True:
+                self.changed.wait_for(lambda: self.seq > seq, min(1.0, max(0.0, deadline - time.monotonic())))
+                if self.seq <= seq:
+                    # 其他进程直接写共享数据库时不会通知本进程
+                    self.seq = max(self.seq, self.max_seq())
+                if self.seq > seq or time.monotonic() >= deadline:
+                    return self.seq
+
+class RemoteJobQueue:
+    """通过协调节点的HTTP接口领取和提交任务，方法与 JobQueue 的租约接口一致
+
+    结果图片先保存在本机输出目录，提交结果时上传到协调节点。
+    """
+
+    def __init__(self, base_url, token=''):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        if token:
+            self.session.headers['Authorization'] = f"Bearer {token}"
+
+    def request(self, method, path, **kwargs):
+        response = self.session.request(method, self.base_url + path, timeout=kwargs.pop('timeout', 30), **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def lease(self, worker, limit=1, lease_seconds=JOB_LEASE_SECONDS):
+        return self.request('POST', '/leases', json={'worker': worker, 'limit': limit,
+                                                     'lease_seconds': lease_seconds})['jobs']
+
+    def heartbeat(self, worker, job_ids, lease_seconds=JOB_LEASE_SECONDS):
+        if not job_ids:
+            return []
+        return self.request('POST', '/leases/heartbeat', json={'worker': worker, 'jobs': list(job_ids),
+                                                               'lease_seconds': lease_seconds})['lost']
+
+    def finish(self, job_id, status, final_prompt='', files=(), image_urls=(), error='', worker=None):
+        uploaded = []
+        for file_path in files:
+            with open(file_path, 'rb') as f:
+                result = self.request('PUT', f"/jobs/{job_id}/files/{os.path.basename(file_path)}",
+                                      params={'worker': worker}, data=f, timeout=300)
+            uploaded.append(result['path'])
+        try:
+            self.request('POST', f"/jobs/{job_id}/result", json={
+                'worker': worker, 'status': status, 'final_prompt': final_prompt, 'files': uploaded,
+                'image_urls': list(image_urls), 'error': error})
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 409:
+                return False
+            raise
+        return True
+
+    def requeue_expired(self):
+        # 由协调节点负责
+        return 0
+
+class RateLimiter:
+    """令牌桶限速：每分钟最多 rate_per_minute 次上游请求，0 表示不限速（线程安全）"""
+
+    def __init__(self, rate_per_minute=0, burst=1):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready(self):
+        """当前是否有可用额度"""
+        if self.rate <= 0:
+            return True
+        with self.lock:
+            self.refill()
+            return self.tokens >= 1
+
+    def take(self, count=1):
+        """扣除额度，允许透支（之后按透支量推迟）"""
+        if self.rate <= 0:
             return
-        
-        # 检查配置
-        if not self.get_current_api_key():
-            QMessageBox.warning(self, "配置不完整", "请先在设置中心配置API密钥")
+        with self.lock:
+            self.refill()
+            self.tokens -= count
+
+class JobService(BatchRunner):
+    """常驻任务执行节点：从任务队列领取任务执行，结果写回队列
+
+    队列可以是本机/共享目录的 JobQueue，也可以是协调节点的 RemoteJobQueue。
+    同一节点的任务共用一组API密钥、并发数和限速额度；图片保存在 <输出目录>/<批次ID>/。
+    execute=False 时只做协调（处理过期租约），不在本机执行任务。
+    """
+
+    def __init__(self, config, job_queue, out_dir, concurrency=None, rate_limit=0, use_cache=True, execute=True):
+        super().__init__(config, [], out_dir, None, concurrency=concurrency, use_cache=use_cache)
+        self.queue = job_queue
+        self.limiter = RateLimiter(rate_limit, burst=self.pool.maxThreadCount())
+        self.execute = execute
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.active_jobs = {}  # 任务ID -> 任务
+        # 结果在后台线程提交（远程队列要上传图片，耗时较长），提交完成前仍为这些任务续约
+        self.submitting = {}   # 任务ID -> 任务
+        self.submit_lock = threading.Lock()
+        self.submit_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='job-submit')
+        self.next_poll = 0.0
+        self.next_heartbeat = 0.0
+
+    def job_output_dir(self, job):
+        return self.out_dir / (job.get('output_dir') or job['batch'])
+
+    def dispatch(self):
+        """有空闲并发和限速额度时从队列领取任务执行"""
+        while (len(self.active_jobs) < self.pool.maxThreadCount() and time.monotonic() >= self.next_poll
+               and self.limiter.ready()):
+            try:
+                jobs = self.queue.lease(self.worker_id, 1, JOB_LEASE_SECONDS)
+            except Exception as e:
+                service_logger.error(f"领取任务失败: {str(e)}")
+                jobs = []
+            if not jobs:
+                self.next_poll = time.monotonic() + JOB_POLL_INTERVAL
+                return
+            job = jobs[0]
+            self.active_jobs[job['id']] = job
+            service_logger.info(f"开始任务 {job['id']}（批次 {job['batch']}，编号 {job['number']}，第{job['attempts']}次）")
+            try:
+                # 每张图一次请求；任务数据有误时只让该任务失败，不中断调度循环
+                self.limiter.take(self.job_image_count(job))
+                self.start_job(job)
+            except Exception as e:
+                service_logger.error(f"任务 {job['id']} 启动失败: {str(e)}")
+                self.submit_result(job, 'failed', error=f"任务启动失败: {str(e)}")
+
+    def maintain(self):
+        """定期为运行中的任务续约，并把租约过期的任务重新排队"""
+        if time.monotonic() < self.next_heartbeat:
             return
-        
-        if not self.save_path:
-            QMessageBox.warning(self, "配置不完整", "请先在设置中心设置保存路径")
+        self.next_heartbeat = time.monotonic() + JOB_HEARTBEAT_INTERVAL
+        with self.submit_lock:
+            job_ids = list(self.active_jobs) + list(self.submitting)
+        try:
+            for job_id in self.queue.heartbeat(self.worker_id, job_ids, JOB_LEASE_SECONDS):
+                service_logger.warning(f"任务 {job_id} 的租约已失效，结果将不被采用")
+            self.queue.requeue_expired()
+        except Exception as e:
+            service_logger.error(f"任务续约失败: {str(e)}")
+
+    def submit_result(self, job, status, final_prompt='', files=(), image_urls=(), error=''):
+        """把结果交给后台线程提交，不阻塞调度循环（续约、领取新任务）"""
+        with self.submit_lock:
+            self.active_jobs.pop(job['id'], None)
+            self.submitting[job['id']] = job
+        self.submit_executor.submit(self.finish_job, job, status, final_prompt, list(files), list(image_urls), error)
+
+    def finish_job(self, job, status, final_prompt, files, image_urls, error):
+        try:
+            accepted = self.queue.finish(job['id'], status, final_prompt, files, image_urls, error, worker=self.worker_id)
+        except Exception as e:
+            # 提交失败的任务会在租约过期后重新排队
+            service_logger.error(f"任务 {job['id']} 提交结果失败: {str(e)}")
             return
-        
-        # 检查是否有提示词
-        if not self.prompt_table_data:
-            QMessageBox.warning(self, "提示", "请先添加提示词或导入CSV文件")
+        finally:
+            with self.submit_lock:
+                self.submitting.pop(job['id'], None)
+        if not accepted:
+            service_logger.warning(f"任务 {job['id']} 的租约已失效，结果未被采用")
+
+    def record_result(self, job, record):
+        self.submit_result(job, record['status'], record['final_prompt'], record['files'],
+                           record['image_urls'], record['error'])
+        service_logger.info(f"任务 {job['id']} {record['status']}（{record['seconds']}s）")
+
+    def serve_forever(self, tick=None):
+        """在当前线程处理任务调度和工作线程信号，直到 KeyboardInterrupt；tick 为每轮额外调用的函数"""
+        app = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            while True:
+                if tick:
+                    tick()
+                self.maintain()
+                if self.execute:
+                    self.dispatch()
+                app.processEvents()
+                time.sleep(0.05)
+        finally:
+            self.pool.clear()
+            # 等待已完成任务的结果提交完毕，避免白白等租约过期后重做
+            self.submit_executor.shutdown(wait=True)
+            if self.cache is not None:
+                self.cache.flush()
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """任务服务的HTTP接口
+
+    POST   /jobs                     提交任务：{"jobs": [{prompt, number, style, ratio, images_per_prompt, reference_names}], "client": "..."}
+    GET    /jobs?batch=&status=&since=  列出任务（since 为变化序号，用于增量轮询）
+    GET    /jobs/<id>                任务详情
+    DELETE /jobs/<id>                取消排队中的任务
+    GET    /jobs/<id>/files/<序号>   下载结果图片
+    GET    /batches/<批次ID>          批次各状态计数和任务列表
+    GET    /events?batch=&since=     以SSE推送任务状态变化
+    GET    /metrics                  OpenMetrics 指标
+
+    执行节点（python main.py worker --coordinator ...）使用：
+    POST   /leases                   领取任务：{"worker", "limit", "lease_seconds"}
+    POST   /leases/heartbeat         续约：{"worker", "jobs": [id], "lease_seconds"}，返回已失效的任务
+    PUT    /jobs/<id>/files/<文件名>?worker=  上传结果图片
+    POST   /jobs/<id>/result         提交结果：{"worker", "status", "final_prompt", "files", "image_urls", "error"}
+    """
+
+    protocol_version = 'HTTP/1.1'
+    service = None  # JobService，由 JobServer 设置
+    token = ''      # 非空时要求 Authorization: Bearer <token>
+    MAX_BODY_BYTES = 10 * 1024 * 1024
+    EVENT_KEEPALIVE = 15  # SSE 心跳间隔（秒）
+
+    def log_message(self, format, *args):
+        service_logger.debug(format % args)
+
+    def send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        if not self.token or self.headers.get('Authorization', '') == f"Bearer {self.token}":
+            return True
+        self.send_json(401, {'error': '未授权'})
+        return False
+
+    def route(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        return [part for part in url.path.split('/') if part], query
+
+    def do_GET(self):
+        parts, query = self.route()
+        if not self.authorized():
             return
-        
-        self.save_config()
-        
-        # 获取所有提示词并重置状态
-        prompts = []
-        original_prompts = []
-        
-        # 重置所有状态
-        for data in self.prompt_table_data:
-            data['status'] = '等待中'
-            data['image_url'] = ''
-            data['error_msg'] = ''
-            prompts.append(data['prompt'])
-            original_prompts.append(data['prompt'])
-            
-        # 刷新表格显示
-        self.refresh_prompt_table()
-        
-        # 添加风格提示词和图片比例
-        style_content = ""
-        if self.custom_style_content.strip():
-            style_content = self.custom_style_content.strip()
-            if self.current_style and self.current_style in self.style_library:
-                self.style_library[self.current_style]['usage_count'] = self.style_library[self.current_style].get('usage_count', 0) + 1
-        elif self.current_style and self.current_style in self.style_library:
-            style_content = self.style_library[self.current_style]['content'].strip()
-            self.style_library[self.current_style]['usage_count'] = self.style_library[self.current_style].get('usage_count', 0) + 1
-        
-        ratio = self.image_ratio
-        
-        # 处理每个提示词
-        processed_prompts = []
-        for p in prompts:
-            if f"图片比例【{ratio}】" not in p:
-                if style_content and style_content not in p:
-                    p = f"{p} {style_content}"
-                p = f"{p} 图片比例【{ratio}】"
-            processed_prompts.append(p)
-        
-        prompts = processed_prompts
-        
-        # 设置计数器（保持兼容性）
-        self.total_images = len(prompts)
-        self.completed_images = 0
-        
-        # 显示整体进度
-        self.overall_progress_bar.setVisible(True)
-        self.overall_progress_label.setText(f"开始重新生成 {len(prompts)} 张图片...")
-        
-        # 更新进度显示
-        self.update_generation_progress()
-        
-        # 重新生成全部时禁用按钮（避免冲突）
-        self.generate_button.setEnabled(False)
-        self.generate_button.setText("重新生成中...")
-        self.regenerate_all_button.setEnabled(False)
-        self.regenerate_all_button.setText("重新生成中...")
-        
-        # 获取图片数据映射
-        image_data_map = self.get_image_data_map()
-        
-        # 为每个提示词创建工作线程
-        for i, prompt in enumerate(prompts):
-            # 从提示词中提取图片名称
-            image_names = self.extract_image_names(prompt)
-            
-            # 获取对应的图片数据
-            image_data_list = []
-            for name in image_names:
-                if name in image_data_map:
-                    image_data_list.append(image_data_map[name])
-            
-            # 获取对应的编号
-            original_prompt = original_prompts[i]
-            number = self.prompt_numbers.get(original_prompt, str(i + 1))
-            
-            worker = Worker(prompt, self.get_current_api_key(), image_data_list, self.api_platform, self.image_model, self.retry_count, number)
-            worker.signals.finished.connect(lambda p, url, num, idx=i, orig=original_prompt: self.handle_success(p, url, num, idx, orig))
-            worker.signals.error.connect(lambda p, err, idx=i, orig=original_prompt: self.handle_error(p, err, idx, orig))
-            worker.signals.progress.connect(lambda p, status, orig=original_prompt: self.handle_progress(p, status, orig))
-            self.threadpool.start(worker)
-    
-    def handle_progress(self, prompt, status, original_prompt):
-        """处理进度更新"""
-        # 找到对应的数据行
-        for data in self.prompt_table_data:
-            if data['prompt'] == original_prompt:
-                if "重试" in status:
-                    data['status'] = status
-                else:
-                    data['status'] = '生成中'
-                break
-        
-        # 刷新表格显示
-        self.refresh_prompt_table()
-    
-    def handle_success(self, prompt, image_url, number, index, original_prompt):
-        """处理成功"""
-        # 找到对应的数据行并更新
-        actual_number = number  # 默认使用传入的编号
-        found = False
-        for data in self.prompt_table_data:
-            if data['prompt'] == original_prompt:
-                data['status'] = '成功'
-                data['image_url'] = image_url
-                data['error_msg'] = ''
-                actual_number = data['number']  # 使用表格中的编号
-                found = True
-                break
-        
-        # 存储图片信息
-        self.generated_images[prompt] = image_url
-        
-        # 生成带时间戳前缀的文件名
-        timestamp = time.strftime('%Y%m%d_%H%M%S')
-        filename = f"{timestamp}_{actual_number}.png"
-        
-        # 将文件名保存到数据中
-        for data in self.prompt_table_data:
-            if data['prompt'] == original_prompt:
-                data['filename'] = filename
-                break
-        
-        # 自动保存图片
-        if self.save_path:
+        if parts == ['metrics']:
+            body = render_openmetrics(METRICS).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', OPENMETRICS_CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        job_queue = self.service.queue
+        if parts == ['health']:
+            self.send_json(200, {'status': 'ok', 'counts': job_queue.counts(), 'workers': job_queue.workers()})
+        elif parts == ['jobs']:
             try:
-                os.makedirs(self.save_path, exist_ok=True)
-                file_path = os.path.join(self.save_path, filename)
-                
-                response = requests.get(image_url)
-                with open(file_path, 'wb') as f:
-                    f.write(response.content)
-                    
-            except Exception as e:
-                error_msg = f"保存图片失败: {str(e)}"
-                logging.error(error_msg)
-        
-        # 刷新表格显示
-        self.refresh_prompt_table()
-        
-        # 动态计算当前任务状态
-        self.update_generation_progress()
-        
-        # 检查是否当前批次全部完成
-        self.check_generation_completion()
-    
-    def handle_error(self, prompt, error, index, original_prompt):
-        """处理错误"""
-        # 找到对应的数据行并更新
-        for data in self.prompt_table_data:
-            if data['prompt'] == original_prompt:
-                data['status'] = '失败'
-                data['image_url'] = ''
-                data['error_msg'] = error
-                break
-        
-        # 刷新表格显示
-        self.refresh_prompt_table()
-        
-        # 记录错误
-        logging.error(f"生成图片 {index+1} 失败:")
-        logging.error(f"提示词: {prompt}")
-        logging.error(f"错误信息: {error}")
-        
-        # 动态计算当前任务状态
-        self.update_generation_progress()
-        
-        # 检查是否当前批次全部完成
-        self.check_generation_completion()
-    
-    def update_generation_progress(self):
-        """动态更新生成进度"""
-        # 统计各种状态的任务数量
-        waiting_count = len([data for data in self.prompt_table_data if data.get('status', '等待中') == '等待中'])
-        generating_count = len([data for data in self.prompt_table_data if data.get('status', '') == '生成中' or '重试' in data.get('status', '')])
-        success_count = len([data for data in self.prompt_table_data if data.get('status', '') == '成功'])
-        failed_count = len([data for data in self.prompt_table_data if data.get('status', '') == '失败'])
-        
-        total_tasks = len(self.prompt_table_data)
-        completed_tasks = success_count + failed_count
-        
-        # 更新进度条
-        if total_tasks > 0:
-            self.overall_progress_bar.setMaximum(total_tasks)
-            self.overall_progress_bar.setValue(completed_tasks)
-            
-            # 更新进度标签
-            if generating_count > 0:
-                self.overall_progress_label.setText(f"进行中: 等待{waiting_count}个 | 生成中{generating_count}个 | 已完成{success_count}个 | 失败{failed_count}个")
+                since = int(query.get('since', 0))
+                limit = min(int(query.get('limit', 1000)), 10000)
+            except ValueError:
+                self.send_json(400, {'error': 'since/limit 必须为整数'})
+                return
+            jobs = job_queue.list_jobs(query.get('batch'), query.get('status'), since, limit)
+            self.send_json(200, {'jobs': jobs, 'seq': jobs[-1]['seq'] if jobs else since})
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            job = job_queue.get(parts[1])
+            if job:
+                self.send_json(200, job)
             else:
-                self.overall_progress_label.setText(f"已处理 {completed_tasks}/{total_tasks} 个任务 | 成功{success_count}个 | 失败{failed_count}个")
-    
-    def check_generation_completion(self):
-        """检查生成是否完成"""
-        # 检查是否还有正在生成或等待中的任务
-        active_tasks = [data for data in self.prompt_table_data 
-                       if data.get('status', '等待中') in ['等待中', '生成中'] or '重试' in data.get('status', '')]
-        
-        # 如果没有活跃任务，说明当前批次已完成
-        if not active_tasks:
-            # 只有在重新生成全部模式下才完全恢复按钮状态
-            if not self.generate_button.isEnabled():  # 说明是重新生成全部模式
-                self.generation_finished()
-    
-    def generation_finished(self):
-        """生成完成"""
-        self.generate_button.setEnabled(True)
-        self.generate_button.setText("智能生成(仅新增)")
-        self.regenerate_all_button.setEnabled(True)
-        self.regenerate_all_button.setText("重新生成全部")
-        
-        # 统计结果
-        success_count = len([data for data in self.prompt_table_data if data['status'] == '成功'])
-        failed_count = self.total_images - success_count
-        
-        # 更新状态显示
-        self.overall_progress_label.setText(f"🎉 生成完成！成功: {success_count} 张，失败: {failed_count} 张")
-        
-        # 播放完成提示音
-        self.play_completion_sound()
-    
-    def check_default_config(self):
-        """检查并创建默认配置文件"""
-        config_path = APP_PATH / 'config.json'
-        if not config_path.exists():
-            # 异步创建，避免阻塞启动
-            QTimer.singleShot(300, lambda: self.create_default_config_file(config_path))
-    
-    def create_default_config_file(self, config_path):
-        """异步创建默认配置文件"""
-        if config_path.exists():  # 双重检查
+                self.send_json(404, {'error': '任务不存在'})
+        elif len(parts) == 4 and parts[0] == 'jobs' and parts[2] == 'files':
+            self.send_result_file(parts[1], parts[3])
+        elif len(parts) == 2 and parts[0] == 'batches':
+            counts = job_queue.counts(parts[1])
+            if not counts:
+                self.send_json(404, {'error': '批次不存在'})
+                return
+            self.send_json(200, {'batch': parts[1], 'counts': counts, 'jobs': job_queue.list_jobs(batch=parts[1], limit=100000)})
+        elif parts == ['events']:
+            try:
+                since = int(self.headers.get('Last-Event-ID') or query.get('since', 0))
+            except ValueError:
+                self.send_json(400, {'error': 'since 必须为整数'})
+                return
+            self.stream_events(query.get('batch'), since)
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def read_json(self):
+        """读取JSON请求体，出错时已返回错误响应并返回 None"""
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > self.MAX_BODY_BYTES:
+            self.send_json(413, {'error': '请求体过大'})
+            return None
+        try:
+            return json.loads(self.rfile.read(length) or b'{}')
+        except ValueError as e:
+            self.send_json(400, {'error': f"无效的JSON: {e}"})
+            return None
+
+    def do_POST(self):
+        parts, _ = self.route()
+        if not self.authorized():
+            return
+        body = self.read_json()
+        if body is None:
+            return
+        if parts == ['jobs']:
+            self.submit_jobs(body)
+        elif parts in (['leases'], ['leases', 'heartbeat']):
+            self.handle_lease(body, heartbeat=len(parts) == 2)
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'result':
+            if not isinstance(body, dict) or body.get('status') not in ('success', 'failed'):
+                self.send_json(400, {'error': 'status 必须为 success 或 failed'})
+                return
+            # 只接受上传到该任务输出目录的文件，防止借结果记录读取服务器上的任意文件
+            job = self.service.queue.get(parts[1])
+            files = body.get('files') or []
+            if not isinstance(files, list) or (job and not all(self.job_file_path(job, path) for path in files)):
+                self.send_json(400, {'error': 'files 只能包含已上传到该任务的文件'})
+                return
+            accepted = self.service.queue.finish(parts[1], body['status'], body.get('final_prompt', ''),
+                                                 files, body.get('image_urls') or [],
+                                                 body.get('error', ''), worker=str(body.get('worker', '')))
+            if accepted:
+                self.send_json(200, {'id': parts[1], 'status': body['status']})
+            else:
+                self.send_json(409, {'error': '任务租约已失效'})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def handle_lease(self, body, heartbeat=False):
+        """领取任务或为任务续约，请求体格式错误时返回400"""
+        try:
+            if not isinstance(body, dict):
+                raise ValueError("请求体必须为JSON对象")
+            try:
+                lease_seconds = float(body.get('lease_seconds') or JOB_LEASE_SECONDS)
+            except (ValueError, TypeError):
+                raise ValueError("lease_seconds 必须为数字") from None
+            if not math.isfinite(lease_seconds) or lease_seconds <= 0:
+                raise ValueError("lease_seconds 必须为正数")
+            lease_seconds = min(lease_seconds, 3600)
+            if heartbeat:
+                job_ids = body.get('jobs') or []
+                if not isinstance(job_ids, list) or not all(isinstance(job_id, str) for job_id in job_ids):
+                    raise ValueError("jobs 必须为任务ID列表")
+            else:
+                try:
+                    limit = max(1, min(int(body.get('limit') or 1), 100))
+                except (ValueError, TypeError, OverflowError):
+                    raise ValueError("limit 必须为整数") from None
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        if heartbeat:
+            lost = self.service.queue.heartbeat(str(body.get('worker', '')), job_ids, lease_seconds)
+            self.send_json(200, {'lost': lost})
+        else:
+            jobs = self.service.queue.lease(str(body.get('worker') or self.client_address[0]), limit, lease_seconds)
+            self.send_json(200, {'jobs': jobs})
+
+    def do_PUT(self):
+        """执行节点上传结果图片，保存到 <输出目录>/<批次ID>/；文件名已存在时另取名，返回实际保存路径"""
+        parts, query = self.route()
+        if not self.authorized():
+            return
+        if len(parts) != 4 or parts[0] != 'jobs' or parts[2] != 'files':
+            self.send_json(404, {'error': 'not found'})
+            return
+        job = self.service.queue.get(parts[1])
+        if not job or job['status'] != 'running' or job['worker'] != query.get('worker'):
+            self.send_json(409, {'error': '任务租约已失效'})
             return
+        filename = os.path.basename(parts[3])
+        length = int(self.headers.get('Content-Length') or 0)
+        if not filename.lower().endswith('.png') or length > 200 * 1024 * 1024:
+            self.send_json(400, {'error': '只接受200MB以内的PNG图片'})
+            return
+        out_dir = self.service.job_output_dir(job)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        # 不同执行节点可能上传同名文件（同编号、同一秒完成），先占用文件名避免互相覆盖
+        file_path = Path(reserve_image_path(str(out_dir / filename)))
+        temp_path = file_path.with_name(file_path.name + '.part')
+        digest = hashlib.sha256()
+        with open(temp_path, 'wb') as f:
+            remaining = length
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                f.write(chunk)
+                digest.update(chunk)
+                remaining -= len(chunk)
+        if remaining > 0:
+            temp_path.unlink(missing_ok=True)
+            file_path.unlink(missing_ok=True)
+            self.send_json(400, {'error': '上传不完整'})
+            return
+        os.replace(temp_path, file_path)
+        self.service.output_index.add([(file_path, length, digest.hexdigest())])
+        self.send_json(200, {'path': str(file_path), 'name': file_path.name})
+
+    def submit_jobs(self, body):
         try:
-            default_config = {
-                'api_key': '',
-                'api_platform': '云雾',
-                'thread_count': 5,
-                'retry_count': 3,
-                'save_path': '',
-                'image_ratio': '3:2',
-                'style_library': {
-                    '超写实风格': {
-                        'name': '超写实风格',
-                        'content': '极致的超写实主义照片风格，画面呈现出顶级数码单反相机（如佳能EOS R5）搭配高质量定焦镜头（如85mm f/1.2）的拍摄效果。明亮、均匀，光影过渡微妙且真实，无明显阴影。绝对真实的全彩照片，无任何色彩滤镜。色彩如同在D65标准光源环境下拍摄，白平衡极其精准，所见即所得。色彩干净通透，类似于现代商业广告摄影风格。严禁任何形式的棕褐色调、复古滤镜或暖黄色偏色。画面高度细腻，细节极其丰富，达到8K分辨率的视觉效果。追求极致的清晰度和纹理表现，所有物体的材质质感都应逼真呈现，无噪点，无失真。',
-                        'category': '摄影风格',
-                        'created_time': '2024-01-01 12:00:00',
-                        'usage_count': 0
-                    },
-                    '动漫风格': {
-                        'name': '动漫风格',
-                        'content': '二次元动漫风格，色彩鲜艳饱满，线条清晰，具有典型的日式动漫美学特征。人物造型精致，表情生动，背景细腻。',
-                        'category': '插画风格',
-                        'created_time': '2024-01-01 12:01:00',
-                        'usage_count': 0
-                    },
-                    '油画风格': {
-                        'name': '油画风格',
-                        'content': '经典油画艺术风格，笔触丰富，色彩层次分明，具有厚重的质感和艺术气息。光影效果自然，构图典雅。',
-                        'category': '艺术风格',
-                        'created_time': '2024-01-01 12:02:00',
-                        'usage_count': 0
-                    }
-                },
-                'current_style': '',
-                'custom_style_content': '',
-                'window_geometry': {
-                    'width': 1200,
-                    'height': 800,
-                    'x': 100,
-                    'y': 100
-                },
-                'category_links': {}
-            }
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump(default_config, f, indent=2, ensure_ascii=False)
-        except Exception:
-            pass  # 静默失败，不影响程序运行
-    
-    def load_config(self):
-        """加载配置"""
+            specs = body.get('jobs', [body] if 'prompt' in body else []) if isinstance(body, dict) else body
+            jobs = []
+            for spec in specs:
+                if not isinstance(spec, dict) or not str(spec.get('prompt', '')).strip():
+                    raise ValueError("每个任务都需要 prompt 字段")
+                reference_names = spec.get('reference_names') or []
+                if not isinstance(reference_names, list):
+                    raise ValueError("reference_names 必须为列表")
+                job = {**{key: spec[key] for key in JOB_OPTIONAL_FIELDS if spec.get(key)},
+                       'number': spec.get('number'), 'prompt': str(spec['prompt'])}
+                if 'images_per_prompt' in job:
+                    job['images_per_prompt'] = parse_images_per_prompt(job['images_per_prompt'])
+                jobs.append(job)
+            if not jobs:
+                raise ValueError("没有任务")
+        except (ValueError, AttributeError, TypeError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        # 服务端不读取客户端机器上的本地文件路径
+        for job in jobs:
+            job.pop('reference_images', None)
+        client = body.get('client', '') if isinstance(body, dict) else ''
+        batch, job_ids = self.service.queue.submit(jobs, client=client or self.client_address[0])
+        service_logger.info(f"收到批次 {batch}: {len(job_ids)} 条（{client or self.client_address[0]}）")
+        self.send_json(201, {'batch': batch, 'jobs': job_ids})
+
+    def do_DELETE(self):
+        parts, _ = self.route()
+        if not self.authorized():
+            return
+        if len(parts) != 2 or parts[0] != 'jobs':
+            self.send_json(404, {'error': 'not found'})
+            return
+        job = self.service.queue.get(parts[1])
+        if not job:
+            self.send_json(404, {'error': '任务不存在'})
+        elif self.service.queue.cancel(parts[1]):
+            self.send_json(200, {'id': parts[1], 'status': 'cancelled'})
+        else:
+            self.send_json(409, {'error': f"任务状态为 {job['status']}，无法取消"})
+
+    def job_file_path(self, job, file_path):
+        """任务输出目录内已存在的文件（解析后的路径），不在目录内或不存在时返回 None"""
         try:
-            config_path = APP_PATH / 'config.json'
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-                self.api_key = config.get('api_key', '')
-                self.api_platform = config.get('api_platform', '云雾')
-                self.image_model = config.get('image_model', 'sora')  # 加载生图模型配置
-                # 加载分离的API密钥
-                self.sora_api_key = config.get('sora_api_key', '')
-                self.nano_api_key = config.get('nano_api_key', '')
-                self.thread_count = config.get('thread_count', 5)
-                self.retry_count = config.get('retry_count', 3)
-                self.save_path = config.get('save_path', '')
-                self.image_ratio = config.get('image_ratio', '3:2')
-                
-                # 加载风格库
-                self.style_library = config.get('style_library', {})
-                self.current_style = config.get('current_style', '')
-                self.custom_style_content = config.get('custom_style_content', '')
-                
-                # 加载图片分类链接
-                self.category_links = config.get('category_links', {})
-                
-                # 加载OpenRouter AI优化配置
-                self.openrouter_api_key = config.get('openrouter_api_key', '')
-                self.ai_model = config.get('ai_model', 'qwen/qwq-32b')
-                self.meta_prompt = config.get('meta_prompt', '')
-                self.meta_prompt_template = config.get('meta_prompt_template', 'template1')
-                self.optimization_history = config.get('optimization_history', [])
-                
-                # 恢复窗口大小和位置
-                window_geometry = config.get('window_geometry', {})
-                if window_geometry:
-                    width = window_geometry.get('width', 1200)
-                    height = window_geometry.get('height', 800)
-                    x = window_geometry.get('x', 100)
-                    y = window_geometry.get('y', 100)
-                    
-                    self.resize(width, height)
-                    self.move(x, y)
-                
-                # 异步刷新界面显示（避免阻塞）
-                QTimer.singleShot(50, self.refresh_ui_after_settings)
-                
-                # 刷新提示词表格中的按钮状态
-                QTimer.singleShot(100, self.refresh_prompt_table)
+            path = Path(file_path).resolve()
+            path.relative_to(self.service.job_output_dir(job).resolve())
+        except (TypeError, ValueError, OSError):
+            return None
+        return path if path.is_file() else None
 
-        except FileNotFoundError:
-            # 即使没有配置文件，也要异步刷新UI
-            QTimer.singleShot(50, self.refresh_ui_after_settings)
-            QTimer.singleShot(100, self.refresh_prompt_table)
-        except Exception as e:
-            # 即使配置加载失败，也要异步刷新UI
-            QTimer.singleShot(50, self.refresh_ui_after_settings)
-            QTimer.singleShot(100, self.refresh_prompt_table)
-    
-    def save_config(self):
-        """保存配置"""
-        if not self._init_done:
+    def send_result_file(self, job_id, index):
+        job = self.service.queue.get(job_id)
+        try:
+            file_path = self.job_file_path(job, job['files'][int(index)])
+        except (TypeError, ValueError, IndexError):
+            self.send_json(404, {'error': '文件不存在'})
+            return
+        if file_path is None:
+            self.send_json(404, {'error': '文件不存在'})
             return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(file_path.stat().st_size))
+        self.send_header('Content-Disposition', f'attachment; filename="{file_path.name}"')
+        self.end_headers()
+        with open(file_path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def stream_events(self, batch, since):
+        """SSE：每条任务状态变化推送一个事件，批次全部结束后关闭"""
+        job_queue = self.service.queue
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
         try:
-            config = {
-                'api_key': self.api_key,
-                'api_platform': self.api_platform,
-                'image_model': self.image_model,  # 保存生图模型配置
-                # 分离的API密钥
-                'sora_api_key': getattr(self, 'sora_api_key', ''),
-                'nano_api_key': getattr(self, 'nano_api_key', ''),
-                'thread_count': self.thread_count,
-                'retry_count': self.retry_count,
-                'save_path': self.save_path,
-                'image_ratio': self.image_ratio,
-                'style_library': self.style_library,
-                'current_style': self.current_style,
-                'custom_style_content': self.custom_style_content,
-                'window_geometry': {
-                    'width': self.width(),
-                    'height': self.height(),
-                    'x': self.x(),
-                    'y': self.y()
-                },
-                'category_links': self.category_links,
-                # OpenRouter AI优化配置
-                'openrouter_api_key': self.openrouter_api_key,
-                'ai_model': self.ai_model,
-                'meta_prompt': self.meta_prompt,
-                'meta_prompt_template': self.meta_prompt_template,
-                'optimization_history': self.optimization_history
-            }
-            config_path = APP_PATH / 'config.json'
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=2, ensure_ascii=False)
-                f.flush()
-                os.fsync(f.fileno())
-        except Exception as e:
+            while True:
+                jobs = job_queue.list_jobs(batch=batch, since=since)
+                for job in jobs:
+                    since = job['seq']
+                    self.wfile.write(f"id: {since}\ndata: {json.dumps(job, ensure_ascii=False)}\n\n".encode('utf-8'))
+                if jobs:
+                    self.wfile.flush()
+                if batch and not any(status not in JOB_FINISHED_STATUSES for status in job_queue.counts(batch)):
+                    self.wfile.write(b"event: done\ndata: {}\n\n")
+                    return
+                if job_queue.wait_for_change(since, self.EVENT_KEEPALIVE) <= since:
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
             pass
-    
-    def play_completion_sound(self):
-        """播放任务完成提示音"""
+
+class JobServer:
+    """在后台线程中提供任务服务HTTP接口"""
+
+    def __init__(self, service, host, port, token=''):
+        self.host = host
+        handler = type('BoundJobRequestHandler', (JobRequestHandler,), {'service': service, 'token': token})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='job-server', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        service_logger.info(f"任务服务已启动: http://{self.host}:{self.port}")
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# ========== 监视文件夹 ==========
+
+WATCH_POLL_INTERVAL = 5     # 轮询扫描间隔（秒）；有文件事件通知时作为兜底的全量扫描间隔再放大
+WATCH_SETTLE_SECONDS = 2    # 文件大小和修改时间保持不变多久后才读取，避免读到写了一半的文件
+
+class WatchEventHandler(FileSystemEventHandler):
+    """收到文件事件时标记需要重新扫描（实际处理在调度线程进行）"""
+
+    def __init__(self, dirty):
+        super().__init__()
+        self.dirty = dirty
+
+    def on_any_event(self, event):
+        self.dirty.set()
+
+def safe_dirname(name):
+    """把文件名转换为可用作目录名的字符串"""
+    name = re.sub(r'[\\/:*?"<>|\s]+', '_', name).strip('._')
+    return name or 'untitled'
+
+class FolderWatcher:
+    """监视文件夹中新增或修改的CSV分镜文件，把没有提交过的行加入任务队列
+
+    每个CSV的结果保存在输出目录下以文件名命名的子目录；同一文件中编号和提示词都相同的行只提交一次，
+    修改过的行视为新任务。
+    """
+
+    def __init__(self, folder, job_queue, recursive=False, column_map=None):
+        self.folder = Path(folder)
+        self.queue = job_queue
+        self.recursive = recursive
+        self.column_map = column_map
+        self.processed = {}  # 文件路径 -> 已处理版本的 (修改时间, 大小)
+        self.pending = {}    # 文件路径 -> (版本, 首次发现该版本的时间)
+        self.dirty = threading.Event()
+        self.dirty.set()
+        self.next_scan = 0.0
+        self.observer = None
+        if Observer is not None:
+            try:
+                self.observer = Observer()
+                self.observer.schedule(WatchEventHandler(self.dirty), str(self.folder), recursive=recursive)
+                self.observer.start()
+            except Exception as e:
+                logging.warning(f"文件事件监视启动失败，改为轮询: {str(e)}")
+                self.observer = None
+
+    @property
+    def mode(self):
+        return "文件事件" if self.observer else f"每{WATCH_POLL_INTERVAL}秒轮询"
+
+    def stop(self):
+        if self.observer:
+            self.observer.stop()
+            self.observer.join(timeout=2)
+
+    def scan(self):
+        """列出文件夹中的CSV文件及其版本"""
+        pattern = '**/*.csv' if self.recursive else '*.csv'
+        files = {}
+        for path in self.folder.glob(pattern):
+            if path.name.startswith(('.', '~$')) or not path.is_file():
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files[path] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def poll(self):
+        """检查文件变化并提交新增的行，返回本次提交的任务数"""
+        now = time.monotonic()
+        if not self.dirty.is_set() and now < self.next_scan:
+            return 0
+        self.dirty.clear()
+        self.next_scan = now + WATCH_POLL_INTERVAL * (12 if self.observer else 1)
+        
+        submitted = 0
+        files = self.scan()
+        for path, version in files.items():
+            if self.processed.get(path) == version:
+                continue
+            pending = self.pending.get(path)
+            if pending is None or pending[0] != version:
+                self.pending[path] = (version, now)
+                continue
+            if now - pending[1] < WATCH_SETTLE_SECONDS:
+                continue
+            del self.pending[path]
+            self.processed[path] = version
+            submitted += self.ingest(path)
+        for path in list(self.pending):
+            if path not in files:
+                del self.pending[path]
+        if self.pending:
+            # 等待中的文件稳定后再检查一次
+            self.next_scan = min(self.next_scan, now + WATCH_SETTLE_SECONDS)
+        return submitted
+
+    def ingest(self, path):
         try:
-            if winsound:
-                # Windows系统：播放系统完成提示音
-                winsound.PlaySound("SystemAsterisk", winsound.SND_ALIAS | winsound.SND_ASYNC)
-            elif subprocess:
-                # 跨平台方案
-                if sys.platform.startswith('darwin'):  # macOS
-                    subprocess.run(['afplay', '/System/Library/Sounds/Glass.aiff'], check=False)
-                elif sys.platform.startswith('linux'):  # Linux
-                    subprocess.run(['aplay', '/usr/share/sounds/alsa/Front_Right.wav'], check=False)
+            rows = table_jobs(read_prompt_file(path, self.column_map))
         except Exception as e:
-            # 如果播放声音失败，忽略错误
-            pass
-    
-    def closeEvent(self, event):
-        """窗口关闭事件"""
-        self.save_config()
-        event.accept()
+            # 文件再次修改后会重试
+            logging.warning(f"读取监视的CSV失败 {path}: {str(e)}")
+            return 0
+        relative = path.relative_to(self.folder)
+        output_dir = safe_dirname(str(relative.with_suffix('')))
+        batch, job_ids = self.queue.submit(rows, client=f"watch:{relative}", source=path.resolve(), output_dir=output_dir)
+        if job_ids:
+            service_logger.info(f"监视文件 {relative}: 新增 {len(job_ids)} 条任务（批次 {batch}）")
+            print(f"{relative}: 新增 {len(job_ids)} 条任务 -> {output_dir}", flush=True)
+        else:
+            service_logger.info(f"监视文件 {relative}: 没有新的行")
+        return len(job_ids)
+
+def build_cli_parser():
+    parser = argparse.ArgumentParser(prog='main.py', description="深海圈生图命令行模式（不带参数运行时启动图形界面）")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    run_parser = subparsers.add_parser('run', help="批量生图")
+    run_parser.add_argument('jobs', help="任务文件：提示词表格（CSV/xlsx/parquet，与导入表格相同）或 JSONL")
+    run_parser.add_argument('--out', required=True, help="图片保存目录")
+    run_parser.add_argument('--config', help="配置文件，默认使用程序目录下的 config.json")
+    run_parser.add_argument('--manifest', help="结果清单路径（JSONL），默认 <输出目录>/manifest.jsonl")
+    run_parser.add_argument('--concurrency', type=int, help="生图并发数，默认使用配置中的线程数")
+    run_parser.add_argument('--images-per-prompt', type=int, help="每条提示词生成的图片数")
+    run_parser.add_argument('--ratio', help="图片比例，如 16:9")
+    run_parser.add_argument('--style', help="风格库中的风格名称，默认使用配置中当前的风格")
+    run_parser.add_argument('--resume', action='store_true', help="跳过清单中已成功的编号，结果追加到清单")
+    run_parser.add_argument('--fresh', action='store_true', help="不复用相同请求的已生成图片")
+    run_parser.add_argument('--no-cache', action='store_true', help="不读写生图结果缓存")
+    
+    serve_parser = subparsers.add_parser('serve', help="启动本地任务服务（HTTP接口）")
+    serve_parser.add_argument('--out', required=True, help="图片保存目录，每个批次一个子目录")
+    serve_parser.add_argument('--host', default='127.0.0.1', help="监听地址，需要局域网访问时使用 0.0.0.0")
+    serve_parser.add_argument('--port', type=int, default=8765)
+    serve_parser.add_argument('--config', help="配置文件，默认使用程序目录下的 config.json")
+    serve_parser.add_argument('--db', help="任务队列数据库，默认使用程序目录下的 jobs.db")
+    serve_parser.add_argument('--concurrency', type=int, help="同时执行的任务数，默认使用配置中的线程数")
+    serve_parser.add_argument('--rate-limit', type=float, default=0, help="每分钟最多发起的生图请求数，0为不限制")
+    serve_parser.add_argument('--token', default=os.environ.get('SORA_SERVICE_TOKEN', ''),
+                              help="访问令牌（也可用环境变量 SORA_SERVICE_TOKEN），客户端需发送 Authorization: Bearer <令牌>")
+    serve_parser.add_argument('--no-cache', action='store_true', help="不读写生图结果缓存")
+    serve_parser.add_argument('--coordinator-only', action='store_true', help="只分发任务给执行节点，本机不执行")
+    
+    worker_parser = subparsers.add_parser('worker', help="作为执行节点领取任务")
+    source = worker_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--coordinator', help="协调节点地址，如 http://192.168.1.10:8765（结果图片上传到协调节点）")
+    source.add_argument('--db', help="共享目录中的任务队列数据库（结果图片直接写入共享的 --out 目录）")
+    worker_parser.add_argument('--out', required=True, help="图片保存目录，每个批次一个子目录")
+    worker_parser.add_argument('--config', help="配置文件，默认使用程序目录下的 config.json")
+    worker_parser.add_argument('--concurrency', type=int, help="同时执行的任务数，默认使用配置中的线程数")
+    worker_parser.add_argument('--rate-limit', type=float, default=0, help="本节点每分钟最多发起的生图请求数，0为不限制")
+    worker_parser.add_argument('--token', default=os.environ.get('SORA_SERVICE_TOKEN', ''), help="协调节点的访问令牌")
+    worker_parser.add_argument('--no-cache', action='store_true', help="不读写生图结果缓存")
+    
+    watch_parser = subparsers.add_parser('watch', help="监视文件夹，新增或修改的CSV自动加入生成队列")
+    watch_parser.add_argument('folder', help="要监视的文件夹")
+    watch_parser.add_argument('--out', help="图片保存目录，默认使用配置中的保存路径；每个CSV一个子目录")
+    watch_parser.add_argument('--config', help="配置文件，默认使用程序目录下的 config.json")
+    watch_parser.add_argument('--db', help="任务队列数据库，默认使用程序目录下的 jobs.db")
+    watch_parser.add_argument('--recursive', action='store_true', help="同时监视子文件夹")
+    watch_parser.add_argument('--concurrency', type=int, help="同时执行的任务数，默认使用配置中的线程数")
+    watch_parser.add_argument('--rate-limit', type=float, default=0, help="每分钟最多发起的生图请求数，0为不限制")
+    watch_parser.add_argument('--enqueue-only', action='store_true', help="只加入队列，由执行节点（worker --db）生成")
+    watch_parser.add_argument('--no-cache', action='store_true', help="不读写生图结果缓存")
+    
+    dedupe_parser = subparsers.add_parser('dedupe', help="查找内容相同的图片，统计可节省的空间并可替换为硬链接")
+    dedupe_parser.add_argument('folders', nargs='*', help="要扫描的文件夹，默认为图库和配置中的保存路径")
+    dedupe_parser.add_argument('--config', help="配置文件，默认使用程序目录下的 config.json")
+    dedupe_parser.add_argument('--apply', action='store_true', help="把重复的文件替换为硬链接（默认只报告）")
+    dedupe_parser.add_argument('--json', help="把重复图片分组写入JSON文件")
+    return parser
+
+def run_command(args):
+    """python main.py run jobs.csv --out DIR"""
+    config = load_app_config(args.config)
+    try:
+        jobs = load_jobs(args.jobs, config.get('import_column_map'))
+    except (OSError, ValueError) as e:
+        print(f"读取任务文件失败: {e}", file=sys.stderr)
+        return 2
+    if args.style and args.style not in config.get('style_library', {}):
+        print(f"风格库中没有该风格: {args.style}", file=sys.stderr)
+        return 2
+    
+    manifest_path = Path(args.manifest) if args.manifest else Path(args.out) / 'manifest.jsonl'
+    if args.resume:
+        finished = {number for number, record in read_manifest(manifest_path).items() if record.get('status') == 'success'}
+        skipped = len(jobs)
+        jobs = [job for job in jobs if job['number'] not in finished]
+        skipped -= len(jobs)
+        if skipped:
+            print(f"跳过清单中已成功的 {skipped} 条")
+    
+    runner = BatchRunner(config, jobs, args.out, manifest_path, concurrency=args.concurrency,
+                         images_per_prompt=args.images_per_prompt, ratio=args.ratio, style=args.style,
+                         use_cache=not args.no_cache, fresh=args.fresh)
+    if not runner.api_key:
+        print("未配置API密钥：请在图形界面设置中心配置，或设置环境变量 SORA_API_KEY", file=sys.stderr)
+        return 2
+    try:
+        failed = runner.run(append=args.resume)
+    except KeyboardInterrupt:
+        return 130
+    return 1 if failed else 0
+
+def serve_command(args):
+    """python main.py serve --out DIR"""
+    config = load_app_config(args.config)
+    service = JobService(config, JobQueue(args.db), args.out, concurrency=args.concurrency,
+                         rate_limit=args.rate_limit, use_cache=not args.no_cache, execute=not args.coordinator_only)
+    if service.execute and not service.api_key:
+        print("未配置API密钥：请在图形界面设置中心配置，或设置环境变量 SORA_API_KEY", file=sys.stderr)
+        return 2
+    if args.host not in ('127.0.0.1', 'localhost') and not args.token:
+        print("警告: 服务监听在非本机地址且未设置 --token，局域网内任何人都可以使用本机的API密钥", file=sys.stderr)
+    try:
+        server = JobServer(service, args.host, args.port, args.token)
+    except OSError as e:
+        print(f"任务服务启动失败 ({args.host}:{args.port}): {e}", file=sys.stderr)
+        return 2
+    server.start()
+    if service.execute:
+        print(f"任务服务已启动: http://{args.host}:{server.port} | {service.api_platform}/{service.image_model} | "
+              f"并发 {service.pool.maxThreadCount()} | 限速 {args.rate_limit or '不限'}/分钟 | 输出 {service.out_dir}", flush=True)
+    else:
+        print(f"任务服务已启动（仅协调）: http://{args.host}:{server.port} | 输出 {service.out_dir}", flush=True)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        print("正在停止任务服务，运行中的任务将在租约过期后重新排队", flush=True)
+    finally:
+        server.stop()
+    return 0
+
+def worker_command(args):
+    """python main.py worker --coordinator URL --out DIR 或 --db 共享数据库 --out 共享目录"""
+    config = load_app_config(args.config)
+    job_queue = RemoteJobQueue(args.coordinator, args.token) if args.coordinator else JobQueue(args.db)
+    service = JobService(config, job_queue, args.out, concurrency=args.concurrency,
+                         rate_limit=args.rate_limit, use_cache=not args.no_cache)
+    if not service.api_key:
+        print("未配置API密钥：请在图形界面设置中心配置，或设置环境变量 SORA_API_KEY", file=sys.stderr)
+        return 2
+    print(f"执行节点 {service.worker_id} 已启动: {args.coordinator or args.db} | {service.api_platform}/{service.image_model} | "
+          f"并发 {service.pool.maxThreadCount()} | 输出 {service.out_dir}", flush=True)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        print("执行节点已停止，运行中的任务将在租约过期后由其他节点重新执行", flush=True)
+    return 0
+
+def watch_command(args):
+    """python main.py watch FOLDER"""
+    config = load_app_config(args.config)
+    out_dir = args.out or config.get('save_path', '')
+    if not out_dir:
+        print("未设置保存路径：请使用 --out 或在图形界面设置中心设置保存路径", file=sys.stderr)
+        return 2
+    if not Path(args.folder).is_dir():
+        print(f"文件夹不存在: {args.folder}", file=sys.stderr)
+        return 2
+    service = JobService(config, JobQueue(args.db), out_dir, concurrency=args.concurrency,
+                         rate_limit=args.rate_limit, use_cache=not args.no_cache, execute=not args.enqueue_only)
+    if service.execute and not service.api_key:
+        print("未配置API密钥：请在图形界面设置中心配置，或设置环境变量 SORA_API_KEY", file=sys.stderr)
+        return 2
+    watcher = FolderWatcher(args.folder, service.queue, recursive=args.recursive,
+                            column_map=config.get('import_column_map'))
+    print(f"开始监视 {args.folder}（{watcher.mode}）| 输出 {service.out_dir}"
+          f"{'' if service.execute else ' | 只加入队列'}", flush=True)
+    try:
+        service.serve_forever(tick=watcher.poll)
+    except KeyboardInterrupt:
+        print("已停止监视", flush=True)
+    finally:
+        watcher.stop()
+    return 0
+
+def dedupe_command(args):
+    """python main.py dedupe [FOLDER ...] [--apply]"""
+    folders = args.folders
+    if not folders:
+        folders = [str(IMAGES_PATH)]
+        save_path = load_app_config(args.config).get('save_path', '')
+        if save_path:
+            folders.append(save_path)
+    missing = [folder for folder in folders if not Path(folder).is_dir()]
+    if missing:
+        print(f"文件夹不存在: {', '.join(missing)}", file=sys.stderr)
+        return 2
+    
+    print(f"扫描 {', '.join(folders)} ...", flush=True)
+    groups = find_duplicate_images(folders)
+    summary = summarize_duplicates(groups)
+    for group in groups[:20]:
+        print(f"{group['size'] / 1024:.0f} KB x {len(group['files'])}  保留 {group['files'][0]}")
+        for file_path in group['files'][1:]:
+            print(f"    重复 {file_path}")
+    if len(groups) > 20:
+        print(f"... 另有 {len(groups) - 20} 组")
+    print(f"重复图片 {summary['groups']} 组，{summary['duplicates']} 个重复文件，"
+          f"可节省 {summary['reclaimable_bytes'] / 1024 / 1024:.1f} MB", flush=True)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'summary': summary, 'groups': groups}, f, ensure_ascii=False, indent=2)
+    
+    if args.apply and groups:
+        linked, reclaimed, errors = link_duplicate_images(groups)
+        for error in errors:
+            print(f"无法创建硬链接: {error}", file=sys.stderr)
+        print(f"已替换 {linked} 个文件为硬链接，节省 {reclaimed / 1024 / 1024:.1f} MB", flush=True)
+        return 1 if errors else 0
+    return 0
+
+CLI_COMMANDS = {'run': run_command, 'serve': serve_command, 'worker': worker_command, 'watch': watch_command,
+                'dedupe': dedupe_command}
+
+def run_cli(argv):
+    """命令行入口，返回退出码"""
+    args = build_cli_parser().parse_args(argv)
+    return CLI_COMMANDS[args.command](args)
 
 def main():
     """主函数，包含完整的错误处理"""
     try:
+        # 带子命令时以命令行模式运行，不创建界面
+        if len(sys.argv) > 1 and sys.argv[1] in (*CLI_COMMANDS, '-h', '--help'):
+            return run_cli(sys.argv[1:])
+        
+        STARTUP_TRACE.mark('导入模块')
+        
         # 设置环境变量，解决各种兼容性问题
         os.environ['PYTHONHASHSEED'] = '0'
         os.environ['QT_AUTO_SCREEN_SCALE_FACTOR'] = '1'
@@ -6193,11 +10461,14 @@ def main():
         
         # 设置异常处理
         sys.excepthook = handle_exception
+        STARTUP_TRACE.mark('创建应用')
         
         try:
             # 创建主窗口
             window = MainWindow()
+            STARTUP_TRACE.mark('创建主窗口')
             window.show()
+            STARTUP_TRACE.mark('显示窗口')
             
             # 运行应用程序
             return app.exec()
@@ -6215,7 +10486,7 @@ def main():
     except ImportError as e:
         print(f"❌ 模块导入错误: {e}")
         print("\n请运行以下命令安装依赖:")
-        print("pip install PyQt6 requests pandas")
+        print("pip install PyQt6 requests")
         print("\n或者双击运行 '简单启动.bat'")
         input("\n按回车键退出...")
         return 1
@@ -6366,13 +10637,18 @@ class ReferenceImageDialog(QDialog):
             QMessageBox.warning(self, "错误", f"无法打开文件夹: {str(e)}")
 
 class OptimizationResultDialog(QDialog):
-    """优化结果对话框"""
-    
-    def __init__(self, original_prompt, optimized_prompt, parent=None):
+    """优化结果对话框（streaming=True 时逐步显示AI输出）"""
+
+    stop_requested = pyqtSignal()
+
+    def __init__(self, original_prompt, optimized_prompt, parent=None, streaming=False):
         super().__init__(parent)
         self.original_prompt = original_prompt
         self.optimized_prompt = optimized_prompt
+        self.streaming = streaming
         self.setup_ui()
+        if streaming:
+            self.start_streaming()
     
     def setup_ui(self):
         """设置界面"""
@@ -6382,9 +10658,9 @@ class OptimizationResultDialog(QDialog):
         layout = QVBoxLayout(self)
         
         # 标题
-        title_label = QLabel("提示词优化结果")
-        title_label.setStyleSheet("font-size: 16px; font-weight: bold; margin: 10px;")
-        layout.addWidget(title_label)
+        self.title_label = QLabel("提示词优化结果")
+        self.title_label.setStyleSheet("font-size: 16px; font-weight: bold; margin: 10px;")
+        layout.addWidget(self.title_label)
         
         # 创建分割窗口
         splitter = QSplitter(Qt.Orientation.Vertical)
@@ -6461,13 +10737,58 @@ class OptimizationResultDialog(QDialog):
             }
         """)
         copy_btn.clicked.connect(self.copy_optimized_text)
+
+        # 停止生成按钮（仅流式模式显示）
+        self.stop_btn = QPushButton("停止生成")
+        self.stop_btn.clicked.connect(self.stop_streaming)
+        self.stop_btn.setVisible(False)
         
         button_layout.addWidget(copy_btn)
         button_layout.addStretch()
+        button_layout.addWidget(self.stop_btn)
         button_layout.addWidget(self.cancel_btn)
         button_layout.addWidget(self.apply_btn)
         
         layout.addLayout(button_layout)
+
+    def start_streaming(self):
+        """进入流式接收状态"""
+        self.title_label.setText("⏳ AI正在优化...")
+        self.optimized_text.setReadOnly(True)
+        self.optimized_text.setPlaceholderText("等待AI输出...")
+        self.apply_btn.setEnabled(False)
+        self.stop_btn.setVisible(True)
+
+    def set_streaming_text(self, text):
+        """刷新已接收的内容"""
+        if not self.streaming:
+            return
+        self.optimized_text.setPlainText(text)
+        self.optimized_text.moveCursor(QTextCursor.MoveOperation.End)
+
+    def finish_streaming(self, text):
+        """接收完成，允许编辑和应用"""
+        self.streaming = False
+        self.title_label.setText("提示词优化结果")
+        self.optimized_text.setPlainText(text)
+        self.optimized_text.setReadOnly(False)
+        self.apply_btn.setEnabled(bool(text.strip()))
+        self.stop_btn.setVisible(False)
+
+    def fail_streaming(self, error_msg):
+        """接收失败或被取消，保留已收到的内容供参考"""
+        self.streaming = False
+        self.title_label.setText(f"❌ 优化未完成: {error_msg[:80]}")
+        self.title_label.setToolTip(error_msg)
+        self.optimized_text.setReadOnly(False)
+        self.apply_btn.setEnabled(bool(self.optimized_text.toPlainText().strip()))
+        self.stop_btn.setVisible(False)
+
+    def stop_streaming(self):
+        """用户判断输出不理想，提前停止"""
+        self.stop_btn.setEnabled(False)
+        self.stop_btn.setText("正在停止...")
+        self.stop_requested.emit()
     
     def copy_optimized_text(self):
         """复制优化结果到剪贴板"""
@@ -6480,6 +10801,151 @@ class OptimizationResultDialog(QDialog):
         return self.optimized_text.toPlainText()
 
 
+class BatchOptimizationReviewDialog(QDialog):
+    """批量优化结果审阅对话框 - 结果陆续返回，统一采用/拒绝"""
+
+    applied = pyqtSignal(list)  # [(行号, 原始提示词, 优化后提示词)]
+    cancel_requested = pyqtSignal()
+
+    def __init__(self, items, parent=None):
+        super().__init__(parent)
+        self.items = list(items)  # [(行号, 编号, 原始提示词)]
+        self.row_index = {row: i for i, (row, _, _) in enumerate(self.items)}
+        self.finished_count = 0
+        self.setWindowTitle("🤖 批量优化审阅")
+        self.resize(1100, 700)
+        self.setup_ui()
+
+    def setup_ui(self):
+        """设置界面"""
+        layout = QVBoxLayout(self)
+
+        self.summary_label = QLabel()
+        self.summary_label.setStyleSheet("font-size: 16px; font-weight: bold; margin: 6px;")
+        layout.addWidget(self.summary_label)
+
+        self.review_table = QTableWidget(len(self.items), 5)
+        self.review_table.setHorizontalHeaderLabels(["采用", "编号", "原始提示词", "优化后提示词（可编辑）", "状态"])
+        header = self.review_table.horizontalHeader()
+        header.setSectionResizeMode(0, QHeaderView.ResizeMode.ResizeToContents)
+        header.setSectionResizeMode(1, QHeaderView.ResizeMode.ResizeToContents)
+        header.setSectionResizeMode(2, QHeaderView.ResizeMode.Stretch)
+        header.setSectionResizeMode(3, QHeaderView.ResizeMode.Stretch)
+        header.setSectionResizeMode(4, QHeaderView.ResizeMode.ResizeToContents)
+        self.review_table.setWordWrap(True)
+        self.review_table.verticalHeader().setVisible(False)
+
+        for i, (row, number, prompt) in enumerate(self.items):
+            accept_item = QTableWidgetItem()
+            accept_item.setFlags(Qt.ItemFlag.ItemIsUserCheckable | Qt.ItemFlag.ItemIsEnabled)
+            accept_item.setCheckState(Qt.CheckState.Unchecked)
+            self.review_table.setItem(i, 0, accept_item)
+
+            number_item = QTableWidgetItem(str(number))
+            number_item.setFlags(number_item.flags() & ~Qt.ItemFlag.ItemIsEditable)
+            self.review_table.setItem(i, 1, number_item)
+
+            original_item = QTableWidgetItem(prompt)
+            original_item.setFlags(original_item.flags() & ~Qt.ItemFlag.ItemIsEditable)
+            self.review_table.setItem(i, 2, original_item)
+
+            optimized_item = QTableWidgetItem("")
+            optimized_item.setFlags(optimized_item.flags() & ~Qt.ItemFlag.ItemIsEditable)
+            self.review_table.setItem(i, 3, optimized_item)
+
+            status_item = QTableWidgetItem("⏳ 优化中")
+            status_item.setFlags(status_item.flags() & ~Qt.ItemFlag.ItemIsEditable)
+            self.review_table.setItem(i, 4, status_item)
+
+        layout.addWidget(self.review_table)
+
+        button_layout = QHBoxLayout()
+        accept_all_button = QPushButton("全部采用")
+        accept_all_button.clicked.connect(lambda: self.set_all_checked(True))
+        reject_all_button = QPushButton("全部拒绝")
+        reject_all_button.clicked.connect(lambda: self.set_all_checked(False))
+        button_layout.addWidget(accept_all_button)
+        button_layout.addWidget(reject_all_button)
+        button_layout.addStretch()
+
+        self.stop_button = QPushButton("停止未完成")
+        self.stop_button.setToolTip("中断正在输出的优化并放弃排队中的任务")
+        self.stop_button.clicked.connect(self.cancel_requested.emit)
+        button_layout.addWidget(self.stop_button)
+
+        self.apply_button = QPushButton("应用已采用结果")
+        self.apply_button.clicked.connect(self.apply_accepted)
+        close_button = QPushButton("关闭")
+        close_button.clicked.connect(self.reject)
+        button_layout.addWidget(self.apply_button)
+        button_layout.addWidget(close_button)
+        layout.addLayout(button_layout)
+
+        self.update_summary()
+
+    def update_summary(self):
+        """更新进度统计"""
+        self.summary_label.setText(f"优化进度: {self.finished_count}/{len(self.items)}")
+        if self.finished_count >= len(self.items):
+            self.stop_button.setEnabled(False)
+
+    def set_partial(self, row, text):
+        """流式刷新一条正在生成的结果"""
+        i = self.row_index.get(row)
+        if i is None:
+            return
+        self.review_table.item(i, 3).setText(text)
+        self.review_table.item(i, 4).setText("✍️ 输出中")
+
+    def set_result(self, row, original_prompt, optimized_prompt):
+        """写入一条优化结果（默认勾选采用）"""
+        i = self.row_index.get(row)
+        if i is None:
+            return
+        optimized_item = self.review_table.item(i, 3)
+        optimized_item.setFlags(optimized_item.flags() | Qt.ItemFlag.ItemIsEditable)
+        optimized_item.setText(optimized_prompt)
+        self.review_table.item(i, 0).setCheckState(Qt.CheckState.Checked)
+        self.review_table.item(i, 4).setText("✅ 完成")
+        self.finished_count += 1
+        self.update_summary()
+        self.review_table.resizeRowToContents(i)
+
+    def set_error(self, row, original_prompt, error_msg):
+        """标记一条优化失败"""
+        i = self.row_index.get(row)
+        if i is None:
+            return
+        status_item = self.review_table.item(i, 4)
+        status_item.setText("⏹ 已取消" if error_msg == "已取消" else "❌ 失败")
+        status_item.setToolTip(error_msg)
+        # 未完成的内容不允许采用
+        self.review_table.item(i, 3).setText("")
+        status_item.setForeground(QColor("#d32f2f"))
+        self.finished_count += 1
+        self.update_summary()
+
+    def set_all_checked(self, checked):
+        """全部采用/全部拒绝（仅对已完成的结果生效）"""
+        state = Qt.CheckState.Checked if checked else Qt.CheckState.Unchecked
+        for i in range(len(self.items)):
+            if self.review_table.item(i, 3).text().strip():
+                self.review_table.item(i, 0).setCheckState(state)
+
+    def apply_accepted(self):
+        """收集被采用的结果并通知主窗口"""
+        results = []
+        for i, (row, _, prompt) in enumerate(self.items):
+            optimized = self.review_table.item(i, 3).text().strip()
+            if optimized and self.review_table.item(i, 0).checkState() == Qt.CheckState.Checked:
+                results.append((row, prompt, optimized))
+        if not results:
+            QMessageBox.information(self, "提示", "没有被采用的优化结果")
+            return
+        self.applied.emit(results)
+        self.accept()
+
+
 class ReferenceImagesManagerDialog(QDialog):
     """参考图片管理对话框 - 带缩略图预览"""
     